@@ -241,3 +241,61 @@ class Profiler(object):
         :rtype:               list of str
         """
         raise NotImplementedError()
+
+    def calculate_applicable_units_batch(self, unit_profiles, bound_repo_id, config, conduit):
+        """
+        Calculate applicability for many unit profiles against the same bound repository in a
+        single call. This is an optional hook that allows a profiler to load the repository's
+        content once and evaluate every given profile against it. The default implementation
+        simply calls calculate_applicable_units() once per profile.
+
+        :param unit_profiles: mapping of profile hashes to consumer unit profiles
+        :type  unit_profiles: dict
+        :param bound_repo_id: repo id of a repository to be used to calculate applicability
+                              against the given consumer profiles
+        :type  bound_repo_id: str
+        :param config:        plugin configuration
+        :type  config:        pulp.server.plugins.config.PluginCallConfiguration
+        :param conduit:       provides access to relevant Pulp functionality
+        :type  conduit:       pulp.plugins.conduits.profile.ProfilerConduit
+        :return:              mapping of profile hashes to the applicability data returned by
+                              calculate_applicable_units() for the corresponding profile
+        :rtype:               dict
+        """
+        applicability = {}
+        for profile_hash, unit_profile in unit_profiles.items():
+            applicability[profile_hash] = self.calculate_applicable_units(
+                unit_profile, bound_repo_id, config, conduit)
+        return applicability
+
+    def calculate_applicable_units_delta(self, unit_profiles, bound_repo_id, unit_ids, config,
+                                         conduit):
+        """
+        Calculate which of the given content units, recently added to the bound repository, are
+        applicable to consumers with the given unit profiles. This optional hook is used to
+        regenerate applicability incrementally: the returned units are added to the previously
+        calculated applicability data, and units removed from the repository are dropped from it.
+
+        Only profilers for which the applicability of a unit does not depend on the other units in
+        the repository should implement this. Profilers that do not implement it always have their
+        applicability recalculated against the whole repository. This is also called with no units
+        when units were only removed from the repository, in which case it should return an empty
+        mapping.
+
+        :param unit_profiles: mapping of profile hashes to consumer unit profiles
+        :type  unit_profiles: dict
+        :param bound_repo_id: repo id of a repository to be used to calculate applicability
+                              against the given consumer profiles
+        :type  bound_repo_id: str
+        :param unit_ids:      mapping of content type ids to lists of ids of the units that were
+                              added to the repository
+        :type  unit_ids:      dict
+        :param config:        plugin configuration
+        :type  config:        pulp.server.plugins.config.PluginCallConfiguration
+        :param conduit:       provides access to relevant Pulp functionality
+        :type  conduit:       pulp.plugins.conduits.profile.ProfilerConduit
+        :return:              mapping of profile hashes to dictionaries, which map content type
+                              ids to lists of ids of the given units that are applicable
+        :rtype:               dict
+        """
+        raise NotImplementedError()
@@ -1,20 +1,31 @@
 from gettext import gettext as _
 import glob
 import gzip
+import hashlib
 import logging
 import os
 import shutil
+import tempfile
 import traceback
+import zlib
 
 
 from xml.sax.saxutils import XMLGenerator
 
 from pulp.common import error_codes
+from pulp.common.compat import json
+from pulp.plugins.util import misc
+from pulp.server import config as pulp_config
 from pulp.server.exceptions import PulpCodedValidationException, PulpCodedException
 from pulp.server.util import CHECKSUM_FUNCTIONS
 
 _LOG = logging.getLogger(__name__)
 BUFFER_SIZE = 1024
+CHECKSUM_BUFFER_SIZE = 65536
+COPY_BUFFER_SIZE = 1024 * 1024
+# The directory, under the server's working directory, where the offset indexes of fast forward
+# XML files are kept, so that they are not published with the files
+OFFSET_INDEX_DIR = 'metadata_offsets'
 
 
 class MetadataFileContext(object):
@@ -22,7 +33,7 @@ class MetadataFileContext(object):
     Context manager class for metadata file generation.
     """
 
-    def __init__(self, metadata_file_path, checksum_type=None):
+    def __init__(self, metadata_file_path, checksum_type=None, checksum_uncompressed=False):
         """
         :param metadata_file_path: full path to metadata file to be generated
         :type  metadata_file_path: str
@@ -30,12 +41,24 @@ class MetadataFileContext(object):
                               to the file names of files. If checksum_type is None,
                               no checksum is added to the filename
         :type checksum_type: str or None
+        :param checksum_uncompressed: also calculate the size and checksum of the data before
+                                      it is compressed, for gzipped metadata files
+        :type  checksum_uncompressed: bool
         """
 
         self.metadata_file_path = metadata_file_path
         self.metadata_file_handle = None
         self.checksum_type = checksum_type
         self.checksum = None
+        self.checksum_uncompressed = checksum_uncompressed
+        self.checksum_constructor = None
+        # Set by finalize: the size of the file and, if requested, of the uncompressed data
+        self.size = None
+        self.uncompressed_size = None
+        self.uncompressed_checksum = None
+        # The writers that count and hash the data as it is written
+        self._file_writer = None
+        self._uncompressed_writer = None
         if self.checksum_type is not None:
             checksum_function = CHECKSUM_FUNCTIONS.get(checksum_type)
             if not checksum_function:
@@ -93,14 +116,12 @@ class MetadataFileContext(object):
         except Exception, e:
             _LOG.exception(e)
 
+        self._collect_checksums()
+
         # Add calculated checksum to the filename
         file_name = os.path.basename(self.metadata_file_path)
         if self.checksum_type is not None:
-            with open(self.metadata_file_path, 'rb') as file_handle:
-                content = file_handle.read()
-                checksum = self.checksum_constructor(content).hexdigest()
-
-            self.checksum = checksum
+            checksum = self.checksum
             file_name_with_checksum = checksum + '-' + file_name
             new_file_path = os.path.join(os.path.dirname(self.metadata_file_path),
                                          file_name_with_checksum)
@@ -110,6 +131,47 @@ class MetadataFileContext(object):
         # Set the metadata_file_handle to None so we don't double call finalize
         self.metadata_file_handle = None
 
+    def _collect_checksums(self):
+        """
+        Collect the sizes and checksums calculated while the metadata file was written. If the
+        file handle was not opened by _open_metadata_file_handle, the file is read to calculate
+        its checksum.
+        """
+        if self._file_writer is None:
+            if self.checksum_type is not None:
+                self.checksum, self.size = self._checksum_file(self.metadata_file_path)
+            return
+
+        self.size = self._file_writer.size
+        self.checksum = self._file_writer.hexdigest()
+        if self._uncompressed_writer is not None:
+            self.uncompressed_size = self._uncompressed_writer.size
+            self.uncompressed_checksum = self._uncompressed_writer.hexdigest()
+        elif self.checksum_uncompressed:
+            # the file is not compressed
+            self.uncompressed_size = self.size
+            self.uncompressed_checksum = self.checksum
+        self._file_writer = None
+        self._uncompressed_writer = None
+
+    def _checksum_file(self, path):
+        """
+        Calculate the checksum of a file by reading it in chunks.
+
+        :param path: full path to the file
+        :type  path: str
+
+        :return: the hex digest of the file and its size
+        :rtype:  tuple
+        """
+        hasher = self.checksum_constructor()
+        size = 0
+        with open(path, 'rb') as file_handle:
+            for chunk in iter(lambda: file_handle.read(CHECKSUM_BUFFER_SIZE), ''):
+                hasher.update(chunk)
+                size += len(chunk)
+        return hasher.hexdigest(), size
+
     def _open_metadata_file_handle(self):
         """
         Open the metadata file handle, creating any missing parent directories.
@@ -142,11 +204,38 @@ class MetadataFileContext(object):
         msg = _('Opening metadata file handle for [%(p)s]')
         _LOG.debug(msg % {'p': self.metadata_file_path})
 
+        # The data is counted and hashed as it is written so that the file is not read again
+        # to calculate its checksum when it is finalized
         if self.metadata_file_path.endswith('.gz'):
-            self.metadata_file_handle = gzip.open(self.metadata_file_path, 'w')
+            self._file_writer = HashingFileWriter(open(self.metadata_file_path, 'wb'),
+                                                  self.checksum_constructor)
+            gzip_handle = self._open_gzip_handle(self._file_writer)
+            if self.checksum_uncompressed:
+                self._uncompressed_writer = HashingFileWriter(gzip_handle,
+                                                              self.checksum_constructor)
+                self.metadata_file_handle = self._uncompressed_writer
+            else:
+                self.metadata_file_handle = gzip_handle
 
         else:
-            self.metadata_file_handle = open(self.metadata_file_path, 'w')
+            self._file_writer = HashingFileWriter(open(self.metadata_file_path, 'w'),
+                                                  self.checksum_constructor)
+            self.metadata_file_handle = self._file_writer
+
+    def _open_gzip_handle(self, file_object):
+        """
+        Open the handle that compresses the metadata written to the file object.
+
+        :param file_object: the file object the compressed data is written to
+        :type  file_object: HashingFileWriter
+
+        :return: the gzip file handle, which closes the file object when it is closed
+        :rtype:  gzip.GzipFile
+        """
+        gzip_handle = gzip.GzipFile(self.metadata_file_path, 'w', fileobj=file_object)
+        # Like gzip.open, let the GzipFile close the file it writes to
+        gzip_handle.myfileobj = file_object
+        return gzip_handle
 
     def _write_file_header(self):
         """
@@ -195,6 +284,138 @@ class MetadataFileContext(object):
                 raise
 
 
+class HashingFileWriter(object):
+    """
+    Wraps a file object opened for writing to count and hash the data written to it. Any other
+    attribute is looked up on the wrapped file object.
+
+    :ivar size: the number of bytes written
+    :type size: int
+    """
+
+    def __init__(self, file_object, checksum_constructor=None):
+        """
+        :param file_object: the file object to write to
+        :type  file_object: file
+        :param checksum_constructor: constructor of the hash object used to hash the data, or
+                                     None to only count it
+        :type  checksum_constructor: callable
+        """
+        self.file_object = file_object
+        self.size = 0
+        self._hasher = checksum_constructor() if checksum_constructor else None
+
+    def write(self, data):
+        """
+        Write data to the file object, counting and hashing it.
+
+        :param data: the data to write
+        :type  data: str
+        """
+        self.file_object.write(data)
+        self.size += len(data)
+        if self._hasher is not None:
+            self._hasher.update(data)
+
+    def update(self, data):
+        """
+        Count and hash data that reached the file without being written through this object.
+
+        :param data: the data
+        :type  data: str
+        """
+        self.size += len(data)
+        if self._hasher is not None:
+            self._hasher.update(data)
+
+    def hexdigest(self):
+        """
+        :return: the hex digest of the data written so far, or None if it is not hashed
+        :rtype:  str or None
+        """
+        if self._hasher is None:
+            return None
+        return self._hasher.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.file_object, name)
+
+
+class GzipMemberWriter(object):
+    """
+    Writes gzip compressed data to a file object as a series of gzip members. Readers of gzip
+    files decompress the members one after the other, as if they were a single stream, and
+    members can be copied from one file to another without being decompressed.
+    """
+
+    def __init__(self, file_object, filename):
+        """
+        :param file_object: the file object the members are written to; it is closed with
+                            this object
+        :type  file_object: file
+        :param filename: the file name stored in the member headers
+        :type  filename: str
+        """
+        self.file_object = file_object
+        self.filename = filename
+        self.closed = False
+        self._member = None
+
+    def write(self, data):
+        """
+        Compress data into the current member, starting one if needed.
+
+        :param data: the data to write
+        :type  data: str
+        """
+        if self._member is None:
+            self._member = gzip.GzipFile(self.filename, 'w', fileobj=self.file_object)
+        self._member.write(data)
+
+    def end_member(self):
+        """
+        Finish the current member, so that the data written next starts a new member or can
+        be copied from another file.
+        """
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+
+    def flush(self):
+        """
+        Flush the file object. Compressed data is flushed when the current member ends.
+        """
+        self.file_object.flush()
+
+    def close(self):
+        """
+        Finish the current member and close the file object.
+        """
+        self.end_member()
+        self.file_object.close()
+        self.closed = True
+
+
+def _decompress_members(chunks):
+    """
+    Decompress gzip members, which may span several chunks of compressed data.
+
+    :param chunks: chunks of one or more complete gzip members
+    :type  chunks: iterable of str
+
+    :return: a generator of decompressed data
+    :rtype:  generator
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            chunk = decompressor.unused_data
+            if chunk:
+                # the member ended within the chunk; the rest belongs to the next member
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
 class JSONArrayFileContext(MetadataFileContext):
     """
     Context manager for writing out units as a json array.
@@ -286,6 +507,14 @@ class XmlFileContext(MetadataFileContext):
 class FastForwardXmlFileContext(XmlFileContext):
     """
     Context manager for reopening an existing XML file context to insert more data.
+
+    When the file is finalized, an offset index is written to the OFFSET_INDEX_DIR of the
+    server's working directory, named after the checksum in the file's name, or after its path
+    if it has no checksum type, recording where the content between the root element's start
+    and end tags lies in the file. Gzipped files are written as separate gzip members for the
+    header, the content and the footer. The next fast forward copies that content as raw
+    blocks, still compressed, instead of decompressing the file and searching it for the
+    content.
     """
 
     def __init__(self, metadata_file_path, root_tag, search_tag, root_attributes=None,
@@ -309,6 +538,14 @@ class FastForwardXmlFileContext(XmlFileContext):
         self.search_tag = search_tag
         self.existing_file = None
         self.xml_generator = None
+        # The offset index of the existing file, if it has a valid one
+        self.offset_index = None
+        # The offsets of the content in the file being written
+        self.content_start = None
+        self.content_end = None
+        # The path of the offset index of the existing file, which the new file replaces
+        self.existing_offset_index_path = None
+        self._member_writer = None
 
     def _open_metadata_file_handle(self):
         """
@@ -336,6 +573,10 @@ class FastForwardXmlFileContext(XmlFileContext):
             self.existing_file = file_name
             self.fast_forward = True
 
+        if self.fast_forward:
+            self.offset_index = self._load_offset_index(
+                os.path.join(working_dir, self.existing_file))
+
         if self.fast_forward:
             # move the file so that we can still process it if the name is the same
             if self.existing_file:
@@ -348,7 +589,7 @@ class FastForwardXmlFileContext(XmlFileContext):
 
             # Open the file, unzip if necessary so that seek operations can be performed
             self.original_file_handle = None
-            if self.existing_file.endswith('.gz'):
+            if self.offset_index is None and self.existing_file.endswith('.gz'):
                 non_compressed_file = self.existing_file[:self.existing_file.rfind('.gz')]
                 with open(os.path.join(working_dir, non_compressed_file), 'wb') as plain_handle:
                     gzip_handle = gzip.open(os.path.join(working_dir, self.existing_file), 'rb')
@@ -364,16 +605,175 @@ class FastForwardXmlFileContext(XmlFileContext):
                 os.unlink(self.existing_file)
                 self.existing_file = non_compressed_file
 
-            self.original_file_handle = open(os.path.join(working_dir, self.existing_file), 'r')
+            self.original_file_handle = open(os.path.join(working_dir, self.existing_file), 'rb')
 
         super(FastForwardXmlFileContext, self)._open_metadata_file_handle()
 
+    def _open_gzip_handle(self, file_object):
+        """
+        Open a handle that writes gzip members, so that the content can be copied by the next
+        fast forward without being decompressed.
+
+        :param file_object: the file object the compressed data is written to
+        :type  file_object: HashingFileWriter
+
+        :return: the gzip member writer
+        :rtype:  GzipMemberWriter
+        """
+        self._member_writer = GzipMemberWriter(file_object, self.metadata_file_path)
+        return self._member_writer
+
+    def _offset_index_path(self, path):
+        """
+        Get the path of the offset index of a metadata file. A file with a checksum type is
+        identified by the checksum in its name, so that files with the same content share an
+        index. Any other file is identified by its path.
+
+        :param path: full path to the metadata file
+        :type  path: str
+
+        :return: the path of the offset index of the metadata file
+        :rtype:  str
+        """
+        if self.checksum_type is not None:
+            checksum = os.path.basename(path).split('-', 1)[0]
+            index_name = '%s-%s' % (self.checksum_type, checksum)
+        else:
+            index_name = 'path-%s' % hashlib.sha256(os.path.abspath(path)).hexdigest()
+        working_dir = pulp_config.config.get('server', 'working_directory')
+        return os.path.join(working_dir, OFFSET_INDEX_DIR, index_name)
+
+    def _offset_index_identity(self, path):
+        """
+        Get the values an offset index records to identify the metadata file it describes,
+        without reading the file. A file without a checksum type is identified by its path,
+        size and modification time.
+
+        :param path: full path to the metadata file
+        :type  path: str
+
+        :return: the identifying values, keyed by their name in the offset index
+        :rtype:  dict
+        """
+        file_stat = os.stat(path)
+        identity = {'size': file_stat.st_size}
+        if self.checksum_type is not None:
+            identity['checksum_type'] = self.checksum_type
+            identity['checksum'] = os.path.basename(path).split('-', 1)[0]
+        else:
+            identity['file_path'] = os.path.abspath(path)
+            identity['mtime'] = file_stat.st_mtime
+        return identity
+
+    def _load_offset_index(self, path):
+        """
+        Load the offset index of an existing file. An index is only used if it identifies the
+        file the same way the file is identified now.
+
+        :param path: full path to the existing file
+        :type  path: str
+
+        :return: the offset index, or None if there is none or it does not describe the file
+        :rtype:  dict or None
+        """
+        identity = self._offset_index_identity(path)
+        self.existing_offset_index_path = self._offset_index_path(path)
+        try:
+            with open(self.existing_offset_index_path) as index_file:
+                offset_index = json.load(index_file)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(offset_index, dict) or \
+                any(offset_index.get(key) != value for key, value in identity.iteritems()):
+            _LOG.debug(_('Ignoring the offset index of %(file)s') % {'file': path})
+            return None
+        return offset_index
+
+    def _write_offset_index(self):
+        """
+        Write the offset index of the finalized file, and remove the index of the file it
+        replaces.
+        """
+        offset_index = self._offset_index_identity(self.metadata_file_path)
+        offset_index.update({
+            'file_name': os.path.basename(self.metadata_file_path),
+            'content_start': self.content_start,
+            'content_end': self.content_end,
+        })
+        offset_index_path = self._offset_index_path(self.metadata_file_path)
+        index_dir = os.path.dirname(offset_index_path)
+        temp_path = None
+        try:
+            misc.mkdir(index_dir)
+            # Files with the same content share an index, so it is replaced atomically
+            temp_fd, temp_path = tempfile.mkstemp(dir=index_dir)
+            with os.fdopen(temp_fd, 'w') as index_file:
+                json.dump(offset_index, index_file)
+            os.rename(temp_path, offset_index_path)
+        except (IOError, OSError), e:
+            _LOG.exception(e)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return
+        if self.existing_offset_index_path not in (None, offset_index_path):
+            try:
+                os.unlink(self.existing_offset_index_path)
+            except OSError:
+                pass
+
+    def _end_content(self):
+        """
+        Finish the current gzip member and return the offset at which the next data is written.
+
+        :return: the offset in the file, or None if the file is not written by this context
+        :rtype:  int or None
+        """
+        if self._file_writer is None:
+            return None
+        if self._member_writer is not None:
+            self._member_writer.end_member()
+        return self._file_writer.size
+
+    def _copy_indexed_content(self):
+        """
+        Copy the content of the existing file using its offset index, as raw blocks.
+        """
+        self.original_file_handle.seek(self.offset_index['content_start'])
+        bytes_to_read = self.offset_index['content_end'] - self.offset_index['content_start']
+
+        def read_blocks(bytes_to_read):
+            while bytes_to_read > 0:
+                content_buffer = self.original_file_handle.read(
+                    min(COPY_BUFFER_SIZE, bytes_to_read))
+                if not content_buffer:
+                    raise Exception(_('Error: %(file)s is shorter than its offset index.')
+                                    % {'file': self.existing_file})
+                bytes_to_read -= len(content_buffer)
+                yield content_buffer
+
+        def write_blocks(blocks):
+            for content_buffer in blocks:
+                self._file_writer.write(content_buffer)
+                yield content_buffer
+
+        blocks = write_blocks(read_blocks(bytes_to_read))
+        if self._member_writer is not None and self._uncompressed_writer is not None:
+            # The content is copied compressed, so decompress it to count and hash it
+            for data in _decompress_members(blocks):
+                self._uncompressed_writer.update(data)
+        else:
+            for content_buffer in blocks:
+                pass
+
     def _write_file_header(self):
         """
         Write out the beginning of the file only if we are not in fast forward mode
         """
         super(FastForwardXmlFileContext, self)._write_file_header()
-        if self.fast_forward:
+        self.content_start = self._end_content()
+        if self.fast_forward and self.offset_index is not None:
+            self._copy_indexed_content()
+        elif self.fast_forward:
             start_tag = '<%s' % self.search_tag
             end_tag = '</%s' % self.root_tag
 
@@ -422,6 +822,29 @@ class FastForwardXmlFileContext(XmlFileContext):
                 bytes_to_read -= buffer_size
                 content_buffer = self.original_file_handle.read(BUFFER_SIZE)
 
+    def _write_file_footer(self):
+        """
+        Write out the end of the file, recording where the content ends.
+        """
+        content_end = self._end_content()
+        super(FastForwardXmlFileContext, self)._write_file_footer()
+        # only a file with a complete footer is given an offset index
+        self.content_end = content_end
+
+    def finalize(self):
+        """
+        Write the footer into the metadata file, close it and write its offset index.
+        """
+        if self._is_closed(self.metadata_file_handle):
+            return
+
+        # the footer is written by the superclass, which logs any error writing it
+        self.content_end = None
+        super(FastForwardXmlFileContext, self).finalize()
+
+        if None not in (self.content_start, self.content_end, self.size):
+            self._write_offset_index()
+
     def _close_metadata_file_handle(self):
         """
         Close any open file handles and remove the original file if a new one
@@ -1,5 +1,5 @@
 from gettext import gettext as _
-from itertools import chain, imap
+from multiprocessing.pool import ThreadPool
 import copy
 import itertools
 import logging
@@ -7,6 +7,7 @@ import os
 import shutil
 import sys
 import tarfile
+import threading
 import time
 import traceback
 import uuid
@@ -29,23 +30,13 @@ from nectar.downloaders.threaded import HTTPThreadedDownloader
 from pulp.server.config import config as pulp_config
 import pulp.server.managers.factory as manager_factory
 from pulp.server.managers.repo import _common as common_utils
-from pulp.server.util import copytree
+from pulp.server.util import copytree, parallel_copytree
 
 
 _logger = logging.getLogger(__name__)
 
-
-def _post_order(step):
-    """
-    Create a generator to perform a pre-order traversal of a step tree
-
-    :param step: a Publish step step to traverse
-    :type step: PublishStep
-    :returns: generator
-    """
-    for v in chain(*imap(_post_order, step.children)):
-        yield v
-    yield step
+# The maximum number of independent child steps of a step that are processed at once
+CHILD_STEP_THREADS = 4
 
 
 class Step(object):
@@ -58,7 +49,8 @@ class Step(object):
     Override the process_main() method and do your work there.
 
     If you are iterating over items and doing the same work on each, also override the
-    get_iterator() and get_total() methods.
+    get_iterator() and get_total() methods. To work on pages of items at once, set batch_size
+    and override process_batch() instead of process_main().
 
     A partial map of the execution flow:
 
@@ -79,7 +71,7 @@ class Step(object):
     """
 
     def __init__(self, step_type, status_conduit=None, non_halting_exceptions=None,
-                 disable_reporting=False):
+                 disable_reporting=False, independent_children=False):
         """
         :param step_type: The id of the step this processes
         :type step_type: str
@@ -89,6 +81,10 @@ class Step(object):
         :type non_halting_exceptions: list of Exception
         :param disable_reporting: Disable progress reporting for this step or any child steps
         :type disable_reporting: bool
+        :param independent_children: The child steps do not depend on each other, for example
+                                     because they write disjoint files, so they may be processed
+                                     in parallel by process_lifecycle()
+        :type independent_children: bool
         """
         self.status_conduit = status_conduit
         self.uuid = str(uuid.uuid4())
@@ -109,6 +105,15 @@ class Step(object):
         self.non_halting_exceptions = non_halting_exceptions or []
         self.exceptions = []
         self.disable_reporting = disable_reporting
+        self.independent_children = independent_children
+        # Set while the children are processed in parallel, so that a failed child leaves
+        # notifying this step and its ancestors until the other children have finished
+        self._processing_children_in_parallel = False
+        # When set, the items are processed by process_batch() in pages of this size
+        self.batch_size = None
+        # Serializes progress reporting and failure counting when child steps run in parallel.
+        # The lock of the root step is shared with all the steps of the tree.
+        self._progress_lock = threading.RLock()
 
     def add_child(self, step):
         """
@@ -118,6 +123,7 @@ class Step(object):
         :type step: Step
         """
         step.parent = self
+        step._share_progress_lock(self._progress_lock)
         self.children.append(step)
 
     def insert_child(self, index, step):
@@ -130,8 +136,20 @@ class Step(object):
         :type step: Step
         """
         step.parent = self
+        step._share_progress_lock(self._progress_lock)
         self.children.insert(index, step)
 
+    def _share_progress_lock(self, lock):
+        """
+        Use the progress lock of the step this step was added to, in this step and its children
+
+        :param lock: The progress lock of the parent step
+        :type lock: threading.RLock
+        """
+        self._progress_lock = lock
+        for step in self.children:
+            step._share_progress_lock(lock)
+
     def get_status_conduit(self):
         if self.status_conduit:
             return self.status_conduit
@@ -156,14 +174,77 @@ class Step(object):
         * finalize - All finalize steps will be called even if one of them throws an exception.
                      This is so that open file handles can be closed.
         * post_process
+
+        The children of a step that declares them independent are processed in parallel, each
+        child with its own subtree, and the step itself is processed once all of them are done.
         """
         try:
-            # Process the steps in post order
-            for step in _post_order(self):
-                step.process()
+            self._process_tree()
         finally:
             self.report_progress(force=True)
 
+    def _process_tree(self):
+        """
+        Process the children of this step in post order, followed by this step.
+        """
+        if self.independent_children and len(self.children) > 1:
+            self._process_children_in_parallel()
+        else:
+            for step in self.children:
+                step._process_tree()
+        self.process()
+
+    def _process_children_in_parallel(self):
+        """
+        Process the subtree of each child on a thread pool. Once a child fails, children that
+        have not started are not processed. The children already running are allowed to finish,
+        and then this step and its ancestors are notified using on_error() and the exception of
+        the first failed child is raised.
+        """
+        failed = threading.Event()
+
+        def process_child(step):
+            if failed.is_set():
+                return None
+            try:
+                step._process_tree()
+            except Exception:
+                failed.set()
+                return sys.exc_info()
+            return None
+
+        pool = ThreadPool(min(CHILD_STEP_THREADS, len(self.children)))
+        self._processing_children_in_parallel = True
+        try:
+            results = pool.map(process_child, self.children)
+        finally:
+            pool.close()
+            pool.join()
+            self._processing_children_in_parallel = False
+        for exc_info in results:
+            if exc_info is not None:
+                self._fail_up_tree()
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _fail_up_tree(self):
+        """
+        Mark this step and its ancestors as failed and notify them using on_error(). An ancestor
+        that is processing its children in parallel is not notified here, since it notifies
+        itself and its own ancestors once its other children have finished.
+        """
+        step = self
+        while step:
+            step.state = reporting_constants.STATE_FAILED
+            try:
+                step.on_error()
+            except Exception:
+                # Eat exceptions from the error handler since we
+                # still want to notify up the tree
+                pass
+            step = step.parent
+            if step is not None and step._processing_children_in_parallel:
+                break
+
     def is_skipped(self):
         """
         Test to find out if the step should be skipped.
@@ -206,6 +287,28 @@ class Step(object):
         """
         pass
 
+    def process_batch(self, items):
+        """
+        Override this method to process a page of items at once, for example to create
+        symlinks or serialize metadata in bulk. It is only called when batch_size is set.
+
+        By default each item is passed to process_main(), and an exception of a
+        non_halting_exceptions type is recorded as a failure of that item only. Progress is
+        reported once per page. A unit that could not be processed can be counted with
+        _record_failure(); every other item in the page is counted as a success. An exception
+        of a non_halting_exceptions type raised by an override is counted as a single failure
+        for the page.
+
+        :param items: A page of the items returned by get_iterator()
+        :type items: tuple
+        """
+        for item in items:
+            try:
+                self.process_main(item=item)
+            except Exception as e:
+                if not self._record_non_halting_exception(e):
+                    raise
+
     def process(self):
         """
         You probably do not want to override this method. It handles workflow for the rest of the
@@ -226,23 +329,23 @@ class Step(object):
                 self.report_progress()
                 self.initialize()
                 self.report_progress()
-                item_iterator = self.get_iterator()
+                if self.batch_size:
+                    item_iterator = self.get_batch_iterator()
+                else:
+                    item_iterator = self.get_iterator()
                 if item_iterator is not None:
-                    # We are using a generator and will call _process_block for each item
+                    # We are using a generator and will call _process_block for each item,
+                    # or _process_batch_block for each page of items
                     for item in item_iterator:
                         if self.canceled:
                             break
                         try:
-                            self._process_block(item=item)
+                            if self.batch_size:
+                                self._process_batch_block(item)
+                            else:
+                                self._process_block(item=item)
                         except Exception as e:
-                            raise_exception = True
-                            for exception in self.non_halting_exceptions:
-                                if isinstance(e, exception):
-                                    raise_exception = False
-                                    self._record_failure(e=e)
-                                    self.exceptions.append(e)
-                                    break
-                            if raise_exception:
+                            if not self._record_non_halting_exception(e):
                                 raise
                         # Clean out the progress_details for the individual item
                         self.progress_details = ""
@@ -263,20 +366,27 @@ class Step(object):
             tb = sys.exc_info()[2]
             if not isinstance(e, PulpCodedTaskFailedException):
                 self._record_failure(e, tb)
-            parent = self
-            while parent:
-                parent.state = reporting_constants.STATE_FAILED
-                try:
-                    parent.on_error()
-                except Exception:
-                    # Eat exceptions from the error handler since we
-                    # still want to notify up the tree
-                    pass
-                parent = parent.parent
+            self._fail_up_tree()
             raise
 
         self.state = reporting_constants.STATE_COMPLETE
 
+    def _record_non_halting_exception(self, e):
+        """
+        Record an exception raised while processing an item as a failure, if it is of one of
+        the non_halting_exceptions types, so that processing can go on with the next item.
+
+        :param e: The exception raised while processing the item
+        :type e: Exception
+        :return: Whether the exception was recorded, rather than having to be raised
+        :rtype: bool
+        """
+        if not isinstance(e, tuple(self.non_halting_exceptions)):
+            return False
+        self._record_failure(e=e)
+        self.exceptions.append(e)
+        return True
+
     def on_error(self):
         """
         this block is called if a child step raised an exception
@@ -300,6 +410,20 @@ class Step(object):
             self.progress_successes += 1
         self.report_progress()
 
+    def _process_batch_block(self, items):
+        """
+        The counterpart of _process_block() for a page of items, used when batch_size is set.
+
+        :param items: A page of the items returned by get_iterator()
+        :type items: tuple
+        """
+        failures = self.progress_failures
+        self.process_batch(items)
+        successes = len(items) - (self.progress_failures - failures)
+        remaining = self.total_units - self.progress_successes - self.progress_failures
+        self.progress_successes += max(0, min(successes, remaining))
+        self.report_progress()
+
     def _get_total(self):
         """
         DEPRECATED in favor of get_total()
@@ -325,21 +449,25 @@ class Step(object):
         if self.disable_reporting:
             return
 
-        # Force an update if the step state has changed
-        if self.state != self.last_reported_state:
-            force = True
-            self.last_reported_state = self.state
-        if self.parent:
-            self.parent.report_progress(force)
-        else:
-            if force:
-                self.get_status_conduit().set_progress(self.get_progress_report())
-            else:
+        report = None
+        with self._progress_lock:
+            # Force an update if the step state has changed
+            if self.state != self.last_reported_state:
+                force = True
+                self.last_reported_state = self.state
+            if self.parent is None:
                 current_time = time.time()
-                if current_time != self.last_report_time:
-                    # Update at most once a second
-                    self.get_status_conduit().set_progress(self.get_progress_report())
+                # Update at most once a second, unless forced
+                if force or current_time != self.last_report_time:
+                    report = self.get_progress_report()
                     self.last_report_time = current_time
+        # The lock is not held while reporting, since the report may be written to the database
+        if self.parent:
+            self.parent.report_progress(force)
+        elif report is not None:
+            # A forced report is written right away rather than left to the task's progress
+            # reporter, so that state changes are not delayed
+            self.get_status_conduit().set_progress(report, flush=force)
 
     def get_progress_report(self):
         """
@@ -384,8 +512,6 @@ class Step(object):
         :param tb: traceback instance (if any)
         :type  tb: Traceback or None
         """
-        self.progress_failures += 1
-
         error_details = {'error': None,
                          'traceback': None}
 
@@ -395,11 +521,14 @@ class Step(object):
         if e is not None:
             error_details['error'] = str(e)
 
-        if error_details.values() != (None, None):
-            self.error_details.append(error_details)
+        with self._progress_lock:
+            self.progress_failures += 1
 
-        if self.parent:
-            self.parent._record_failure()
+            if error_details.values() != (None, None):
+                self.error_details.append(error_details)
+
+            if self.parent:
+                self.parent._record_failure()
 
     def cancel(self):
         """
@@ -421,6 +550,19 @@ class Step(object):
         """
         return None
 
+    def get_batch_iterator(self):
+        """
+        This method returns a generator of pages of batch_size items from get_iterator().
+        The pages will be iterated over by the process_batch method.
+
+        :return: a generator of tuples, or None if get_iterator is not defined
+        :rtype: generator
+        """
+        item_iterator = self.get_iterator()
+        if item_iterator is None:
+            return None
+        return misc.paginate(item_iterator, self.batch_size)
+
 
 class PluginStep(Step):
     """
@@ -578,7 +720,8 @@ class UnitModelPluginStep(PluginStep):
     The QuerySetNoCache objects themselves do not cache results, as the name implies.
     """
     def __init__(self, step_type, model_classes, repo_content_unit_q=None, repo=None, conduit=None,
-                 config=None, working_dir=None, plugin_type=None, unit_fields=None, **kwargs):
+                 config=None, working_dir=None, plugin_type=None, unit_fields=None,
+                 batch_size=None, **kwargs):
         """
         :param step_type: The id of the step this processes
         :type  step_type: str
@@ -599,6 +742,9 @@ class UnitModelPluginStep(PluginStep):
         :type  plugin_type: str
         :param unit_fields: list of unit fields to retrieve from database, if None all are retrieved
 -       :type unit_fields: list of str
+        :param batch_size: when set, units are fetched from the database and passed to
+                           process_batch() in pages of this size
+        :type  batch_size: int
         """
         super(UnitModelPluginStep, self).__init__(step_type, repo, conduit, config, working_dir,
                                                   plugin_type, **kwargs)
@@ -606,6 +752,7 @@ class UnitModelPluginStep(PluginStep):
         self.model_classes = model_classes
         self._repo_content_unit_q = repo_content_unit_q
         self.unit_fields = unit_fields
+        self.batch_size = batch_size
 
         # the corresponding publicly-accessible values get cached here
         self._unit_querysets = None
@@ -638,6 +785,9 @@ class UnitModelPluginStep(PluginStep):
                 queries = repo_controller.get_unit_model_querysets(self.get_repo().id,
                                                                    model_class,
                                                                    self._repo_content_unit_q)
+                if self.batch_size:
+                    # fetch each page of units from the database in a single round trip
+                    queries = [query.batch_size(self.batch_size) for query in queries]
                 self._unit_querysets.extend(queries)
 
         if self.unit_fields:
@@ -745,7 +895,7 @@ class UnitPublishStep(PublishStep):
     """
 
     def __init__(self, step_type, unit_type=None, association_filters=None,
-                 unit_fields=None):
+                 unit_fields=None, batch_size=None):
         """
         Set the default parent, step_type and unit_type for the the publish step
         the unit_type defaults to none since some steps are not used for processing units.
@@ -754,6 +904,8 @@ class UnitPublishStep(PublishStep):
         :type step_type: str
         :param unit_type: The type of unit this step processes
         :type unit_type: str or list of str
+        :param batch_size: when set, units are passed to process_batch() in pages of this size
+        :type batch_size: int
         """
         super(UnitPublishStep, self).__init__(step_type)
         if isinstance(unit_type, list):
@@ -763,6 +915,7 @@ class UnitPublishStep(PublishStep):
         self.skip_list = set()
         self.association_filters = association_filters
         self.unit_fields = unit_fields
+        self.batch_size = batch_size
 
     def get_unit_generator(self):
         """
@@ -909,7 +1062,11 @@ class AtomicDirectoryPublishStep(PluginStep):
                     raise
         except OSError as e:
             if e.errno == errno.EXDEV:
-                copytree(self.source_dir, timestamp_master_dir, symlinks=True)
+                # The master directory is on another filesystem, so the files cannot be
+                # renamed or linked there and are copied in parallel instead
+                parallel_copytree(self.source_dir, timestamp_master_dir, symlinks=True,
+                                  progress_callback=self._report_copy_progress)
+                self.progress_details = ''
             else:
                 raise
 
@@ -952,6 +1109,19 @@ class AtomicDirectoryPublishStep(PluginStep):
         # Clear out any previously published masters
         misc.clear_directory(self.master_publish_dir, skip_list=[self.parent.timestamp])
 
+    def _report_copy_progress(self, copied, total):
+        """
+        Report the progress of copying the source directory to the master directory.
+
+        :param copied: The number of files copied
+        :type copied: int
+        :param total: The total number of files to copy
+        :type total: int
+        """
+        self.progress_details = _('Copied %(copied)d of %(total)d files') % {
+            'copied': copied, 'total': total}
+        self.report_progress()
+
 
 class SaveTarFilePublishStep(PublishStep):
     """
@@ -0,0 +1,250 @@
+"""
+Asynchronous progress reporting for tasks.
+
+Progress reports are written to the task's status by a background thread, so that the code
+reporting progress does not wait on the database. Reports are coalesced between writes, and
+each write only sets the fields of the reports that changed since the previous one.
+"""
+import copy
+import logging
+import threading
+
+from pulp.server.db import model
+
+
+_logger = logging.getLogger(__name__)
+
+# How long, in seconds, the reporter waits after a report changes before writing it, so that
+# further changes in that time are written together
+PROGRESS_INTERVAL = 1
+
+_reporters = {}
+_reporters_lock = threading.Lock()
+
+
+class ProgressReporter(object):
+    """
+    Writes the progress reports of a task in a background thread.
+
+    Each report is stored in the task status at progress_report.<report_id>. Only the latest
+    version of each report is kept until it is written, so the pending updates are bounded by
+    the number of reports, and reporting progress never blocks on the database. Each write
+    only sets the fields of the reports that changed, down to the values of nested dicts and
+    lists.
+
+    :ivar task_id: The ID of the task the reports belong to.
+    :type task_id: basestring
+    :ivar updates: The number of reports given to the reporter.
+    :type updates: int
+    :ivar writes:  The number of updates written to the database.
+    :type writes:  int
+    """
+
+    def __init__(self, task_id, interval=PROGRESS_INTERVAL):
+        """
+        :param task_id:  The ID of the task the reports belong to.
+        :type  task_id:  basestring
+        :param interval: How long, in seconds, to wait after a report changes before writing.
+        :type  interval: float
+        """
+        self.task_id = task_id
+        self.interval = interval
+        self.updates = 0
+        self.writes = 0
+        # report_id -> latest report that has not been written
+        self._pending = {}
+        # report_id -> report as last written
+        self._written = {}
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='progress-%s' % task_id)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def update(self, report_id, report, flush=False):
+        """
+        Replace a progress report. The report is copied, so the caller may keep changing it
+        while it is written.
+
+        :param report_id: Identifies the report within the task's progress report.
+        :type  report_id: basestring
+        :param report:    The report, which must be serializable to BSON.
+        :type  report:    object
+        :param flush:     If True, write the pending reports before returning, such as when
+                          the state of the work being reported changes.
+        :type  flush:     bool
+
+        :raises Exception: if flush is True and the reports cannot be written
+        """
+        # Copied here rather than by the writing thread, which could otherwise see the report
+        # while the caller changes it
+        report = copy.deepcopy(report)
+        with self._condition:
+            self._pending[report_id] = report
+            self.updates += 1
+            self._condition.notify()
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending reports.
+
+        :raises Exception: if the reports cannot be written, in which case they are kept to be
+                           written again unless they are replaced in the meantime
+        """
+        with self._write_lock:
+            with self._condition:
+                pending, self._pending = self._pending, {}
+            try:
+                self._write(pending)
+            except Exception:
+                with self._condition:
+                    for report_id, report in pending.iteritems():
+                        self._pending.setdefault(report_id, report)
+                raise
+
+    def close(self):
+        """
+        Stop the background thread and write the pending reports.
+
+        :raises Exception: if the reports cannot be written
+        """
+        self._closing.set()
+        with self._condition:
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _write(self, reports):
+        """
+        Set the fields of the reports that differ from the ones last written in the task status.
+
+        :param reports: Reports keyed by report ID.
+        :type  reports: dict
+        """
+        changed = dict((report_id, report) for report_id, report in reports.iteritems()
+                       if report_id not in self._written or self._written[report_id] != report)
+        if not changed:
+            return
+        update = {}
+        if not all(_is_field_name(report_id) for report_id in changed):
+            # The ID cannot be used in a field path, so the whole progress report is replaced
+            progress_report = dict(self._written)
+            progress_report.update(changed)
+            update['$set'] = {'progress_report': progress_report}
+        else:
+            sets = {}
+            unsets = {}
+            for report_id, report in changed.iteritems():
+                _diff('progress_report.%s' % report_id, self._written.get(report_id, _MISSING),
+                      report, sets, unsets)
+            if sets:
+                update['$set'] = sets
+            if unsets:
+                update['$unset'] = unsets
+        model.TaskStatus._get_collection().update_one({'task_id': self.task_id}, update)
+        self._written.update(changed)
+        self.writes += 1
+
+    def _run(self):
+        """
+        Write the pending reports once they have had time to coalesce, until the reporter is
+        closed.
+        """
+        while True:
+            with self._condition:
+                while not self._pending and not self._closing.is_set():
+                    self._condition.wait()
+            self._closing.wait(self.interval)
+            if self._closing.is_set():
+                return
+            try:
+                self.flush()
+            except Exception:
+                _logger.exception('Error writing progress for task [%s]' % self.task_id)
+
+
+# Stands for a report that has not been written yet
+_MISSING = object()
+
+
+def _is_field_name(key):
+    """
+    :param key: A key of a report.
+    :type  key: object
+
+    :return: True if the key can be used in a field path.
+    :rtype:  bool
+    """
+    return isinstance(key, basestring) and key != '' and '.' not in key and \
+        not key.startswith('$')
+
+
+def _diff(path, old, new, sets, unsets):
+    """
+    Collect the updates that turn a value written at a field path into a new value. Dicts are
+    compared key by key, and lists of the same length item by item, so that only the values
+    that changed are set.
+
+    :param path:   The field path of the value.
+    :type  path:   basestring
+    :param old:    The value last written, or _MISSING.
+    :type  old:    object
+    :param new:    The new value, which differs from the old one.
+    :type  new:    object
+    :param sets:   Collects the values to set, keyed by field path.
+    :type  sets:   dict
+    :param unsets: Collects the field paths to unset.
+    :type  unsets: dict
+    """
+    if isinstance(old, dict) and isinstance(new, dict) and \
+            all(_is_field_name(key) for key in old) and all(_is_field_name(key) for key in new):
+        items = [(key, old.get(key, _MISSING), value) for key, value in new.iteritems()]
+        for key in old:
+            if key not in new:
+                unsets['%s.%s' % (path, key)] = ''
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        items = [(index, old[index], value) for index, value in enumerate(new)]
+    else:
+        sets[path] = new
+        return
+    for key, old_value, new_value in items:
+        if old_value is _MISSING or old_value != new_value:
+            _diff('%s.%s' % (path, key), old_value, new_value, sets, unsets)
+
+
+def get_reporter(task_id):
+    """
+    Get the progress reporter of a task, starting one if the task does not have one.
+
+    :param task_id: The ID of the task.
+    :type  task_id: basestring
+
+    :return: The task's progress reporter.
+    :rtype:  ProgressReporter
+    """
+    with _reporters_lock:
+        reporter = _reporters.get(task_id)
+        if reporter is None:
+            reporter = _reporters[task_id] = ProgressReporter(task_id)
+        return reporter
+
+
+def close_reporter(task_id):
+    """
+    Close the progress reporter of a task, if it has one, writing its pending reports. Errors
+    are logged rather than raised, so that they do not change the outcome of the task.
+
+    :param task_id: The ID of the task.
+    :type  task_id: basestring
+    """
+    with _reporters_lock:
+        reporter = _reporters.pop(task_id, None)
+    if reporter is None:
+        return
+    try:
+        reporter.close()
+    except Exception:
+        _logger.exception('Error writing progress for task [%s]' % task_id)
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from datetime import datetime
 from gettext import gettext as _
 import logging
@@ -16,6 +17,8 @@ from mongoengine.queryset import DoesNotExist
 
 from pulp.common.constants import SCHEDULER_WORKER_NAME, RESOURCE_MANAGER_WORKER_NAME
 from pulp.common import constants, dateutils, tags
+from pulp.server.config import config
+from pulp.server.async import progress
 from pulp.server.async.celery_instance import celery, RESOURCE_MANAGER_QUEUE, \
     DEDICATED_QUEUE_EXCHANGE
 from pulp.server.exceptions import PulpException, MissingResource, \
@@ -30,6 +33,15 @@ from pulp.server.managers.schedule import utils
 controller = control.Control(app=celery)
 _logger = logging.getLogger(__name__)
 
+# How often, in seconds, the resource manager refreshes its list of workers from the database
+WORKER_REFRESH_INTERVAL = 5
+# How long, in seconds, the resource manager waits before checking again for released
+# reservations when no worker is available for a task
+RESERVATION_POLL_INTERVAL = 0.25
+# How many resources the resource manager remembers the last worker of, to place their tasks on
+# a worker that recently worked on them
+RECENT_RESOURCES_LIMIT = 1000
+
 
 class PulpTask(CeleryTask):
     """
@@ -129,99 +141,339 @@ def _queue_reserved_task(name, task_id, resource_id, inner_args, inner_kwargs):
 
     :return: None
     """
+    start = time.time()
+    _reservation_index.sync()
     while True:
         try:
-            worker = get_worker_for_reservation(resource_id)
+            worker_name = _reservation_index.find_worker(resource_id)
         except NoWorkers:
             pass
         else:
             break
 
-        try:
-            worker = _get_unreserved_worker()
-        except NoWorkers:
-            pass
-        else:
-            break
+        # No worker is ready for this work, so we need to wait until one of the reservations is
+        # released or a new worker becomes available
+        _reservation_index.wait()
 
-        # No worker is ready for this work, so we need to wait
-        time.sleep(0.25)
+    _reservation_index.reserve(task_id, worker_name, resource_id)
 
-    ReservedResource(task_id=task_id, worker_name=worker['name'], resource_id=resource_id).save()
-
-    inner_kwargs['routing_key'] = worker.name
+    inner_kwargs['routing_key'] = worker_name
     inner_kwargs['exchange'] = DEDICATED_QUEUE_EXCHANGE
     inner_kwargs['task_id'] = task_id
 
     try:
         celery.tasks[name].apply_async(*inner_args, **inner_kwargs)
     finally:
-        _release_resource.apply_async((task_id, ), routing_key=worker.name,
+        _release_resource.apply_async((task_id, ), routing_key=worker_name,
                                       exchange=DEDICATED_QUEUE_EXCHANGE)
+    _reservation_index.record_dispatch(task_id, worker_name, time.time() - start)
 
 
-def _is_worker(worker_name):
-    """
-    Strip out workers that should never be assigned work. We need to check
-    via "startswith()" since we do not know which host the worker is running on.
+class ReservationIndex(object):
     """
+    An in-memory index of the available workers and of the resources reserved on each of them,
+    kept by the resource manager to decide which worker a reserved task is dispatched to.
 
-    if worker_name.startswith(SCHEDULER_WORKER_NAME) or \
-       worker_name.startswith(RESOURCE_MANAGER_QUEUE):
-        return False
-    return True
+    The resource manager is the only process that creates reservations, so after loading the
+    existing ones once, the index only needs to find out which of its reservations have been
+    released, by _release_resource or _delete_worker in other processes. It does so by looking up
+    the ids of the reservations it holds, instead of loading every Worker and ReservedResource
+    document. The list of workers, which is maintained by the worker heartbeats, is refreshed at
+    most every WORKER_REFRESH_INTERVAL seconds, or when a reservation refers to an unknown worker.
 
+    Tasks that reserve a resource that is already reserved are dispatched to the worker holding
+    the reservation. Otherwise, the worker is chosen by a PlacementPolicy.
 
-def get_worker_for_reservation(resource_id):
+    The index also keeps count of how long reserved tasks waited to be dispatched.
     """
-    Return the Worker instance that is associated with a reservation of type resource_id. If
-    there are no workers with that reservation_id type a pulp.server.exceptions.NoWorkers
-    exception is raised.
 
-    :param resource_id:    The name of the resource you wish to reserve for your task.
+    def __init__(self, policy=None):
+        """
+        :param policy: the policy used to choose a worker for resources that are not reserved.
+                       Defaults to a LeastLoadedPlacementPolicy.
+        :type  policy: PlacementPolicy
+        """
+        self._policy = policy or LeastLoadedPlacementPolicy()
+        self._loaded = False
+        # task_id -> (worker_name, resource_id)
+        self._reservations = {}
+        # resource_id -> (worker_name, set of task_ids)
+        self._resources = {}
+        # worker_name -> set of task_ids
+        self._worker_reservations = {}
+        self._workers = set()
+        self._workers_refreshed = None
+        # resource_id -> name of the worker that was last dispatched a task reserving it
+        self._recent_workers = OrderedDict()
+
+        self.dispatch_count = 0
+        self.total_dispatch_latency = 0.0
+        self.max_dispatch_latency = 0.0
+
+    def _add(self, task_id, worker_name, resource_id):
+        """
+        Add a reservation to the index.
+
+        :param task_id:     The UUID of the task that holds the reservation
+        :type  task_id:     basestring
+        :param worker_name: The name of the worker the task was dispatched to
+        :type  worker_name: basestring
+        :param resource_id: The id of the reserved resource
+        :type  resource_id: basestring
+        """
+        self._reservations[task_id] = (worker_name, resource_id)
+        self._resources.setdefault(resource_id, (worker_name, set()))[1].add(task_id)
+        self._worker_reservations.setdefault(worker_name, set()).add(task_id)
+
+    def _remove(self, task_id):
+        """
+        Remove a released reservation from the index.
+
+        :param task_id: The UUID of the task that held the reservation
+        :type  task_id: basestring
+        """
+        worker_name, resource_id = self._reservations.pop(task_id)
+
+        task_ids = self._resources[resource_id][1]
+        task_ids.discard(task_id)
+        if not task_ids:
+            del self._resources[resource_id]
+
+        task_ids = self._worker_reservations[worker_name]
+        task_ids.discard(task_id)
+        if not task_ids:
+            del self._worker_reservations[worker_name]
+
+    def sync(self):
+        """
+        Bring the index up to date with the reservations that have been released and the workers
+        that have come and gone.
+        """
+        if not self._loaded:
+            for reservation in ReservedResource.objects.all():
+                self._add(reservation.task_id, reservation.worker_name, reservation.resource_id)
+            self._loaded = True
+        elif self._reservations:
+            held = set(ReservedResource.objects(
+                task_id__in=self._reservations.keys()).distinct('task_id'))
+            for task_id in set(self._reservations) - held:
+                self._remove(task_id)
+
+        now = time.time()
+        if self._workers_refreshed is None or \
+                now - self._workers_refreshed >= WORKER_REFRESH_INTERVAL:
+            self._refresh_workers(now)
+
+    def _refresh_workers(self, now):
+        """
+        Load the names of the workers that can be assigned work.
+
+        :param now: the current time, as returned by time.time()
+        :type  now: float
+        """
+        self._workers = set(filter(_is_worker, Worker.objects.distinct('name')))
+        self._workers_refreshed = now
+
+    def wait(self):
+        """
+        Wait for the index to change, by polling for released reservations and new workers.
+        """
+        time.sleep(RESERVATION_POLL_INTERVAL)
+        self.sync()
+
+    def find_worker(self, resource_id):
+        """
+        Find the worker a task that reserves the given resource should be dispatched to. This is
+        the worker that already holds a reservation for the resource, or else the worker chosen
+        by the placement policy.
 
-    :raises NoWorkers:     If all workers have reserved_resource entries associated with them.
+        :param resource_id: The id of the resource the task reserves
+        :type  resource_id: basestring
 
-    :type resource_id:     basestring
-    :returns:              The Worker instance that has a reserved_resource entry of type
-                           `resource_id` associated with it.
-    :rtype:                pulp.server.db.model.resources.Worker
+        :raises NoWorkers:  If no worker can be assigned the task at the moment
+
+        :return:            The name of the worker
+        :rtype:             basestring
+        """
+        if resource_id in self._resources:
+            worker_name = self._resources[resource_id][0]
+            if worker_name not in self._workers:
+                self._refresh_workers(time.time())
+            if worker_name in self._workers:
+                return worker_name
+            # The worker has gone away, and its reservations have not been cleaned up yet
+            raise NoWorkers()
+
+        loads = dict((name, len(self._worker_reservations.get(name, ())))
+                     for name in self._workers)
+        worker_name = self._policy.select_worker(resource_id, loads,
+                                                 self._recent_workers.get(resource_id))
+        if worker_name is None:
+            raise NoWorkers()
+        return worker_name
+
+    def reserve(self, task_id, worker_name, resource_id):
+        """
+        Save a reservation of a resource for a task dispatched to a worker.
+
+        :param task_id:     The UUID of the task that reserves the resource
+        :type  task_id:     basestring
+        :param worker_name: The name of the worker the task is dispatched to
+        :type  worker_name: basestring
+        :param resource_id: The id of the reserved resource
+        :type  resource_id: basestring
+        """
+        ReservedResource(task_id=task_id, worker_name=worker_name, resource_id=resource_id).save()
+        self._add(task_id, worker_name, resource_id)
+
+        self._recent_workers.pop(resource_id, None)
+        self._recent_workers[resource_id] = worker_name
+        if len(self._recent_workers) > RECENT_RESOURCES_LIMIT:
+            self._recent_workers.popitem(last=False)
+
+    def record_dispatch(self, task_id, worker_name, latency):
+        """
+        Record how long a reserved task waited to be dispatched.
+
+        :param task_id:     The UUID of the dispatched task
+        :type  task_id:     basestring
+        :param worker_name: The name of the worker the task was dispatched to
+        :type  worker_name: basestring
+        :param latency:     The number of seconds the task waited to be dispatched
+        :type  latency:     float
+        """
+        self.dispatch_count += 1
+        self.total_dispatch_latency += latency
+        self.max_dispatch_latency = max(self.max_dispatch_latency, latency)
+        _logger.debug(_('Dispatched task %(task_id)s to %(worker)s after %(latency).3f seconds. '
+                        'Average dispatch latency is %(average).3f seconds.') %
+                      {'task_id': task_id, 'worker': worker_name, 'latency': latency,
+                       'average': self.total_dispatch_latency / self.dispatch_count})
+
+
+class PlacementPolicy(object):
     """
-    reservation = ReservedResource.objects(resource_id=resource_id).first()
-    if reservation:
-        return Worker.objects(name=reservation['worker_name']).first()
-    else:
-        raise NoWorkers()
+    Chooses the worker a task is dispatched to when the resource it reserves is not already
+    reserved on a worker.
+    """
+
+    def __init__(self, reservation_limit=1):
+        """
+        :param reservation_limit: the number of outstanding reserved tasks a worker may have
+                                  before it stops being assigned more resources
+        :type  reservation_limit: int
+        """
+        self.reservation_limit = reservation_limit
+
+    def select_worker(self, resource_id, loads, recent_worker):
+        """
+        Choose a worker for a task reserving the given resource.
+
+        :param resource_id:   The id of the resource the task reserves
+        :type  resource_id:   basestring
+        :param loads:         maps the name of each available worker to the number of reserved
+                              tasks dispatched to it that have not finished yet
+        :type  loads:         dict
+        :param recent_worker: The name of the worker that was last dispatched a task reserving
+                              the resource, or None
+        :type  recent_worker: basestring
+
+        :return:              The name of the chosen worker, or None if no worker should be
+                              assigned the task at the moment
+        :rtype:               basestring
+        """
+        raise NotImplementedError()
 
 
-def _get_unreserved_worker():
+class LeastLoadedPlacementPolicy(PlacementPolicy):
+    """
+    Chooses the worker with the fewest outstanding reserved tasks, among the workers that are
+    below the reservation limit.
     """
-    Return the Worker instance that has no reserved_resource entries
-    associated with it. If there are no unreserved workers a
-    pulp.server.exceptions.NoWorkers exception is raised.
 
-    :raises NoWorkers: If all workers have reserved_resource entries associated with them.
+    def _sort_key(self, worker_name, load, recent_worker):
+        """
+        :return: a key by which the candidate workers are sorted, the smallest one being chosen
+        :rtype:  tuple
+        """
+        return load, worker_name
+
+    def select_worker(self, resource_id, loads, recent_worker):
+        """
+        Choose a worker for a task reserving the given resource.
 
-    :returns:          The Worker instance that has no reserved_resource
-                       entries associated with it.
-    :rtype:            pulp.server.db.model.resources.Worker
+        :param resource_id:   The id of the resource the task reserves
+        :type  resource_id:   basestring
+        :param loads:         maps the name of each available worker to the number of reserved
+                              tasks dispatched to it that have not finished yet
+        :type  loads:         dict
+        :param recent_worker: The name of the worker that was last dispatched a task reserving
+                              the resource, or None
+        :type  recent_worker: basestring
+
+        :return:              The name of the chosen worker, or None if all the workers are at
+                              the reservation limit
+        :rtype:               basestring
+        """
+        candidates = [(self._sort_key(name, load, recent_worker), name)
+                      for name, load in loads.iteritems() if load < self.reservation_limit]
+        if not candidates:
+            return None
+        return min(candidates)[1]
+
+
+class AffinityPlacementPolicy(LeastLoadedPlacementPolicy):
+    """
+    Chooses the worker with the fewest outstanding reserved tasks like the
+    LeastLoadedPlacementPolicy, but among equally loaded workers, prefers the one that last worked
+    on the resource, since its working directory and page cache are likely to still be warm.
     """
 
-    # Build a mapping of queue names to Worker objects
-    workers_dict = dict((worker['name'], worker) for worker in Worker.objects())
-    worker_names = workers_dict.keys()
-    reserved_names = [r['worker_name'] for r in ReservedResource.objects.all()]
+    def _sort_key(self, worker_name, load, recent_worker):
+        """
+        :return: a key by which the candidate workers are sorted, the smallest one being chosen
+        :rtype:  tuple
+        """
+        return load, worker_name != recent_worker, worker_name
+
 
-    # Find an unreserved worker using set differences of the names, and filter
-    # out workers that should not be assigned work.
-    # NB: this is a little messy but set comprehensions are in python 2.7+
-    unreserved_workers = set(filter(_is_worker, worker_names)) - set(reserved_names)
+PLACEMENT_POLICIES = {
+    'least_loaded': LeastLoadedPlacementPolicy,
+    'affinity': AffinityPlacementPolicy,
+}
+
+
+def get_placement_policy():
+    """
+    Create the placement policy configured in the [tasks] section of the server configuration.
 
+    :return: the configured placement policy
+    :rtype:  PlacementPolicy
+    """
+    name = config.get('tasks', 'worker_placement_policy')
+    reservation_limit = max(config.getint('tasks', 'worker_reservation_limit'), 1)
     try:
-        return workers_dict[unreserved_workers.pop()]
+        policy_class = PLACEMENT_POLICIES[name]
     except KeyError:
-        # All workers are reserved
-        raise NoWorkers()
+        _logger.error(_('Unknown worker placement policy: %(name)s. Using %(default)s instead.') %
+                      {'name': name, 'default': 'affinity'})
+        policy_class = AffinityPlacementPolicy
+    return policy_class(reservation_limit)
+
+
+_reservation_index = ReservationIndex(get_placement_policy())
+
+
+def _is_worker(worker_name):
+    """
+    Strip out workers that should never be assigned work. We need to check
+    via "startswith()" since we do not know which host the worker is running on.
+    """
+
+    if worker_name.startswith(SCHEDULER_WORKER_NAME) or \
+       worker_name.startswith(RESOURCE_MANAGER_QUEUE):
+        return False
+    return True
 
 
 def _delete_worker(name, normal_shutdown=False):
@@ -505,6 +757,8 @@ class Task(PulpTask, ReservedTaskMixin):
                 _logger.info(_('resetting consecutive failure count for schedule %(id)s')
                              % {'id': kwargs['scheduled_call_id']})
                 utils.reset_failure_count(kwargs['scheduled_call_id'])
+        # Write the remaining progress before the final state of the task
+        progress.close_reporter(task_id)
         if not self.request.called_directly:
             now = datetime.now(dateutils.utc_tz())
             finish_time = dateutils.format_iso8601_datetime(now)
@@ -557,6 +811,7 @@ class Task(PulpTask, ReservedTaskMixin):
             # celery will log the traceback
         if kwargs.get('scheduled_call_id') is not None:
             utils.increment_failure_count(kwargs['scheduled_call_id'])
+        progress.close_reporter(task_id)
         if not self.request.called_directly:
             now = datetime.now(dateutils.utc_tz())
             finish_time = dateutils.format_iso8601_datetime(now)
@@ -32,6 +32,20 @@ try:
     from bson.son import SON
 except ImportError:
     from pymongo.son import SON  # noqa
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  # noqa
+    except ImportError:
+        scandir = None  # noqa
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile  # noqa
+    except ImportError:
+        sendfile = None  # noqa
 
 
 def _update_wrapper(orig, wrapper):
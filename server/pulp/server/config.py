@@ -127,6 +127,8 @@ _default_values = {
         'keyfile': '/etc/pki/pulp/qpid/client.crt',
         'certfile': '/etc/pki/pulp/qpid/client.crt',
         'login_method': '',
+        'worker_placement_policy': 'affinity',
+        'worker_reservation_limit': '1',
     },
     'lazy': {
         'redirect_host': socket.getfqdn(),
@@ -134,7 +136,8 @@ _default_values = {
         'redirect_path': '/streamer/',
         'https_retrieval': 'true',
         'download_interval': '30',
-        'download_concurrency': '5'
+        'download_concurrency': '5',
+        'deferred_download_batch_size': '1000'
     },
 }
 
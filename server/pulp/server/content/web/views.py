@@ -1,7 +1,11 @@
+from collections import namedtuple, OrderedDict
 from gettext import gettext as _
 import logging
 import mimetypes
 import os
+import stat
+import threading
+import time
 
 from django.http import \
     HttpResponse, HttpResponseRedirect, HttpResponseForbidden, Http404
@@ -9,21 +13,102 @@ from django.shortcuts import render_to_response
 from django.views.generic import View
 
 from pulp.repoauth.wsgi import allow_access
+from pulp.server.compat import scandir
 from pulp.server.config import config as pulp_conf
-from pulp.server.lazy import URL, Key
+from pulp.server.lazy import signing_service
 
 
 logger = logging.getLogger(__name__)
 
 SAFE_STORAGE_SUBDIRS = ('published', 'content', 'static')
 
+# How long, in seconds, the resolution of a requested path is cached
+RESOLUTION_CACHE_TIMEOUT = 5
+# The maximum number of requested paths whose resolution is cached
+RESOLUTION_CACHE_SIZE = 10000
+# The maximum number of rendered directory indexes cached
+DIRECTORY_INDEX_CACHE_SIZE = 1000
+
+# How a requested path is served
+SERVE_FILE = 'file'
+SERVE_DIRECTORY = 'directory'
+SERVE_REDIRECT = 'redirect'
+SERVE_NOT_FOUND = 'not_found'
+SERVE_FORBIDDEN = 'forbidden'
+
+Resolution = namedtuple('Resolution', ('path', 'action'))
+
+
+class TimedCache(object):
+    """
+    A thread-safe cache that holds at most a given number of entries, evicting the oldest
+    entry when it is full. Entries are discarded once they are older than the timeout.
+    """
+
+    def __init__(self, max_size, timeout=None):
+        """
+        :param max_size: The maximum number of entries to hold.
+        :type  max_size: int
+        :param timeout:  The number of seconds entries are kept, or None to keep them until
+                         they are evicted.
+        :type  timeout:  float
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        # key -> (time added, value)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: The key of the entry.
+        :type  key: hashable
+
+        :return: The value, or None if there is no entry for the key or it has expired.
+        :rtype:  object
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            added, value = entry
+            if self.timeout is not None and time.time() - added >= self.timeout:
+                del self._entries[key]
+                return None
+            return value
+
+    def put(self, key, value):
+        """
+        Add or replace an entry.
+
+        :param key:   The key of the entry.
+        :type  key:   hashable
+        :param value: The value of the entry.
+        :type  value: object
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all the entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+# Requested path -> Resolution
+_resolution_cache = TimedCache(RESOLUTION_CACHE_SIZE, RESOLUTION_CACHE_TIMEOUT)
+# Directory path -> (modification time, rendered index)
+_directory_index_cache = TimedCache(DIRECTORY_INDEX_CACHE_SIZE)
+
 
 class ContentView(View):
     """
     The content delivery view provides content.
-
-    :ivar key: The public RSA key used for URL signing.
-    :type key: M2Crypto.RSA.RSA
     """
 
     @staticmethod
@@ -89,14 +174,14 @@ class ContentView(View):
         return reply
 
     @staticmethod
-    def redirect(request, key):
+    def redirect(request):
         """
         Redirected GET request.
+        The redirect URL is signed with the server private RSA key by the process-wide
+        signing service, which reuses the signed URL for repeated requests by the same client.
 
         :param request: The WSGI request object.
         :type request: django.core.handlers.wsgi.WSGIRequest
-        :param key: A private RSA key.
-        :type key: RSA.RSA
         :return: A redirect or not-found reply.
         :rtype: django.http.HttpResponse
         """
@@ -119,13 +204,12 @@ class ContentView(View):
             path,
             query)
 
-        url = URL(redirect)
-        signed = url.sign(key, remote_ip=remote_ip)
+        key_path = pulp_conf.get('authentication', 'rsa_key')
+        signed = signing_service.sign(redirect, key_path, remote_ip=remote_ip)
         return HttpResponseRedirect(str(signed))
 
     def __init__(self, **kwargs):
         super(ContentView, self).__init__(**kwargs)
-        self.key = Key.load(pulp_conf.get('authentication', 'rsa_key'))
         # Make sure all requested paths fall under these sub-directories, otherwise
         # we might find ourselves serving private keys to all and sundry.
         local_storage = pulp_conf.get('server', 'storage_dir')
@@ -135,6 +219,40 @@ class ContentView(View):
                        "Apache's mod_xsendfile is configured to serve from "
                        "these paths as well").format(paths=str(self.safe_serving_paths)))
 
+    def resolve(self, path_info):
+        """
+        Determine how a requested path is served. Resolutions are cached for
+        RESOLUTION_CACHE_TIMEOUT seconds, so that clients walking a published tree do not
+        cause the same file system lookups on every request.
+
+        :param path_info: The requested path.
+        :type  path_info: str
+
+        :return: The real path and how it is served.
+        :rtype:  Resolution
+        """
+        resolution = _resolution_cache.get(path_info)
+        if resolution is not None:
+            return resolution
+
+        path = os.path.realpath(path_info)
+        if not any([path.startswith(prefix) for prefix in self.safe_serving_paths]):
+            action = SERVE_FORBIDDEN
+        elif not os.path.lexists(path_info):
+            # The symbolic link doesn't even exist
+            action = SERVE_NOT_FOUND
+        elif os.path.isdir(path):
+            action = SERVE_DIRECTORY
+        elif os.path.exists(path):
+            # Already downloaded
+            action = SERVE_FILE
+        else:
+            action = SERVE_REDIRECT
+
+        resolution = Resolution(path, action)
+        _resolution_cache.put(path_info, resolution)
+        return resolution
+
     def get(self, request):
         """
         Process the GET content request.
@@ -145,7 +263,7 @@ class ContentView(View):
         :rtype: django.http.HttpResponse
         """
         host = request.get_host()
-        path = os.path.realpath(request.path_info)
+        path, action = self.resolve(request.path_info)
 
         # Check authorization if http isn't being used. This environ variable must
         # be available in all implementations so it is not dependant on Apache httpd:
@@ -157,42 +275,88 @@ class ContentView(View):
                               ' authenticators failed.').format(host=host, path=path))
                 return HttpResponseForbidden()
 
-        if not any([path.startswith(prefix) for prefix in self.safe_serving_paths]):
+        if action == SERVE_FORBIDDEN:
             # Someone is requesting something they shouldn't.
             logger.info(_('Denying {host} request to {path} as it does not resolve to'
                           'a Pulp content path.').format(host=host, path=path))
             return HttpResponseForbidden()
 
         # Immediately 404 if the symbolic link doesn't even exist
-        if not os.path.lexists(request.path_info):
+        if action == SERVE_NOT_FOUND:
             logger.debug(_('Symbolic link to {path} does not exist.').format(path=path))
             raise Http404
 
-        if os.path.isdir(path):
+        if action == SERVE_DIRECTORY:
             logger.debug(_('Rendering directory index for {path}.').format(path=path))
             return self.directory_index(path)
 
-        # Already downloaded
-        if os.path.exists(path):
+        if action == SERVE_FILE:
             logger.debug(_('Serving {path} with mod_xsendfile.').format(path=path))
             return self.x_send(path)
 
         logger.debug(_('Redirecting request for {path}.').format(path=path))
-        return self.redirect(request, self.key)
+        return self.redirect(request)
 
     @staticmethod
     def directory_index(path):
         """
-        Render the given path to a directory index.
+        Render the given path to a directory index. Rendered indexes are cached until the
+        modification time of the directory changes.
 
         :param path: Absolute path to the directory to list.
         :type  path: str
 
         :return: HttpResponse
         """
-        listing = os.listdir(path)
+        mtime = os.stat(path).st_mtime
+        cached = _directory_index_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            content, content_type = cached[1]
+            return HttpResponse(content, content_type=content_type)
+
+        dirs, files = ContentView.list_directory(path)
         context = {
-            'dirs': sorted([f for f in listing if os.path.isdir(os.path.join(path, f))]),
-            'files': sorted([f for f in listing if os.path.isfile(os.path.join(path, f))]),
+            'dirs': sorted(dirs),
+            'files': sorted(files),
         }
-        return render_to_response('directory_index.html', context)
+        reply = render_to_response('directory_index.html', context)
+        # An entry added within the resolution of the modification time would not change it,
+        # so only indexes of directories that have not changed recently are cached.
+        if time.time() - mtime > 1:
+            _directory_index_cache.put(path, (mtime, (reply.content, reply['Content-Type'])))
+        return reply
+
+    @staticmethod
+    def list_directory(path):
+        """
+        List the sub-directories and files in a directory, following symbolic links. Each
+        entry is examined with at most one stat call, or none if the file system reports
+        the type of entries that are not symbolic links.
+
+        :param path: Absolute path to the directory to list.
+        :type  path: str
+
+        :return: A tuple of the names of the sub-directories and of the files.
+        :rtype:  tuple
+        """
+        dirs = []
+        files = []
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+            return dirs, files
+
+        for name in os.listdir(path):
+            try:
+                mode = os.stat(os.path.join(path, name)).st_mode
+            except OSError:
+                # A broken symbolic link
+                continue
+            if stat.S_ISDIR(mode):
+                dirs.append(name)
+            elif stat.S_ISREG(mode):
+                files.append(name)
+        return dirs, files
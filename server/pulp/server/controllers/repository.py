@@ -1,9 +1,14 @@
 from gettext import gettext as _
 from itertools import chain
+from multiprocessing.pool import ThreadPool
 import copy
+import hashlib
 import logging
 import os
+import stat
+import struct
 import sys
+import threading
 import time
 from urlparse import urlunsplit
 import uuid
@@ -15,8 +20,9 @@ from nectar.config import DownloaderConfig
 from nectar.request import DownloadRequest
 from nectar.downloaders.threaded import HTTPThreadedDownloader
 from nectar.listener import DownloadEventListener
+from pymongo import UpdateOne
 
-from pulp.common import dateutils, error_codes, tags
+from pulp.common import constants, dateutils, error_codes, tags
 from pulp.common.config import parse_bool, Unparsable
 from pulp.common.plugins import reporting_constants, importer_constants
 from pulp.common.tags import resource_tag, RESOURCE_REPOSITORY_TYPE, action_tag
@@ -29,6 +35,7 @@ from pulp.plugins.model import SyncReport
 from pulp.plugins.util.misc import paginate
 from pulp.plugins.util.verification import VerificationException, verify_checksum
 from pulp.server import exceptions as pulp_exceptions
+from pulp.server.async.progress import get_reporter
 from pulp.server.async.tasks import (PulpTask, register_sigterm_handler, Task, TaskResult,
                                      get_current_task_id)
 from pulp.server.config import config as pulp_conf
@@ -42,7 +49,7 @@ from pulp.server.db import connection, model
 from pulp.server.db.model.repository import (
     RepoContentUnit, RepoSyncResult, RepoPublishResult)
 from pulp.server.exceptions import PulpCodedTaskException
-from pulp.server.lazy import URL, Key
+from pulp.server.lazy import URL, signing_service
 from pulp.server.managers import factory as manager_factory
 from pulp.server.managers.repo import _common as common_utils
 from pulp.server.util import InvalidChecksumType
@@ -57,6 +64,16 @@ TYPE_ID = 'type_id'
 UNIT_FILES = 'unit_files'
 REQUEST = 'request'
 
+# The number of content units whose download requests are built at a time
+DOWNLOAD_REQUEST_WINDOW_SIZE = 1000
+
+# The number of threads that verify the files already in storage
+VERIFICATION_THREADS = 8
+
+# The number of units associated one at a time whose content fingerprint updates are buffered
+# before they are written
+CONTENT_CHANGE_BATCH_SIZE = 1000
+
 
 def get_associated_unit_ids(repo_id, unit_type, repo_content_unit_q=None):
     """
@@ -292,11 +309,13 @@ def has_all_units_downloaded(repo_id):
 
 def rebuild_content_unit_counts(repository):
     """
-    Update the content_unit_counts field on a Repository.
+    Update the content_unit_counts field on a Repository. The buffered content fingerprint
+    updates of units associated one at a time are written first.
 
     :param repository: The repository to update
     :type repository: pulp.server.db.model.Repository
     """
+    flush_content_fingerprints()
     db = connection.get_database()
 
     pipeline = [
@@ -328,10 +347,16 @@ def associate_single_unit(repository, unit):
         repo_id=repository.repo_id,
         unit_id=unit.id,
         unit_type_id=unit._content_type_id)
-    qs.update_one(
+    existing = qs.modify(
         set_on_insert__created=formatted_datetime,
         set__updated=formatted_datetime,
         upsert=True)
+    # If the association did not exist before, the content of the repository changed. The unit
+    # is journaled even if it was already associated, since its metadata may have changed.
+    if existing is None:
+        _content_fingerprints.add(repository.repo_id, unit._content_type_id, unit.id)
+    record_content_changes(repository.repo_id, unit._content_type_id, [unit.id],
+                           model.RepositoryContentChange.ACTION_ADDED)
 
 
 def disassociate_units(repository, unit_iterable):
@@ -347,8 +372,234 @@ def disassociate_units(repository, unit_iterable):
         unit_id_list = [unit.id for unit in unit_group]
         qs = model.RepositoryContentUnit.objects(
             repo_id=repository.repo_id, unit_id__in=unit_id_list)
+        # Only the units that were actually associated change the content of the repository
+        associated_ids_by_type = {}
+        for association in qs.only('unit_id', 'unit_type_id'):
+            associated_ids_by_type.setdefault(association.unit_type_id, []).append(
+                association.unit_id)
         qs.delete()
 
+        for unit_type_id, unit_ids in associated_ids_by_type.items():
+            update_content_fingerprint(repository.repo_id, unit_type_id, unit_ids)
+
+        unit_ids_by_type = {}
+        for unit in unit_group:
+            unit_ids_by_type.setdefault(unit._content_type_id, []).append(unit.id)
+        for unit_type_id, unit_ids in unit_ids_by_type.items():
+            record_content_changes(repository.repo_id, unit_type_id, unit_ids,
+                                   model.RepositoryContentChange.ACTION_REMOVED)
+
+
+def calculate_content_fingerprint(unit_type_id, unit_ids):
+    """
+    Calculate the contribution of the given units to the content fingerprint of a repository.
+
+    Each unit is hashed to a signed 64 bit integer, and the hashes are combined with XOR. Because
+    XOR is commutative and its own inverse, the fingerprint of a repository can be kept up to date
+    by combining it with the contribution of every unit added to or removed from it, regardless of
+    the order in which that happens.
+
+    :param unit_type_id: identifies the type of the units
+    :type  unit_type_id: str
+    :param unit_ids: ids of the units
+    :type  unit_ids: iterable of str
+
+    :return: the combined hash of the units
+    :rtype:  long
+    """
+    fingerprint = 0
+    for unit_id in unit_ids:
+        digest = hashlib.sha256('%s:%s' % (unit_type_id, unit_id)).digest()
+        fingerprint ^= struct.unpack('>q', digest[:8])[0]
+    return long(fingerprint)
+
+
+def update_content_fingerprint(repo_id, unit_type_id, unit_ids):
+    """
+    Atomically update the content fingerprint of a repository after the given units were added to
+    or removed from it. This must only be called for units whose association actually changed.
+
+    :param repo_id: identifies the repo
+    :type  repo_id: str
+    :param unit_type_id: identifies the type of the units
+    :type  unit_type_id: str
+    :param unit_ids: ids of the units that were added or removed
+    :type  unit_ids: iterable of str
+    """
+    _xor_content_fingerprint(repo_id, calculate_content_fingerprint(unit_type_id, unit_ids))
+
+
+def _xor_content_fingerprint(repo_id, delta):
+    """
+    Atomically combine the content fingerprint of a repository with a value.
+
+    :param repo_id: identifies the repo
+    :type  repo_id: str
+    :param delta: the value to combine the fingerprint with
+    :type  delta: long
+    """
+    if delta:
+        model.Repository._get_collection().update_one(
+            {'repo_id': repo_id}, {'$bit': {'content_fingerprint': {'xor': delta}}})
+
+
+class ContentFingerprintBuffer(object):
+    """
+    Buffers the content fingerprint updates of units that are associated one at a time, such as
+    during a sync, so that they are written in batches rather than with one more write per unit.
+
+    While a repository has buffered updates, its content fingerprint is offset by a random
+    value. If the buffered updates are lost, the fingerprint then matches no content, rather
+    than the content the repository had before the updates.
+    """
+
+    def __init__(self, max_size=CONTENT_CHANGE_BATCH_SIZE):
+        """
+        :param max_size: The number of updates after which the buffer is written.
+        :type  max_size: int
+        """
+        self.max_size = max_size
+        self._size = 0
+        # repo_id -> {'offset': long, 'delta': long}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, repo_id, unit_type_id, unit_id):
+        """
+        Buffer the fingerprint update for a unit newly associated to a repository.
+
+        :param repo_id: identifies the repo
+        :type  repo_id: str
+        :param unit_type_id: identifies the type of the unit
+        :type  unit_type_id: str
+        :param unit_id: identifies the unit
+        :type  unit_id: str
+        """
+        with self._lock:
+            pending = self._pending.get(repo_id)
+            if pending is None:
+                offset = 0
+                while not offset:
+                    offset = struct.unpack('>q', os.urandom(8))[0]
+                _xor_content_fingerprint(repo_id, offset)
+                pending = self._pending[repo_id] = {'offset': offset, 'delta': 0}
+            pending['delta'] ^= calculate_content_fingerprint(unit_type_id, [unit_id])
+            self._size += 1
+            full = self._size >= self.max_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered fingerprint updates.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._size = 0
+        for repo_id, update in pending.items():
+            try:
+                _xor_content_fingerprint(repo_id, long(update['offset'] ^ update['delta']))
+            except Exception:
+                # Keep the updates that were not written, so that the next flush writes them
+                with self._lock:
+                    for unwritten_repo_id, unwritten in pending.iteritems():
+                        self._restore(unwritten_repo_id, unwritten)
+                raise
+            del pending[repo_id]
+
+    def _restore(self, repo_id, update):
+        """
+        Merge an update that could not be written back into the buffer. Must be called with the
+        lock held.
+
+        :param repo_id: identifies the repo
+        :type  repo_id: str
+        :param update: the update of the repo that was taken from the buffer
+        :type  update: dict
+        """
+        pending = self._pending.setdefault(repo_id, {'offset': 0, 'delta': 0})
+        pending['offset'] ^= update['offset']
+        pending['delta'] ^= update['delta']
+        self._size += 1
+
+
+_content_fingerprints = ContentFingerprintBuffer()
+
+
+def flush_content_fingerprints():
+    """
+    Write the buffered content fingerprint updates of units associated one at a time. Callers
+    that associate units with associate_single_unit must call this, or
+    rebuild_content_unit_counts, once they are done, including when they fail.
+    """
+    _content_fingerprints.flush()
+
+
+def record_content_changes(repo_id, unit_type_id, unit_ids, action):
+    """
+    Record in the repository's content change journal that the given units have been added to or
+    removed from the repository. The journal keeps only the most recent change for each unit, and
+    is used to regenerate applicability incrementally.
+
+    :param repo_id: identifies the repo
+    :type  repo_id: str
+    :param unit_type_id: identifies the type of the units
+    :type  unit_type_id: str
+    :param unit_ids: ids of the units that were added or removed
+    :type  unit_ids: iterable of str
+    :param action: the change made to the units, one of the RepositoryContentChange actions
+    :type  action: str
+    """
+    now = dateutils.now_utc_datetime_with_tzinfo()
+    collection = model.RepositoryContentChange._get_collection()
+    for unit_id_group in paginate(unit_ids):
+        requests = [UpdateOne({'repo_id': repo_id, 'unit_type_id': unit_type_id,
+                               'unit_id': unit_id},
+                              {'$set': {'action': action, 'updated': now},
+                               '$setOnInsert': {'_ns': 'repo_content_changes'}},
+                              upsert=True)
+                    for unit_id in unit_id_group]
+        collection.bulk_write(requests, ordered=False)
+
+
+def get_content_changes(repo_id, changed_before):
+    """
+    Get the net changes made to the content of a repository, as recorded in its content change
+    journal.
+
+    :param repo_id: identifies the repo
+    :type  repo_id: str
+    :param changed_before: only changes recorded at or before this time are returned
+    :type  changed_before: datetime.datetime
+
+    :return: A 2-tuple. The first element is a dictionary mapping unit type ids to lists of ids
+             of the units that were added. The second element is a set of ids of the units
+             that were removed.
+    :rtype:  tuple
+    """
+    added_units = {}
+    removed_unit_ids = set()
+    changes = model.RepositoryContentChange.objects(
+        repo_id=repo_id, updated__lte=changed_before).only('unit_id', 'unit_type_id', 'action')
+    for change in changes:
+        if change.action == model.RepositoryContentChange.ACTION_ADDED:
+            added_units.setdefault(change.unit_type_id, []).append(change.unit_id)
+        else:
+            removed_unit_ids.add(change.unit_id)
+    return added_units, removed_unit_ids
+
+
+def clear_content_changes(repo_id, changed_before):
+    """
+    Remove the changes that have been accounted for from a repository's content change journal.
+
+    :param repo_id: identifies the repo
+    :type  repo_id: str
+    :param changed_before: only changes recorded at or before this time are removed
+    :type  changed_before: datetime.datetime
+    """
+    model.RepositoryContentChange.objects(repo_id=repo_id, updated__lte=changed_before).delete()
+
 
 def create_repo(repo_id, display_name=None, description=None, notes=None, importer_type_id=None,
                 importer_repo_plugin_config=None, distributor_list=None):
@@ -535,6 +786,7 @@ def delete(repo_id):
         RepoSyncResult.get_collection().remove({'repo_id': repo_id})
         RepoPublishResult.get_collection().remove({'repo_id': repo_id})
         RepoContentUnit.get_collection().remove({'repo_id': repo_id})
+        model.RepositoryContentChange.objects(repo_id=repo_id).delete()
     except Exception, e:
         msg = _('Error updating one or more database collections while removing repo [%(r)s]')
         msg = msg % {'r': repo_id}
@@ -1369,16 +1621,30 @@ def queue_download_repo(repo_id, verify_all_units=False):
 def download_deferred():
     """
     Downloads all the units with entries in the DeferredDownload collection.
+
+    The entries are claimed in batches, so that concurrent tasks do not download the same
+    units, and each batch is deleted once it has been downloaded. Entries claimed by tasks that
+    are no longer running are released first.
     """
     task_description = _('Download Cached On-Demand Content')
-    deferred_content_units = _get_deferred_content_units()
-    download_requests = _create_download_requests(deferred_content_units)
+    batch_size = int(pulp_conf.get('lazy', 'deferred_download_batch_size'))
+    claim_id = get_current_task_id() or str(uuid.uuid4())
     download_step = LazyUnitDownloadStep(
         _('on_demand_download'),
         task_description,
-        download_requests
+        []
     )
-    download_step.start()
+
+    _release_stale_deferred_claims()
+    deferred_downloads = model.DeferredDownload.objects.claim(claim_id, batch_size)
+    if not deferred_downloads:
+        download_step.start()
+    while deferred_downloads:
+        deferred_content_units = _get_deferred_content_units(deferred_downloads)
+        download_requests = _create_download_requests(deferred_content_units)
+        download_step.download_batch(download_requests)
+        model.DeferredDownload.objects(id__in=[d.id for d in deferred_downloads]).delete()
+        deferred_downloads = model.DeferredDownload.objects.claim(claim_id, batch_size)
 
 
 @celery.task(base=Task)
@@ -1400,39 +1666,110 @@ def download_repo(repo_id, verify_all_units=False):
     if verify_all_units:
         repo_unit_querysets = get_mongoengine_unit_querysets(repo_id)
         missing_content_units = chain(*repo_unit_querysets)
+        estimated_total = _file_unit_count(repo_id)
     else:
         missing_content_units = find_units_not_downloaded(repo_id)
+        estimated_total = missing_unit_count(repo_id)
 
-    download_requests = _create_download_requests(missing_content_units)
+    # The requests are built while the download is in progress, so only the number of units
+    # is known up front. The total is corrected once all the requests have been built.
+    download_requests = _stream_download_requests(missing_content_units,
+                                                  verify_existing=verify_all_units)
     download_step = LazyUnitDownloadStep(
         _('background_download'),
         task_description,
-        download_requests
+        download_requests,
+        total_units=estimated_total
     )
     download_step.start()
 
 
-def _get_deferred_content_units():
+def _file_unit_count(repo_id):
+    """
+    Count the units in a repository whose types have files, with a single query.
+
+    :param repo_id: The ID of the repository.
+    :type  repo_id: str
+
+    :return: The number of units with files.
+    :rtype:  int
     """
-    Retrieve a list of units that have been added to the DeferredDownload collection.
+    unit_type_ids = [unit_model._content_type_id.default for unit_model in
+                     get_repo_unit_models(repo_id)
+                     if issubclass(unit_model, model.FileContentUnit)]
+    if not unit_type_ids:
+        return 0
+    return model.RepositoryContentUnit.objects(repo_id=repo_id,
+                                               unit_type_id__in=unit_type_ids).count()
+
+
+def _release_stale_deferred_claims():
+    """
+    Release the DeferredDownload entries claimed by tasks that are no longer running, such as
+    tasks whose worker was lost, so that they are downloaded again.
+    """
+    claim_ids = [claim_id for claim_id in model.DeferredDownload.objects.distinct('claimed_by')
+                 if claim_id]
+    if not claim_ids:
+        return
+    running = set(model.TaskStatus.objects(
+        task_id__in=claim_ids,
+        state__nin=constants.CALL_COMPLETE_STATES).distinct('task_id'))
+    stale_ids = [claim_id for claim_id in claim_ids if claim_id not in running]
+    if stale_ids:
+        _logger.info(_('Releasing on-demand downloads claimed by tasks that are not running.'))
+        model.DeferredDownload.objects.release_claims(stale_ids)
+
+
+def _get_deferred_content_units(deferred_downloads):
+    """
+    Retrieve the units of the given DeferredDownload entries, using one query per content type.
+
+    :param deferred_downloads: The entries to retrieve the units of.
+    :type  deferred_downloads: list of pulp.server.db.model.DeferredDownload
 
     :return: A generator of content units that correspond to DeferredDownload entries.
     :rtype:  generator of pulp.server.db.model.FileContentUnit
     """
-    for deferred_download in model.DeferredDownload.objects.filter():
-        try:
-            unit_model = plugin_api.get_unit_model_by_id(deferred_download.unit_type_id)
-            if unit_model is None:
-                _logger.error(_('Unable to find the model object for the {type} type.').format(
-                    type=deferred_download.unit_type_id))
-            else:
-                unit = unit_model.objects.filter(id=deferred_download.unit_id).get()
-                yield unit
-        except DoesNotExist:
+    unit_ids_by_type = {}
+    for deferred_download in deferred_downloads:
+        unit_ids_by_type.setdefault(deferred_download.unit_type_id, set()).add(
+            deferred_download.unit_id)
+
+    for unit_type_id, unit_ids in unit_ids_by_type.iteritems():
+        unit_model = plugin_api.get_unit_model_by_id(unit_type_id)
+        if unit_model is None:
+            _logger.error(_('Unable to find the model object for the {type} type.').format(
+                type=unit_type_id))
+            continue
+        for unit in unit_model.objects.filter(id__in=list(unit_ids)):
+            unit_ids.discard(unit.id)
+            yield unit
+        for unit_id in unit_ids:
             # This is normal if the content unit in question has been purged during an
             # orphan cleanup.
             _logger.debug(_('Unable to find the {type}:{id} content unit.').format(
-                type=deferred_download.unit_type_id, id=deferred_download.unit_id))
+                type=unit_type_id, id=unit_id))
+
+
+def _delete_deferred_downloads(download_requests):
+    """
+    Delete the DeferredDownload entries of the units that have been downloaded, using one
+    query per content type.
+
+    :param download_requests: The requests of the download.
+    :type  download_requests: list of nectar.request.DownloadRequest
+    """
+    unit_ids_by_type = {}
+    for request in download_requests:
+        unit_ids_by_type.setdefault(request.data[TYPE_ID], set()).add(request.data[UNIT_ID])
+
+    for unit_type_id, unit_ids in unit_ids_by_type.iteritems():
+        for unit_ids_page in paginate(unit_ids):
+            model.DeferredDownload.objects.filter(
+                unit_id__in=unit_ids_page,
+                unit_type_id=unit_type_id
+            ).delete()
 
 
 def _create_download_requests(content_units):
@@ -1449,47 +1786,198 @@ def _create_download_requests(content_units):
              path.
     :rtype:  list of nectar.request.DownloadRequest
     """
-    requests = []
+    return list(chain.from_iterable(_generate_download_request_windows(content_units)))
+
+
+def _stream_download_requests(content_units, verify_existing=False):
+    """
+    Generate Nectar DownloadRequests for the given content units, building them one window of
+    units at a time as the downloader consumes them. The DeferredDownload entries of the units
+    in each window are deleted as the window is handed to the downloader.
+
+    :param content_units:   The content units to generate DownloadRequests for.
+    :type  content_units:   iterable of pulp.server.db.model.FileContentUnit
+    :param verify_existing: Whether to verify the files already in storage, and only request
+                            the files that are missing or invalid.
+    :type  verify_existing: bool
+
+    :return: A generator of DownloadRequests, as built by _create_download_requests.
+    :rtype:  generator of nectar.request.DownloadRequest
+    """
+    windows = _generate_download_request_windows(content_units, verify_existing)
+    for window in windows:
+        _delete_deferred_downloads(window)
+        for request in window:
+            yield request
+
+
+def _generate_download_request_windows(content_units, verify_existing=False):
+    """
+    Build Nectar DownloadRequests for windows of DOWNLOAD_REQUEST_WINDOW_SIZE content units,
+    looking up the catalog entries of each window with one query per content type.
+
+    When verifying existing files, the files of each window are verified in a thread pool
+    before its requests are built. Valid files are not requested, and units whose files are
+    all valid are marked as downloaded.
+
+    :param content_units:   The content units to build DownloadRequests for.
+    :type  content_units:   iterable of pulp.server.db.model.FileContentUnit
+    :param verify_existing: Whether to verify the files already in storage, and only request
+                            the files that are missing or invalid.
+    :type  verify_existing: bool
+
+    :return: A generator of lists of DownloadRequests, as built by _create_download_requests.
+    :rtype:  generator of list
+    """
     working_dir = common_utils.get_working_directory()
-    signing_key = Key.load(pulp_conf.get('authentication', 'rsa_key'))
-
-    for content_unit in content_units:
-        # All files in the unit; every request for a unit has a reference to this dict.
-        unit_files = {}
-        unit_working_dir = os.path.join(working_dir, content_unit.id)
-        for file_path in content_unit.list_files():
-            qs = model.LazyCatalogEntry.objects.filter(
-                unit_id=content_unit.id,
-                unit_type_id=content_unit.type_id,
-                path=file_path
-            )
-            catalog_entry = qs.order_by('revision').first()
-            if catalog_entry is None:
-                continue
-            signed_url = _get_streamer_url(catalog_entry, signing_key)
+    signing_key = signing_service.key(pulp_conf.get('authentication', 'rsa_key'))
+    pool = ThreadPool(VERIFICATION_THREADS) if verify_existing else None
 
-            temporary_destination = os.path.join(
-                unit_working_dir,
-                os.path.basename(catalog_entry.path)
-            )
-            mkdir(unit_working_dir)
-            unit_files[temporary_destination] = {
-                CATALOG_ENTRY: catalog_entry,
-                PATH_DOWNLOADED: None,
-            }
-
-            request = DownloadRequest(signed_url, temporary_destination)
-            # For memory reasons, only hold onto the id and type_id so we can reload the unit
-            # once it's successfully downloaded.
-            request.data = {
-                TYPE_ID: content_unit.type_id,
-                UNIT_ID: content_unit.id,
-                UNIT_FILES: unit_files,
-                REQUEST: request
-            }
-            requests.append(request)
-
-    return requests
+    try:
+        for units_page in paginate(content_units, DOWNLOAD_REQUEST_WINDOW_SIZE):
+            requests = []
+            catalog_entries = model.LazyCatalogEntry.objects.find_entries_for_units(units_page)
+            if pool is not None:
+                valid_paths = _verify_existing_files(catalog_entries.values(), pool)
+            else:
+                valid_paths = None
+            downloaded_unit_ids = {}
+            for content_unit in units_page:
+                # All files in the unit; every request for a unit has a reference to this dict.
+                unit_files = {}
+                unit_working_dir = os.path.join(working_dir, content_unit.id)
+                unit_requests = []
+                for file_path in content_unit.list_files():
+                    catalog_entry = catalog_entries.get(
+                        (content_unit.type_id, content_unit.id, file_path))
+                    if catalog_entry is None:
+                        continue
+
+                    temporary_destination = os.path.join(
+                        unit_working_dir,
+                        os.path.basename(catalog_entry.path)
+                    )
+                    # None if the file has not been verified yet
+                    path_downloaded = None
+                    if valid_paths is not None:
+                        path_downloaded = catalog_entry.path in valid_paths
+                    unit_files[temporary_destination] = {
+                        CATALOG_ENTRY: catalog_entry,
+                        PATH_DOWNLOADED: path_downloaded,
+                    }
+                    if path_downloaded:
+                        continue
+
+                    signed_url = _get_streamer_url(catalog_entry, signing_key)
+                    mkdir(unit_working_dir)
+                    request = DownloadRequest(signed_url, temporary_destination)
+                    # For memory reasons, only hold onto the id and type_id so we can reload
+                    # the unit once it's successfully downloaded.
+                    request.data = {
+                        TYPE_ID: content_unit.type_id,
+                        UNIT_ID: content_unit.id,
+                        UNIT_FILES: unit_files,
+                        REQUEST: request
+                    }
+                    unit_requests.append(request)
+
+                if unit_files and not unit_requests:
+                    downloaded_unit_ids.setdefault(content_unit.type_id, []).append(
+                        content_unit.id)
+                requests.extend(unit_requests)
+
+            for unit_type_id, unit_ids in downloaded_unit_ids.iteritems():
+                unit_model = plugin_api.get_unit_model_by_id(unit_type_id)
+                unit_model.objects(id__in=unit_ids).update(set__downloaded=True)
+            yield requests
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _verify_existing_files(catalog_entries, pool):
+    """
+    Verify the files of the given catalog entries that are already in storage, calculating
+    their checksums in a thread pool. A file recorded in the VerifiedFile collection is not
+    read again if its size and modification time are unchanged. Files whose checksums are
+    calculated and valid are recorded.
+
+    :param catalog_entries: The catalog entries whose files should be verified.
+    :type  catalog_entries: list of pulp.server.db.model.LazyCatalogEntry
+    :param pool:            The pool of threads that verify the files.
+    :type  pool:            multiprocessing.pool.ThreadPool
+
+    :return: The paths of the files that are present and valid.
+    :rtype:  set of str
+    """
+    if not catalog_entries:
+        return set()
+    paths = [catalog_entry.path for catalog_entry in catalog_entries]
+    verified_files = dict((verified_file.path, verified_file) for verified_file in
+                          model.VerifiedFile.objects(path__in=paths))
+    results = pool.map(
+        _verify_file,
+        [(catalog_entry, verified_files.get(catalog_entry.path))
+         for catalog_entry in catalog_entries])
+
+    valid_paths = set()
+    operations = []
+    for catalog_entry, (valid, verified_file) in zip(catalog_entries, results):
+        if valid:
+            valid_paths.add(catalog_entry.path)
+        if verified_file is not None:
+            operations.append(UpdateOne({'path': verified_file['path']},
+                                        {'$set': verified_file,
+                                         '$setOnInsert': {'_ns': 'verified_files'}},
+                                        upsert=True))
+    if operations:
+        model.VerifiedFile._get_collection().bulk_write(operations, ordered=False)
+    return valid_paths
+
+
+def _verify_file(verification):
+    """
+    Verify a file in storage against its catalog entry. If the catalog entry has no checksum,
+    the file only needs to exist.
+
+    :param verification: The catalog entry, and the VerifiedFile recorded for its path or None.
+    :type  verification: tuple
+
+    :return: Whether the file is valid, and the VerifiedFile fields to record if its checksum
+             was calculated and is valid, or None.
+    :rtype:  tuple
+    """
+    catalog_entry, verified_file = verification
+    try:
+        file_stat = os.stat(catalog_entry.path)
+    except OSError:
+        return False, None
+    if not stat.S_ISREG(file_stat.st_mode):
+        return False, None
+
+    checksum_type = catalog_entry.checksum_algorithm
+    checksum = catalog_entry.checksum
+    if not (checksum_type and checksum):
+        return True, None
+    if verified_file is not None and \
+            (verified_file.size, verified_file.mtime) == (file_stat.st_size,
+                                                          file_stat.st_mtime) and \
+            (verified_file.checksum_type, verified_file.checksum) == (checksum_type, checksum):
+        return True, None
+
+    try:
+        with open(catalog_entry.path) as f:
+            verify_checksum(f, checksum_type, checksum)
+    except (InvalidChecksumType, VerificationException, IOError):
+        return False, None
+    return True, {
+        'path': catalog_entry.path,
+        'size': file_stat.st_size,
+        'mtime': file_stat.st_mtime,
+        'checksum_type': checksum_type,
+        'checksum': checksum,
+    }
 
 
 def _get_streamer_url(catalog_entry, signing_key):
@@ -1527,7 +2015,7 @@ class LazyUnitDownloadStep(DownloadEventListener):
     to download from the Pulp Streamer components.
 
     :ivar download_requests: The download requests the step will process.
-    :type download_requests: list of nectar.request.DownloadRequest
+    :type download_requests: iterable of nectar.request.DownloadRequest
     :ivar download_config:   The keyword args used to initialize the Nectar
                              downloader configuration.
     :type download_config:   dict
@@ -1535,12 +2023,17 @@ class LazyUnitDownloadStep(DownloadEventListener):
     :type downloader:        nectar.downloaders.threaded.HTTPThreadedDownloader
     """
 
-    def __init__(self, step_type, step_description, download_requests):
+    def __init__(self, step_type, step_description, download_requests, total_units=None):
         """
         Initializes a Step that downloads all the download requests provided.
 
-        :param download_requests:   List of download requests to process.
-        :type  download_requests:   list of nectar.request.DownloadRequest
+        :param download_requests:   List of download requests to process, or an iterable that
+                                    builds them as the download proceeds.
+        :type  download_requests:   iterable of nectar.request.DownloadRequest
+        :param total_units:         The expected number of download requests, required if
+                                    download_requests is not a list. It is corrected once all
+                                    the requests have been built.
+        :type  total_units:         int
         """
         self.description = step_description
         self.download_requests = download_requests
@@ -1562,8 +2055,11 @@ class LazyUnitDownloadStep(DownloadEventListener):
         self.progress_successes = 0
         self.progress_failures = 0
         self.error_details = []
-        self.total_units = len(download_requests)
-        self.last_report_time = 0
+        if total_units is None:
+            total_units = len(download_requests)
+        self.total_units = total_units
+        self.requests_built = 0
+        self.building_requests = False
         self.last_reported_state = self.state
         self.timestamp = str(time.time())
         self.task_id = get_current_task_id()
@@ -1573,8 +2069,39 @@ class LazyUnitDownloadStep(DownloadEventListener):
         Start the download process.
         """
         self.state = reporting_constants.STATE_RUNNING
+        self.building_requests = True
+        self.report()
+        self.downloader.download(self._count_requests(self.download_requests))
         self.report()
-        self.downloader.download(self.download_requests)
+
+    def _count_requests(self, download_requests):
+        """
+        Count the download requests as the downloader consumes them, so that the total is
+        exact once all the requests have been built.
+
+        :param download_requests: The download requests to process.
+        :type  download_requests: iterable of nectar.request.DownloadRequest
+
+        :return: A generator of the download requests.
+        :rtype:  generator of nectar.request.DownloadRequest
+        """
+        for request in download_requests:
+            self.requests_built += 1
+            self.total_units = max(self.total_units, self.requests_built)
+            yield request
+        self.total_units = self.requests_built
+        self.building_requests = False
+
+    def download_batch(self, download_requests):
+        """
+        Download a further batch of requests, counted in the progress of this step.
+
+        :param download_requests: List of download requests to process.
+        :type  download_requests: list of nectar.request.DownloadRequest
+        """
+        self.download_requests = download_requests
+        self.total_units += len(download_requests)
+        self.start()
 
     def report(self):
         """
@@ -1583,7 +2110,7 @@ class LazyUnitDownloadStep(DownloadEventListener):
         progress reporting system when that has been implemented.
         """
         total_processed = self.progress_successes + self.progress_failures
-        if self.total_units == total_processed:
+        if not self.building_requests and self.total_units == total_processed:
             self.state = reporting_constants.STATE_COMPLETE
 
         if self.progress_failures > 0:
@@ -1601,14 +2128,12 @@ class LazyUnitDownloadStep(DownloadEventListener):
             reporting_constants.PROGRESS_DESCRIPTION_KEY: self.description,
             reporting_constants.PROGRESS_DETAILS_KEY: self.progress_details
         }
-        report = {self.step_id: [progress]}
-
-        # Update at most once a second, unless the state changed
-        if self.state != self.last_reported_state or int(time.time()) != self.last_report_time:
-            if self.task_id is not None:
-                qs = model.TaskStatus.objects.filter(task_id=self.task_id)
-                qs.update_one(set__progress_report=report)
-        self.last_report_time = int(time.time())
+
+        # The task's progress reporter coalesces the updates, but changes of state are
+        # written right away
+        if self.task_id is not None:
+            get_reporter(self.task_id).update(self.step_id, [progress],
+                                              flush=self.state != self.last_reported_state)
         self.last_reported_state = self.state
 
     def download_started(self, report):
@@ -1627,33 +2152,29 @@ class LazyUnitDownloadStep(DownloadEventListener):
         """
         _logger.debug(_('Starting download of {url}.').format(url=report.url))
 
-        # Remove the deferred entry now that the download has started.
-        query_set = model.DeferredDownload.objects.filter(
-            unit_id=report.data[UNIT_ID],
-            unit_type_id=report.data[TYPE_ID]
-        )
-        query_set.delete()
-
-        try:
-            # If the file exists and the checksum is valid, don't download it
-            path_entry = report.data[UNIT_FILES][report.destination]
-            catalog_entry = path_entry[CATALOG_ENTRY]
-            self.validate_file(
-                catalog_entry.path,
-                catalog_entry.checksum_algorithm,
-                catalog_entry.checksum
-            )
-            path_entry[PATH_DOWNLOADED] = True
-            self.progress_successes += 1
-            self.report()
-            msg = _('{path} has already been downloaded.').format(
-                path=path_entry[CATALOG_ENTRY].path)
-            _logger.debug(msg)
-            report.data[REQUEST].canceled = True
-
-        except (InvalidChecksumType, VerificationException, IOError):
-            # It's either missing or incorrect, so download it
-            pass
+        path_entry = report.data[UNIT_FILES][report.destination]
+        # Files that have already been verified and found missing or invalid are not checked
+        # again.
+        if path_entry[PATH_DOWNLOADED] is None:
+            try:
+                # If the file exists and the checksum is valid, don't download it
+                catalog_entry = path_entry[CATALOG_ENTRY]
+                self.validate_file(
+                    catalog_entry.path,
+                    catalog_entry.checksum_algorithm,
+                    catalog_entry.checksum
+                )
+                path_entry[PATH_DOWNLOADED] = True
+                self.progress_successes += 1
+                self.report()
+                msg = _('{path} has already been downloaded.').format(
+                    path=path_entry[CATALOG_ENTRY].path)
+                _logger.debug(msg)
+                report.data[REQUEST].canceled = True
+
+            except (InvalidChecksumType, VerificationException, IOError):
+                # It's either missing or incorrect, so download it
+                pass
 
         unit_model = plugin_api.get_unit_model_by_id(report.data[TYPE_ID])
         unit_qs = unit_model.objects.filter(id=report.data[UNIT_ID])
@@ -158,6 +158,7 @@ def ensure_database_indexes():
 
     model.Importer.ensure_indexes()
     model.RepositoryContentUnit.ensure_indexes()
+    model.RepositoryContentChange.ensure_indexes()
     model.Repository.ensure_indexes()
     model.ReservedResource.ensure_indexes()
     model.TaskStatus.ensure_indexes()
@@ -166,6 +167,7 @@ def ensure_database_indexes():
     model.ResourceManagerLock.ensure_indexes()
     model.LazyCatalogEntry.ensure_indexes()
     model.DeferredDownload.ensure_indexes()
+    model.VerifiedFile.ensure_indexes()
     model.Distributor.ensure_indexes()
 
     # Load all the model classes that the server knows about and ensure their indexes as well
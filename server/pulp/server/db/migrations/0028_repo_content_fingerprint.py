@@ -0,0 +1,38 @@
+import hashlib
+import struct
+
+from pulp.server.db.connection import get_collection
+
+
+def migrate(*args, **kwargs):
+    """
+    Calculate the content fingerprint of every repository from its unit associations.
+    """
+    repo_collection = get_collection('repos')
+    association_collection = get_collection('repo_content_units')
+    for repo in repo_collection.find({}, projection=['repo_id']):
+        fingerprint = 0
+        associations = association_collection.find(
+            {'repo_id': repo['repo_id']}, projection=['unit_id', 'unit_type_id'])
+        for association in associations:
+            fingerprint ^= _unit_fingerprint(association['unit_type_id'], association['unit_id'])
+        repo_collection.update_one({'_id': repo['_id']},
+                                   {'$set': {'content_fingerprint': long(fingerprint)}})
+
+
+def _unit_fingerprint(unit_type_id, unit_id):
+    """
+    Hash a unit to the signed 64 bit integer that it contributes to the content fingerprint of
+    a repository. This must match the hash used by the repository controller at the time of
+    this migration.
+
+    :param unit_type_id: identifies the type of the unit
+    :type  unit_type_id: str
+    :param unit_id: identifies the unit
+    :type  unit_id: str
+
+    :return: the hash of the unit
+    :rtype:  int
+    """
+    digest = hashlib.sha256('%s:%s' % (unit_type_id, unit_id)).digest()
+    return struct.unpack('>q', digest[:8])[0]
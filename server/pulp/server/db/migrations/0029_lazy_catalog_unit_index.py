@@ -0,0 +1,32 @@
+"""
+This migration creates the index used to find the lazy catalog entries of content units.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+
+from pulp.server.db import connection
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(*args, **kwargs):
+    """
+    Perform the migration as described in this module's docblock.
+
+    :param args:   unused
+    :type  args:   list
+    :param kwargs: unused
+    :type  kwargs: dict
+    """
+    db = connection.get_database()
+
+    # If 'lazy_content_catalog' is not defined, the index is created with the collection
+    if 'lazy_content_catalog' not in db.collection_names():
+        return
+
+    _logger.info('Creating the unit index of lazy_content_catalog')
+    db['lazy_content_catalog'].create_index([('unit_id', ASCENDING),
+                                             ('unit_type_id', ASCENDING),
+                                             ('path', ASCENDING),
+                                             ('revision', DESCENDING)], background=True)
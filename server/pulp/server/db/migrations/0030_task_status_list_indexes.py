@@ -0,0 +1,32 @@
+"""
+This migration creates the indexes used to filter and page the task list.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+
+from pulp.server.db import connection
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(*args, **kwargs):
+    """
+    Perform the migration as described in this module's docblock.
+
+    :param args:   unused
+    :type  args:   list
+    :param kwargs: unused
+    :type  kwargs: dict
+    """
+    db = connection.get_database()
+
+    # If 'task_status' is not defined, the indexes are created with the collection
+    if 'task_status' not in db.collection_names():
+        return
+
+    _logger.info('Creating the task list indexes of task_status')
+    collection = db['task_status']
+    collection.create_index([('state', ASCENDING), ('_id', ASCENDING)], background=True)
+    collection.create_index([('start_time', DESCENDING)], background=True)
+    collection.create_index([('finish_time', DESCENDING)], background=True)
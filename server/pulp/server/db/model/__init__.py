@@ -9,8 +9,9 @@ from gettext import gettext as _
 from hashlib import sha256
 from hmac import HMAC
 
-from mongoengine import (BooleanField, DictField, Document, DynamicField, IntField,
-                         ListField, StringField, UUIDField, ValidationError, QuerySetNoCache)
+from mongoengine import (BooleanField, DictField, Document, DynamicField, FloatField, IntField,
+                         ListField, LongField, StringField, UUIDField, ValidationError,
+                         QuerySetNoCache)
 from mongoengine import signals
 
 from pulp.common import constants, dateutils, error_codes
@@ -26,7 +27,9 @@ from pulp.server.compat import digestmod
 from pulp.server.db.fields import ISO8601StringField, UTCDateTimeField
 from pulp.server.db.model.reaper_base import ReaperMixin
 from pulp.server.db.model import base
-from pulp.server.db.querysets import CriteriaQuerySet, RepoQuerySet, RepositoryContentUnitQuerySet
+from pulp.server.db.querysets import (CriteriaQuerySet, DeferredDownloadQuerySet,
+                                      LazyCatalogEntryQuerySet, RepoQuerySet,
+                                      RepositoryContentUnitQuerySet)
 from pulp.server.managers import factory
 from pulp.server.util import Singleton
 from pulp.server.webservices.views import serializers
@@ -108,6 +111,11 @@ class Repository(AutoRetryDocument):
     :type last_unit_added: UTCDateTimeField
     :ivar last_unit_removed: Datetime of the most recent occurence of removing a unit from the repo
     :type last_unit_removed: UTCDateTimeField
+    :ivar content_fingerprint: order independent hash of the set of units associated with this
+                               repo, used to share applicability data between repos that have
+                               identical content. It is updated atomically as units are associated
+                               and disassociated.
+    :type content_fingerprint: mongoengine.LongField
     :ivar _ns: (Deprecated) Namespace of repo, included for backwards compatibility.
     :type _is: mongoengine.StringField
     """
@@ -123,6 +131,7 @@ class Repository(AutoRetryDocument):
     content_unit_counts = DictField(default={})
     last_unit_added = UTCDateTimeField()
     last_unit_removed = UTCDateTimeField()
+    content_fingerprint = LongField(default=0)
 
     # For backward compatibility
     _ns = StringField(default='repos')
@@ -167,7 +176,8 @@ class Repository(AutoRetryDocument):
                     self.notes[key] = value
 
         # These keys may not be changed.
-        prohibited = ['content_unit_counts', 'repo_id', 'last_unit_added', 'last_unit_removed']
+        prohibited = ['content_unit_counts', 'repo_id', 'last_unit_added', 'last_unit_removed',
+                      'content_fingerprint']
         [setattr(self, key, value) for key, value in repo_delta.items() if key not in prohibited]
 
 
@@ -220,12 +230,63 @@ class RepositoryContentUnit(AutoRetryDocument):
                 {
                     # Used for reverse lookup of units to repositories
                     'fields': ['unit_id']
+                },
+                {
+                    # Used to list the associated units of a type in order, to find orphans
+                    'fields': ['unit_type_id', 'unit_id']
                 }
             ],
             'queryset_class': RepositoryContentUnitQuerySet
             }
 
 
+class RepositoryContentChange(AutoRetryDocument):
+    """
+    A journal of the content units that have been added to or removed from a repository since
+    applicability was last regenerated for it. There is at most one entry per unit in each
+    repository, recording the most recent change made to that unit's association.
+
+    Defines the schema for the documents in repo_content_changes collection.
+
+    :ivar repo_id: string representation of the repository id
+    :type repo_id: mongoengine.StringField
+    :ivar unit_id: string representation of content unit id
+    :type unit_id: mongoengine.StringField
+    :ivar unit_type_id: string representation of content unit type
+    :type unit_type_id: mongoengine.StringField
+    :ivar action: the most recent change made to the association, either ACTION_ADDED or
+                  ACTION_REMOVED
+    :type action: mongoengine.StringField
+    :ivar updated: UTC datetime of the most recent change made to the association
+    :type updated: UTCDateTimeField
+    :ivar _ns: The namespace field (Deprecated), reading
+    :type _ns: mongoengine.StringField
+    """
+    ACTION_ADDED = 'added'
+    ACTION_REMOVED = 'removed'
+
+    repo_id = StringField(required=True)
+    unit_id = StringField(required=True)
+    unit_type_id = StringField(required=True)
+    action = StringField(required=True, choices=(ACTION_ADDED, ACTION_REMOVED))
+    updated = UTCDateTimeField(required=True, default=dateutils.now_utc_datetime_with_tzinfo)
+
+    # For backward compatibility
+    _ns = StringField(default='repo_content_changes')
+
+    meta = {'collection': 'repo_content_changes',
+            'allow_inheritance': False,
+            'indexes': [
+                {
+                    'fields': ['repo_id', 'unit_type_id', 'unit_id'],
+                    'unique': True
+                },
+                {
+                    'fields': ['repo_id', 'updated']
+                }
+            ]}
+
+
 class Importer(AutoRetryDocument):
     """
     Defines schema for an Importer in the `repo_importers` collection.
@@ -507,7 +568,9 @@ class TaskStatus(AutoRetryDocument, ReaperMixin):
     _ns = StringField(default='task_status')
 
     meta = {'collection': 'task_status',
-            'indexes': ['-tags', '-state', {'fields': ['-task_id'], 'unique': True}, '-group_id'],
+            'indexes': ['-tags', '-state', {'fields': ['-task_id'], 'unique': True}, '-group_id',
+                        # These back the filters and the id order of the paged task list
+                        ('state', 'id'), '-start_time', '-finish_time'],
             'allow_inheritance': False,
             'queryset_class': CriteriaQuerySet}
 
@@ -1066,7 +1129,17 @@ class LazyCatalogEntry(AutoRetryDocument):
                 ],
                 'unique': True
             },
+            {
+                # Used to find the entries of content units, see find_entries_for_units()
+                'fields': [
+                    'unit_id',
+                    'unit_type_id',
+                    'path',
+                    '-revision',
+                ]
+            },
         ],
+        'queryset_class': LazyCatalogEntryQuerySet,
     }
 
     # For backward compatibility
@@ -1114,6 +1187,8 @@ class DeferredDownload(AutoRetryDocument):
     :type unit_id:      str
     :ivar unit_type_id: The associated content unit type.
     :type unit_type_id: str
+    :ivar claimed_by:   The ID of the task downloading the unit, if any.
+    :type claimed_by:   str
     """
     meta = {
         'collection': 'deferred_download',
@@ -1121,17 +1196,56 @@ class DeferredDownload(AutoRetryDocument):
             {
                 'fields': ['unit_id', 'unit_type_id'],
                 'unique': True
-            }
-        ]
+            },
+            'claimed_by',
+        ],
+        'queryset_class': DeferredDownloadQuerySet
     }
 
     unit_id = StringField(required=True)
     unit_type_id = StringField(required=True)
+    claimed_by = StringField()
 
     # For backward compatibility
     _ns = StringField(default='deferred_download')
 
 
+class VerifiedFile(AutoRetryDocument):
+    """
+    A file in content storage whose checksum has been verified, so that it does not need to be
+    calculated again while the file is unchanged.
+
+    :ivar path:          The absolute path of the file.
+    :type path:          str
+    :ivar size:          The size of the file when it was verified.
+    :type size:          int
+    :ivar mtime:         The modification time of the file when it was verified.
+    :type mtime:         float
+    :ivar checksum_type: The checksum algorithm.
+    :type checksum_type: str
+    :ivar checksum:      The verified checksum.
+    :type checksum:      str
+    """
+    meta = {
+        'collection': 'verified_files',
+        'indexes': [
+            {
+                'fields': ['path'],
+                'unique': True
+            }
+        ]
+    }
+
+    path = StringField(required=True)
+    size = LongField(required=True)
+    mtime = FloatField(required=True)
+    checksum_type = StringField(required=True)
+    checksum = StringField(required=True)
+
+    # For backward compatibility
+    _ns = StringField(default='verified_files')
+
+
 class User(AutoRetryDocument):
     """
     :ivar login: user's login name, must be unique for each user
@@ -174,6 +174,9 @@ class RepoProfileApplicability(Model):
     The profile itself is included here for ease of recalculating the applicability when a
     repository's contents change.
 
+    The content fingerprint of the repository the applicability was calculated for may also be
+    stored, so that the applicability can be reused for other repositories with identical content.
+
     The RepoProfileApplicabilityManager can be accessed through the classlevel "objects" attribute.
     """
     collection_name = 'repo_profile_applicability'
@@ -181,6 +184,9 @@ class RepoProfileApplicability(Model):
     unique_indices = (
         ('profile_hash', 'repo_id'),
     )
+    search_indices = (
+        ('profile_hash', 'content_fingerprint'),
+    )
 
     def __init__(self, profile_hash, repo_id, profile, applicability, _id=None, **kwargs):
         """
@@ -271,6 +277,9 @@ class UnitProfile(Model):
     unique_indices = (
         ('consumer_id', 'content_type'),
     )
+    search_indices = (
+        ('profile_hash',),
+    )
 
     def __init__(self, consumer_id, content_type, profile, profile_hash=None):
         """
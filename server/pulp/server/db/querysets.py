@@ -139,6 +139,75 @@ class RepoQuerySet(CriteriaQuerySet):
             raise pulp_exceptions.MissingResource(repository=repo_id)
 
 
+class LazyCatalogEntryQuerySet(QuerySetPreventCache):
+    """
+    Custom queryset for lazy catalog entries.
+    """
+
+    def find_entries_for_units(self, units):
+        """
+        Find the newest catalog entry for each file of the given content units, using one query
+        per content type.
+
+        :param units: the content units to find catalog entries for
+        :type  units: iterable of pulp.server.db.model.FileContentUnit
+        :return: the catalog entry with the highest revision for each file, keyed by
+                 (unit_type_id, unit_id, path)
+        :rtype:  dict
+        """
+        unit_ids_by_type = {}
+        for unit in units:
+            unit_ids_by_type.setdefault(unit.type_id, []).append(unit.id)
+
+        entries = {}
+        for unit_type_id, unit_ids in unit_ids_by_type.iteritems():
+            for entry in self(unit_id__in=unit_ids, unit_type_id=unit_type_id):
+                key = (entry.unit_type_id, entry.unit_id, entry.path)
+                newest = entries.get(key)
+                if newest is None or entry.revision > newest.revision:
+                    entries[key] = entry
+        return entries
+
+
+class DeferredDownloadQuerySet(QuerySetPreventCache):
+    """
+    Custom queryset for deferred downloads.
+    """
+
+    def claim(self, claim_id, batch_size):
+        """
+        Claim a batch of unclaimed deferred downloads, so that concurrent download tasks do not
+        download the same units. Claiming is atomic for each entry, so an entry claimed by
+        another task at the same time is not returned. If other tasks claim all of the entries
+        first, the next unclaimed entries are tried, so that nothing is returned only when no
+        unclaimed entries are left.
+
+        :param claim_id:   identifies the claimant, such as the ID of the task
+        :type  claim_id:   str
+        :param batch_size: the maximum number of entries to claim
+        :type  batch_size: int
+        :return: the entries claimed
+        :rtype:  list of pulp.server.db.model.DeferredDownload
+        """
+        while True:
+            candidate_ids = [entry.id for entry in
+                             self(claimed_by=None).only('id').limit(batch_size)]
+            if not candidate_ids:
+                return []
+            if self(id__in=candidate_ids, claimed_by=None).update(set__claimed_by=claim_id):
+                return list(self(id__in=candidate_ids, claimed_by=claim_id))
+
+    def release_claims(self, claim_ids):
+        """
+        Release the entries claimed by the given claimants, so that they can be claimed again.
+
+        :param claim_ids: identify the claimants whose entries are released
+        :type  claim_ids: list of str
+        """
+        if claim_ids:
+            self(claimed_by__in=claim_ids).update(unset__claimed_by=True)
+
+
 class RepositoryContentUnitQuerySet(CriteriaQuerySet):
     """
     Custom queryset for repository content units.
@@ -18,9 +18,11 @@ zDFYRlosVNTom5YiKprVkJEAo3cbTOMoZss_NS-vpzauuk-qXwqj05gI7fJVsVD915gGcY0xPUbpCbVT
 """
 
 from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import OrderedDict
 from gettext import gettext as _
 from hashlib import sha256
 from time import time
+import threading
 from urllib import quote, unquote
 from urlparse import ParseResult, urlparse, urlunparse
 
@@ -29,6 +31,12 @@ from M2Crypto import RSA, BIO
 from pulp.server.compat import json
 
 
+# The maximum number of signed URLs kept by the signing service
+SIGNED_URL_CACHE_SIZE = 10000
+# The fraction of its lifetime for which a signed URL is handed out again
+SIGNED_URL_REUSE_FRACTION = 0.5
+
+
 class NotValid(Exception):
     """
     URL or policy is not valid.
@@ -594,3 +602,118 @@ class SignedURL(URL):
             if extensions.get(k) != v:
                 raise ExtensionNotMatched(k)
         return policy.resource
+
+
+class SigningService(object):
+    """
+    Provides URL signing with RSA keys that are loaded once per process.
+
+    Signed URLs are cached by URL, key and policy extensions, and the same signed URL is handed
+    out again until it is near its expiration, so that repeated requests for a resource by
+    the same client do not each need an RSA signature.
+
+    :ivar hits: The number of signed URLs taken from the cache.
+    :type hits: int
+    :ivar misses: The number of URLs that were signed.
+    :type misses: int
+    :ivar signing_time: The total number of seconds spent signing URLs.
+    :type signing_time: float
+    :ivar loads: The number of keys loaded.
+    :type loads: int
+    :ivar loading_time: The total number of seconds spent loading keys.
+    :type loading_time: float
+    """
+
+    def __init__(self, max_size=SIGNED_URL_CACHE_SIZE, reuse=SIGNED_URL_REUSE_FRACTION):
+        """
+        :param max_size: The maximum number of signed URLs to cache.
+        :type max_size: int
+        :param reuse: The fraction of its lifetime for which a signed URL is reused.
+        :type reuse: float
+        """
+        self.max_size = max_size
+        self.reuse = reuse
+        self.hits = 0
+        self.misses = 0
+        self.signing_time = 0.0
+        self.loads = 0
+        self.loading_time = 0.0
+        # path -> RSA.RSA
+        self._keys = {}
+        # (url, key path, expiration, extensions) -> (reuse deadline, SignedURL)
+        self._signed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, path):
+        """
+        Get the RSA key at the specified path, loading it the first time it is requested.
+
+        :param path: An absolute path to a PEM encoded key.
+        :type path: str
+        :return: The loaded key.
+        :rtype: RSA.RSA
+        """
+        with self._lock:
+            key = self._keys.get(path)
+        if key is not None:
+            return key
+        started = time()
+        key = Key.load(path)
+        with self._lock:
+            self.loads += 1
+            self.loading_time += time() - started
+            return self._keys.setdefault(path, key)
+
+    def sign(self, url, path, expiration=90, cache=True, **extensions):
+        """
+        Sign the URL using the private RSA key at the specified path.
+
+        :param url: The URL to be signed.
+        :type url: str
+        :param path: An absolute path to a PEM encoded private key.
+        :type path: str
+        :param expiration: The signature expiration in seconds.
+        :type expiration: int
+        :param cache: Whether a cached signed URL may be returned, and the signed URL cached.
+            URLs that are signed only once should not be cached.
+        :type cache: bool
+        :param extensions: Optional policy extensions.
+        :type extensions: dict
+        :return: The signed URL.
+        :rtype: SignedURL
+        """
+        cache_key = (url, path, expiration, tuple(sorted(extensions.items())))
+        now = time()
+        if cache:
+            with self._lock:
+                entry = self._signed.pop(cache_key, None)
+                if entry is not None and entry[0] > now:
+                    self._signed[cache_key] = entry
+                    self.hits += 1
+                    return entry[1]
+
+        key = self.key(path)
+        started = time()
+        signed = URL(url).sign(key, expiration=expiration, **extensions)
+        finished = time()
+
+        with self._lock:
+            self.misses += 1
+            self.signing_time += finished - started
+            if cache and self.max_size > 0:
+                self._signed[cache_key] = (now + expiration * self.reuse, signed)
+                while len(self._signed) > self.max_size:
+                    self._signed.popitem(last=False)
+        return signed
+
+    def clear(self):
+        """
+        Forget the loaded keys and signed URLs.
+        """
+        with self._lock:
+            self._keys.clear()
+            self._signed.clear()
+
+
+# The signing service shared by the process
+signing_service = SigningService()
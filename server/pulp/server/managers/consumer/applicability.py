@@ -5,17 +5,22 @@ Contains content applicability management classes
 from gettext import gettext as _
 from logging import getLogger
 from uuid import uuid4
+import base64
 
 from celery import task
+from pymongo import ASCENDING, UpdateOne
 
+from pulp.common import dateutils
 from pulp.plugins.conduits.profiler import ProfilerConduit
 from pulp.plugins.config import PluginCallConfiguration
 from pulp.plugins.loader import api as plugin_api, exceptions as plugin_exceptions
 from pulp.plugins.profiler import Profiler
 from pulp.server.async.tasks import Task
+from pulp.server.controllers import repository as repo_controller
 from pulp.server.db import model
 from pulp.server.db.model.consumer import Bind, RepoProfileApplicability, UnitProfile
 from pulp.server.db.model.criteria import Criteria
+from pulp.server.exceptions import InvalidValue
 from pulp.server.managers import factory as managers
 from pulp.server.managers.consumer.query import ConsumerQueryManager
 from pulp.plugins.util.misc import paginate
@@ -23,6 +28,15 @@ from pulp.plugins.util.misc import paginate
 
 _logger = getLogger(__name__)
 
+# The number of profiles whose applicability is regenerated at once. All the profile data for a
+# batch is loaded into memory, so this should not be too large.
+APPLICABILITY_BATCH_SIZE = 50
+
+# The number of consumers whose applicability is collated at once when the applicability report
+# is retrieved in pages, and the default number of consumers in each page.
+APPLICABILITY_REPORT_CHUNK_SIZE = 1000
+APPLICABILITY_REPORT_PAGE_SIZE = 10000
+
 
 class ApplicabilityRegenerationManager(object):
     @staticmethod
@@ -84,35 +98,75 @@ class ApplicabilityRegenerationManager(object):
         for binding in all_repo_bindings:
             repo_consumers_map.setdefault(binding['repo_id'], []).append(binding['consumer_id'])
 
-        # Create a set of (repo_id, (profile_hash, content_type))
-        repo_profile_hashes = set()
+        # Create a map of repo_id to the set of (profile_hash, content_type) tuples bound to it
+        repo_profile_hashes = {}
         for repo_id, consumer_id_list in repo_consumers_map.items():
             for consumer_id in consumer_id_list:
                 if consumer_id in consumer_unit_profiles_map:
-                    for unit_profile_tuple in consumer_unit_profiles_map[consumer_id]:
-                        repo_profile_hashes.add((repo_id, unit_profile_tuple))
-
-        # Iterate through each tuple in repo_profile_hashes set and regenerate applicability,
-        # if it doesn't exist. These are all guaranteed to be unique tuples because of the logic
-        # used to create maps and sets above, eliminating multiple unnecessary queries
-        # to check for existing applicability for same profiles.
-        manager = managers.applicability_regeneration_manager()
-        for repo_id, (profile_hash, content_type) in repo_profile_hashes:
-            # Check if applicability for given profile_hash and repo_id already exists
-            if ApplicabilityRegenerationManager._is_existing_applicability(repo_id, profile_hash):
-                continue
-            # If applicability does not exist, generate applicability data for given profile
-            # and repo id.
-            profile_id = profile_hash_profile_id_map[profile_hash]
-            manager.regenerate_applicability(profile_hash, content_type, profile_id, repo_id)
+                    repo_profile_hashes.setdefault(repo_id, set()).update(
+                        consumer_unit_profiles_map[consumer_id])
+
+        # Find all the (repo_id, profile_hash) combinations that already have applicability data
+        # with a single query, instead of checking every combination separately.
+        existing_applicabilities = RepoProfileApplicability.get_collection().find(
+            {'repo_id': {'$in': repo_profile_hashes.keys()},
+             'profile_hash': {'$in': profile_hash_profile_id_map.keys()}},
+            projection=['repo_id', 'profile_hash'])
+        existing_repo_profiles = set((a['repo_id'], a['profile_hash'])
+                                     for a in existing_applicabilities)
+
+        # Map every repo_id to the profiles that are missing applicability data. These are all
+        # guaranteed to be unique because of the logic used to create maps and sets above,
+        # eliminating multiple unnecessary queries for the same profiles.
+        missing_repo_profiles = {}
+        for repo_id, profile_tuples in repo_profile_hashes.items():
+            for profile_hash, content_type in profile_tuples:
+                if (repo_id, profile_hash) not in existing_repo_profiles:
+                    missing_repo_profiles.setdefault(repo_id, {})[profile_hash] = content_type
+        if not missing_repo_profiles:
+            return
+
+        repo_content_types_map = \
+            ApplicabilityRegenerationManager._get_existing_repo_content_types_map(
+                missing_repo_profiles.keys())
+
+        # Load the actual profiles in pages, so that only a bounded number of them is in memory
+        # at once, and generate applicability for every repo that needs any of them.
+        missing_profile_hashes = set()
+        for profiles in missing_repo_profiles.values():
+            missing_profile_hashes.update(profiles)
+        for profile_hash_page in paginate(sorted(missing_profile_hashes),
+                                          APPLICABILITY_BATCH_SIZE):
+            profile_ids = [profile_hash_profile_id_map[h] for h in profile_hash_page]
+            unit_profiles = UnitProfile.get_collection().find(
+                {'id': {'$in': profile_ids}}, projection=['profile_hash', 'profile'])
+            profile_map = dict((p['profile_hash'], p['profile']) for p in unit_profiles)
+
+            for repo_id, profiles in missing_repo_profiles.items():
+                batch = [(profile_hash, profiles[profile_hash], profile_map[profile_hash])
+                         for profile_hash in profile_hash_page
+                         if profile_hash in profiles and profile_hash in profile_map]
+                if batch:
+                    ApplicabilityRegenerationManager._regenerate_applicability_batch(
+                        repo_id, batch, repo_content_types_map.get(repo_id, set()))
 
     @staticmethod
-    def regenerate_applicability_for_repos(repo_criteria):
+    def regenerate_applicability_for_repos(repo_criteria, incremental=False):
         """
         Regenerate and save applicability data affected by given updated repositories.
 
+        When incremental is True, only the units that were added to or removed from each
+        repository since its applicability was last regenerated are taken into account, as
+        recorded in the repository's content change journal.
+
+        Applicability data that was already calculated for another repository with identical
+        content, as identified by the repositories' content fingerprints, is reused instead of
+        being calculated again.
+
         :param repo_criteria: The repo selection criteria
         :type repo_criteria: dict
+        :param incremental: whether to only account for the changes made to the repositories
+        :type incremental: bool
         """
         repo_criteria = Criteria.from_dict(repo_criteria)
 
@@ -121,28 +175,62 @@ class ApplicabilityRegenerationManager(object):
         repo_ids = [r.repo_id for r in model.Repository.objects.find_by_criteria(repo_criteria)]
 
         for repo_id in repo_ids:
-            # Find all existing applicabilities for given repo_id. Setting batch size of 5 ensures
-            # the MongoDB cursor does not time out. See https://pulp.plan.io/issues/998#note-6 for
-            # more details.
-            existing_applicabilities = RepoProfileApplicability.get_collection().find(
-                {'repo_id': repo_id}).batch_size(5)
-            for existing_applicability in existing_applicabilities:
-                existing_applicability = RepoProfileApplicability(**dict(existing_applicability))
-                profile_hash = existing_applicability['profile_hash']
-                unit_profile = UnitProfile.get_collection().find_one({'profile_hash': profile_hash},
-                                                                     projection=['id',
-                                                                                 'content_type'])
-                if unit_profile is None:
-                    # Unit profiles change whenever packages are installed or removed on consumers,
-                    # and it is possible that existing_applicability references a UnitProfile
-                    # that no longer exists. This is harmless, as Pulp has a monthly cleanup task
-                    # that will identify these dangling references and remove them.
-                    continue
+            if incremental:
+                # The fingerprint must be read before the journal, so that it does not account
+                # for changes the patched applicability data does not account for
+                content_fingerprint = ApplicabilityRegenerationManager._get_content_fingerprint(
+                    repo_id)
+            # Changes journaled after this point will be accounted for by the next regeneration
+            changed_before = dateutils.now_utc_datetime_with_tzinfo()
+            if incremental:
+                ApplicabilityRegenerationManager._patch_applicability_for_repo(
+                    repo_id, changed_before, content_fingerprint)
+            else:
+                ApplicabilityRegenerationManager._regenerate_applicability_for_repo(repo_id)
+            repo_controller.clear_content_changes(repo_id, changed_before)
+
+    @staticmethod
+    def _regenerate_applicability_for_repo(repo_id):
+        """
+        Regenerate and save all the existing applicability data for a repository.
 
-                # Regenerate applicability data for given unit_profile and repo id
-                ApplicabilityRegenerationManager.regenerate_applicability(
-                    profile_hash, unit_profile['content_type'], unit_profile['id'], repo_id,
-                    existing_applicability)
+        :param repo_id: Repository id for which applicability is being calculated
+        :type repo_id: str
+        """
+        # Find the profile hashes of all existing applicabilities for given repo_id, and
+        # regenerate them in batches, so only a batch worth of profiles is loaded into memory
+        # at once. Only the hashes are read up front, so the MongoDB cursor is exhausted
+        # right away and cannot time out while applicability is being calculated. See
+        # https://pulp.plan.io/issues/998#note-6 for more details.
+        profile_hashes = list(RepoProfileApplicability.get_collection().find(
+            {'repo_id': repo_id}, projection={'profile_hash': 1, '_id': 0}))
+        for batch in paginate(profile_hashes, APPLICABILITY_BATCH_SIZE):
+            ApplicabilityRegenerationManager.batch_regenerate_applicability(repo_id, batch)
+
+    @staticmethod
+    def _patch_applicability_for_repo(repo_id, changed_before, content_fingerprint=None):
+        """
+        Incrementally update all the existing applicability data for a repository, using the
+        changes recorded in its content change journal.
+
+        :param repo_id: Repository id for which applicability is being calculated
+        :type repo_id: str
+        :param changed_before: only changes recorded at or before this time are accounted for
+        :type changed_before: datetime.datetime
+        :param content_fingerprint: content fingerprint of the repository, read before
+                                    changed_before, or None if it is not known
+        :type content_fingerprint: long
+        """
+        added_units, removed_unit_ids = repo_controller.get_content_changes(repo_id,
+                                                                            changed_before)
+        if not (added_units or removed_unit_ids):
+            return
+
+        profile_hashes = list(RepoProfileApplicability.get_collection().find(
+            {'repo_id': repo_id}, projection={'profile_hash': 1, '_id': 0}))
+        for batch in paginate(profile_hashes, APPLICABILITY_BATCH_SIZE):
+            ApplicabilityRegenerationManager.batch_patch_applicability(
+                repo_id, batch, added_units, removed_unit_ids, content_fingerprint)
 
     @staticmethod
     def queue_regenerate_applicability_for_repos(repo_criteria):
@@ -164,7 +252,7 @@ class ApplicabilityRegenerationManager(object):
         for repo_id in repo_ids:
             profile_hashes = RepoProfileApplicability.get_collection().find(
                 {'repo_id': repo_id}, {'profile_hash': 1})
-            for batch in paginate(profile_hashes, 10):
+            for batch in paginate(profile_hashes, APPLICABILITY_BATCH_SIZE):
                 batch_regenerate_applicability_task.apply_async((repo_id, batch),
                                                                 **{'group_id': task_group_id})
         return task_group_id
@@ -181,26 +269,297 @@ class ApplicabilityRegenerationManager(object):
                                associated with these hashes is loaded into the memory.
         :type profile_hashes: tuple of dicts in form of {'profile_hash': str}
         """
+        batch = ApplicabilityRegenerationManager._load_applicability_batch(repo_id, profile_hashes)
+        if not batch:
+            return
+
+        # The content types of the repo are the same for every profile in the batch
+        repo_content_types = set(
+            ApplicabilityRegenerationManager._get_existing_repo_content_types(repo_id))
+        ApplicabilityRegenerationManager._regenerate_applicability_batch(
+            repo_id, [(profile_hash, content_type, profile)
+                      for profile_hash, content_type, profile, _a in batch],
+            repo_content_types)
+
+    @staticmethod
+    def batch_patch_applicability(repo_id, profile_hashes, added_units, removed_unit_ids,
+                                  content_fingerprint=None):
+        """
+        Incrementally update the applicability data for a batch of existing applicabilities,
+        given the units that have been added to and removed from the repository since the
+        applicability was last regenerated.
+
+        Only the added units are evaluated against each profile, and removed units are simply
+        dropped from the existing applicability data. Profiles whose profiler does not support
+        incremental applicability have their applicability regenerated in full.
+
+        :param repo_id: Repository id for which applicability is being calculated
+        :type repo_id: str
+        :param profile_hashes: Tuple of consumer profile hashes for applicability profiles.
+                               Don't pass too much of these, all the profile data
+                               associated with these hashes is loaded into the memory.
+        :type profile_hashes: tuple of dicts in form of {'profile_hash': str}
+        :param added_units: mapping of content type ids to lists of ids of units added to the repo
+        :type added_units: dict
+        :param removed_unit_ids: ids of units removed from the repo
+        :type removed_unit_ids: set
+        :param content_fingerprint: content fingerprint of the repository the changes lead to, or
+                                    None if it is not known
+        :type content_fingerprint: long
+        """
+        batch = ApplicabilityRegenerationManager._load_applicability_batch(repo_id, profile_hashes)
+        if not batch:
+            return
+
+        batch_by_type = {}
+        for profile_hash, content_type, profile, applicability in batch:
+            batch_by_type.setdefault(content_type, []).append(
+                (profile_hash, profile, applicability))
+
+        patched_applicabilities = []
+        full_regeneration = []
+        for content_type, profiles in batch_by_type.items():
+            profiler, profiler_cfg = ApplicabilityRegenerationManager._profiler(content_type)
+            added_applicability = {}
+            # The profiler is asked even if units were only removed, because removing a unit
+            # may make other units applicable for profilers that do not support deltas
+            if added_units or removed_unit_ids:
+                call_config = PluginCallConfiguration(plugin_config=profiler_cfg,
+                                                      repo_plugin_config=None)
+                unit_profiles = dict((profile_hash, profile)
+                                     for profile_hash, profile, _a in profiles)
+                try:
+                    added_applicability = profiler.calculate_applicable_units_delta(
+                        unit_profiles, repo_id, added_units, call_config, ProfilerConduit())
+                except NotImplementedError:
+                    full_regeneration.extend((profile_hash, content_type, profile)
+                                             for profile_hash, profile, _a in profiles)
+                    continue
+
+            for profile_hash, profile, applicability in profiles:
+                patched = {}
+                for type_id, unit_ids in applicability.items():
+                    patched[type_id] = [u for u in unit_ids if u not in removed_unit_ids]
+                for type_id, unit_ids in added_applicability.get(profile_hash, {}).items():
+                    applicable = patched.setdefault(type_id, [])
+                    applicable.extend(set(unit_ids) - set(applicable))
+                if patched != applicability:
+                    patched_applicabilities.append((profile_hash, patched))
+
+        if patched_applicabilities:
+            content_fingerprint = ApplicabilityRegenerationManager._verify_content_fingerprint(
+                repo_id, content_fingerprint)
+            requests = []
+            for profile_hash, applicability in patched_applicabilities:
+                update = ApplicabilityRegenerationManager._applicability_update(
+                    applicability, content_fingerprint)
+                requests.append(UpdateOne({'profile_hash': profile_hash, 'repo_id': repo_id},
+                                          update))
+            RepoProfileApplicability.get_collection().bulk_write(requests, ordered=False)
+
+        if full_regeneration:
+            repo_content_types = set(
+                ApplicabilityRegenerationManager._get_existing_repo_content_types(repo_id))
+            ApplicabilityRegenerationManager._regenerate_applicability_batch(
+                repo_id, full_regeneration, repo_content_types)
+
+    @staticmethod
+    def _load_applicability_batch(repo_id, profile_hashes):
+        """
+        Load a batch of existing applicabilities for a repository, along with the content type
+        of each profile.
+
+        :param repo_id: Repository id for which applicability is being calculated
+        :type repo_id: str
+        :param profile_hashes: Tuple of consumer profile hashes for applicability profiles.
+        :type profile_hashes: tuple of dicts in form of {'profile_hash': str}
+        :return: list of (profile_hash, content_type, profile, applicability) tuples
+        :rtype: list
+        """
         profile_hash_list = [phash['profile_hash'] for phash in profile_hashes]
         existing_applicabilities = RepoProfileApplicability.get_collection().find(
             {"repo_id": repo_id, "profile_hash": {"$in": profile_hash_list}})
-        for existing_applicability in list(existing_applicabilities):
-                # Convert cursor to RepoProfileApplicability object
-            existing_applicability = RepoProfileApplicability(**dict(existing_applicability))
+        existing_applicabilities = list(existing_applicabilities)
+        if not existing_applicabilities:
+            return []
+
+        # Look up the content type of all the profiles in the batch with a single query
+        unit_profiles = UnitProfile.get_collection().find(
+            {'profile_hash': {'$in': profile_hash_list}},
+            projection=['profile_hash', 'content_type'])
+        content_type_map = {}
+        for unit_profile in unit_profiles:
+            content_type_map.setdefault(unit_profile['profile_hash'], unit_profile['content_type'])
+
+        batch = []
+        for existing_applicability in existing_applicabilities:
             profile_hash = existing_applicability['profile_hash']
-            unit_profile = UnitProfile.get_collection().find_one({'profile_hash': profile_hash},
-                                                                 projection=['id', 'content_type'])
-            if unit_profile is None:
+            if profile_hash not in content_type_map:
                 # Unit profiles change whenever packages are installed or removed on consumers,
                 # and it is possible that existing_applicability references a UnitProfile
                 # that no longer exists. This is harmless, as Pulp has a monthly cleanup task
                 # that will identify these dangling references and remove them.
                 continue
+            batch.append((profile_hash, content_type_map[profile_hash],
+                          existing_applicability['profile'],
+                          existing_applicability['applicability']))
+        return batch
 
-            # Regenerate applicability data for given unit_profile and repo id
-            ApplicabilityRegenerationManager.regenerate_applicability(
-                profile_hash, unit_profile['content_type'], unit_profile['id'], repo_id,
-                existing_applicability)
+    @staticmethod
+    def _regenerate_applicability_batch(repo_id, profiles, repo_content_types):
+        """
+        Regenerate and save applicability data for a batch of profiles against one repository.
+
+        Profiles are grouped by content type, so that each profiler is called once per batch
+        through its calculate_applicable_units_batch hook, and all the results are written back
+        to the database with a single bulk upsert.
+
+        Applicability data is stored along with the content fingerprint of the repository it was
+        calculated for. If another repository with the same content fingerprint already has
+        applicability data for a profile, that data is reused and the profiler is not called for
+        the profile.
+
+        :param repo_id:            repo id to be used to calculate applicability against the
+                                   given profiles
+        :type  repo_id:            str
+        :param profiles:           list of (profile_hash, content_type, profile) tuples
+        :type  profiles:           list
+        :param repo_content_types: content type ids that have units in the repository
+        :type  repo_content_types: set
+        """
+        profiles_by_type = {}
+        for profile_hash, content_type, profile in profiles:
+            profiles_by_type.setdefault(content_type, {})[profile_hash] = profile
+
+        content_fingerprint = ApplicabilityRegenerationManager._get_content_fingerprint(repo_id)
+        cached_applicabilities = ApplicabilityRegenerationManager._get_cached_applicabilities(
+            repo_id, [profile_hash for profile_hash, _t, _p in profiles], content_fingerprint)
+
+        results = []
+        for content_type, unit_profiles in profiles_by_type.items():
+            profiler, profiler_cfg = ApplicabilityRegenerationManager._profiler(content_type)
+
+            # Only regenerate applicability if the repo contains types that the profiler handles
+            if not (repo_content_types & set(profiler.metadata()['types'])):
+                continue
+
+            applicabilities = dict(
+                (profile_hash, cached_applicabilities[profile_hash])
+                for profile_hash in unit_profiles if profile_hash in cached_applicabilities)
+            uncached_profiles = dict(
+                (profile_hash, profile) for profile_hash, profile in unit_profiles.items()
+                if profile_hash not in cached_applicabilities)
+            if uncached_profiles:
+                call_config = PluginCallConfiguration(plugin_config=profiler_cfg,
+                                                      repo_plugin_config=None)
+                try:
+                    applicabilities.update(profiler.calculate_applicable_units_batch(
+                        uncached_profiles, repo_id, call_config, ProfilerConduit()))
+                except NotImplementedError:
+                    msg = "Profiler for content type [%s] does not support applicability" % \
+                        content_type
+                    _logger.debug(msg)
+                    continue
+
+            for profile_hash, applicability in applicabilities.items():
+                results.append((profile_hash, applicability, unit_profiles[profile_hash]))
+
+        if results:
+            content_fingerprint = ApplicabilityRegenerationManager._verify_content_fingerprint(
+                repo_id, content_fingerprint)
+            requests = []
+            for profile_hash, applicability, profile in results:
+                update = ApplicabilityRegenerationManager._applicability_update(
+                    applicability, content_fingerprint)
+                update['$setOnInsert'] = {'profile': profile}
+                requests.append(UpdateOne({'profile_hash': profile_hash, 'repo_id': repo_id},
+                                          update, upsert=True))
+            RepoProfileApplicability.get_collection().bulk_write(requests, ordered=False)
+
+    @staticmethod
+    def _get_content_fingerprint(repo_id):
+        """
+        Get the content fingerprint of a repository.
+
+        :param repo_id: The repo_id of the repository
+        :type  repo_id: basestring
+        :return:        The content fingerprint, or None if the repository does not exist
+        :rtype:         long
+        """
+        repos = model.Repository.objects(repo_id=repo_id).only('content_fingerprint')
+        for repo_obj in repos:
+            return repo_obj.content_fingerprint
+        return None
+
+    @staticmethod
+    def _verify_content_fingerprint(repo_id, content_fingerprint):
+        """
+        Verify that the content fingerprint of a repository did not change while its
+        applicability data was being calculated. Applicability data calculated while the content
+        of the repository changed may not match any content fingerprint, and must not be reused.
+
+        :param repo_id:             The repo_id of the repository
+        :type  repo_id:             basestring
+        :param content_fingerprint: The content fingerprint the applicability data was calculated
+                                    for, or None if it is not known
+        :type  content_fingerprint: long
+        :return:                    The content fingerprint the applicability data should be
+                                    stored with, or None if it should not be reused
+        :rtype:                     long
+        """
+        if content_fingerprint is None:
+            return None
+        if ApplicabilityRegenerationManager._get_content_fingerprint(repo_id) != \
+                content_fingerprint:
+            return None
+        return content_fingerprint
+
+    @staticmethod
+    def _get_cached_applicabilities(repo_id, profile_hashes, content_fingerprint):
+        """
+        Find applicability data for the given profiles that was calculated for other
+        repositories with the same content fingerprint, using a single query.
+
+        :param repo_id:             The repo_id of the repository whose applicability is being
+                                    calculated. Its own applicability data is never reused.
+        :type  repo_id:             basestring
+        :param profile_hashes:      hashes of the profiles to look applicability data up for
+        :type  profile_hashes:      list
+        :param content_fingerprint: The content fingerprint of the repository, or None if it is
+                                    not known
+        :type  content_fingerprint: long
+        :return:                    A dictionary mapping profile hashes to applicability data
+        :rtype:                     dict
+        """
+        if content_fingerprint is None:
+            return {}
+        cached_applicabilities = RepoProfileApplicability.get_collection().find(
+            {'profile_hash': {'$in': profile_hashes},
+             'content_fingerprint': content_fingerprint,
+             'repo_id': {'$ne': repo_id}},
+            projection=['profile_hash', 'applicability'])
+        return dict((a['profile_hash'], a['applicability']) for a in cached_applicabilities)
+
+    @staticmethod
+    def _applicability_update(applicability, content_fingerprint):
+        """
+        Build the update document that stores applicability data along with the content
+        fingerprint it was calculated for.
+
+        :param applicability:       A dictionary mapping content type ids to lists of applicable
+                                    unit ids
+        :type  applicability:       dict
+        :param content_fingerprint: The content fingerprint the applicability data was calculated
+                                    for, or None if the data should not be reused
+        :type  content_fingerprint: long
+        :return:                    MongoDB update document
+        :rtype:                     dict
+        """
+        if content_fingerprint is None:
+            return {'$set': {'applicability': applicability},
+                    '$unset': {'content_fingerprint': ''}}
+        return {'$set': {'applicability': applicability,
+                         'content_fingerprint': content_fingerprint}}
 
     @staticmethod
     def regenerate_applicability(profile_hash, content_type, profile_id,
@@ -293,6 +652,28 @@ class ApplicabilityRegenerationManager(object):
                 repo_content_types_with_non_zero_unit_count.append(content_type)
         return repo_content_types_with_non_zero_unit_count
 
+    @staticmethod
+    def _get_existing_repo_content_types_map(repo_ids):
+        """
+        For each of the given repo_ids, find the content_type_ids that have content unit counts
+        greater than 0, using a single query.
+
+        :param repo_ids: The repo_ids for the repositories that we wish to know the unit types
+                         contained therein
+        :type  repo_ids: list
+        :return:         A dictionary mapping repo_ids to sets of content type ids that have unit
+                         counts greater than 0. Repositories that do not exist are not included.
+        :rtype:          dict
+        """
+        repos = model.Repository.objects(repo_id__in=list(repo_ids)).only(
+            'repo_id', 'content_unit_counts')
+        content_types_map = {}
+        for repo_obj in repos:
+            content_types_map[repo_obj.repo_id] = set(
+                content_type for content_type, count in repo_obj.content_unit_counts.items()
+                if count > 0)
+        return content_types_map
+
     @staticmethod
     def _is_existing_applicability(repo_id, profile_hash):
         """
@@ -456,6 +837,11 @@ class RepoProfileApplicabilityManager(object):
         # Remove all RepoProfileApplicability objects that reference these profile hashes
         if missing_profile_hashes:
             rpa_collection.remove({'profile_hash': {'$in': missing_profile_hashes}})
+
+        # Content change journals are only used to update existing applicability data, so the
+        # journals of repositories without any applicability data are not needed
+        model.RepositoryContentChange.objects(
+            repo_id__nin=rpa_collection.distinct('repo_id')).delete()
 # Instantiate one of the managers on the object it manages for convenience
 RepoProfileApplicability.objects = RepoProfileApplicabilityManager()
 
@@ -518,6 +904,118 @@ def retrieve_consumer_applicability(consumer_criteria, content_types=None):
     return _format_report(consumer_applicability_map)
 
 
+def retrieve_consumer_applicability_page(consumer_criteria, content_types=None,
+                                         page_size=APPLICABILITY_REPORT_PAGE_SIZE,
+                                         continuation=None):
+    """
+    Query content applicability for a page of the consumers matched by a given
+    consumer_criteria, optionally limiting by content type.
+
+    Unlike retrieve_consumer_applicability(), the applicability reports are generated lazily, so
+    that they can be streamed to the client. Consumers are paged in the order of their ids, so
+    the sort, limit and skip of the consumer_criteria are not used. The consumers in the page are
+    processed in chunks of APPLICABILITY_REPORT_CHUNK_SIZE, and consumers are only collated
+    together with the other consumers in the same chunk, which bounds the memory used. As a
+    result, the same applicability data may be reported more than once for different sets of
+    consumers.
+
+    :param consumer_criteria: The consumer selection criteria
+    :type  consumer_criteria: pulp.server.db.model.criteria.Criteria
+    :param content_types:     An optional list of content types that the caller wishes to limit
+                              the results to. Defaults to None, which will return data for all
+                              types
+    :type  content_types:     list
+    :param page_size:         The maximum number of consumers to report applicability for
+    :type  page_size:         int
+    :param continuation:      The continuation token returned for the previous page, or None to
+                              retrieve the first page
+    :type  continuation:      basestring
+    :return: A 2-tuple. The first element is a generator of the applicability reports for the
+             page, in the same format as returned by retrieve_consumer_applicability(). The second
+             element is the continuation token for the next page, or None if this is the last page
+    :rtype:  tuple
+
+    :raises InvalidValue: if the continuation token is not valid
+    """
+    filters = consumer_criteria.filters or {}
+    if continuation is not None:
+        last_consumer_id = _decode_continuation(continuation)
+        filters = {'$and': [filters, {'id': {'$gt': last_consumer_id}}]}
+
+    # Only the ids of the consumers in the page are loaded up front. One more consumer than
+    # requested is looked up to find out whether there is a next page.
+    page_criteria = Criteria(filters=filters, sort=[('id', ASCENDING)], limit=page_size + 1,
+                             fields=['id'])
+    consumer_ids = [c['id'] for c in ConsumerQueryManager.find_by_criteria(page_criteria)]
+
+    next_continuation = None
+    if len(consumer_ids) > page_size:
+        consumer_ids = consumer_ids[:page_size]
+        next_continuation = _encode_continuation(consumer_ids[-1])
+
+    return _generate_applicability_reports(consumer_ids, content_types), next_continuation
+
+
+def _generate_applicability_reports(consumer_ids, content_types):
+    """
+    Generate the applicability reports for the given consumers, processing them in chunks of
+    APPLICABILITY_REPORT_CHUNK_SIZE.
+
+    :param consumer_ids:  The ids of the consumers to report applicability for
+    :type  consumer_ids:  list
+    :param content_types: If not None, the content types to limit the reports to
+    :type  content_types: list or None
+    :return:              generator of applicability reports
+    :rtype:               generator
+    """
+    for consumer_id_chunk in paginate(consumer_ids, APPLICABILITY_REPORT_CHUNK_SIZE):
+        consumer_id_chunk = list(consumer_id_chunk)
+        consumer_map = dict([(c, {'profiles': [], 'repo_ids': []}) for c in consumer_id_chunk])
+        profile_hashes = _add_profiles_to_consumer_map_and_get_hashes(consumer_id_chunk,
+                                                                      consumer_map)
+        _add_repo_ids_to_consumer_map(consumer_id_chunk, consumer_map)
+
+        repo_ids = set()
+        for repo_profile_data in consumer_map.values():
+            repo_ids.update(repo_profile_data['repo_ids'])
+        applicability_map = _get_applicability_map(profile_hashes, content_types,
+                                                   list(repo_ids))
+        _add_consumers_to_applicability_map(consumer_map, applicability_map)
+        del consumer_map
+
+        for report in _format_report(_get_consumer_applicability_map(applicability_map)):
+            yield report
+
+
+def _encode_continuation(last_consumer_id):
+    """
+    Build the continuation token that identifies the page following the given consumer.
+
+    :param last_consumer_id: The id of the last consumer in the current page
+    :type  last_consumer_id: basestring
+    :return:                 An opaque continuation token
+    :rtype:                  str
+    """
+    return base64.urlsafe_b64encode(last_consumer_id.encode('utf-8'))
+
+
+def _decode_continuation(continuation):
+    """
+    Get the id of the last consumer of the previous page from a continuation token.
+
+    :param continuation: A continuation token returned by _encode_continuation()
+    :type  continuation: basestring
+    :return:             The id of the last consumer in the previous page
+    :rtype:              unicode
+
+    :raises InvalidValue: if the continuation token is not valid
+    """
+    try:
+        return base64.urlsafe_b64decode(str(continuation)).decode('utf-8')
+    except (TypeError, UnicodeError):
+        raise InvalidValue(['continuation'])
+
+
 def _add_consumers_to_applicability_map(consumer_map, applicability_map):
     """
     For all consumers in the consumer_map, look for their profiles and repos in the
@@ -616,7 +1114,7 @@ def _format_report(consumer_applicability_map):
     return report
 
 
-def _get_applicability_map(profile_hashes, content_types):
+def _get_applicability_map(profile_hashes, content_types, repo_ids=None):
     """
     Build an "applicability_map", which is a dictionary that maps tuples of
     (profile_hash, repo_id) to a dictionary of applicability data and consumer_ids. The
@@ -633,25 +1131,32 @@ def _get_applicability_map(profile_hashes, content_types):
                            be included in the applicability data within the
                            applicability_map
     :type  content_types:  list or None
+    :param repo_ids:       If not None, only the applicability data for these repositories is
+                           included in the applicability_map
+    :type  repo_ids:       list or None
     :return:               The applicability map
     :rtype:                dict
     """
-    applicabilities = RepoProfileApplicability.get_collection().find(
-        {'profile_hash': {'$in': profile_hashes}},
-        projection=['profile_hash', 'repo_id', 'applicability'])
+    spec = {'profile_hash': {'$in': profile_hashes}}
+    if repo_ids is not None:
+        spec['repo_id'] = {'$in': repo_ids}
+    projection = ['profile_hash', 'repo_id']
+    if content_types is None:
+        projection.append('applicability')
+    elif not content_types:
+        return {}
+    else:
+        # The caller has requested us to filter by content_type, so only the requested content
+        # types are returned by the database, and applicabilities that don't have data for any
+        # of them are not returned at all
+        spec['$or'] = [{'applicability.%s' % t: {'$exists': True}} for t in content_types]
+        projection.extend('applicability.%s' % t for t in content_types)
+    applicabilities = RepoProfileApplicability.get_collection().find(spec, projection=projection)
     return_value = {}
     for a in applicabilities:
-        if content_types is not None:
-            # The caller has requested us to filter by content_type, so we need to look through
-            # the applicability data and filter out the unwanted content types. Some
-            # applicabilities may end up being empty if they don't have any data for the
-            # requested types, so we'll build a list of those to remove
-            for key in a['applicability'].keys():
-                if key not in content_types:
-                    del a['applicability'][key]
-            # If a doesn't have anything worth reporting, move on to the next applicability
-            if not a['applicability']:
-                continue
+        # If a doesn't have anything worth reporting, move on to the next applicability
+        if content_types is not None and not a.get('applicability'):
+            continue
         return_value[(a['profile_hash'], a['repo_id'])] = {'applicability': a['applicability'],
                                                            'consumers': []}
     return return_value
@@ -1,17 +1,20 @@
 from gettext import gettext as _
+from multiprocessing.pool import ThreadPool
 import itertools
 import logging
 import os
 import re
 import shutil
+import time
 
 from celery import task
+from pymongo import ASCENDING
 
 from pulp.plugins.types import database as content_types_db
 from pulp.plugins.loader import api as plugin_api
 from pulp.plugins.util import misc as plugin_misc
 from pulp.server import config as pulp_config, exceptions as pulp_exceptions
-from pulp.server.async.tasks import Task
+from pulp.server.async.tasks import Task, get_current_task_id
 from pulp.server.controllers import units as units_controller
 from pulp.server.db.model.repository import RepoContentUnit
 from pulp.server.db import model
@@ -20,6 +23,52 @@ from pulp.server.exceptions import MissingResource
 
 _logger = logging.getLogger(__name__)
 
+# The number of orphaned content units that are deleted from the database at once
+ORPHAN_DELETE_BATCH_SIZE = 1000
+# The number of threads that delete the files of orphaned content units
+ORPHAN_FILE_DELETE_THREADS = 8
+
+
+class OrphanDeletionProgress(object):
+    """
+    Reports the number of orphaned content units of a type that have been deleted in the progress
+    report of the current task, under progress_report.delete_orphans.<content type id>, at most
+    once a second.
+    """
+
+    def __init__(self, content_type_id):
+        """
+        :param content_type_id: id of the content type whose orphans are being deleted
+        :type  content_type_id: basestring
+        """
+        self.content_type_id = content_type_id
+        self.task_id = get_current_task_id()
+        self.deleted = 0
+        self.last_report_time = None
+
+    def units_deleted(self, count):
+        """
+        Add to the number of deleted content units, and report it if it was not reported in the
+        last second.
+
+        :param count: the number of content units that were just deleted
+        :type  count: int
+        """
+        self.deleted += count
+        if int(time.time()) != self.last_report_time:
+            self.report()
+
+    def report(self):
+        """
+        Save the number of deleted content units in the progress report of the current task.
+        """
+        self.last_report_time = int(time.time())
+        if self.task_id is None:
+            return
+        key = 'progress_report.delete_orphans.%s' % self.content_type_id
+        model.TaskStatus._get_collection().update_one({'task_id': self.task_id},
+                                                      {'$set': {key: self.deleted}})
+
 
 class OrphanManager(object):
 
@@ -47,6 +96,11 @@ class OrphanManager(object):
         :return: count of orphaned units of the given type
         :rtype: int
         """
+        if RepoContentUnit.get_collection().find_one({'unit_type_id': content_type_id},
+                                                     projection=['_id']) is None:
+            # None of the units are associated, so they are all orphans
+            return content_types_db.type_units_collection(content_type_id).count()
+
         count = 0
         for unit in OrphanManager.generate_orphans_by_type(content_type_id):
             count += 1
@@ -84,6 +138,24 @@ class OrphanManager(object):
                     content_type_id):
                 yield content_unit
 
+    @staticmethod
+    def _generate_associated_unit_ids(content_type_id):
+        """
+        Return a generator of the ids of the content units of the given content type that are
+        associated with at least one repository, in ascending order. An id is repeated once
+        for each repository the unit is associated with.
+
+        :param content_type_id: id of the content type
+        :type content_type_id: basestring
+        :return: generator of sorted unit ids
+        :rtype: generator
+        """
+        associations = RepoContentUnit.get_collection().find(
+            {'unit_type_id': content_type_id},
+            projection={'_id': False, 'unit_id': True}).sort('unit_id', ASCENDING)
+        for association in associations:
+            yield association['unit_id']
+
     @staticmethod
     def generate_orphans_by_type(content_type_id, fields=None):
         """
@@ -91,6 +163,10 @@ class OrphanManager(object):
 
         If fields is not specified, only the `_id` field will be present.
 
+        The content units and the ids of the associated content units are both read in
+        ascending order of id, so the orphans are found by merging the two, without querying
+        the associations of each content unit.
+
         :param content_type_id: id of the content type
         :type content_type_id: basestring
         :param fields: list of fields to include in each content unit
@@ -101,14 +177,18 @@ class OrphanManager(object):
 
         fields = fields if fields is not None else ['_id']
         content_units_collection = content_types_db.type_units_collection(content_type_id)
-        repo_content_units_collection = RepoContentUnit.get_collection()
 
-        for content_unit in content_units_collection.find({}, projection=fields):
+        content_units = content_units_collection.find({}, projection=fields)
+        content_units = content_units.sort('_id', ASCENDING)
+        associated_unit_ids = OrphanManager._generate_associated_unit_ids(content_type_id)
+        associated_unit_id = next(associated_unit_ids, None)
 
-            repo_content_units_cursor = repo_content_units_collection.find(
-                {'unit_id': content_unit['_id']})
+        for content_unit in content_units:
 
-            if repo_content_units_cursor.count() > 0:
+            while associated_unit_id is not None and associated_unit_id < content_unit['_id']:
+                associated_unit_id = next(associated_unit_ids, None)
+
+            if associated_unit_id == content_unit['_id']:
                 continue
 
             yield content_unit
@@ -150,16 +230,111 @@ class OrphanManager(object):
                                  given content type and unit id
         """
 
-        for content_unit in OrphanManager.generate_orphans_by_type(content_type_id):
-
-            if content_unit['_id'] != content_unit_id:
-                continue
+        content_units_collection = content_types_db.type_units_collection(content_type_id)
+        content_unit = content_units_collection.find_one({'_id': content_unit_id},
+                                                         projection=['_id'])
 
-            return content_unit
+        if content_unit is not None:
+            association = RepoContentUnit.get_collection().find_one(
+                {'unit_id': content_unit_id, 'unit_type_id': content_type_id},
+                projection=['_id'])
+            if association is None:
+                return content_unit
 
         raise pulp_exceptions.MissingResource(content_type=content_type_id,
                                               content_unit=content_unit_id)
 
+    @staticmethod
+    def _generate_orphans_by_id(content_type_id, content_unit_ids, fields):
+        """
+        Return a generator of the content units of the given content type and ids that are
+        orphaned.
+
+        :param content_type_id: id of the content type
+        :type content_type_id: basestring
+        :param content_unit_ids: ids of the content units
+        :type content_unit_ids: iterable
+        :param fields: list of fields to include in each content unit
+        :type fields: list
+        :return: generator of orphaned content units
+        :rtype: generator
+        """
+        content_units_collection = content_types_db.type_units_collection(content_type_id)
+        repo_content_units_collection = RepoContentUnit.get_collection()
+
+        for page in plugin_misc.paginate(content_unit_ids, ORPHAN_DELETE_BATCH_SIZE):
+            associated_unit_ids = set(repo_content_units_collection.find(
+                {'unit_id': {'$in': page}, 'unit_type_id': content_type_id},
+                projection=['unit_id']).distinct('unit_id'))
+            orphan_ids = [unit_id for unit_id in page if unit_id not in associated_unit_ids]
+            if not orphan_ids:
+                continue
+            for content_unit in content_units_collection.find({'_id': {'$in': orphan_ids}},
+                                                              projection=fields):
+                yield content_unit
+
+    @staticmethod
+    def _delete_orphans(content_type_id, orphans, delete_units):
+        """
+        Delete orphaned content units in batches of ORPHAN_DELETE_BATCH_SIZE. For each batch, the
+        content units, their lazy catalog entries and the verified checksums of their files are
+        deleted with one query each, and the files of the content units are handed to a pool of
+        threads, which delete them while the next batch is deleted from the database.
+
+        Files in shared storage are deleted by the calling thread, since several content units
+        may share the same content.
+
+        :param content_type_id: id of the content type
+        :type content_type_id: basestring
+        :param orphans: the orphaned content units, as (unit id, storage path) tuples
+        :type orphans: iterable
+        :param delete_units: function that deletes the content units with the ids in the given
+                             list from the database
+        :type delete_units: callable
+        """
+        storage_dir = pulp_config.config.get('server', 'storage_dir')
+        progress = OrphanDeletionProgress(content_type_id)
+        pool = ThreadPool(ORPHAN_FILE_DELETE_THREADS)
+        pending = None
+        try:
+            for batch in plugin_misc.paginate(orphans, ORPHAN_DELETE_BATCH_SIZE):
+                unit_ids = [unit_id for unit_id, storage_path in batch]
+                catalog_entries = model.LazyCatalogEntry.objects(
+                    unit_id__in=unit_ids,
+                    unit_type_id=content_type_id
+                )
+                # Forget the verified checksums of the files of the content units, so that
+                # they are not trusted for other files stored at the same paths later
+                verified_paths = set(catalog_entries.distinct('path'))
+                verified_paths.update(storage_path for unit_id, storage_path in batch
+                                      if storage_path is not None)
+                if verified_paths:
+                    model.VerifiedFile.objects(path__in=list(verified_paths)).delete()
+                catalog_entries.delete()
+                delete_units(unit_ids)
+
+                storage_paths = []
+                for unit_id, storage_path in batch:
+                    if storage_path is None:
+                        continue
+                    if OrphanManager.is_shared(storage_dir, storage_path):
+                        OrphanManager.delete_orphaned_file(storage_path)
+                    else:
+                        storage_paths.append(storage_path)
+
+                # Only one batch of files is deleted at a time, to bound memory use
+                if pending is not None:
+                    pending.get()
+                pending = pool.map_async(OrphanManager.delete_orphaned_file, storage_paths)
+                progress.units_deleted(len(unit_ids))
+
+            if pending is not None:
+                pending.get()
+        finally:
+            pool.close()
+            pool.join()
+        progress.report()
+
     @staticmethod
     def delete_all_orphans():
         """
@@ -214,22 +389,20 @@ class OrphanManager(object):
         """
 
         content_units_collection = content_types_db.type_units_collection(content_type_id)
+        fields = ['_id', '_storage_path']
 
-        for content_unit in OrphanManager.generate_orphans_by_type(content_type_id,
-                                                                   fields=['_id', '_storage_path']):
-
-            if content_unit_ids is not None and content_unit['_id'] not in content_unit_ids:
-                continue
+        if content_unit_ids is not None:
+            content_units = OrphanManager._generate_orphans_by_id(content_type_id,
+                                                                  content_unit_ids, fields)
+        else:
+            content_units = OrphanManager.generate_orphans_by_type(content_type_id, fields=fields)
+        orphans = ((content_unit['_id'], content_unit.get('_storage_path', None))
+                   for content_unit in content_units)
 
-            model.LazyCatalogEntry.objects(
-                unit_id=content_unit['_id'],
-                unit_type_id=content_type_id
-            ).delete()
-            content_units_collection.remove(content_unit['_id'])
+        def delete_units(unit_ids):
+            content_units_collection.remove({'_id': {'$in': unit_ids}})
 
-            storage_path = content_unit.get('_storage_path', None)
-            if storage_path is not None:
-                OrphanManager.delete_orphaned_file(storage_path)
+        OrphanManager._delete_orphans(content_type_id, orphans, delete_units)
 
     @staticmethod
     def delete_orphan_content_units_by_type(type_id, content_unit_ids=None):
@@ -255,30 +428,31 @@ class OrphanManager(object):
         else:
             content_units = content_model.objects.only('id', '_storage_path')
 
-        # Paginate the content units
-        for units_group in plugin_misc.paginate(content_units):
-            # Build the list of ids to search for an easier way to access units in the group by id
-            unit_dict = dict()
-            for unit in units_group:
-                unit_dict[unit.id] = unit
-
-            id_list = list(unit_dict.iterkeys())
-
-            # Clear the units that are currently associated from unit_dict
-            non_orphan = model.RepositoryContentUnit.objects(unit_id__in=id_list)\
-                .distinct('unit_id')
-            for non_orphan_id in non_orphan:
-                unit_dict.pop(non_orphan_id)
-
-            # Remove the unit, lazy catalog entries, and any content in storage.
-            for unit_to_delete in unit_dict.itervalues():
-                model.LazyCatalogEntry.objects(
-                    unit_id=str(unit_to_delete.id),
-                    unit_type_id=str(type_id)
-                ).delete()
-                unit_to_delete.delete()
-                if unit_to_delete._storage_path:
-                    OrphanManager.delete_orphaned_file(unit_to_delete._storage_path)
+        def generate_orphans():
+            # Paginate the content units
+            for units_group in plugin_misc.paginate(content_units):
+                # Build the list of ids to search for an easier way to access units in the group
+                # by id
+                unit_dict = dict()
+                for unit in units_group:
+                    unit_dict[unit.id] = unit
+
+                id_list = list(unit_dict.iterkeys())
+
+                # Clear the units that are currently associated from unit_dict
+                non_orphan = model.RepositoryContentUnit.objects(unit_id__in=id_list)\
+                    .distinct('unit_id')
+                for non_orphan_id in non_orphan:
+                    unit_dict.pop(non_orphan_id)
+
+                for unit in unit_dict.itervalues():
+                    yield str(unit.id), unit._storage_path or None
+
+        def delete_units(unit_ids):
+            content_model.objects(id__in=unit_ids).delete()
+
+        # Remove the units, lazy catalog entries, and any content in storage.
+        OrphanManager._delete_orphans(str(type_id), generate_orphans(), delete_units)
 
     @staticmethod
     def delete_orphaned_file(path):
@@ -311,12 +485,17 @@ class OrphanManager(object):
             path = os.path.dirname(path)
             if root_content_regex.match(path):
                 break
-            contents = os.listdir(path)
-            if contents:
-                break
-            if not os.access(path, os.W_OK):
+            try:
+                contents = os.listdir(path)
+                if contents:
+                    break
+                if not os.access(path, os.W_OK):
+                    break
+                os.rmdir(path)
+            except OSError:
+                # Files are deleted by several threads at once, so another thread may have
+                # removed this directory in the meantime
                 break
-            os.rmdir(path)
 
     @staticmethod
     def is_shared(storage_dir, path):
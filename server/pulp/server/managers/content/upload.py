@@ -236,6 +236,9 @@ class ContentUploadManager(object):
             msg = msg % {'r': repo_id}
             logger.exception(msg)
             raise PulpExecutionException(e), None, sys.exc_info()[2]
+        finally:
+            # Write the fingerprint updates of any units associated before the importer failed
+            repo_controller.flush_content_fingerprints()
 
         # TODO: Add support for tracking the report as a history entry on the repo
 
@@ -79,6 +79,11 @@ class RepoUnitAssociationManager(object):
         @raise InvalidType: if the given owner type is not of the valid enumeration
         """
 
+        # The unit is journaled even if it was already associated, since its metadata may have
+        # changed
+        repo_controller.record_content_changes(repo_id, unit_type_id, [unit_id],
+                                               model.RepositoryContentChange.ACTION_ADDED)
+
         # If the association already exists, no need to do anything else
         spec = {'repo_id': repo_id,
                 'unit_id': unit_id,
@@ -95,6 +100,7 @@ class RepoUnitAssociationManager(object):
         # Create the database entry
         association = RepoContentUnit(repo_id, unit_id, unit_type_id)
         RepoContentUnit.get_collection().save(association)
+        repo_controller.update_content_fingerprint(repo_id, unit_type_id, [unit_id])
 
         # update the count and times of associated units on the repo object
         if update_repo_metadata and not similar_exists:
@@ -285,6 +291,9 @@ class RepoUnitAssociationManager(object):
             msg_dict = {'i': dest_repo_importer.importer_type_id, 'r': dest_repo_id}
             logger.exception(msg % msg_dict)
             raise exceptions.PulpExecutionException(), None, sys.exc_info()[2]
+        finally:
+            # Write the fingerprint updates of any units associated before the importer failed
+            repo_controller.flush_content_fingerprints()
 
     def unassociate_unit_by_id(self, repo_id, unit_type_id, unit_id, notify_plugins=True):
         """
@@ -384,7 +393,11 @@ class RepoUnitAssociationManager(object):
                     'unit_type_id': unit_type_id,
                     'unit_id': {'$in': unit_ids}
                     }
+            associated_ids = [a['unit_id'] for a in collection.find(spec, projection=['unit_id'])]
             collection.remove(spec)
+            repo_controller.update_content_fingerprint(repo_id, unit_type_id, associated_ids)
+            repo_controller.record_content_changes(repo_id, unit_type_id, unit_ids,
+                                                   model.RepositoryContentChange.ACTION_REMOVED)
 
             unique_count = sum(
                 1 for unit_id in unit_ids if not RepoUnitAssociationManager.association_exists(
@@ -3,13 +3,15 @@ This module contains utility code to be used by pulp.server.
 """
 from contextlib import contextmanager
 from gettext import gettext as _
+from multiprocessing.pool import ThreadPool
 import hashlib
 import logging
 import os
-from shutil import copy, Error
+from shutil import copy, copymode, Error
 
 from pulp.common import error_codes
 
+from pulp.server.compat import sendfile
 from pulp.server.exceptions import PulpCodedException, PulpExecutionException
 
 
@@ -19,6 +21,12 @@ _logger = logging.getLogger(__name__)
 # Number of bytes to read into RAM at a time when validating the checksum
 CHECKSUM_CHUNK_SIZE = 8 * 1024 * 1024
 
+# Number of files copied at once by parallel_copytree
+COPY_THREADS = 8
+
+# Number of bytes copied by each sendfile call
+SENDFILE_CHUNK_SIZE = 64 * 1024 * 1024
+
 # Constants to pass in as the checksum type in verify_checksum
 TYPE_MD5 = hashlib.md5().name
 TYPE_SHA = 'sha'
@@ -272,6 +280,105 @@ def copytree(src, dst, symlinks=False, ignore=None):
         raise Error(errors)
 
 
+def copy_file(src, dst):
+    """
+    Copy the contents and permission bits of the file at src to dst, like shutil.copy. When
+    sendfile is available, the data is copied by the kernel rather than read into python.
+
+    :param src: Path to the source file
+    :type  src: basestring
+    :param dst: Path to the destination file, which is overwritten if it exists
+    :type  dst: basestring
+    """
+    if sendfile is None:
+        copy(src, dst)
+        return
+
+    with open(src, 'rb') as src_file:
+        with open(dst, 'wb') as dst_file:
+            offset = 0
+            while True:
+                sent = sendfile(dst_file.fileno(), src_file.fileno(), offset,
+                                SENDFILE_CHUNK_SIZE)
+                if sent == 0:
+                    break
+                offset += sent
+    copymode(src, dst)
+
+
+def parallel_copytree(src, dst, symlinks=False, threads=COPY_THREADS, progress_callback=None):
+    """
+    Copies src tree to dst, like copytree, but copies the files on a pool of threads.
+
+    The directories and symlinks are created first; the files are then copied with copy_file,
+    without their attributes.
+
+    After 100 errors, this function gives up and raises shutil.Error
+
+    :param src: Source directory rooted at src
+    :type  src: basestring
+    :param dst: Destination directory, a new directory and any parent directories are created if
+                any are missing
+    :type  dst: basestring
+    :param symlinks: If true, symlinks are copied as symlinks. If false, the contents of symlinks
+                     are copied to the new tree.
+    :type  symlinks: boolean
+    :param threads: The number of files copied at once
+    :type  threads: int
+    :param progress_callback: Called with the number of files copied and the total number of
+                              files after each file is copied
+    :type  progress_callback: callable
+
+    :raises shutil.Error:   If there are one or more errors copying files. After 100 errors, the
+                            operation aborts and raises this exception with those errors.
+    """
+    errors = []
+    files = []
+    directories = [(src, dst)]
+    while directories and len(errors) < 100:
+        src_dir, dst_dir = directories.pop()
+        try:
+            os.makedirs(dst_dir)
+            names = os.listdir(src_dir)
+        except (IOError, os.error) as why:
+            errors.append((src_dir, dst_dir, str(why)))
+            continue
+        for name in names:
+            srcname = os.path.join(src_dir, name)
+            dstname = os.path.join(dst_dir, name)
+            try:
+                if symlinks and os.path.islink(srcname):
+                    os.symlink(os.readlink(srcname), dstname)
+                elif os.path.isdir(srcname):
+                    directories.append((srcname, dstname))
+                else:
+                    files.append((srcname, dstname))
+            except (IOError, os.error) as why:
+                errors.append((srcname, dstname, str(why)))
+
+    def copy_one(names):
+        try:
+            copy_file(*names)
+        except (IOError, os.error) as why:
+            return names + (str(why),)
+
+    if files and len(errors) < 100:
+        pool = ThreadPool(threads)
+        try:
+            for copied, error in enumerate(pool.imap_unordered(copy_one, files), 1):
+                if error is not None:
+                    errors.append(error)
+                    if len(errors) >= 100:
+                        break
+                if progress_callback is not None:
+                    progress_callback(copied, len(files))
+        finally:
+            pool.terminate()
+            pool.join()
+    if errors:
+        raise Error(errors)
+
+
 @contextmanager
 def deleting(path):
     """
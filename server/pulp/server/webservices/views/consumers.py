@@ -14,8 +14,9 @@ from pulp.server.managers import factory
 from pulp.server.managers.consumer import bind
 from pulp.server.managers.consumer import profile
 from pulp.server.managers.consumer import query as query_manager
-from pulp.server.managers.consumer.applicability import (regenerate_applicability_for_consumers,
-                                                         retrieve_consumer_applicability)
+from pulp.server.managers.consumer.applicability import (
+    APPLICABILITY_REPORT_PAGE_SIZE, regenerate_applicability_for_consumers,
+    retrieve_consumer_applicability, retrieve_consumer_applicability_page)
 from pulp.server.managers.schedule.consumer import (UNIT_INSTALL_ACTION, UNIT_UNINSTALL_ACTION,
                                                     UNIT_UPDATE_ACTION)
 from pulp.server.webservices.views import search
@@ -25,6 +26,7 @@ from pulp.server.webservices.views.util import (_ensure_input_encoding,
                                                 generate_json_response,
                                                 generate_json_response_with_pulp_encoder,
                                                 generate_redirect_response,
+                                                generate_streaming_json_response,
                                                 parse_json_body)
 
 
@@ -812,7 +814,9 @@ class ConsumerContentApplicabilityView(View):
         Query content applicability for a given consumer criteria query.
 
         body {criteria: <object>,
-              content_types: <array>[optional]}
+              content_types: <array>[optional],
+              page_size: <int>[optional],
+              continuation: <str>[optional]}
 
         This method returns a JSON document containing an array of objects that each have two
         keys: 'consumers', and 'applicability'. 'consumers' will index an array of consumer_ids,
@@ -825,6 +829,11 @@ class ConsumerContentApplicabilityView(View):
          {'consumers': ['consumer_2', 'consumer_3'],
           'applicability': {'content_type_1': ['unit_1', 'unit_2']}}]
 
+        If page_size or continuation is given, the applicability of one page of consumers is
+        streamed instead, as a JSON object with two keys: 'applicability', which indexes an array
+        of the objects described above, and 'continuation', which indexes the token to pass to
+        retrieve the next page, or null if this is the last page.
+
         :param request: WSGI request object
         :type request: django.core.handlers.wsgi.WSGIRequest
 
@@ -838,9 +847,17 @@ class ConsumerContentApplicabilityView(View):
         try:
             consumer_criteria = self._get_consumer_criteria(request)
             content_types = self._get_content_types(request)
+            page_size, continuation = self._get_page(request)
+            if page_size is not None:
+                reports, next_continuation = retrieve_consumer_applicability_page(
+                    consumer_criteria, content_types, page_size, continuation)
         except InvalidValue, e:
             return HttpResponseBadRequest(str(e))
 
+        if page_size is not None:
+            return generate_streaming_json_response(reports, 'applicability',
+                                                    {'continuation': next_continuation})
+
         response = retrieve_consumer_applicability(consumer_criteria, content_types)
         return generate_json_response_with_pulp_encoder(response)
 
@@ -890,6 +907,36 @@ class ConsumerContentApplicabilityView(View):
 
         return content_types
 
+    def _get_page(self, request):
+        """
+        Get the page size and continuation token the caller wishes to page the response with. If
+        the caller included neither, the response is not paged and the page size is None.
+
+        :param request: WSGI request object
+        :type request: django.core.handlers.wsgi.WSGIRequest
+
+        :raises InvalidValue: if some parameters were invalid
+
+        :return: A 2-tuple of the page size and the continuation token
+        :rtype:  tuple
+        """
+
+        body = request.body_as_json
+
+        page_size = body.get('page_size', None)
+        continuation = body.get('continuation', None)
+        if page_size is None and continuation is None:
+            return None, None
+
+        if page_size is None:
+            page_size = APPLICABILITY_REPORT_PAGE_SIZE
+        elif isinstance(page_size, bool) or not isinstance(page_size, int) or page_size < 1:
+            raise InvalidValue('page_size must be a positive integer.')
+        if continuation is not None and not isinstance(continuation, basestring):
+            raise InvalidValue('continuation must be a string.')
+
+        return page_size, continuation
+
 
 class ConsumerContentApplicRegenerationView(View):
     """
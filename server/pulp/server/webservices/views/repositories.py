@@ -895,6 +895,7 @@ class ContentApplicabilityRegenerationView(View):
 
         repo_criteria_body = request.body_as_json.get('repo_criteria', None)
         parallel = request.body_as_json.get('parallel', False)
+        incremental = request.body_as_json.get('incremental', False)
 
         if repo_criteria_body is None:
             raise exceptions.MissingValue('repo_criteria')
@@ -905,9 +906,15 @@ class ContentApplicabilityRegenerationView(View):
             invalid_criteria.add_child_exception(e)
             raise invalid_criteria
 
+        if type(incremental) is not bool:
+            raise exceptions.InvalidValue('incremental')
+
         if parallel:
             if type(parallel) is not bool:
                 raise exceptions.InvalidValue('parallel')
+            if incremental:
+                # Parallel regeneration always recalculates the applicability data in full
+                raise exceptions.InvalidValue('incremental')
 
             async_result = ApplicabilityRegenerationManager.\
                 queue_regenerate_applicability_for_repos(repo_criteria.as_dict())
@@ -919,7 +926,7 @@ class ContentApplicabilityRegenerationView(View):
         regeneration_tag = tags.action_tag('content_applicability_regeneration')
         async_result = regenerate_applicability_for_repos.apply_async_with_reservation(
             tags.RESOURCE_REPOSITORY_PROFILE_APPLICABILITY_TYPE, tags.RESOURCE_ANY_ID,
-            (repo_criteria.as_dict(),), tags=[regeneration_tag])
+            (repo_criteria.as_dict(),), {'incremental': incremental}, tags=[regeneration_tag])
         raise exceptions.OperationPostponed(async_result)
 
 
@@ -359,7 +359,7 @@ class Repository(ModelSerializer):
         """
         Contains information that the base serializer needs to properly handle a Repository object.
         """
-        exclude_fields = []
+        exclude_fields = ['content_fingerprint']
         remapped_fields = {'repo_id': 'id', 'id': '_id'}
 
     def get_href(self, instance):
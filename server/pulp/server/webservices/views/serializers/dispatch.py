@@ -1,6 +1,12 @@
 from pulp.server.webservices.views.serializers.link import link_obj
 
 
+# The attributes of a TaskStatus that are included in its serialized form
+TASK_STATUS_ATTRIBUTES = ('task_id', 'worker_name', 'tags', 'state', 'error', 'spawned_tasks',
+                          'progress_report', 'task_type', 'start_time', 'finish_time', 'result',
+                          'exception', 'traceback', '_ns')
+
+
 def task_result_href(task):
     if task.get('task_id'):
         return {'_href': '/pulp/api/v2/tasks/%s/' % task['task_id']}
@@ -36,10 +42,7 @@ def task_status(task):
     :rtype:  dict
     """
     task_dict = {}
-    attributes = ['task_id', 'worker_name', 'tags', 'state', 'error', 'spawned_tasks',
-                  'progress_report', 'task_type', 'start_time', 'finish_time', 'result',
-                  'exception', 'traceback', '_ns']
-    for attribute in attributes:
+    for attribute in TASK_STATUS_ATTRIBUTES:
         task_dict[attribute] = task[attribute]
 
     # This is to preserve backward compatibility for semantic versioning.
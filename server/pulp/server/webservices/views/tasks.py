@@ -3,12 +3,14 @@ This module contains views related to Pulp's task system models.
 """
 from datetime import datetime
 
+from bson import ObjectId
+from bson.errors import InvalidId
 from django.views.generic import View
 from django.http import HttpResponse
 from mongoengine.queryset import DoesNotExist
 
-from pulp.common import error_codes
-from pulp.common.constants import CALL_CANCELED_STATE, CALL_COMPLETE_STATES
+from pulp.common import dateutils, error_codes
+from pulp.common.constants import CALL_CANCELED_STATE, CALL_COMPLETE_STATES, CALL_STATES
 from pulp.server import exceptions as pulp_exceptions
 from pulp.server.async import tasks
 from pulp.server.auth import authorization
@@ -18,12 +20,25 @@ from pulp.server.webservices.views import search
 from pulp.server.webservices.views.decorators import auth_required
 from pulp.server.webservices.views.serializers import dispatch as serial_dispatch
 from pulp.server.webservices.views.util import (generate_json_response,
-                                                generate_json_response_with_pulp_encoder)
+                                                generate_json_response_with_pulp_encoder,
+                                                generate_streaming_json_response)
 
 
 # This constant set is used for deleting the completed tasks from the collection.
 VALID_STATES = set(filter(lambda state: state != CALL_CANCELED_STATE, CALL_COMPLETE_STATES))
 
+# The number of tasks in a page of the task list when only a continuation is given, and the
+# largest page that may be requested
+TASK_LIST_PAGE_SIZE = 1000
+
+# The GET parameters that filter the task list on a time range, and the queries they build
+TASK_LIST_TIME_FILTERS = {
+    'started_after': 'start_time__gte',
+    'started_before': 'start_time__lte',
+    'finished_after': 'finish_time__gte',
+    'finished_before': 'finish_time__lte',
+}
+
 
 def task_serializer(task):
     """
@@ -57,22 +72,160 @@ class TaskCollectionView(View):
     @auth_required(authorization.READ)
     def get(self, request):
         """
-        Return a response containing a list of all tasks or a response containing
-        a list of tasks filtered by the optional GET parameter 'tags'.
+        Return a response containing a list of all tasks, or of the tasks matching the optional
+        GET parameters 'tag', 'state', 'started_after', 'started_before', 'finished_after' and
+        'finished_before'. If the GET parameter 'field' is given, the tasks only include the
+        given fields, their task_id and their _href.
+
+        If the GET parameter 'limit' or 'continuation' is given, a page of tasks is returned in
+        the order the tasks were created. The response is then a JSON object with two keys:
+        'tasks', which indexes the list of tasks, and 'continuation', which indexes the value to
+        pass as 'continuation' to get the next page, or None if this is the last page.
+
+        The tasks are serialized one at a time as the response is streamed.
 
         :param request: WSGI request object
         :type  request: django.core.handlers.wsgi.WSGIRequest
 
         :return: Response containing a serialized list of dicts, one for each task
-        :rtype:  django.http.HttpResponse
+        :rtype:  django.http.StreamingHttpResponse
+
+        :raises InvalidValue: if some parameters are invalid
+        """
+        filters = self._get_filters(request)
+        fields = self._get_fields(request)
+        limit, continuation = self._get_page(request)
+        if continuation is not None:
+            filters['id__gt'] = continuation
+
+        raw_tasks = TaskStatus.objects(group_id=None, **filters)
+        if fields:
+            raw_tasks = raw_tasks.only(*fields)
+        if limit is None:
+            return generate_streaming_json_response(self._serialize(raw_tasks, fields), None)
+
+        # Get one more task than requested to know whether there is a next page
+        page = list(raw_tasks.order_by('id').limit(limit + 1))
+        next_continuation = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_continuation = str(page[-1].id)
+        return generate_streaming_json_response(self._serialize(page, fields), 'tasks',
+                                                {'continuation': next_continuation})
+
+    @staticmethod
+    def _get_filters(request):
         """
+        Build the query that filters the task list from the GET parameters of a request.
+
+        :param request: WSGI request object
+        :type  request: django.core.handlers.wsgi.WSGIRequest
+
+        :return: keyword arguments to query TaskStatus objects with
+        :rtype:  dict
+
+        :raises InvalidValue: if a state or time is not valid
+        """
+        filters = {}
         tags = request.GET.getlist('tag')
         if tags:
-            raw_tasks = TaskStatus.objects(tags__all=tags, group_id=None)
+            filters['tags__all'] = tags
+
+        states = request.GET.getlist('state')
+        if states:
+            if not set(states).issubset(CALL_STATES):
+                raise pulp_exceptions.InvalidValue(['state'])
+            filters['state__in'] = states
+
+        for param, query in TASK_LIST_TIME_FILTERS.iteritems():
+            value = request.GET.get(param)
+            if value is None:
+                continue
+            try:
+                time = dateutils.parse_iso8601_datetime_or_date(value)
+            except ValueError:
+                raise pulp_exceptions.InvalidValue([param])
+            # Task times are stored as UTC ISO8601 strings, which sort in chronological order
+            time = dateutils.to_utc_datetime(time, no_tz_equals_local_tz=False)
+            filters[query] = dateutils.format_iso8601_datetime(time)
+        return filters
+
+    @staticmethod
+    def _get_fields(request):
+        """
+        Get the fields the caller wishes the tasks to be limited to.
+
+        :param request: WSGI request object
+        :type  request: django.core.handlers.wsgi.WSGIRequest
+
+        :return: the fields to include, including task_id, or None to include all of them
+        :rtype:  set or None
+
+        :raises InvalidValue: if a field is not a task attribute
+        """
+        fields = request.GET.getlist('field')
+        if not fields:
+            return None
+        if not set(fields).issubset(serial_dispatch.TASK_STATUS_ATTRIBUTES):
+            raise pulp_exceptions.InvalidValue(['field'])
+        return set(fields) | set(['task_id'])
+
+    @staticmethod
+    def _get_page(request):
+        """
+        Get the page size and continuation the caller wishes to page the task list with. If the
+        caller included neither, the list is not paged and the page size is None. A larger limit
+        than TASK_LIST_PAGE_SIZE is reduced to it, so that a page is always bounded.
+
+        :param request: WSGI request object
+        :type  request: django.core.handlers.wsgi.WSGIRequest
+
+        :return: A 2-tuple of the page size and the ID of the last task of the previous page
+        :rtype:  tuple
+
+        :raises InvalidValue: if the limit or continuation is not valid
+        """
+        limit = request.GET.get('limit')
+        continuation = request.GET.get('continuation')
+        if limit is None and continuation is None:
+            return None, None
+
+        if limit is None:
+            limit = TASK_LIST_PAGE_SIZE
         else:
-            raw_tasks = TaskStatus.objects(group_id=None)
-        serialized_task_statuses = [task_serializer(task) for task in raw_tasks]
-        return generate_json_response_with_pulp_encoder(serialized_task_statuses)
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise pulp_exceptions.InvalidValue(['limit'])
+            if limit < 1:
+                raise pulp_exceptions.InvalidValue(['limit'])
+            limit = min(limit, TASK_LIST_PAGE_SIZE)
+        if continuation is not None:
+            try:
+                continuation = ObjectId(continuation)
+            except (InvalidId, TypeError):
+                raise pulp_exceptions.InvalidValue(['continuation'])
+        return limit, continuation
+
+    @staticmethod
+    def _serialize(raw_tasks, fields):
+        """
+        Serialize tasks one at a time.
+
+        :param raw_tasks: The tasks from the database
+        :type  raw_tasks: iterable of pulp.server.db.model.TaskStatus
+        :param fields:    The fields to include in addition to _href, or None to include all
+        :type  fields:    set or None
+
+        :return: A generator of serialized tasks
+        :rtype:  generator of dict
+        """
+        for task in raw_tasks:
+            task = task_serializer(task)
+            if fields:
+                task = dict((key, value) for key, value in task.iteritems()
+                            if key in fields or key == '_href')
+            yield task
 
     @auth_required(authorization.DELETE)
     def delete(self, request):
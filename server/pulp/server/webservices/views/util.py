@@ -6,7 +6,7 @@ import httplib
 import json
 import sys
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.encoding import iri_to_uri
 
 from pulp.common import dateutils, error_codes
@@ -65,6 +65,46 @@ generate_json_response_with_pulp_encoder = functools.partial(
 )
 
 
+def generate_streaming_json_response(items, items_key, extra=None, default=pulp_json_encoder,
+                                     content_type='application/json; charset=utf-8'):
+    """
+    Serialize the items of an iterable one at a time and stream them to the client as an array
+    inside a JSON object, so that the whole response never has to be held in memory.
+
+    :param items        : items to be serialized as a JSON array
+    :type  items        : iterable of objects that are serializable by json.dumps
+    :param items_key    : key of the JSON object that indexes the array of items, or None to
+                          stream the array by itself
+    :type  items_key    : str or None
+    :param extra        : other keys and values to include in the JSON object after the items;
+                          not used if items_key is None
+    :type  extra        : dict or None
+    :param default      : function used by json.dumps to serialize content (also called default)
+    :type  default      : function or None
+    :param content_type : type of returned content
+    :type  content_type : str
+
+    :return             : response that streams the serialized content
+    :rtype              : django.http.StreamingHttpResponse
+    """
+    def stream():
+        if items_key is not None:
+            yield '{%s: ' % json.dumps(items_key)
+        yield '['
+        for i, item in enumerate(items):
+            if i:
+                yield ', '
+            yield json.dumps(item, default=default)
+        yield ']'
+        if items_key is None:
+            return
+        for key, value in (extra or {}).items():
+            yield ', %s: %s' % (json.dumps(key), json.dumps(value, default=default))
+        yield '}'
+
+    return StreamingHttpResponse(stream(), content_type=content_type)
+
+
 def generate_redirect_response(response, href):
     response['Location'] = iri_to_uri(href)
     response.status_code = httplib.CREATED
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from mock import Mock
+
+from pulp.plugins.profiler import Profiler
+
+
+class TestCalculateApplicableUnitsBatch(TestCase):
+    """
+    This class contains tests for pulp.plugins.profiler.Profiler.calculate_applicable_units_batch().
+    """
+    def test_calls_calculate_applicable_units_per_profile(self):
+        """
+        Test that the default implementation delegates to calculate_applicable_units().
+        """
+        profiler = Profiler()
+        profiler.calculate_applicable_units = Mock(side_effect=lambda p, r, c, x: {'rpm': p})
+        config = Mock()
+        conduit = Mock()
+
+        applicability = profiler.calculate_applicable_units_batch(
+            {'hash-1': ['a'], 'hash-2': ['b']}, 'repo-1', config, conduit)
+
+        self.assertEqual(applicability, {'hash-1': {'rpm': ['a']}, 'hash-2': {'rpm': ['b']}})
+        self.assertEqual(profiler.calculate_applicable_units.call_count, 2)
+        profiler.calculate_applicable_units.assert_any_call(['a'], 'repo-1', config, conduit)
+
+    def test_not_implemented(self):
+        """
+        Test that profilers without applicability support raise NotImplementedError.
+        """
+        profiler = Profiler()
+
+        self.assertRaises(NotImplementedError, profiler.calculate_applicable_units_batch,
+                          {'hash-1': ['a']}, 'repo-1', Mock(), Mock())
+
+
+class TestCalculateApplicableUnitsDelta(TestCase):
+    """
+    This class contains tests for pulp.plugins.profiler.Profiler.calculate_applicable_units_delta().
+    """
+    def test_not_implemented(self):
+        """
+        Test that incremental applicability is not supported by default.
+        """
+        profiler = Profiler()
+
+        self.assertRaises(NotImplementedError, profiler.calculate_applicable_units_delta,
+                          {'hash-1': ['a']}, 'repo-1', {'rpm': ['unit-1']}, Mock(), Mock())
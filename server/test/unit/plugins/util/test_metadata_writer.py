@@ -1,5 +1,6 @@
 import gzip
 import hashlib
+import json
 import unittest
 import os
 import tempfile
@@ -13,7 +14,7 @@ from pulp.common.error_codes import PLP1005
 from pulp.devel.unit.server.util import assert_validation_exception
 from pulp.plugins.util.metadata_writer import MetadataFileContext, JSONArrayFileContext
 from pulp.plugins.util.metadata_writer import XmlFileContext
-from pulp.plugins.util.metadata_writer import FastForwardXmlFileContext
+from pulp.plugins.util.metadata_writer import FastForwardXmlFileContext, OFFSET_INDEX_DIR
 from pulp.server.util import TYPE_SHA1
 
 
@@ -247,6 +248,48 @@ class MetadataWriterTests(unittest.TestCase):
                                                    expected_metadata_file_name)
         self.assertEquals(expected_metadata_file_path, context.metadata_file_path)
 
+    @patch('pulp.plugins.util.metadata_writer.MetadataFileContext._checksum_file')
+    def test_finalize_checksums_while_writing(self, mock_checksum_file):
+        path = os.path.join(self.metadata_file_dir, 'test.xml.gz')
+        context = MetadataFileContext(path, TYPE_SHA1, checksum_uncompressed=True)
+
+        context.initialize()
+        context.metadata_file_handle.write('<metadata/>')
+        context.finalize()
+
+        self.assertFalse(mock_checksum_file.called)
+        with open(context.metadata_file_path, 'rb') as file_handle:
+            content = file_handle.read()
+        self.assertEqual(context.checksum, hashlib.sha1(content).hexdigest())
+        self.assertEqual(context.size, len(content))
+        self.assertEqual(context.uncompressed_checksum, hashlib.sha1('<metadata/>').hexdigest())
+        self.assertEqual(context.uncompressed_size, len('<metadata/>'))
+        self.assertEqual(gzip.open(context.metadata_file_path).read(), '<metadata/>')
+
+    def test_finalize_checksums_uncompressed_file(self):
+        path = os.path.join(self.metadata_file_dir, 'test.xml')
+        context = MetadataFileContext(path, TYPE_SHA1, checksum_uncompressed=True)
+
+        context.initialize()
+        context.metadata_file_handle.write('<metadata/>')
+        context.finalize()
+
+        self.assertEqual(context.checksum, hashlib.sha1('<metadata/>').hexdigest())
+        self.assertEqual(context.size, len('<metadata/>'))
+        self.assertEqual(context.uncompressed_checksum, context.checksum)
+        self.assertEqual(context.uncompressed_size, context.size)
+
+    def test_finalize_checksums_external_handle(self):
+        path = os.path.join(self.metadata_file_dir, 'test.xml')
+        context = MetadataFileContext(path, TYPE_SHA1)
+
+        context.metadata_file_handle = open(path, 'w')
+        context.metadata_file_handle.write('<metadata/>')
+        context.finalize()
+
+        self.assertEqual(context.checksum, hashlib.sha1('<metadata/>').hexdigest())
+        self.assertEqual(context.size, len('<metadata/>'))
+
     @patch('pulp.plugins.util.metadata_writer._LOG.exception')
     def test_finalize_error_on_footer(self, mock_logger):
 
@@ -368,12 +411,18 @@ class FastForwardXmlFileContextTests(unittest.TestCase):
 
     def setUp(self):
         self.working_dir = tempfile.mkdtemp()
+        self.server_working_dir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.server_working_dir, OFFSET_INDEX_DIR)
         self.metadata_dir = os.path.join(DATA_DIR, 'metadata')
         self.tag = 'metadata'
         self.attributes = {'packages': '30'}
+        config_patcher = patch('pulp.plugins.util.metadata_writer.pulp_config.config')
+        self.addCleanup(config_patcher.stop)
+        config_patcher.start().get.return_value = self.server_working_dir
 
     def tearDown(self):
         shutil.rmtree(self.working_dir)
+        shutil.rmtree(self.server_working_dir)
 
     @patch('pulp.plugins.util.metadata_writer.XMLGenerator')
     def test_open_metadata_file_handle_non_existent_file(self, mock_generator):
@@ -581,3 +630,116 @@ class FastForwardXmlFileContextTests(unittest.TestCase):
         context._open_metadata_file_handle()
         context._close_metadata_file_handle()
         self.assertTrue(context._is_closed(context.metadata_file_handle))
+
+    def _publish(self, path, packages, **kwargs):
+        context = FastForwardXmlFileContext(path, self.tag, 'package',
+                                            {'packages': str(len(packages))}, **kwargs)
+        context.initialize()
+        for package in packages:
+            context.metadata_file_handle.write('<package>%s</package>' % package)
+        context.finalize()
+        return context
+
+    def test_finalize_writes_offset_index(self):
+        path = os.path.join(self.working_dir, 'test.xml')
+
+        self._publish(path, ['foo'])
+
+        with open(path) as test_file:
+            content = test_file.read()
+        index_path = os.path.join(self.index_dir, 'path-%s' % hashlib.sha256(path).hexdigest())
+        with open(index_path) as index_file:
+            offset_index = json.load(index_file)
+        self.assertEqual(offset_index['file_name'], 'test.xml')
+        self.assertEqual(offset_index['file_path'], path)
+        self.assertEqual(offset_index['size'], len(content))
+        self.assertEqual(offset_index['mtime'], os.stat(path).st_mtime)
+        self.assertEqual(
+            content[offset_index['content_start']:offset_index['content_end']],
+            '<package>foo</package>')
+        # the index is not written next to the file, which may be published
+        self.assertEqual(os.listdir(self.working_dir), ['test.xml'])
+
+    @patch('pulp.plugins.util.metadata_writer.COPY_BUFFER_SIZE', new=8)
+    def test_fast_forward_with_offset_index(self):
+        path = os.path.join(self.working_dir, 'test.xml')
+        self._publish(path, ['foo'])
+
+        context = self._publish(path, ['bar'])
+
+        self.assertNotEqual(context.offset_index, None)
+        with open(path) as test_file:
+            self.assertEqual(
+                test_file.read(),
+                '<?xml version="1.0" encoding="UTF-8"?>\n<metadata packages="1">'
+                '<package>foo</package><package>bar</package></metadata>')
+
+    @patch('pulp.plugins.util.metadata_writer.COPY_BUFFER_SIZE', new=8)
+    def test_fast_forward_with_offset_index_gzip(self):
+        path = os.path.join(self.working_dir, 'test.xml.gz')
+        self._publish(path, ['foo'], checksum_type=TYPE_SHA1)
+
+        context = self._publish(path, ['bar'], checksum_type=TYPE_SHA1,
+                                checksum_uncompressed=True)
+
+        self.assertNotEqual(context.offset_index, None)
+        expected = ('<?xml version="1.0" encoding="UTF-8"?>\n<metadata packages="1">'
+                    '<package>foo</package><package>bar</package></metadata>')
+        self.assertEqual(gzip.open(context.metadata_file_path).read(), expected)
+        self.assertEqual(context.uncompressed_checksum, hashlib.sha1(expected).hexdigest())
+        self.assertEqual(context.uncompressed_size, len(expected))
+        # only the new file and its offset index remain
+        self.assertEqual(os.listdir(self.working_dir),
+                         [os.path.basename(context.metadata_file_path)])
+        self.assertEqual(os.listdir(self.index_dir), ['%s-%s' % (TYPE_SHA1, context.checksum)])
+
+    @patch('pulp.plugins.util.metadata_writer.MetadataFileContext._checksum_file')
+    def test_fast_forward_does_not_read_file_for_offset_index(self, mock_checksum_file):
+        """
+        The offset index is found and written without reading the existing or the new file.
+        """
+        for checksum_type in (None, TYPE_SHA1):
+            path = os.path.join(self.working_dir, 'test-%s.xml' % checksum_type)
+            self._publish(path, ['foo'], checksum_type=checksum_type)
+
+            context = self._publish(path, ['bar'], checksum_type=checksum_type)
+
+            self.assertNotEqual(context.offset_index, None)
+        self.assertFalse(mock_checksum_file.called)
+
+    def test_fast_forward_ignores_offset_index_of_other_content(self):
+        """
+        An index is not used for a file of the same name and size that was rewritten.
+        """
+        path = os.path.join(self.working_dir, 'test.xml')
+        self._publish(path, ['foo'])
+        with open(path) as test_file:
+            content = test_file.read()
+        mtime = os.stat(path).st_mtime
+        with open(path, 'w') as test_file:
+            test_file.write(content.replace('foo', 'baz'))
+        os.utime(path, (mtime + 10, mtime + 10))
+
+        context = self._publish(path, ['bar'])
+
+        self.assertEqual(context.offset_index, None)
+        with open(path) as test_file:
+            self.assertEqual(
+                test_file.read(),
+                '<?xml version="1.0" encoding="UTF-8"?>\n<metadata packages="1">'
+                '<package>baz</package><package>bar</package></metadata>')
+
+    def test_fast_forward_ignores_stale_offset_index(self):
+        path = os.path.join(self.working_dir, 'test.xml')
+        context = self._publish(path, ['foo'])
+        with open(path, 'a') as test_file:
+            test_file.write('\n')
+
+        context = self._publish(path, ['bar'])
+
+        self.assertEqual(context.offset_index, None)
+        with open(path) as test_file:
+            self.assertEqual(
+                test_file.read(),
+                '<?xml version="1.0" encoding="UTF-8"?>\n<metadata packages="1">'
+                '<package>foo</package><package>bar</package></metadata>')
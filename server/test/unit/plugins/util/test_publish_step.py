@@ -1,9 +1,11 @@
 import contextlib
+import errno
 import os
 import shutil
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 import traceback
 import unittest
@@ -21,6 +23,7 @@ from pulp.plugins.config import PluginCallConfiguration
 from pulp.plugins.model import Repository, SyncReport, Unit
 from pulp.plugins.util import publish_step
 from pulp.server.db import model
+from pulp.server.exceptions import PulpCodedTaskFailedException
 from pulp.server.managers import factory
 
 factory.initialize()
@@ -128,26 +131,29 @@ class TestUnitModelPluginStep(PluginBase):
 
         self.assertEqual(list(ret), [u1, u2, u3])
 
+    @patch('pulp.server.controllers.repository.get_unit_model_querysets')
+    def test_querysets_batch_size(self, mock_get_querysets):
+        qs1 = MagicMock()
+        qs2 = MagicMock()
+        mock_get_querysets.side_effect = [[qs1], [qs2]]
+        self.step.batch_size = 100
 
-class PostOrderTests(unittest.TestCase):
+        ret = self.step.unit_querysets
 
-    def test_ordered_output(self):
-        class Node:
-            def __init__(self, value):
-                self.value = value
-                self.children = []
+        qs1.batch_size.assert_called_once_with(100)
+        qs2.batch_size.assert_called_once_with(100)
+        self.assertEqual(ret, [qs1.batch_size.return_value, qs2.batch_size.return_value])
 
-        n1 = Node(1)
-        n2 = Node(2)
-        n3 = Node(3)
-        n4 = Node(4)
-        n5 = Node(5)
+    def test_get_batch_iterator(self):
+        u1 = MagicMock()
+        u2 = MagicMock()
+        u3 = MagicMock()
+        self.step._unit_querysets = [[u1, u2], [u3]]
+        self.step.batch_size = 2
 
-        n5.children = [n1, n4]
-        n4.children = [n2, n3]
+        ret = self.step.get_batch_iterator()
 
-        value_list = [n.value for n in publish_step._post_order(n5)]
-        self.assertEquals(value_list, [1, 2, 3, 4, 5])
+        self.assertEqual(list(ret), [(u1, u2), (u3,)])
 
 
 class StepTests(PublisherBase):
@@ -220,6 +226,89 @@ class TestStepProcessBlock(unittest.TestCase):
         self.assertEqual(step.progress_successes, 1)
 
 
+class TestStepProcessBatch(unittest.TestCase):
+
+    def test_process_batch(self):
+        step = publish_step.Step('foo_step')
+        step.batch_size = 2
+        step.get_iterator = Mock(return_value=iter(['a', 'b', 'c']))
+        step.get_total = Mock(return_value=3)
+        step.process_main = Mock()
+        step.report_progress = Mock()
+
+        step.process()
+
+        self.assertEqual(step.process_main.call_count, 3)
+        step.process_main.assert_called_with(item='c')
+        self.assertEqual(step.progress_successes, 3)
+        self.assertEqual(step.state, reporting_constants.STATE_COMPLETE)
+
+    def test_process_batch_non_halting_exception(self):
+        """
+        Test that a non halting exception fails the item that raised it, not the whole page.
+        """
+        step = publish_step.Step('foo_step', non_halting_exceptions=[ValueError])
+        step.status_conduit = Mock()
+        step.batch_size = 3
+        step.get_iterator = Mock(return_value=iter(['a', 'b', 'c']))
+        step.get_total = Mock(return_value=3)
+        error = ValueError('b')
+        step.process_main = Mock(side_effect=[None, error, None])
+        step.report_progress = Mock()
+
+        self.assertRaises(PulpCodedTaskFailedException, step.process)
+
+        self.assertEqual(step.process_main.call_count, 3)
+        self.assertEqual(step.progress_successes, 2)
+        self.assertEqual(step.progress_failures, 1)
+        self.assertEqual(step.exceptions, [error])
+
+    def test_process_batch_halting_exception(self):
+        step = publish_step.Step('foo_step', non_halting_exceptions=[ValueError])
+        step.batch_size = 3
+        step.get_iterator = Mock(return_value=iter(['a', 'b', 'c']))
+        step.get_total = Mock(return_value=3)
+        step.process_main = Mock(side_effect=[None, TypeError('b'), None])
+        step.report_progress = Mock()
+
+        self.assertRaises(TypeError, step.process)
+
+        self.assertEqual(step.process_main.call_count, 2)
+        self.assertEqual(step.exceptions, [])
+
+    def test_process_batch_pages(self):
+        step = publish_step.Step('foo_step')
+        step.batch_size = 2
+        step.get_iterator = Mock(return_value=iter(['a', 'b', 'c']))
+        step.get_total = Mock(return_value=3)
+        step.process_batch = Mock()
+        step.report_progress = Mock()
+
+        step.process()
+
+        self.assertEqual(step.process_batch.call_args_list,
+                         [((('a', 'b'),), {}), ((('c',),), {})])
+
+    def test_process_batch_block_counts_failures(self):
+        step = publish_step.Step('foo_step', disable_reporting=True)
+        step.total_units = 3
+        step.process_batch = Mock(side_effect=lambda items: step._record_failure())
+
+        step._process_batch_block(('a', 'b', 'c'))
+
+        self.assertEqual(step.progress_successes, 2)
+        self.assertEqual(step.progress_failures, 1)
+
+    def test_process_batch_block_overflow_prevention(self):
+        step = publish_step.Step('foo_step', disable_reporting=True)
+        step.total_units = 3
+        step.progress_successes = 2
+
+        step._process_batch_block(('a', 'b'))
+
+        self.assertEqual(step.progress_successes, 3)
+
+
 class PluginStepTests(PluginBase):
     """
     This class has a lot of duplicated tests from PublishStepTests, in order to
@@ -328,6 +417,50 @@ class PluginStepTests(PluginBase):
         plugin_step.report_progress()
         plugin_step.parent.report_progress.assert_called_once_with(False)
 
+    def test_report_progress_force_flushes(self):
+        plugin_step = publish_step.PluginStep('foo_step')
+        plugin_step.status_conduit = Mock()
+        plugin_step.report_progress(force=True)
+        plugin_step.status_conduit.set_progress.assert_called_once_with(
+            plugin_step.get_progress_report(), flush=True)
+
+    def test_report_progress_lock_released(self):
+        """
+        Test that the progress lock is not held while the report is written.
+        """
+        plugin_step = publish_step.PluginStep('foo_step')
+        plugin_step.status_conduit = Mock()
+        held = []
+
+        def set_progress(report, flush):
+            # The lock is reentrant, so it is only free if another thread can acquire it
+            thread = threading.Thread(
+                target=lambda: held.append(not plugin_step._progress_lock.acquire(False)))
+            thread.start()
+            thread.join()
+
+        plugin_step.status_conduit.set_progress.side_effect = set_progress
+        plugin_step.report_progress(force=True)
+
+        self.assertEqual(held, [False])
+
+    def test_progress_lock_shared(self):
+        """
+        Test that all the steps of a tree share the progress lock of the root step.
+        """
+        root = publish_step.Step('root')
+        child = publish_step.Step('child')
+        grandchild = publish_step.Step('grandchild')
+        other = publish_step.Step('other')
+        child.add_child(grandchild)
+
+        root.add_child(child)
+        root.insert_child(0, other)
+
+        for step in (child, grandchild, other):
+            self.assertTrue(step._progress_lock is root._progress_lock)
+        self.assertFalse(publish_step.Step('root')._progress_lock is root._progress_lock)
+
     def test_record_failure(self):
         plugin_step = publish_step.PluginStep('foo_step')
         plugin_step.parent = self.pluginstep
@@ -486,6 +619,94 @@ class PluginStepTests(PluginBase):
 
         step.report_progress.assert_called_once_with(force=True)
 
+    def test_process_lifecycle_independent_children(self):
+        step = publish_step.PluginStep('parent', working_dir=self.working_dir, conduit=self.conduit,
+                                       independent_children=True)
+        step.process = Mock()
+        started = [threading.Event(), threading.Event()]
+        overlapped = []
+
+        def process(index):
+            # Each child waits for the other to start, which only happens when run in parallel
+            started[index].set()
+            overlapped.append(started[1 - index].wait(5))
+
+        for index in range(2):
+            child_step = publish_step.PluginStep('child', working_dir=self.working_dir,
+                                                 conduit=self.conduit)
+            child_step.process = Mock(side_effect=lambda index=index: process(index))
+            step.add_child(child_step)
+        step.report_progress = Mock()
+
+        step.process_lifecycle()
+
+        self.assertEqual(overlapped, [True, True])
+        step.process.assert_called_once_with()
+        step.report_progress.assert_called_once_with(force=True)
+
+    def test_process_lifecycle_independent_children_on_error(self):
+        step = publish_step.PluginStep('parent', working_dir=self.working_dir, conduit=self.conduit,
+                                       independent_children=True)
+        step.process = Mock()
+        step.on_error = Mock()
+        failed_step = publish_step.PluginStep('failed', working_dir=self.working_dir,
+                                              conduit=self.conduit)
+        failed_step.initialize = Mock(side_effect=ValueError('boo'))
+        child_step = publish_step.PluginStep('child', working_dir=self.working_dir,
+                                             conduit=self.conduit)
+        child_step.process = Mock()
+        step.add_child(failed_step)
+        step.add_child(child_step)
+        step.report_progress = Mock()
+
+        self.assertRaises(ValueError, step.process_lifecycle)
+
+        self.assertFalse(step.process.called)
+        self.assertTrue(step.on_error.called)
+        self.assertEquals(reporting_constants.STATE_FAILED, step.state)
+        self.assertEquals(reporting_constants.STATE_FAILED, failed_step.state)
+        self.assertEquals(1, step.progress_failures)
+
+    def test_process_lifecycle_independent_children_on_error_waits_for_siblings(self):
+        step = publish_step.PluginStep('parent', working_dir=self.working_dir, conduit=self.conduit,
+                                       independent_children=True)
+        step.process = Mock()
+        step.on_error = Mock()
+        slow_started = threading.Event()
+        failed_step = publish_step.PluginStep('failed', working_dir=self.working_dir,
+                                              conduit=self.conduit)
+
+        def fail():
+            slow_started.wait(5)
+            raise ValueError('boo')
+
+        parent_notified = []
+
+        def slow_process():
+            # Keep running until the sibling has failed
+            slow_started.set()
+            for i in range(500):
+                if failed_step.state == reporting_constants.STATE_FAILED:
+                    break
+                time.sleep(0.01)
+            parent_notified.append(step.on_error.called)
+
+        failed_step.initialize = Mock(side_effect=fail)
+        slow_step = publish_step.PluginStep('slow', working_dir=self.working_dir,
+                                            conduit=self.conduit)
+        slow_step.process = Mock(side_effect=slow_process)
+        step.add_child(failed_step)
+        step.add_child(slow_step)
+        step.report_progress = Mock()
+
+        self.assertRaises(ValueError, step.process_lifecycle)
+
+        # The parent is only notified once the slow sibling has finished
+        self.assertEqual(parent_notified, [False])
+        self.assertTrue(step.on_error.called)
+        self.assertEquals(reporting_constants.STATE_FAILED, step.state)
+        self.assertEquals(reporting_constants.STATE_FAILED, failed_step.state)
+
     def test_clear_children(self):
         step = publish_step.PublishStep("foo")
         step.children = ['bar']
@@ -714,6 +935,30 @@ class TestAtomicDirectoryPublishStep(unittest.TestCase):
         self.assertEquals(True, os.path.exists(target_file))
         self.assertEquals(1, len(os.listdir(master_dir)))
 
+    @patch('pulp.plugins.util.publish_step.parallel_copytree')
+    @patch('os.rename')
+    def test_process_main_other_filesystem(self, mock_rename, mock_copytree):
+        source_dir = os.path.join(self.working_directory, 'source')
+        master_dir = os.path.join(self.working_directory, 'master')
+        step = publish_step.AtomicDirectoryPublishStep(source_dir, [], master_dir)
+        step.parent = Mock(timestamp=str(time.time()))
+        mock_rename.side_effect = OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        step.process_main()
+
+        mock_copytree.assert_called_once_with(
+            source_dir, os.path.join(master_dir, step.parent.timestamp), symlinks=True,
+            progress_callback=step._report_copy_progress)
+
+    def test_report_copy_progress(self):
+        step = publish_step.AtomicDirectoryPublishStep('foo', 'bar', 'baz')
+        step.report_progress = Mock()
+
+        step._report_copy_progress(3, 10)
+
+        self.assertEqual(step.progress_details, 'Copied 3 of 10 files')
+        step.report_progress.assert_called_once_with()
+
     @patch('selinux.restorecon')
     def test_process_main_multiple_targets(self, restorecon):
         source_dir = os.path.join(self.working_directory, 'source')
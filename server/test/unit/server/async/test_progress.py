@@ -0,0 +1,228 @@
+"""
+This module contains tests for the pulp.server.async.progress module.
+"""
+import threading
+import unittest
+
+import mock
+
+from pulp.server.async import progress
+
+
+MODULE = 'pulp.server.async.progress.'
+
+
+@mock.patch(MODULE + 'model.TaskStatus._get_collection')
+class TestProgressReporter(unittest.TestCase):
+
+    def setUp(self):
+        # A long interval keeps the background thread from writing during the tests
+        self.reporter = progress.ProgressReporter('task', interval=60)
+
+    def tearDown(self):
+        with mock.patch(MODULE + 'model.TaskStatus._get_collection'):
+            self.reporter.close()
+
+    def test_flush_sets_report_paths(self, mock_get_collection):
+        """Assert each report is set at its own path in the progress report."""
+        self.reporter.update('a', {'state': 'running'})
+        self.reporter.update('b', [1, 2])
+        self.reporter.flush()
+
+        mock_get_collection.return_value.update_one.assert_called_once_with(
+            {'task_id': 'task'},
+            {'$set': {'progress_report.a': {'state': 'running'}, 'progress_report.b': [1, 2]}})
+        self.assertEqual(self.reporter.updates, 2)
+        self.assertEqual(self.reporter.writes, 1)
+
+    def test_flush_coalesces(self, mock_get_collection):
+        """Assert only the latest version of a report is written."""
+        for done in range(5):
+            self.reporter.update('a', {'done': done})
+        self.reporter.flush()
+
+        mock_get_collection.return_value.update_one.assert_called_once_with(
+            {'task_id': 'task'}, {'$set': {'progress_report.a': {'done': 4}}})
+
+    def test_flush_only_changed(self, mock_get_collection):
+        """Assert reports that did not change since the last write are not written again."""
+        self.reporter.update('a', {'done': 1})
+        self.reporter.update('b', {'done': 1})
+        self.reporter.flush()
+        self.reporter.update('a', {'done': 1})
+        self.reporter.update('b', {'done': 2})
+        self.reporter.flush()
+        self.reporter.update('b', {'done': 2})
+        self.reporter.flush()
+
+        update_one = mock_get_collection.return_value.update_one
+        self.assertEqual(update_one.call_count, 2)
+        self.assertEqual(update_one.call_args[0][1], {'$set': {'progress_report.b.done': 2}})
+        self.assertEqual(self.reporter.writes, 2)
+
+    def test_flush_copies_report(self, mock_get_collection):
+        """Assert a report is copied when it is given, so later changes are detected."""
+        report = {'done': 1}
+        self.reporter.update('a', report)
+        report['done'] = 2
+        self.reporter.flush()
+        report['done'] = 3
+        self.reporter.update('a', report)
+        self.reporter.flush()
+
+        update_one = mock_get_collection.return_value.update_one
+        self.assertEqual(update_one.call_args_list[0][0][1],
+                         {'$set': {'progress_report.a': {'done': 1}}})
+        self.assertEqual(update_one.call_args_list[1][0][1],
+                         {'$set': {'progress_report.a.done': 3}})
+
+    def test_flush_sets_changed_leaves(self, mock_get_collection):
+        """Assert only the values of nested dicts and lists that changed are written."""
+        self.reporter.update('a', {'x': 1, 'y': {'z': 1, 'gone': 1}, 'steps': [{'n': 1}]})
+        self.reporter.flush()
+        self.reporter.update('a', {'x': 1, 'y': {'z': 2, 'new': 1}, 'steps': [{'n': 2}]})
+        self.reporter.flush()
+
+        mock_get_collection.return_value.update_one.assert_called_with(
+            {'task_id': 'task'},
+            {'$set': {'progress_report.a.y.z': 2, 'progress_report.a.y.new': 1,
+                      'progress_report.a.steps.0.n': 2},
+             '$unset': {'progress_report.a.y.gone': ''}})
+
+    def test_flush_sets_replaced_values(self, mock_get_collection):
+        """Assert values that cannot be updated field by field are set whole."""
+        self.reporter.update('a', {'items': [1], 'y': {'b.c': 1}, 'z': 1})
+        self.reporter.flush()
+        self.reporter.update('a', {'items': [1, 2], 'y': {'b.c': 2}, 'z': {'n': 1}})
+        self.reporter.flush()
+
+        mock_get_collection.return_value.update_one.assert_called_with(
+            {'task_id': 'task'},
+            {'$set': {'progress_report.a.items': [1, 2], 'progress_report.a.y': {'b.c': 2},
+                      'progress_report.a.z': {'n': 1}}})
+
+    def test_flush_unsets_only(self, mock_get_collection):
+        """Assert an update that only removes fields does not set anything."""
+        self.reporter.update('a', {'x': 1, 'y': 1})
+        self.reporter.flush()
+        self.reporter.update('a', {'x': 1})
+        self.reporter.flush()
+
+        mock_get_collection.return_value.update_one.assert_called_with(
+            {'task_id': 'task'}, {'$unset': {'progress_report.a.y': ''}})
+
+    def test_update_flush(self, mock_get_collection):
+        """Assert a flushed update is written before returning."""
+        self.reporter.update('a', 'running', flush=True)
+
+        mock_get_collection.return_value.update_one.assert_called_once_with(
+            {'task_id': 'task'}, {'$set': {'progress_report.a': 'running'}})
+
+    def test_update_dotted_id(self, mock_get_collection):
+        """Assert the whole progress report is set when an ID cannot be used in a path."""
+        self.reporter.update('a', 1, flush=True)
+        self.reporter.update('b.c', 2, flush=True)
+
+        mock_get_collection.return_value.update_one.assert_called_with(
+            {'task_id': 'task'}, {'$set': {'progress_report': {'a': 1, 'b.c': 2}}})
+
+    def test_flush_failure_keeps_reports(self, mock_get_collection):
+        """Assert reports that failed to be written are written by the next flush."""
+        update_one = mock_get_collection.return_value.update_one
+        update_one.side_effect = [Exception('down'), None]
+        self.reporter.update('a', 1)
+        self.assertRaises(Exception, self.reporter.flush)
+        self.reporter.flush()
+
+        update_one.assert_called_with({'task_id': 'task'}, {'$set': {'progress_report.a': 1}})
+        self.assertEqual(self.reporter.writes, 1)
+
+    def test_close_flushes(self, mock_get_collection):
+        """Assert closing the reporter writes the pending reports and stops the thread."""
+        self.reporter.update('a', 1)
+        self.reporter.close()
+
+        mock_get_collection.return_value.update_one.assert_called_once_with(
+            {'task_id': 'task'}, {'$set': {'progress_report.a': 1}})
+        self.assertFalse(self.reporter._thread.is_alive())
+
+
+class TestProgressReporterThread(unittest.TestCase):
+
+    @mock.patch(MODULE + 'model.TaskStatus._get_collection')
+    def test_background_write(self, mock_get_collection):
+        """Assert the background thread writes the reports without a flush."""
+        written = threading.Event()
+        mock_get_collection.return_value.update_one.side_effect = lambda *a: written.set()
+        reporter = progress.ProgressReporter('task', interval=0.01)
+
+        reporter.update('a', 1)
+
+        self.assertTrue(written.wait(5))
+        mock_get_collection.return_value.update_one.assert_called_once_with(
+            {'task_id': 'task'}, {'$set': {'progress_report.a': 1}})
+        reporter.close()
+        self.assertEqual(mock_get_collection.return_value.update_one.call_count, 1)
+
+    @mock.patch(MODULE + '_logger')
+    @mock.patch(MODULE + 'model.TaskStatus._get_collection')
+    def test_background_write_failure(self, mock_get_collection, mock_logger):
+        """Assert failed background writes are logged and retried."""
+        written = threading.Event()
+        results = [Exception('down'), None]
+
+        def update_one(*args):
+            result = results.pop(0)
+            if result is not None:
+                raise result
+            written.set()
+
+        mock_get_collection.return_value.update_one.side_effect = update_one
+        reporter = progress.ProgressReporter('task', interval=0.01)
+
+        reporter.update('a', 1)
+
+        self.assertTrue(written.wait(5))
+        reporter.close()
+        self.assertEqual(mock_get_collection.return_value.update_one.call_count, 2)
+        self.assertEqual(mock_logger.exception.call_count, 1)
+
+
+@mock.patch(MODULE + 'ProgressReporter')
+class TestReporters(unittest.TestCase):
+
+    def tearDown(self):
+        progress._reporters.clear()
+
+    def test_get_reporter(self, mock_reporter):
+        """Assert each task has a single reporter."""
+        reporter = progress.get_reporter('task')
+
+        self.assertTrue(reporter is mock_reporter.return_value)
+        self.assertTrue(progress.get_reporter('task') is reporter)
+        mock_reporter.assert_called_once_with('task')
+
+    def test_close_reporter(self, mock_reporter):
+        """Assert closing a task's reporter closes it and forgets it."""
+        reporter = progress.get_reporter('task')
+
+        progress.close_reporter('task')
+
+        reporter.close.assert_called_once_with()
+        self.assertEqual(progress._reporters, {})
+
+    def test_close_reporter_none(self, mock_reporter):
+        """Assert closing the reporter of a task without one does nothing."""
+        progress.close_reporter('task')
+
+        self.assertFalse(mock_reporter.called)
+
+    @mock.patch(MODULE + '_logger')
+    def test_close_reporter_error(self, mock_logger, mock_reporter):
+        """Assert errors writing the last reports are logged rather than raised."""
+        mock_reporter.return_value.close.side_effect = Exception('down')
+        progress.get_reporter('task')
+
+        progress.close_reporter('task')
+
+        self.assertEqual(mock_logger.exception.call_count, 1)
@@ -1,7 +1,6 @@
 """
 This module contains tests for the pulp.server.async.tasks module.
 """
-from datetime import datetime
 import signal
 import unittest
 import uuid
@@ -20,7 +19,7 @@ from pulp.common.constants import (CALL_CANCELED_STATE, CALL_FINISHED_STATE,
 from pulp.common.tags import action_tag, resource_tag, RESOURCE_CONSUMER_TYPE
 from pulp.devel.unit.util import compare_dict
 from pulp.server.async import app, tasks
-from pulp.server.db.model import Worker, TaskStatus
+from pulp.server.db.model import TaskStatus
 from pulp.server.db.reaper import queue_reap_expired_documents
 from pulp.server.exceptions import NoWorkers, PulpException, PulpCodedException
 from pulp.server.maintenance.monthly import queue_monthly_maintenance
@@ -35,17 +34,13 @@ WORKER_3 = 'worker-3'
 class TestQueueReservedTask(ResourceReservationTests):
 
     def setUp(self):
-        self.patch_a = mock.patch('pulp.server.async.tasks.get_worker_for_reservation')
-        self.mock_get_worker_for_reservation = self.patch_a.start()
-
-        self.patch_b = mock.patch('pulp.server.async.tasks._get_unreserved_worker')
-        self.mock_get_unreserved_worker = self.patch_b.start()
+        self.patch_a = mock.patch('pulp.server.async.tasks._reservation_index', autospec=True)
+        self.mock_reservation_index = self.patch_a.start()
+        self.mock_reservation_index.find_worker.return_value = 'worker1'
 
         self.patch_c = mock.patch('pulp.server.async.tasks.time', autospec=True)
         self.mock_time = self.patch_c.start()
-
-        self.patch_d = mock.patch('pulp.server.async.tasks.ReservedResource', autospec=True)
-        self.mock_reserved_resource = self.patch_d.start()
+        self.mock_time.time.side_effect = [10.0, 12.5]
 
         self.patch_e = mock.patch('pulp.server.async.tasks.celery', autospec=True)
         self.mock_celery = self.patch_e.start()
@@ -58,76 +53,271 @@ class TestQueueReservedTask(ResourceReservationTests):
 
     def tearDown(self):
         self.patch_a.stop()
-        self.patch_b.stop()
         self.patch_c.stop()
-        self.patch_d.stop()
         self.patch_e.stop()
         self.patch_f.stop()
         super(TestQueueReservedTask, self).tearDown()
 
-    def test_creates_and_saves_reserved_resource(self):
-        self.mock_get_worker_for_reservation.return_value = Worker(
-            name='worker1', last_heartbeat=datetime.utcnow())
+    def test_syncs_reservation_index(self):
         tasks._queue_reserved_task('task_name', 'my_task_id', 'my_resource_id', [1, 2], {'a': 2})
-        self.mock_reserved_resource.assert_called_once_with(task_id='my_task_id',
-                                                            worker_name='worker1',
-                                                            resource_id='my_resource_id')
-        self.mock_reserved_resource.return_value.save.assert_called_once_with()
+        self.mock_reservation_index.sync.assert_called_once_with()
+        self.mock_reservation_index.find_worker.assert_called_once_with('my_resource_id')
+
+    def test_reserves_resource(self):
+        tasks._queue_reserved_task('task_name', 'my_task_id', 'my_resource_id', [1, 2], {'a': 2})
+        self.mock_reservation_index.reserve.assert_called_once_with(
+            'my_task_id', 'worker1', 'my_resource_id')
 
     def test_dispatches_inner_task(self):
-        self.mock_get_worker_for_reservation.return_value = Worker(
-            name='worker1', last_heartbeat=datetime.utcnow())
         tasks._queue_reserved_task('task_name', 'my_task_id', 'my_resource_id', [1, 2], {'a': 2})
         apply_async = self.mock_celery.tasks['task_name'].apply_async
         apply_async.assert_called_once_with(1, 2, a=2, routing_key='worker1', task_id='my_task_id',
                                             exchange='C.dq')
 
     def test_dispatches__release_resource(self):
-        self.mock_get_worker_for_reservation.return_value = Worker(
-            name='worker1', last_heartbeat=datetime.utcnow())
         tasks._queue_reserved_task('task_name', 'my_task_id', 'my_resource_id', [1, 2], {'a': 2})
         self.mock__release_resource.apply_async.assert_called_once_with(('my_task_id',),
                                                                         routing_key='worker1',
                                                                         exchange='C.dq')
 
-    def test_get_worker_for_reservation_breaks_out_of_loop(self):
-        self.mock_get_worker_for_reservation.return_value = Worker(
-            name='worker1', last_heartbeat=datetime.utcnow())
+    def test_records_dispatch_latency(self):
+        tasks._queue_reserved_task('task_name', 'my_task_id', 'my_resource_id', [1, 2], {'a': 2})
+        self.mock_reservation_index.record_dispatch.assert_called_once_with(
+            'my_task_id', 'worker1', 2.5)
+
+    def test_found_worker_does_not_wait(self):
         tasks._queue_reserved_task('task_name', 'my_task_id', 'my_resource_id', [1, 2], {'a': 2})
-        self.assertTrue(not self.mock_get_unreserved_worker.called)
-        self.assertTrue(not self.mock_time.sleep.called)
+        self.assertTrue(not self.mock_reservation_index.wait.called)
+
+    def test_waits_for_available_worker(self):
+        self.mock_reservation_index.find_worker.side_effect = [
+            NoWorkers(), NoWorkers(), 'worker2']
 
-    def test_get_unreserved_worker_breaks_out_of_loop(self):
-        self.mock_get_worker_for_reservation.side_effect = NoWorkers()
-        self.mock_get_unreserved_worker.return_value = Worker(name='worker1',
-                                                              last_heartbeat=datetime.utcnow())
         tasks._queue_reserved_task('task_name', 'my_task_id', 'my_resource_id', [1, 2], {'a': 2})
-        self.assertTrue(not self.mock_time.sleep.called)
 
-    def test_loops_and_sleeps_waiting_for_available_worker(self):
-        self.mock_get_worker_for_reservation.side_effect = NoWorkers()
-        self.mock_get_unreserved_worker.side_effect = NoWorkers()
+        self.assertEqual(self.mock_reservation_index.wait.call_count, 2)
+        self.mock_reservation_index.reserve.assert_called_once_with(
+            'my_task_id', 'worker2', 'my_resource_id')
 
-        class BreakOutException(Exception):
-            pass
 
-        def side_effect(*args):
-            def second_call(*args):
-                raise BreakOutException()
-            self.mock_time.sleep.side_effect = second_call
-            return None
+@mock.patch('pulp.server.async.tasks.time', autospec=True)
+@mock.patch('pulp.server.async.tasks.Worker', autospec=True)
+@mock.patch('pulp.server.async.tasks.ReservedResource', autospec=True)
+class TestReservationIndex(unittest.TestCase):
+    """
+    Tests for pulp.server.async.tasks.ReservationIndex.
+    """
 
-        self.mock_time.sleep.side_effect = side_effect
+    def _index(self, m_reserved_resource, m_worker, m_time, workers=(WORKER_1, WORKER_2),
+               reservations=()):
+        m_time.time.return_value = 100.0
+        m_worker.objects.distinct.return_value = list(workers)
+        m_reserved_resource.objects.all.return_value = [
+            mock.Mock(task_id=t, worker_name=w, resource_id=r) for t, w, r in reservations]
+        index = tasks.ReservationIndex()
+        index.sync()
+        return index
 
-        try:
-            tasks._queue_reserved_task('task_name', 'my_task_id', 'my_resource_id', [1, 2],
-                                       {'a': 2})
-        except BreakOutException:
-            pass
-        else:
-            self.fail('_queue_reserved_task should have raised a BreakOutException')
+    def test_sync_loads_reservations_once(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time,
+                            reservations=[('task-1', WORKER_1, 'repo-1')])
+        m_reserved_resource.objects.return_value.distinct.return_value = ['task-1']
+
+        index.sync()
+
+        m_reserved_resource.objects.all.assert_called_once_with()
+        m_reserved_resource.objects.assert_called_once_with(task_id__in=['task-1'])
+        self.assertEqual(index.find_worker('repo-1'), WORKER_1)
+
+    def test_sync_removes_released_reservations(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time,
+                            reservations=[('task-1', WORKER_1, 'repo-1'),
+                                          ('task-2', WORKER_2, 'repo-2')])
+        m_reserved_resource.objects.return_value.distinct.return_value = ['task-2']
+
+        index.sync()
+
+        # repo-1 is no longer reserved, and worker-1 is free to take it
+        self.assertEqual(index.find_worker('repo-1'), WORKER_1)
+        self.assertEqual(index.find_worker('repo-2'), WORKER_2)
+
+    def test_sync_refreshes_workers_after_interval(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time, workers=[])
+        m_worker.objects.distinct.return_value = [WORKER_1]
+
+        index.sync()
+        self.assertRaises(NoWorkers, index.find_worker, 'repo-1')
+
+        m_time.time.return_value = 100.0 + tasks.WORKER_REFRESH_INTERVAL
+        index.sync()
+        self.assertEqual(index.find_worker('repo-1'), WORKER_1)
+
+    def test_find_worker_excludes_special_workers(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time,
+                            workers=[SCHEDULER_WORKER_NAME + '@host',
+                                     RESOURCE_MANAGER_WORKER_NAME + '@host'])
+
+        self.assertRaises(NoWorkers, index.find_worker, 'repo-1')
+
+    def test_find_worker_reserved_workers_busy(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time, workers=[WORKER_1])
+        index.reserve('task-1', WORKER_1, 'repo-1')
+
+        self.assertEqual(index.find_worker('repo-1'), WORKER_1)
+        self.assertRaises(NoWorkers, index.find_worker, 'repo-2')
+        m_reserved_resource.assert_called_once_with(task_id='task-1', worker_name=WORKER_1,
+                                                    resource_id='repo-1')
+        m_reserved_resource.return_value.save.assert_called_once_with()
+
+    def test_find_worker_missing_worker(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time,
+                            reservations=[('task-1', WORKER_3, 'repo-1')])
+
+        # The reservation waits for the worker to come back or to be cleaned up
+        self.assertRaises(NoWorkers, index.find_worker, 'repo-1')
+        self.assertEqual(m_worker.objects.distinct.call_count, 2)
+
+    def test_find_worker_uses_policy(self, m_reserved_resource, m_worker, m_time):
+        policy = mock.Mock(spec=tasks.PlacementPolicy)
+        policy.select_worker.return_value = WORKER_2
+        index = self._index(m_reserved_resource, m_worker, m_time)
+        index._policy = policy
+        index.reserve('task-1', WORKER_1, 'repo-1')
+        index.reserve('task-2', WORKER_1, 'repo-1')
+
+        self.assertEqual(index.find_worker('repo-2'), WORKER_2)
+        self.assertEqual(index.find_worker('repo-1'), WORKER_1)
+        policy.select_worker.assert_called_once_with('repo-2', {WORKER_1: 2, WORKER_2: 0}, None)
 
-        self.mock_time.sleep.assert_has_calls([mock.call(0.25), mock.call(0.25)])
+    def test_find_worker_passes_recent_worker(self, m_reserved_resource, m_worker, m_time):
+        policy = mock.Mock(spec=tasks.PlacementPolicy)
+        index = self._index(m_reserved_resource, m_worker, m_time)
+        index._policy = policy
+        index.reserve('task-1', WORKER_2, 'repo-1')
+        m_reserved_resource.objects.return_value.distinct.return_value = []
+        index.sync()
+
+        index.find_worker('repo-1')
+
+        policy.select_worker.assert_called_once_with('repo-1', {WORKER_1: 0, WORKER_2: 0},
+                                                     WORKER_2)
+
+    def test_find_worker_policy_finds_none(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time)
+        index._policy = mock.Mock(spec=tasks.PlacementPolicy)
+        index._policy.select_worker.return_value = None
+
+        self.assertRaises(NoWorkers, index.find_worker, 'repo-1')
+
+    @mock.patch('pulp.server.async.tasks.RECENT_RESOURCES_LIMIT', 1)
+    def test_recent_workers_limit(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time)
+
+        index.reserve('task-1', WORKER_1, 'repo-1')
+        index.reserve('task-2', WORKER_2, 'repo-2')
+
+        self.assertEqual(index._recent_workers.items(), [('repo-2', WORKER_2)])
+
+    def test_wait(self, m_reserved_resource, m_worker, m_time):
+        index = self._index(m_reserved_resource, m_worker, m_time)
+
+        with mock.patch.object(index, 'sync') as m_sync:
+            index.wait()
+
+        m_time.sleep.assert_called_once_with(tasks.RESERVATION_POLL_INTERVAL)
+        m_sync.assert_called_once_with()
+
+    def test_record_dispatch(self, m_reserved_resource, m_worker, m_time):
+        index = tasks.ReservationIndex()
+
+        index.record_dispatch('task-1', WORKER_1, 0.5)
+        index.record_dispatch('task-2', WORKER_1, 1.5)
+
+        self.assertEqual(index.dispatch_count, 2)
+        self.assertEqual(index.total_dispatch_latency, 2.0)
+        self.assertEqual(index.max_dispatch_latency, 1.5)
+
+
+class TestLeastLoadedPlacementPolicy(unittest.TestCase):
+    """
+    Tests for pulp.server.async.tasks.LeastLoadedPlacementPolicy.
+    """
+
+    def test_least_loaded(self):
+        policy = tasks.LeastLoadedPlacementPolicy(reservation_limit=3)
+
+        worker = policy.select_worker('repo-1', {WORKER_1: 2, WORKER_2: 1, WORKER_3: 2}, WORKER_1)
+
+        self.assertEqual(worker, WORKER_2)
+
+    def test_reservation_limit(self):
+        policy = tasks.LeastLoadedPlacementPolicy(reservation_limit=2)
+
+        self.assertEqual(policy.select_worker('repo-1', {WORKER_1: 2, WORKER_2: 3}, None), None)
+
+    def test_default_idle_workers_only(self):
+        policy = tasks.LeastLoadedPlacementPolicy()
+
+        self.assertEqual(policy.select_worker('repo-1', {WORKER_1: 1, WORKER_2: 0}, None),
+                         WORKER_2)
+        self.assertEqual(policy.select_worker('repo-1', {WORKER_1: 1}, None), None)
+
+
+class TestAffinityPlacementPolicy(unittest.TestCase):
+    """
+    Tests for pulp.server.async.tasks.AffinityPlacementPolicy.
+    """
+
+    def test_prefers_recent_worker(self):
+        policy = tasks.AffinityPlacementPolicy(reservation_limit=3)
+
+        worker = policy.select_worker('repo-1', {WORKER_1: 1, WORKER_2: 1, WORKER_3: 2}, WORKER_2)
+
+        self.assertEqual(worker, WORKER_2)
+
+    def test_prefers_less_loaded_worker(self):
+        policy = tasks.AffinityPlacementPolicy(reservation_limit=3)
+
+        worker = policy.select_worker('repo-1', {WORKER_1: 0, WORKER_2: 1}, WORKER_2)
+
+        self.assertEqual(worker, WORKER_1)
+
+    def test_recent_worker_gone(self):
+        policy = tasks.AffinityPlacementPolicy()
+
+        worker = policy.select_worker('repo-1', {WORKER_1: 0, WORKER_2: 0}, WORKER_3)
+
+        self.assertEqual(worker, WORKER_1)
+
+
+class TestGetPlacementPolicy(unittest.TestCase):
+    """
+    Tests for pulp.server.async.tasks.get_placement_policy().
+    """
+
+    @mock.patch('pulp.server.async.tasks.config')
+    def test_configured_policy(self, m_config):
+        m_config.get.return_value = 'least_loaded'
+        m_config.getint.return_value = 4
+
+        policy = tasks.get_placement_policy()
+
+        self.assertTrue(type(policy) is tasks.LeastLoadedPlacementPolicy)
+        self.assertEqual(policy.reservation_limit, 4)
+        m_config.get.assert_called_once_with('tasks', 'worker_placement_policy')
+        m_config.getint.assert_called_once_with('tasks', 'worker_reservation_limit')
+
+    @mock.patch('pulp.server.async.tasks._logger')
+    @mock.patch('pulp.server.async.tasks.config')
+    def test_unknown_policy(self, m_config, m_logger):
+        m_config.get.return_value = 'fastest'
+        m_config.getint.return_value = 0
+
+        policy = tasks.get_placement_policy()
+
+        self.assertTrue(type(policy) is tasks.AffinityPlacementPolicy)
+        self.assertEqual(policy.reservation_limit, 1)
+        self.assertEqual(m_logger.error.call_count, 1)
 
 
 class TestDeleteWorker(ResourceReservationTests):
@@ -388,6 +578,18 @@ class TestTaskOnSuccessHandler(ResourceReservationTests):
         dateutils.parse_iso8601_datetime(new_task_status['finish_time'])
         self.assertEqual(new_task_status['spawned_tasks'], ['foo-id'])
 
+    @mock.patch('pulp.server.async.tasks.progress.close_reporter')
+    @mock.patch('pulp.server.async.tasks.Task.request')
+    def test_closes_progress_reporter(self, mock_request, mock_close_reporter):
+        task_id = str(uuid.uuid4())
+        mock_request.called_directly = False
+        TaskStatus(task_id).save()
+
+        task = tasks.Task()
+        task.on_success('random_return_value', task_id, [], {})
+
+        mock_close_reporter.assert_called_once_with(task_id)
+
     @mock.patch('pulp.server.async.tasks.Task.request')
     def test_spawned_task_dict(self, mock_request):
         retval = tasks.TaskResult(spawned_tasks=[{'task_id': 'foo-id'}], result='bar')
@@ -523,6 +725,19 @@ class TestTaskOnFailureHandler(ResourceReservationTests):
         dateutils.parse_iso8601_datetime(new_task_status['finish_time'])
         self.assertEqual(new_task_status['traceback'], einfo.traceback)
 
+    @mock.patch('pulp.server.async.tasks.progress.close_reporter')
+    @mock.patch('pulp.server.async.tasks.Task.request')
+    def test_closes_progress_reporter(self, mock_request, mock_close_reporter):
+        task_id = str(uuid.uuid4())
+        mock_request.called_directly = False
+        TaskStatus(task_id).save()
+        einfo = mock.Mock(traceback='string_repr_of_traceback')
+
+        task = tasks.Task()
+        task.on_failure(Exception(), task_id, [], {}, einfo)
+
+        mock_close_reporter.assert_called_once_with(task_id)
+
     @mock.patch('pulp.server.async.tasks.Task.request')
     @mock.patch('pulp.server.managers.schedule.utils.increment_failure_count')
     def test_with_scheduled_call(self, mock_increment_failure, mock_request):
@@ -950,86 +1165,7 @@ class TestScheduledTasks(unittest.TestCase):
         mock_monthly_apply_async.assert_called_once_with(tags=[action_tag('monthly')])
 
 
-class TestGetWorkerForReservation(ResourceReservationTests):
-
-    @mock.patch('pulp.server.async.tasks.Worker.objects')
-    @mock.patch('pulp.server.async.tasks.ReservedResource')
-    def test_existing_reservation_correctly_found(self, mock_reserved_resource,
-                                                  mock_worker_objects):
-        get_objects = mock_reserved_resource.objects
-        tasks.get_worker_for_reservation('resource1')
-        get_objects.assert_called_once_with(resource_id='resource1')
-        get_objects.return_value.first.assert_called_once_with()
-
-    @mock.patch('pulp.server.async.tasks.Worker.objects')
-    @mock.patch('pulp.server.async.tasks.ReservedResource')
-    def test_correct_worker_returned(self, mock_reserved_resource, mock_worker_objects):
-        find_one = mock_reserved_resource.objects.return_value.first
-        find_one.return_value = {'worker_name': 'worker1'}
-        mock_worker_objects.return_value.first.return_value = find_one.return_value
-        result = tasks.get_worker_for_reservation('resource1')
-        self.assertTrue(result is find_one.return_value)
-
-    @mock.patch('pulp.server.async.tasks.ReservedResource')
-    def test_no_workers_raised_if_no_reservations(self, mock_reserved_resource):
-        find_one = mock_reserved_resource.objects.return_value.first
-        find_one.return_value = False
-        try:
-            tasks.get_worker_for_reservation('resource1')
-        except NoWorkers:
-            pass
-        else:
-            self.fail("NoWorkers() Exception should have been raised.")
-
-
-class TestGetUnreservedWorker(ResourceReservationTests):
-
-    @mock.patch('pulp.server.async.tasks.ReservedResource')
-    def test_reserved_resources_queried_correctly(self, mock_reserved_resource):
-        find = mock_reserved_resource.objects.all
-        find.return_value = [{'worker_name': 'a'}, {'worker_name': 'b'}]
-        try:
-            tasks._get_unreserved_worker()
-        except NoWorkers:
-            pass
-        else:
-            self.fail("NoWorkers() Exception should have been raised.")
-        find.assert_called_once_with()
-
-    @mock.patch('pulp.server.async.tasks.Worker.objects')
-    @mock.patch('pulp.server.async.tasks.ReservedResource')
-    def test_worker_returned_when_one_worker_is_not_reserved(self, mock_reserved_resource,
-                                                             mock_worker_objects):
-        mock_worker_objects.return_value = [{'name': 'a'}, {'name': 'b'}]
-        mock_reserved_resource.objects.all.return_value = [{'worker_name': 'a'}]
-        result = tasks._get_unreserved_worker()
-        self.assertEqual(result, {'name': 'b'})
-
-    @mock.patch('pulp.server.async.tasks.Worker.objects')
-    @mock.patch('pulp.server.async.tasks.ReservedResource')
-    def test_no_workers_raised_when_all_workers_reserved(self, mock_reserved_resource, mock_worker):
-        mock_worker.objects.return_value = [{'name': 'a'}, {'name': 'b'}]
-        find = mock_reserved_resource.objects
-        find.return_value = [{'worker_name': 'a'}, {'worker_name': 'b'}]
-        try:
-            tasks._get_unreserved_worker()
-        except NoWorkers:
-            pass
-        else:
-            self.fail("NoWorkers() Exception should have been raised.")
-
-    @mock.patch('pulp.server.async.tasks.Worker.objects')
-    @mock.patch('pulp.server.async.tasks.ReservedResource')
-    def test_no_workers_raised_when_there_are_no_workers(self, mock_reserved_resource, mock_worker):
-        mock_worker.objects.return_value = []
-        find = mock_reserved_resource.objects
-        find.return_value = [{'worker_name': 'a'}, {'worker_name': 'b'}]
-        try:
-            tasks._get_unreserved_worker()
-        except NoWorkers:
-            pass
-        else:
-            self.fail("NoWorkers() Exception should have been raised.")
+class TestIsWorker(unittest.TestCase):
 
     def test_is_worker(self):
         self.assertTrue(tasks._is_worker("a_worker@some.hostname"))
@@ -1,11 +1,14 @@
 import os
+import shutil
+import tempfile
+import time
 
 from unittest import TestCase
 
 from mock import Mock, patch
 
 from pulp.server.content.web import views as content_views
-from pulp.server.content.web.views import ContentView
+from pulp.server.content.web.views import ContentView, SAFE_STORAGE_SUBDIRS
 
 
 MODULE = 'pulp.server.content.web.views'
@@ -14,6 +17,8 @@ MODULE = 'pulp.server.content.web.views'
 class TestContentView(TestCase):
 
     def setUp(self):
+        content_views._resolution_cache.clear()
+        content_views._directory_index_cache.clear()
         self.environ = {
             # These values must be present in all requests unless they are
             # allowed to be empty strings
@@ -45,23 +50,23 @@ class TestContentView(TestCase):
         }
 
     @patch(MODULE + '.pulp_conf')
-    @patch(MODULE + '.Key.load')
-    def test_init(self, key_load, pulp_conf):
-        key_path = '/tmp/rsa.key'
+    @patch(MODULE + '.signing_service')
+    def test_init(self, signing_service, pulp_conf):
         conf = {
-            'authentication': {'rsa_key': key_path},
             'server': {'storage_dir': '/var/lib/pulp'},
         }
 
         pulp_conf.get.side_effect = lambda s, p: conf.get(s).get(p)
 
         # test
-        ContentView()
+        view = ContentView()
 
         # validation
-        key_load.assert_called_once_with(key_path)
+        self.assertEqual(
+            view.safe_serving_paths,
+            [os.path.realpath(os.path.join('/var/lib/pulp', d)) for d in SAFE_STORAGE_SUBDIRS])
+        self.assertFalse(signing_service.key.called)
 
-    @patch(MODULE + '.Key.load', Mock())
     def test_urljoin(self):
         scheme = 'http'
         host = 'redhat.com'
@@ -100,10 +105,10 @@ class TestContentView(TestCase):
         forbidden.assert_called_once_with()
         self.assertEqual(reply, forbidden.return_value)
 
-    @patch(MODULE + '.URL')
+    @patch(MODULE + '.signing_service')
     @patch(MODULE + '.pulp_conf')
     @patch(MODULE + '.HttpResponseRedirect')
-    def test_redirect(self, redirect, pulp_conf, url):
+    def test_redirect(self, redirect, pulp_conf, signing_service):
         remote_ip = '172.10.08.20'
         scheme = 'https'
         host = 'localhost'
@@ -126,16 +131,15 @@ class TestContentView(TestCase):
         self.environ['QUERY_STRING'] = query
         self.environ['REMOTE_ADDR'] = remote_ip
         request = Mock(environ=self.environ, path_info=path)
-        key = Mock()
 
         # test
-        reply = ContentView.redirect(request, key)
+        reply = ContentView.redirect(request)
 
         # validation
-        url.assert_called_once_with(ContentView.urljoin(
-            scheme, host, port, redirect_path, path, query))
-        url.return_value.sign.assert_called_once_with(key, remote_ip=remote_ip)
-        redirect.assert_called_once_with(str(url.return_value.sign.return_value))
+        signing_service.sign.assert_called_once_with(
+            ContentView.urljoin(scheme, host, port, redirect_path, path, query),
+            '/tmp/key', remote_ip=remote_ip)
+        redirect.assert_called_once_with(str(signing_service.sign.return_value))
         self.assertEqual(reply, redirect.return_value)
 
     @patch('os.path.lexists', Mock(return_value=True))
@@ -143,7 +147,6 @@ class TestContentView(TestCase):
     @patch('os.path.exists')
     @patch(MODULE + '.allow_access')
     @patch(MODULE + '.ContentView.x_send')
-    @patch(MODULE + '.Key.load', Mock())
     def test_get_x_send(self, x_send, allow_access, exists, realpath):
         allow_access.return_value = True
         exists.return_value = True
@@ -166,7 +169,6 @@ class TestContentView(TestCase):
         self.assertEqual(reply, x_send.return_value)
 
     @patch('os.path.lexists', Mock(return_value=False))
-    @patch(MODULE + '.Key.load', Mock())
     @patch(MODULE + '.allow_access')
     @patch('os.path.realpath')
     def test_get_http(self, realpath, allow_access):
@@ -190,7 +192,6 @@ class TestContentView(TestCase):
     @patch(MODULE + '.pulp_conf.get', return_value='True')
     @patch(MODULE + '.allow_access')
     @patch(MODULE + '.ContentView.redirect')
-    @patch(MODULE + '.Key.load', Mock())
     def test_get_redirected(self, redirect, allow_access, mock_conf_get, exists, realpath):
         allow_access.return_value = True
         exists.return_value = False
@@ -211,13 +212,12 @@ class TestContentView(TestCase):
         realpath.assert_called_with(path)
         exists.assert_has_call('/var/lib/pulp/content/rpm')
         self.assertTrue(exists.call_count > 0)
-        redirect.assert_called_once_with(request, view.key)
+        redirect.assert_called_once_with(request)
         self.assertEqual(reply, redirect.return_value)
 
     @patch('os.path.lexists', Mock(return_value=False))
     @patch('os.path.realpath', Mock())
     @patch(MODULE + '.allow_access', Mock(return_value=True))
-    @patch(MODULE + '.Key.load', Mock())
     @patch(MODULE + '.pulp_conf')
     def test_get_not_found(self, pulp_conf):
         host = 'localhost'
@@ -236,7 +236,6 @@ class TestContentView(TestCase):
 
     @patch(MODULE + '.allow_access')
     @patch(MODULE + '.HttpResponseForbidden')
-    @patch(MODULE + '.Key.load', Mock())
     def test_get_not_authorized(self, forbidden, allow_access):
         allow_access.return_value = False
 
@@ -256,7 +255,6 @@ class TestContentView(TestCase):
 
     @patch(MODULE + '.allow_access')
     @patch(MODULE + '.HttpResponseForbidden')
-    @patch(MODULE + '.Key.load', Mock())
     def test_get_outside_pub(self, forbidden, allow_access):
         allow_access.return_value = True
 
@@ -273,3 +271,101 @@ class TestContentView(TestCase):
         # validation
         allow_access.assert_called_once_with(request.environ, host)
         self.assertEqual(reply, forbidden.return_value)
+
+    @patch('os.path.lexists', Mock(return_value=True))
+    @patch('os.path.realpath')
+    @patch('os.path.exists', Mock(return_value=True))
+    @patch(MODULE + '.allow_access', Mock(return_value=True))
+    @patch(MODULE + '.ContentView.x_send')
+    def test_get_resolution_cached(self, x_send, realpath):
+        """
+        The file system is only examined on the first request for a path.
+        """
+        realpath.side_effect = lambda p: '/var/lib/pulp/published/content'
+        request = Mock(path_info='/var/www/pub/content', environ=self.environ)
+
+        ContentView().get(request)
+        realpath.reset_mock()
+        view = ContentView()
+        realpath.reset_mock()
+        reply = view.get(request)
+
+        self.assertFalse(realpath.called)
+        self.assertEqual(x_send.call_count, 2)
+        x_send.assert_called_with('/var/lib/pulp/published/content')
+        self.assertEqual(reply, x_send.return_value)
+
+    @patch(MODULE + '.time')
+    @patch('os.path.lexists', Mock(return_value=False))
+    @patch('os.path.realpath', Mock(side_effect=lambda p: '/var/lib/pulp/published/content'))
+    def test_resolve_expired(self, mock_time):
+        mock_time.time.return_value = 100
+        view = ContentView()
+        path = '/var/www/pub/content'
+
+        self.assertEqual(view.resolve(path).action, content_views.SERVE_NOT_FOUND)
+        with patch('os.path.lexists', Mock(return_value=True)):
+            with patch('os.path.isdir', Mock(return_value=True)):
+                mock_time.time.return_value = 104
+                self.assertEqual(view.resolve(path).action, content_views.SERVE_NOT_FOUND)
+                mock_time.time.return_value = 105
+                self.assertEqual(view.resolve(path).action, content_views.SERVE_DIRECTORY)
+
+
+class TestDirectoryIndex(TestCase):
+
+    def setUp(self):
+        content_views._directory_index_cache.clear()
+        self.working_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.working_dir, 'dir'))
+        open(os.path.join(self.working_dir, 'file'), 'w').close()
+        os.symlink(os.path.join(self.working_dir, 'dir'), os.path.join(self.working_dir, 'link'))
+        os.symlink(os.path.join(self.working_dir, 'missing'),
+                   os.path.join(self.working_dir, 'broken'))
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def test_list_directory(self):
+        dirs, files = ContentView.list_directory(self.working_dir)
+
+        self.assertEqual(sorted(dirs), ['dir', 'link'])
+        self.assertEqual(files, ['file'])
+
+    @patch(MODULE + '.scandir', None)
+    def test_list_directory_no_scandir(self):
+        dirs, files = ContentView.list_directory(self.working_dir)
+
+        self.assertEqual(sorted(dirs), ['dir', 'link'])
+        self.assertEqual(files, ['file'])
+
+    @patch(MODULE + '.render_to_response')
+    def test_directory_index_cached(self, render):
+        """
+        The index is rendered again only once the directory has been modified.
+        """
+        render.return_value = content_views.HttpResponse('index', content_type='text/html')
+        mtime = time.time() - 10
+        os.utime(self.working_dir, (mtime, mtime))
+
+        ContentView.directory_index(self.working_dir)
+        reply = ContentView.directory_index(self.working_dir)
+        render.assert_called_once_with('directory_index.html', {'dirs': ['dir', 'link'],
+                                                                'files': ['file']})
+        self.assertEqual(reply.content, 'index')
+
+        os.utime(self.working_dir, (mtime + 1, mtime + 1))
+        ContentView.directory_index(self.working_dir)
+        self.assertEqual(render.call_count, 2)
+
+    @patch(MODULE + '.render_to_response')
+    def test_directory_index_recently_modified(self, render):
+        """
+        The index of a directory modified within the last second is not cached.
+        """
+        render.return_value = content_views.HttpResponse('index', content_type='text/html')
+
+        ContentView.directory_index(self.working_dir)
+        ContentView.directory_index(self.working_dir)
+
+        self.assertEqual(render.call_count, 2)
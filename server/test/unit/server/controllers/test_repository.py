@@ -1,13 +1,18 @@
 import datetime
+import hashlib
 import inspect
+import os
+import shutil
+import tempfile
 
 from bson.objectid import InvalidId
 from mock import call, Mock, MagicMock, patch
 import mock
 import mongoengine
 
-from pulp.common import dateutils, error_codes
+from pulp.common import constants, dateutils, error_codes
 from pulp.common.compat import unittest
+from pulp.common.plugins import reporting_constants
 from pulp.plugins.loader import exceptions as plugin_exceptions
 from pulp.plugins.model import PublishReport
 from pulp.server.controllers import repository as repo_controller
@@ -339,13 +344,29 @@ class UpdateRepoUnitCountsTests(unittest.TestCase):
         self.assertDictEqual(repo.content_unit_counts, {'type_1': 5, 'type_2': 3})
         repo.save.assert_called_once_with()
 
+    @patch('pulp.server.controllers.repository._content_fingerprints')
+    @patch('pulp.server.controllers.repository.connection.get_database')
+    def test_flushes_content_fingerprints(self, mock_get_db, mock_fingerprints):
+        """
+        Test that the buffered fingerprint updates are written when the counts are rebuilt.
+        """
+        mock_get_db.return_value.command.return_value = {'result': []}
+
+        repo_controller.rebuild_content_unit_counts(MagicMock(repo_id='foo'))
+
+        mock_fingerprints.flush.assert_called_once_with()
+
 
 class AssociateSingleUnitTests(unittest.TestCase):
 
+    @patch('pulp.server.controllers.repository.record_content_changes')
+    @patch('pulp.server.controllers.repository._content_fingerprints')
     @patch('pulp.server.controllers.repository.model.RepositoryContentUnit.objects')
     @patch('pulp.server.controllers.repository.dateutils.format_iso8601_utc_timestamp')
-    def test_unit_association(self, mock_get_timestamp, mock_rcu_objects):
+    def test_unit_association(self, mock_get_timestamp, mock_rcu_objects, mock_fingerprints,
+                              mock_record):
         mock_get_timestamp.return_value = 'foo_tstamp'
+        mock_rcu_objects.return_value.modify.return_value = None
         test_unit = DemoModel(id='bar', key_field='baz')
         repo = MagicMock(repo_id='foo')
         repo_controller.associate_single_unit(repo, test_unit)
@@ -354,25 +375,221 @@ class AssociateSingleUnitTests(unittest.TestCase):
             unit_id='bar',
             unit_type_id=DemoModel._content_type_id.default
         )
-        mock_rcu_objects.return_value.update_one.assert_called_once_with(
+        mock_rcu_objects.return_value.modify.assert_called_once_with(
             set_on_insert__created='foo_tstamp',
             set__updated='foo_tstamp',
             upsert=True)
+        mock_fingerprints.add.assert_called_once_with('foo', DemoModel._content_type_id.default,
+                                                      'bar')
+        mock_record.assert_called_once_with('foo', DemoModel._content_type_id.default, ['bar'],
+                                            model.RepositoryContentChange.ACTION_ADDED)
+
+    @patch('pulp.server.controllers.repository.record_content_changes')
+    @patch('pulp.server.controllers.repository._content_fingerprints')
+    @patch('pulp.server.controllers.repository.model.RepositoryContentUnit.objects')
+    def test_existing_unit_association(self, mock_rcu_objects, mock_fingerprints, mock_record):
+        """
+        Test that the content fingerprint is not changed if the unit was already associated,
+        but that the unit is still journaled.
+        """
+        mock_rcu_objects.return_value.modify.return_value = Mock()
+        test_unit = DemoModel(id='bar', key_field='baz')
+        repo = MagicMock(repo_id='foo')
+        repo_controller.associate_single_unit(repo, test_unit)
+        self.assertFalse(mock_fingerprints.add.called)
+        mock_record.assert_called_once_with('foo', DemoModel._content_type_id.default, ['bar'],
+                                            model.RepositoryContentChange.ACTION_ADDED)
+
+
+@patch('pulp.server.controllers.repository.os.urandom', Mock(return_value='\x00' * 7 + '\x05'))
+@patch('pulp.server.controllers.repository.model.Repository._get_collection')
+class TestContentFingerprintBuffer(unittest.TestCase):
+    """
+    Tests for the buffer of fingerprint updates of units associated one at a time.
+    """
+
+    def test_add_offsets_fingerprint(self, m_get_collection):
+        """
+        Test that the fingerprint is offset once per repository until the buffer is written.
+        """
+        buf = repo_controller.ContentFingerprintBuffer()
+
+        buf.add('foo', 'rpm', 'a')
+        buf.add('foo', 'rpm', 'b')
+
+        m_get_collection.return_value.update_one.assert_called_once_with(
+            {'repo_id': 'foo'}, {'$bit': {'content_fingerprint': {'xor': 5}}})
+
+    def test_flush(self, m_get_collection):
+        """
+        Test that the offset and the updates of the units are written together.
+        """
+        buf = repo_controller.ContentFingerprintBuffer()
+        buf.add('foo', 'rpm', 'a')
+        buf.add('foo', 'srpm', 'c')
+
+        buf.flush()
+
+        delta = (repo_controller.calculate_content_fingerprint('rpm', ['a']) ^
+                 repo_controller.calculate_content_fingerprint('srpm', ['c']))
+        m_get_collection.return_value.update_one.assert_called_with(
+            {'repo_id': 'foo'}, {'$bit': {'content_fingerprint': {'xor': 5 ^ delta}}})
+
+        buf.flush()
+        self.assertEqual(m_get_collection.return_value.update_one.call_count, 2)
+
+    def test_add_flushes_when_full(self, m_get_collection):
+        """
+        Test that the buffer is written once it holds the maximum number of updates.
+        """
+        buf = repo_controller.ContentFingerprintBuffer(max_size=2)
+
+        buf.add('foo', 'rpm', 'a')
+        buf.add('bar', 'rpm', 'b')
+
+        # One offset per repository, then one write per repository
+        self.assertEqual(m_get_collection.return_value.update_one.call_count, 4)
+
+    def test_flush_failure_keeps_updates(self, m_get_collection):
+        """
+        Test that updates that could not be written are written by the next flush.
+        """
+        buf = repo_controller.ContentFingerprintBuffer()
+        buf.add('foo', 'rpm', 'a')
+        m_get_collection.return_value.update_one.side_effect = [Exception('down'), None]
+
+        self.assertRaises(Exception, buf.flush)
+        buf.flush()
+
+        delta = repo_controller.calculate_content_fingerprint('rpm', ['a'])
+        self.assertEqual(m_get_collection.return_value.update_one.call_args_list, [
+            call({'repo_id': 'foo'}, {'$bit': {'content_fingerprint': {'xor': 5}}}),
+            call({'repo_id': 'foo'}, {'$bit': {'content_fingerprint': {'xor': 5 ^ delta}}}),
+            call({'repo_id': 'foo'}, {'$bit': {'content_fingerprint': {'xor': 5 ^ delta}}})])
 
 
 class TestDisassociateUnits(unittest.TestCase):
 
+    @patch('pulp.server.controllers.repository.update_content_fingerprint')
+    @patch('pulp.server.controllers.repository.record_content_changes')
     @patch('pulp.server.controllers.repository.model.RepositoryContentUnit.objects')
-    def test_disaccociate_units(self, m_rcu_objects):
+    def test_disaccociate_units(self, m_rcu_objects, m_record, m_fingerprint):
         """"
         Test that multiple objects are all deleted
         """
         test_unit1 = DemoModel(id='bar', key_field='baz')
         test_unit2 = DemoModel(id='baz', key_field='baz')
         repo = MagicMock(repo_id='foo')
+        m_rcu_objects.return_value.only.return_value = [
+            Mock(unit_id='bar', unit_type_id=DemoModel._content_type_id.default)]
         repo_controller.disassociate_units(repo, [test_unit1, test_unit2])
         m_rcu_objects.assert_called_once_with(repo_id='foo', unit_id__in=['bar', 'baz'])
         m_rcu_objects.return_value.delete.assert_called_once()
+        # Only the units that were associated change the fingerprint
+        m_fingerprint.assert_called_once_with('foo', DemoModel._content_type_id.default, ['bar'])
+        m_record.assert_called_once_with(
+            'foo', DemoModel._content_type_id.default, ['bar', 'baz'],
+            model.RepositoryContentChange.ACTION_REMOVED)
+
+
+class TestContentChanges(unittest.TestCase):
+    """
+    Tests for the repository content change journal.
+    """
+
+    @patch('pulp.server.controllers.repository.model.RepositoryContentChange._get_collection')
+    def test_record_content_changes(self, m_get_collection):
+        """
+        Test that every unit is upserted into the journal with a single bulk write per page.
+        """
+        repo_controller.record_content_changes(
+            'foo', 'rpm', ['unit-1', 'unit-2'], model.RepositoryContentChange.ACTION_ADDED)
+
+        self.assertEqual(m_get_collection.return_value.bulk_write.call_count, 1)
+        requests = m_get_collection.return_value.bulk_write.call_args[0][0]
+        self.assertEqual([r._filter for r in requests],
+                         [{'repo_id': 'foo', 'unit_type_id': 'rpm', 'unit_id': 'unit-1'},
+                          {'repo_id': 'foo', 'unit_type_id': 'rpm', 'unit_id': 'unit-2'}])
+        self.assertEqual(requests[0]._doc['$set']['action'], 'added')
+        self.assertTrue(requests[0]._upsert)
+
+    @patch('pulp.server.controllers.repository.model.RepositoryContentChange.objects')
+    def test_get_content_changes(self, m_objects):
+        """
+        Test that the changes are split into added units by type and removed unit ids.
+        """
+        m_objects.return_value.only.return_value = [
+            Mock(unit_id='unit-1', unit_type_id='rpm', action='added'),
+            Mock(unit_id='unit-2', unit_type_id='erratum', action='added'),
+            Mock(unit_id='unit-3', unit_type_id='rpm', action='removed')]
+
+        added, removed = repo_controller.get_content_changes('foo', 'now')
+
+        m_objects.assert_called_once_with(repo_id='foo', updated__lte='now')
+        self.assertEqual(added, {'rpm': ['unit-1'], 'erratum': ['unit-2']})
+        self.assertEqual(removed, set(['unit-3']))
+
+    @patch('pulp.server.controllers.repository.model.RepositoryContentChange.objects')
+    def test_clear_content_changes(self, m_objects):
+        """
+        Test that only the changes recorded before the given time are removed.
+        """
+        repo_controller.clear_content_changes('foo', 'now')
+
+        m_objects.assert_called_once_with(repo_id='foo', updated__lte='now')
+        m_objects.return_value.delete.assert_called_once_with()
+
+
+class TestContentFingerprint(unittest.TestCase):
+    """
+    Tests for the repository content fingerprint.
+    """
+
+    def test_calculate_content_fingerprint_order_independent(self):
+        """
+        Test that the fingerprint of a set of units does not depend on their order.
+        """
+        fingerprint = repo_controller.calculate_content_fingerprint('rpm', ['a', 'b', 'c'])
+
+        self.assertNotEqual(fingerprint, 0)
+        self.assertEqual(fingerprint,
+                         repo_controller.calculate_content_fingerprint('rpm', ['c', 'a', 'b']))
+        self.assertNotEqual(fingerprint,
+                            repo_controller.calculate_content_fingerprint('srpm', ['a', 'b', 'c']))
+
+    def test_calculate_content_fingerprint_incremental(self):
+        """
+        Test that adding and then removing units restores the previous fingerprint.
+        """
+        fingerprint = repo_controller.calculate_content_fingerprint('rpm', ['a', 'b'])
+        added = fingerprint ^ repo_controller.calculate_content_fingerprint('rpm', ['c'])
+
+        self.assertEqual(added,
+                         repo_controller.calculate_content_fingerprint('rpm', ['a', 'b', 'c']))
+        self.assertEqual(added ^ repo_controller.calculate_content_fingerprint('rpm', ['c']),
+                         fingerprint)
+        self.assertTrue(-2 ** 63 <= added < 2 ** 63)
+
+    @patch('pulp.server.controllers.repository.model.Repository._get_collection')
+    def test_update_content_fingerprint(self, m_get_collection):
+        """
+        Test that the fingerprint is updated atomically on the repository.
+        """
+        repo_controller.update_content_fingerprint('foo', 'rpm', ['a', 'b'])
+
+        m_get_collection.return_value.update_one.assert_called_once_with(
+            {'repo_id': 'foo'},
+            {'$bit': {'content_fingerprint': {
+                'xor': repo_controller.calculate_content_fingerprint('rpm', ['a', 'b'])}}})
+
+    @patch('pulp.server.controllers.repository.model.Repository._get_collection')
+    def test_update_content_fingerprint_no_units(self, m_get_collection):
+        """
+        Test that the repository is not updated if no units changed.
+        """
+        repo_controller.update_content_fingerprint('foo', 'rpm', [])
+
+        self.assertFalse(m_get_collection.called)
 
 
 @mock.patch('pulp.server.controllers.repository.dist_controller')
@@ -1656,86 +1873,179 @@ class TestQueueDownloadRepo(unittest.TestCase):
         )
 
 
+@patch(MODULE + 'pulp_conf.get', Mock(return_value='2'))
+@patch(MODULE + 'get_current_task_id', Mock(return_value='task-id'))
+@patch(MODULE + '_release_stale_deferred_claims')
+@patch(MODULE + 'model.DeferredDownload')
 class TestDownloadDeferred(unittest.TestCase):
 
     @patch(MODULE + 'LazyUnitDownloadStep')
     @patch(MODULE + '_create_download_requests')
     @patch(MODULE + '_get_deferred_content_units')
-    def test_download_deferred(self, mock_get_deferred, mock_create_requests, mock_step):
-        """Assert the download step is initialized and called."""
+    def test_download_deferred(self, mock_get_deferred, mock_create_requests, mock_step,
+                               mock_deferred, mock_release):
+        """Assert each claimed batch is downloaded by the step and then deleted."""
+        batches = [[Mock(id=1), Mock(id=2)], [Mock(id=3)], []]
+        mock_deferred.objects.claim.side_effect = batches
+
+        repo_controller.download_deferred()
+
+        mock_release.assert_called_once_with()
+        self.assertEqual(mock_deferred.objects.claim.call_args_list,
+                         [call('task-id', 2)] * 3)
+        self.assertEqual(mock_get_deferred.call_args_list, [call(batches[0]), call(batches[1])])
+        self.assertEqual(mock_step.return_value.download_batch.call_count, 2)
+        mock_step.return_value.download_batch.assert_called_with(
+            mock_create_requests.return_value)
+        self.assertEqual(mock_deferred.objects.call_args_list,
+                         [call(id__in=[1, 2]), call(id__in=[3])])
+        self.assertEqual(mock_deferred.objects.return_value.delete.call_count, 2)
+        self.assertFalse(mock_step.return_value.start.called)
+
+    @patch(MODULE + 'LazyUnitDownloadStep')
+    def test_download_deferred_nothing(self, mock_step, mock_deferred, mock_release):
+        """Assert the step reports completion when there is nothing to download."""
+        mock_deferred.objects.claim.return_value = []
+
         repo_controller.download_deferred()
-        mock_create_requests.assert_called_once_with(mock_get_deferred.return_value)
+
         mock_step.return_value.start.assert_called_once_with()
+        self.assertFalse(mock_step.return_value.download_batch.called)
+
+
+class TestReleaseStaleDeferredClaims(unittest.TestCase):
+
+    @patch(MODULE + 'model')
+    def test_release(self, mock_model):
+        """Assert only the claims of tasks that are not running are released."""
+        mock_model.DeferredDownload.objects.distinct.return_value = [None, 'running', 'gone']
+        mock_model.TaskStatus.objects.return_value.distinct.return_value = ['running']
+
+        repo_controller._release_stale_deferred_claims()
+
+        mock_model.TaskStatus.objects.assert_called_once_with(
+            task_id__in=['running', 'gone'], state__nin=constants.CALL_COMPLETE_STATES)
+        mock_model.DeferredDownload.objects.release_claims.assert_called_once_with(['gone'])
+
+    @patch(MODULE + 'model')
+    def test_no_claims(self, mock_model):
+        mock_model.DeferredDownload.objects.distinct.return_value = [None]
+
+        repo_controller._release_stale_deferred_claims()
+
+        self.assertFalse(mock_model.TaskStatus.objects.called)
+        self.assertFalse(mock_model.DeferredDownload.objects.release_claims.called)
+
+
+class TestDeleteDeferredDownloads(unittest.TestCase):
+
+    @patch(MODULE + 'model.DeferredDownload')
+    def test_delete(self, mock_deferred):
+        """Assert the entries are deleted with one query per type."""
+        requests = [
+            Mock(data={repo_controller.TYPE_ID: 'abc', repo_controller.UNIT_ID: '1'}),
+            Mock(data={repo_controller.TYPE_ID: 'abc', repo_controller.UNIT_ID: '1'}),
+        ]
+
+        repo_controller._delete_deferred_downloads(requests)
+
+        mock_deferred.objects.filter.assert_called_once_with(unit_id__in=('1',),
+                                                             unit_type_id='abc')
+        mock_deferred.objects.filter.return_value.delete.assert_called_once_with()
 
 
 class TestDownloadRepo(unittest.TestCase):
 
+    @patch(MODULE + 'missing_unit_count', Mock(return_value=7))
     @patch(MODULE + 'LazyUnitDownloadStep')
-    @patch(MODULE + '_create_download_requests')
+    @patch(MODULE + '_stream_download_requests')
     @patch(MODULE + 'find_units_not_downloaded')
-    def test_download_repo_no_verify(self, mock_missing_units, mock_create_requests, mock_step):
+    def test_download_repo_no_verify(self, mock_missing_units, mock_stream_requests, mock_step):
         """Assert the download step is initialized and called with missing units."""
         repo_controller.download_repo('fake-id')
         mock_missing_units.assert_called_once_with('fake-id')
-        mock_create_requests.assert_called_once_with(mock_missing_units.return_value)
+        mock_stream_requests.assert_called_once_with(mock_missing_units.return_value)
+        mock_step.assert_called_once_with('background_download', 'Download Repository Content',
+                                          mock_stream_requests.return_value, total_units=7)
         mock_step.return_value.start.assert_called_once_with()
 
+    @patch(MODULE + '_file_unit_count', Mock(return_value=2))
     @patch(MODULE + 'LazyUnitDownloadStep')
-    @patch(MODULE + '_create_download_requests')
+    @patch(MODULE + '_stream_download_requests')
     @patch(MODULE + 'get_mongoengine_unit_querysets')
-    def test_download_repo_verify(self, mock_units_qs, mock_create_requests, mock_step):
+    def test_download_repo_verify(self, mock_units_qs, mock_stream_requests, mock_step):
         """Assert the download step is initialized and called with all units."""
         mock_units_qs.return_value = [['some'], ['lists']]
         repo_controller.download_repo('fake-id', verify_all_units=True)
         mock_units_qs.assert_called_once_with('fake-id')
-        self.assertEqual(list(mock_create_requests.call_args[0][0]), ['some', 'lists'])
+        self.assertEqual(list(mock_stream_requests.call_args[0][0]), ['some', 'lists'])
+        self.assertEqual(mock_step.call_args[1], {'total_units': 2})
         mock_step.return_value.start.assert_called_once_with()
 
 
+class TestFileUnitCount(unittest.TestCase):
+
+    @patch(MODULE + 'model.RepositoryContentUnit')
+    @patch(MODULE + 'model.FileContentUnit', type('FileContentUnit', (object,), {}))
+    @patch(MODULE + 'get_repo_unit_models')
+    def test_count(self, mock_get_models, mock_rcu):
+        """Assert only the units of types with files are counted, with one query."""
+        file_model = type('FileModel', (repo_controller.model.FileContentUnit,),
+                          {'_content_type_id': Mock(default='file_type')})
+        mock_get_models.return_value = [file_model, DemoModel]
+
+        count = repo_controller._file_unit_count('fake-id')
+
+        self.assertEqual(count, mock_rcu.objects.return_value.count.return_value)
+        mock_rcu.objects.assert_called_once_with(repo_id='fake-id',
+                                                 unit_type_id__in=['file_type'])
+
+    @patch(MODULE + 'model.RepositoryContentUnit')
+    @patch(MODULE + 'get_repo_unit_models', Mock(return_value=[]))
+    def test_no_file_units(self, mock_rcu):
+        self.assertEqual(repo_controller._file_unit_count('fake-id'), 0)
+        self.assertFalse(mock_rcu.objects.called)
+
+
 class TestGetDeferredContentUnits(unittest.TestCase):
 
     @patch(MODULE + 'plugin_api.get_unit_model_by_id')
-    @patch(MODULE + 'model.DeferredDownload')
-    def test_get_deferred_content_units(self, mock_qs, mock_get_model):
+    def test_get_deferred_content_units(self, mock_get_model):
         # Setup
-        mock_unit = Mock(unit_type_id='abc', unit_id='123')
-        mock_qs.objects.filter.return_value = [mock_unit]
+        deferred = [Mock(unit_type_id='abc', unit_id='123'),
+                    Mock(unit_type_id='abc', unit_id='456')]
+        mock_unit = Mock(id='123')
+        mock_get_model.return_value.objects.filter.return_value = [mock_unit]
 
         # Test
-        result = list(repo_controller._get_deferred_content_units())
-        self.assertEqual(1, len(result))
+        result = list(repo_controller._get_deferred_content_units(deferred))
+        self.assertEqual([mock_unit], result)
         mock_get_model.assert_called_once_with('abc')
         unit_filter = mock_get_model.return_value.objects.filter
-        unit_filter.assert_called_once_with(id='123')
-        unit_filter.return_value.get.assert_called_once_with()
+        self.assertEqual(sorted(unit_filter.call_args[1]['id__in']), ['123', '456'])
 
     @patch(MODULE + '_logger.error')
     @patch(MODULE + 'plugin_api.get_unit_model_by_id')
-    @patch(MODULE + 'model.DeferredDownload')
-    def test_get_deferred_content_units_no_model(self, mock_qs, mock_get_model, mock_log):
+    def test_get_deferred_content_units_no_model(self, mock_get_model, mock_log):
         # Setup
-        mock_unit = Mock(unit_type_id='abc', unit_id='123')
-        mock_qs.objects.filter.return_value = [mock_unit]
+        deferred = [Mock(unit_type_id='abc', unit_id='123')]
         mock_get_model.return_value = None
 
         # Test
-        result = list(repo_controller._get_deferred_content_units())
+        result = list(repo_controller._get_deferred_content_units(deferred))
         self.assertEqual(0, len(result))
         mock_log.assert_called_once_with('Unable to find the model object for the abc type.')
         mock_get_model.assert_called_once_with('abc')
 
     @patch(MODULE + '_logger.debug')
     @patch(MODULE + 'plugin_api.get_unit_model_by_id')
-    @patch(MODULE + 'model.DeferredDownload')
-    def test_get_deferred_content_units_no_unit(self, mock_qs, mock_get_model, mock_log):
+    def test_get_deferred_content_units_no_unit(self, mock_get_model, mock_log):
         # Setup
-        mock_unit = Mock(unit_type_id='abc', unit_id='123')
-        mock_qs.objects.filter.return_value = [mock_unit]
-        unit_qs = mock_get_model.return_value.objects.filter.return_value
-        unit_qs.get.side_effect = mongoengine.DoesNotExist()
+        deferred = [Mock(unit_type_id='abc', unit_id='123')]
+        mock_get_model.return_value.objects.filter.return_value = []
 
         # Test
-        result = list(repo_controller._get_deferred_content_units())
+        result = list(repo_controller._get_deferred_content_units(deferred))
         self.assertEqual(0, len(result))
         mock_log.assert_called_once_with('Unable to find the abc:123 content unit.')
         mock_get_model.assert_called_once_with('abc')
@@ -1743,17 +2053,18 @@ class TestGetDeferredContentUnits(unittest.TestCase):
 
 class TestCreateDownloadRequests(unittest.TestCase):
 
-    @patch(MODULE + 'Key.load', Mock())
+    @patch(MODULE + 'signing_service', Mock())
     @patch(MODULE + 'common_utils.get_working_directory', Mock(return_value='/working/'))
     @patch(MODULE + 'mkdir')
     @patch(MODULE + '_get_streamer_url')
     @patch(MODULE + 'model.LazyCatalogEntry')
     def test_create_download_requests(self, mock_catalog, mock_get_url, mock_mkdir):
         # Setup
-        content_units = [Mock(id='123', type_id='abc', list_files=lambda: ['/file/path'])]
-        filtered_qs = mock_catalog.objects.filter.return_value
-        catalog_entry = filtered_qs.order_by.return_value.first.return_value
-        catalog_entry.path = '/storage/123/path'
+        content_units = [Mock(id='123', type_id='abc', list_files=lambda: ['/file/path']),
+                         Mock(id='456', type_id='abc', list_files=lambda: ['/other/path'])]
+        catalog_entry = Mock(path='/storage/123/path')
+        mock_catalog.objects.find_entries_for_units.return_value = {
+            ('abc', '123', '/file/path'): catalog_entry}
         expected_data_dict = {
             repo_controller.TYPE_ID: 'abc',
             repo_controller.UNIT_ID: '123',
@@ -1768,19 +2079,156 @@ class TestCreateDownloadRequests(unittest.TestCase):
         # Test
         requests = repo_controller._create_download_requests(content_units)
         expected_data_dict[repo_controller.REQUEST] = requests[0]
-        mock_catalog.objects.filter.assert_called_once_with(
-            unit_id='123',
-            unit_type_id='abc',
-            path='/file/path'
-        )
-        filtered_qs.order_by.assert_called_once_with('revision')
-        filtered_qs.order_by.return_value.first.assert_called_once_with()
+        mock_catalog.objects.find_entries_for_units.assert_called_once_with(
+            tuple(content_units))
         mock_mkdir.assert_called_once_with('/working/123')
         self.assertEqual(1, len(requests))
         self.assertEqual(mock_get_url.return_value, requests[0].url)
         self.assertEqual('/working/123/path', requests[0].destination)
         self.assertEqual(expected_data_dict, requests[0].data)
 
+    @patch(MODULE + 'DOWNLOAD_REQUEST_WINDOW_SIZE', 1)
+    @patch(MODULE + 'signing_service', Mock())
+    @patch(MODULE + 'common_utils.get_working_directory', Mock(return_value='/working/'))
+    @patch(MODULE + 'mkdir', Mock())
+    @patch(MODULE + '_get_streamer_url', Mock())
+    @patch(MODULE + '_delete_deferred_downloads')
+    @patch(MODULE + 'model.LazyCatalogEntry')
+    def test_stream_download_requests(self, mock_catalog, mock_delete_deferred):
+        """Assert the requests are built one window at a time, as they are consumed."""
+        content_units = [Mock(id='123', type_id='abc', list_files=lambda: ['/file/path']),
+                         Mock(id='456', type_id='abc', list_files=lambda: ['/other/path'])]
+        mock_catalog.objects.find_entries_for_units.return_value = {
+            ('abc', '123', '/file/path'): Mock(path='/storage/123/path'),
+            ('abc', '456', '/other/path'): Mock(path='/storage/456/path')}
+
+        requests = repo_controller._stream_download_requests(content_units)
+        self.assertFalse(mock_catalog.objects.find_entries_for_units.called)
+
+        first = next(requests)
+        self.assertEqual(first.data[repo_controller.UNIT_ID], '123')
+        mock_catalog.objects.find_entries_for_units.assert_called_once_with(
+            (content_units[0],))
+        mock_delete_deferred.assert_called_once_with([first])
+
+        self.assertEqual([r.data[repo_controller.UNIT_ID] for r in requests], ['456'])
+        self.assertEqual(mock_catalog.objects.find_entries_for_units.call_count, 2)
+        self.assertEqual(mock_delete_deferred.call_count, 2)
+
+
+class TestVerifyExistingFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.working_dir, 'file')
+        with open(self.path, 'w') as f:
+            f.write('content')
+        self.checksum = hashlib.sha256('content').hexdigest()
+        self.catalog_entry = Mock(path=self.path, checksum_algorithm='sha256',
+                                  checksum=self.checksum)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def test_verify_file(self):
+        """Assert a valid file is recorded as verified."""
+        valid, verified_file = repo_controller._verify_file((self.catalog_entry, None))
+
+        self.assertTrue(valid)
+        self.assertEqual(verified_file['path'], self.path)
+        self.assertEqual(verified_file['size'], len('content'))
+        self.assertEqual(verified_file['checksum'], self.checksum)
+
+    def test_verify_file_invalid(self):
+        self.catalog_entry.checksum = 'wrong'
+
+        self.assertEqual(repo_controller._verify_file((self.catalog_entry, None)),
+                         (False, None))
+
+    def test_verify_file_missing(self):
+        self.catalog_entry.path = os.path.join(self.working_dir, 'missing')
+
+        self.assertEqual(repo_controller._verify_file((self.catalog_entry, None)),
+                         (False, None))
+
+    def test_verify_file_no_checksum(self):
+        self.catalog_entry.checksum = None
+
+        self.assertEqual(repo_controller._verify_file((self.catalog_entry, None)),
+                         (True, None))
+
+    @patch(MODULE + 'verify_checksum')
+    def test_verify_file_unchanged(self, mock_verify):
+        """Assert a file that was verified and has not changed is not read again."""
+        file_stat = os.stat(self.path)
+        verified_file = Mock(size=file_stat.st_size, mtime=file_stat.st_mtime,
+                             checksum_type='sha256', checksum=self.checksum)
+
+        self.assertEqual(repo_controller._verify_file((self.catalog_entry, verified_file)),
+                         (True, None))
+        self.assertFalse(mock_verify.called)
+
+    def test_verify_file_changed(self):
+        """Assert a file that changed since it was verified is verified again."""
+        verified_file = Mock(size=1, mtime=0, checksum_type='sha256', checksum=self.checksum)
+
+        valid, record = repo_controller._verify_file((self.catalog_entry, verified_file))
+        self.assertTrue(valid)
+        self.assertEqual(record['size'], len('content'))
+
+    @patch(MODULE + 'model.VerifiedFile')
+    def test_verify_existing_files(self, mock_verified_file):
+        """Assert the files are verified in the pool and the new results are recorded."""
+        missing = Mock(path=os.path.join(self.working_dir, 'missing'))
+        mock_verified_file.objects.return_value = []
+        pool = Mock()
+        pool.map.side_effect = map
+
+        valid_paths = repo_controller._verify_existing_files([self.catalog_entry, missing],
+                                                             pool)
+
+        self.assertEqual(valid_paths, set([self.path]))
+        mock_verified_file.objects.assert_called_once_with(path__in=[self.path, missing.path])
+        collection = mock_verified_file._get_collection.return_value
+        operations = collection.bulk_write.call_args[0][0]
+        self.assertEqual(len(operations), 1)
+        self.assertEqual(operations[0]._filter, {'path': self.path})
+
+
+class TestGenerateDownloadRequestWindows(unittest.TestCase):
+
+    @patch(MODULE + 'ThreadPool', Mock())
+    @patch(MODULE + 'signing_service', Mock())
+    @patch(MODULE + 'common_utils.get_working_directory', Mock(return_value='/working/'))
+    @patch(MODULE + 'mkdir', Mock())
+    @patch(MODULE + '_get_streamer_url', Mock())
+    @patch(MODULE + 'plugin_api.get_unit_model_by_id')
+    @patch(MODULE + '_verify_existing_files')
+    @patch(MODULE + 'model.LazyCatalogEntry')
+    def test_verify_existing(self, mock_catalog, mock_verify, mock_get_model):
+        """
+        Assert only the files that fail verification are requested, and units whose files are
+        all valid are marked as downloaded.
+        """
+        content_units = [Mock(id='123', type_id='abc', list_files=lambda: ['/a', '/b']),
+                         Mock(id='456', type_id='abc', list_files=lambda: ['/c'])]
+        mock_catalog.objects.find_entries_for_units.return_value = {
+            ('abc', '123', '/a'): Mock(path='/storage/a'),
+            ('abc', '123', '/b'): Mock(path='/storage/b'),
+            ('abc', '456', '/c'): Mock(path='/storage/c')}
+        mock_verify.return_value = set(['/storage/a', '/storage/c'])
+
+        windows = list(repo_controller._generate_download_request_windows(content_units, True))
+
+        self.assertEqual(len(windows), 1)
+        self.assertEqual([r.destination for r in windows[0]], ['/working/123/b'])
+        unit_files = windows[0][0].data[repo_controller.UNIT_FILES]
+        self.assertEqual(unit_files['/working/123/a'][repo_controller.PATH_DOWNLOADED], True)
+        self.assertEqual(unit_files['/working/123/b'][repo_controller.PATH_DOWNLOADED], False)
+        mock_get_model.return_value.objects.assert_called_once_with(id__in=['456'])
+        mock_get_model.return_value.objects.return_value.update.assert_called_once_with(
+            set__downloaded=True)
+
 
 class TestGetStreamerUrl(unittest.TestCase):
 
@@ -1872,36 +2320,100 @@ class TestLazyUnitDownloadStep(unittest.TestCase):
         """Assert calls to `_process_block` result in calls to the downloader."""
         self.step.downloader = Mock()
         self.step.start()
-        self.step.downloader.download.assert_called_once_with(self.step.download_requests)
+        requests = self.step.downloader.download.call_args[0][0]
+        self.assertEqual(list(requests), self.step.download_requests)
+
+    @patch(MODULE + 'get_reporter', Mock())
+    def test_start_estimated_total(self):
+        """Assert the estimated total is corrected once all the requests have been built."""
+        download_requests = iter([Mock(), Mock(), Mock()])
+        step = repo_controller.LazyUnitDownloadStep('test_step', 'Test Step', download_requests,
+                                                    total_units=2)
+        totals = []
+
+        def download(requests):
+            for request in requests:
+                totals.append(step.total_units)
+                self.assertEqual(step.state, reporting_constants.STATE_RUNNING)
+                step.progress_successes += 1
+                step.report()
+
+        step.downloader = Mock()
+        step.downloader.download.side_effect = download
+        step.start()
+
+        self.assertEqual(totals, [2, 2, 3])
+        self.assertEqual(step.total_units, 3)
+        self.assertEqual(step.state, reporting_constants.STATE_COMPLETE)
+
+    @patch(MODULE + 'get_reporter')
+    def test_report(self, mock_get_reporter):
+        """Assert the progress is given to the task's reporter, flushing on state changes."""
+        self.step.task_id = 'task'
+        self.step.state = reporting_constants.STATE_RUNNING
+
+        self.step.report()
+        self.step.report()
+
+        mock_get_reporter.assert_called_with('task')
+        calls = mock_get_reporter.return_value.update.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0][0][0], 'test_step')
+        self.assertEqual(calls[0][0][1][0][reporting_constants.PROGRESS_STATE_KEY],
+                         reporting_constants.STATE_RUNNING)
+        self.assertEqual([call[1]['flush'] for call in calls], [True, False])
+
+    @patch(MODULE + 'get_reporter')
+    def test_report_no_task(self, mock_get_reporter):
+        """Assert nothing is reported outside of a task."""
+        self.step.report()
+        self.assertFalse(mock_get_reporter.called)
+
+    def test_download_batch(self):
+        """Assert each batch is downloaded and counted in the progress."""
+        self.step.downloader = Mock()
+        self.step.report = Mock()
+        self.step.total_units = 1
+        batch = [Mock(), Mock()]
+
+        self.step.download_batch(batch)
+
+        self.assertEqual(self.step.total_units, 3)
+        self.assertEqual(self.step.state, reporting_constants.STATE_RUNNING)
+        self.assertEqual(list(self.step.downloader.download.call_args[0][0]), batch)
 
     @patch(MODULE + 'plugin_api.get_unit_model_by_id')
-    @patch(MODULE + 'model.DeferredDownload')
-    def test_download_started(self, mock_deferred_download, mock_get_model):
+    def test_download_started(self, mock_get_model):
         """Assert if validate_file raises an exception, the download is not skipped."""
         self.step.validate_file = Mock(side_effect=IOError)
 
         self.step.download_started(self.report)
-        qs = mock_deferred_download.objects.filter
-        qs.assert_called_once_with(unit_id='1234', unit_type_id='abc')
-        qs.return_value.delete.assert_called_once_with()
+        self.assertFalse(self.report.data[repo_controller.REQUEST].canceled)
 
     @patch(MODULE + 'plugin_api.get_unit_model_by_id')
-    @patch(MODULE + 'model.DeferredDownload')
-    def test_download_started_already_downloaded(self, mock_deferred_download, mock_get_model):
+    def test_download_started_already_downloaded(self, mock_get_model):
         """Assert if validate_file doesn't raise an exception, the download is skipped."""
         self.step.validate_file = Mock()
         model_qs = mock_get_model.return_value
 
         self.step.download_started(self.report)
         self.assertTrue(self.report.data[repo_controller.REQUEST].canceled)
-        qs = mock_deferred_download.objects.filter
-        qs.assert_called_once_with(unit_id='1234', unit_type_id='abc')
-        qs.return_value.delete.assert_called_once_with()
         self.assertEqual(
             {'set__downloaded': True},
             model_qs.objects.filter.return_value.update_one.call_args_list[0][1]
         )
 
+    @patch(MODULE + 'plugin_api.get_unit_model_by_id', Mock())
+    def test_download_started_failed_verification(self):
+        """Assert files that have already failed verification are not validated again."""
+        self.step.validate_file = Mock()
+        self.data[repo_controller.UNIT_FILES]['/no/where'][repo_controller.PATH_DOWNLOADED] = \
+            False
+
+        self.step.download_started(self.report)
+        self.assertFalse(self.step.validate_file.called)
+        self.assertFalse(self.report.data[repo_controller.REQUEST].canceled)
+
     @patch(MODULE + 'os.path.relpath', Mock(return_value='filename'))
     @patch(MODULE + 'plugin_api.get_unit_model_by_id')
     def test_download_succeeded(self, mock_get_model):
@@ -0,0 +1,52 @@
+import hashlib
+import struct
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from pulp.server.db.migrate.models import MigrationModule
+
+MIGRATION = 'pulp.server.db.migrations.0028_repo_content_fingerprint'
+
+
+class TestMigration(TestCase):
+    """
+    Test the migration.
+    """
+
+    @patch('.'.join((MIGRATION, 'get_collection')))
+    def test_migrate(self, m_get_collection):
+        """
+        Test that the content fingerprint is calculated from the associations of each repo.
+        """
+        repo_collection = Mock()
+        repo_collection.find.return_value = [{'_id': 'id-1', 'repo_id': 'repo-1'},
+                                             {'_id': 'id-2', 'repo_id': 'repo-2'}]
+        association_collection = Mock()
+        associations = {
+            'repo-1': [{'unit_id': 'unit-1', 'unit_type_id': 'rpm'},
+                       {'unit_id': 'unit-2', 'unit_type_id': 'erratum'}],
+            'repo-2': [{'unit_id': 'unit-2', 'unit_type_id': 'erratum'},
+                       {'unit_id': 'unit-1', 'unit_type_id': 'rpm'}],
+        }
+        association_collection.find.side_effect = lambda spec, projection: \
+            associations[spec['repo_id']]
+        m_get_collection.side_effect = {'repos': repo_collection,
+                                        'repo_content_units': association_collection}.get
+
+        # test
+        module = MigrationModule(MIGRATION)._module
+        module.migrate()
+
+        # validation
+        self.assertEqual(repo_collection.update_one.call_count, 2)
+        fingerprints = [c[0][1]['$set']['content_fingerprint']
+                        for c in repo_collection.update_one.call_args_list]
+        expected = 0
+        for unit in ('rpm:unit-1', 'erratum:unit-2'):
+            expected ^= struct.unpack('>q', hashlib.sha256(unit).digest()[:8])[0]
+        self.assertEqual(fingerprints[0], expected)
+        # The same units in a different order result in the same fingerprint
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        repo_collection.update_one.assert_any_call(
+            {'_id': 'id-1'}, {'$set': {'content_fingerprint': fingerprints[0]}})
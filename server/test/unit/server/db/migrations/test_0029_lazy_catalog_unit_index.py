@@ -0,0 +1,38 @@
+"""
+This module contains tests for pulp.server.db.migrations.0029_lazy_catalog_unit_index.
+"""
+import unittest
+
+from mock import patch
+
+from pulp.server.db.migrate.models import _import_all_the_way
+
+migration = _import_all_the_way('pulp.server.db.migrations.0029_lazy_catalog_unit_index')
+
+
+class TestMigrate(unittest.TestCase):
+
+    @patch.object(migration.connection, 'get_database')
+    def test_migrate_no_collection_in_db(self, mock_get_database):
+        """
+        Test that nothing is done if the collection does not exist.
+        """
+        mock_get_database.return_value.collection_names.return_value = []
+
+        migration.migrate()
+
+        self.assertFalse(mock_get_database.return_value.__getitem__.called)
+
+    @patch.object(migration.connection, 'get_database')
+    def test_migrate_creates_index(self, mock_get_database):
+        """
+        Test that the unit index is created.
+        """
+        mock_get_database.return_value.collection_names.return_value = ['lazy_content_catalog']
+        collection = mock_get_database.return_value['lazy_content_catalog']
+
+        migration.migrate()
+
+        collection.create_index.assert_called_once_with(
+            [('unit_id', 1), ('unit_type_id', 1), ('path', 1), ('revision', -1)],
+            background=True)
@@ -0,0 +1,39 @@
+"""
+This module contains tests for pulp.server.db.migrations.0030_task_status_list_indexes.
+"""
+import unittest
+
+from mock import call, patch
+
+from pulp.server.db.migrate.models import _import_all_the_way
+
+migration = _import_all_the_way('pulp.server.db.migrations.0030_task_status_list_indexes')
+
+
+class TestMigrate(unittest.TestCase):
+
+    @patch.object(migration.connection, 'get_database')
+    def test_migrate_no_collection_in_db(self, mock_get_database):
+        """
+        Test that nothing is done if the collection does not exist.
+        """
+        mock_get_database.return_value.collection_names.return_value = []
+
+        migration.migrate()
+
+        self.assertFalse(mock_get_database.return_value.__getitem__.called)
+
+    @patch.object(migration.connection, 'get_database')
+    def test_migrate_creates_indexes(self, mock_get_database):
+        """
+        Test that the task list indexes are created.
+        """
+        mock_get_database.return_value.collection_names.return_value = ['task_status']
+        collection = mock_get_database.return_value['task_status']
+
+        migration.migrate()
+
+        self.assertEqual(collection.create_index.call_args_list, [
+            call([('state', 1), ('_id', 1)], background=True),
+            call([('start_time', -1)], background=True),
+            call([('finish_time', -1)], background=True)])
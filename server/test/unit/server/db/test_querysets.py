@@ -124,3 +124,98 @@ class TestReqoQuerySet(unittest.TestCase):
         qs.get = mock_get
         self.assertRaises(pulp_exceptions.MissingResource, qs.get_repo_or_missing_resource, 'repo')
         mock_get.assert_called_once_with(repo_id='repo')
+
+
+class TestLazyCatalogEntryQuerySet(unittest.TestCase):
+    """
+    Tests for the lazy catalog entry custom query set.
+    """
+
+    def test_find_entries_for_units(self):
+        """
+        Assert the entries of the units are found with one query per type, and that the entry
+        with the highest revision is returned for each file.
+        """
+        qs = querysets.LazyCatalogEntryQuerySet(mock.MagicMock(), mock.MagicMock())
+        units = [mock.Mock(id='1', type_id='rpm'), mock.Mock(id='2', type_id='rpm'),
+                 mock.Mock(id='3', type_id='drpm')]
+        entries = {
+            'rpm': [mock.Mock(unit_id='1', unit_type_id='rpm', path='/a', revision=2),
+                    mock.Mock(unit_id='1', unit_type_id='rpm', path='/a', revision=3),
+                    mock.Mock(unit_id='1', unit_type_id='rpm', path='/a', revision=1),
+                    mock.Mock(unit_id='2', unit_type_id='rpm', path='/b', revision=1)],
+            'drpm': [],
+        }
+
+        with mock.patch.object(querysets.LazyCatalogEntryQuerySet, '__call__') as mock_call:
+            mock_call.side_effect = lambda unit_id__in, unit_type_id: entries[unit_type_id]
+            result = qs.find_entries_for_units(units)
+
+        self.assertEqual(result, {('rpm', '1', '/a'): entries['rpm'][1],
+                                  ('rpm', '2', '/b'): entries['rpm'][3]})
+        mock_call.assert_any_call(unit_id__in=['1', '2'], unit_type_id='rpm')
+        mock_call.assert_any_call(unit_id__in=['3'], unit_type_id='drpm')
+        self.assertEqual(mock_call.call_count, 2)
+
+
+class TestDeferredDownloadQuerySet(unittest.TestCase):
+    """
+    Tests for the deferred download custom query set.
+    """
+
+    def setUp(self):
+        self.qs = querysets.DeferredDownloadQuerySet(mock.MagicMock(), mock.MagicMock())
+
+    def test_claim(self):
+        """
+        Assert unclaimed entries are claimed, and only the entries that were claimed are
+        returned.
+        """
+        candidates = [mock.Mock(id=1), mock.Mock(id=2)]
+        claimed = [mock.Mock(id=2)]
+
+        with mock.patch.object(querysets.DeferredDownloadQuerySet, '__call__') as mock_call:
+            mock_call.return_value.only.return_value.limit.return_value = candidates
+            mock_call.return_value.__iter__.return_value = iter(claimed)
+            result = self.qs.claim('task-id', 2)
+
+        self.assertEqual(result, claimed)
+        mock_call.return_value.only.return_value.limit.assert_called_once_with(2)
+        mock_call.assert_any_call(id__in=[1, 2], claimed_by=None)
+        mock_call.return_value.update.assert_called_once_with(set__claimed_by='task-id')
+        mock_call.assert_any_call(id__in=[1, 2], claimed_by='task-id')
+
+    def test_claim_retries_when_candidates_are_taken(self):
+        """
+        Assert the next unclaimed entries are tried when another task claims all of the
+        candidates first.
+        """
+        claimed = [mock.Mock(id=3)]
+
+        with mock.patch.object(querysets.DeferredDownloadQuerySet, '__call__') as mock_call:
+            mock_call.return_value.only.return_value.limit.side_effect = [
+                [mock.Mock(id=1), mock.Mock(id=2)], [mock.Mock(id=3)]]
+            mock_call.return_value.update.side_effect = [0, 1]
+            mock_call.return_value.__iter__.return_value = iter(claimed)
+            result = self.qs.claim('task-id', 2)
+
+        self.assertEqual(result, claimed)
+        mock_call.assert_any_call(id__in=[1, 2], claimed_by=None)
+        mock_call.assert_any_call(id__in=[3], claimed_by=None)
+        mock_call.assert_any_call(id__in=[3], claimed_by='task-id')
+        self.assertEqual(mock_call.return_value.update.call_count, 2)
+
+    def test_claim_nothing(self):
+        with mock.patch.object(querysets.DeferredDownloadQuerySet, '__call__') as mock_call:
+            mock_call.return_value.only.return_value.limit.return_value = []
+            result = self.qs.claim('task-id', 2)
+
+        self.assertEqual(result, [])
+        self.assertFalse(mock_call.return_value.update.called)
+
+    def test_release_claims(self):
+        with mock.patch.object(querysets.DeferredDownloadQuerySet, '__call__') as mock_call:
+            self.qs.release_claims(['task-id'])
+
+        mock_call.assert_called_once_with(claimed_by__in=['task-id'])
+        mock_call.return_value.update.assert_called_once_with(unset__claimed_by=True)
@@ -6,7 +6,8 @@ from M2Crypto import RSA
 
 from pulp.server.lazy.url import (
     NotValid, DecodingError, NotSigned, ResourceNotMatched, ExtensionNotMatched, PolicyMalformed,
-    PolicyNotAuthenticated, PolicyExpired, Base64, JSON, Policy, Query, Key, URL, SignedURL)
+    PolicyNotAuthenticated, PolicyExpired, Base64, JSON, Policy, Query, Key, URL, SignedURL,
+    SigningService)
 
 
 MODULE = 'pulp.server.lazy.url'
@@ -470,3 +471,125 @@ class TestSignedURL(TestCase):
         # test
         url = SignedURL('https://pulp.org{r}'.format(r=resource))
         self.assertRaises(ExtensionNotMatched, url.validate, key, remote_ip=remote_ip)
+
+
+class TestSigningService(TestCase):
+
+    @patch(MODULE + '.Key.load')
+    def test_key(self, load):
+        service = SigningService()
+
+        # test
+        key = service.key('/tmp/key.pem')
+        key_again = service.key('/tmp/key.pem')
+
+        # validation
+        load.assert_called_once_with('/tmp/key.pem')
+        self.assertEqual(key, load.return_value)
+        self.assertEqual(key_again, load.return_value)
+        self.assertEqual(service.loads, 1)
+
+    @patch(MODULE + '.Key.load', Mock())
+    @patch(MODULE + '.URL')
+    def test_sign_cached(self, url):
+        service = SigningService()
+        url.return_value.sign.side_effect = [Mock(), Mock()]
+
+        # test
+        signed = service.sign('http://pulp.org/a', '/tmp/key.pem', remote_ip='10.0.0.1')
+        signed_again = service.sign('http://pulp.org/a', '/tmp/key.pem', remote_ip='10.0.0.1')
+
+        # validation
+        url.return_value.sign.assert_called_once_with(
+            service.key('/tmp/key.pem'), expiration=90, remote_ip='10.0.0.1')
+        self.assertEqual(signed, signed_again)
+        self.assertEqual(service.hits, 1)
+        self.assertEqual(service.misses, 1)
+
+    @patch(MODULE + '.Key.load', Mock())
+    @patch(MODULE + '.URL')
+    def test_sign_per_client(self, url):
+        service = SigningService()
+        url.return_value.sign.side_effect = [Mock(), Mock()]
+
+        # test
+        signed = service.sign('http://pulp.org/a', '/tmp/key.pem', remote_ip='10.0.0.1')
+        signed_other = service.sign('http://pulp.org/a', '/tmp/key.pem', remote_ip='10.0.0.2')
+
+        # validation
+        self.assertNotEqual(signed, signed_other)
+        self.assertEqual(service.misses, 2)
+
+    @patch(MODULE + '.Key.load', Mock())
+    @patch(MODULE + '.URL')
+    def test_sign_per_key(self, url):
+        service = SigningService()
+        url.return_value.sign.side_effect = [Mock(), Mock()]
+
+        # test
+        signed = service.sign('http://pulp.org/a', '/tmp/key.pem')
+        signed_other = service.sign('http://pulp.org/a', '/tmp/new-key.pem')
+
+        # validation
+        self.assertNotEqual(signed, signed_other)
+        self.assertEqual(service.misses, 2)
+
+    @patch(MODULE + '.Key.load', Mock())
+    @patch(MODULE + '.time')
+    @patch(MODULE + '.URL')
+    def test_sign_near_expiry(self, url, time):
+        service = SigningService(reuse=0.5)
+        url.return_value.sign.side_effect = [Mock(), Mock(), Mock()]
+        time.return_value = 1000
+
+        # test
+        signed = service.sign('http://pulp.org/a', '/tmp/key.pem')
+        time.return_value = 1044
+        signed_reused = service.sign('http://pulp.org/a', '/tmp/key.pem')
+        time.return_value = 1045
+        signed_again = service.sign('http://pulp.org/a', '/tmp/key.pem')
+
+        # validation
+        self.assertEqual(signed, signed_reused)
+        self.assertNotEqual(signed, signed_again)
+        self.assertEqual(service.misses, 2)
+
+    @patch(MODULE + '.Key.load', Mock())
+    @patch(MODULE + '.URL')
+    def test_sign_not_cached(self, url):
+        service = SigningService()
+        url.return_value.sign.side_effect = [Mock(), Mock()]
+
+        # test
+        signed = service.sign('http://pulp.org/a', '/tmp/key.pem', cache=False)
+        signed_again = service.sign('http://pulp.org/a', '/tmp/key.pem', cache=False)
+
+        # validation
+        self.assertNotEqual(signed, signed_again)
+        self.assertEqual(service.hits, 0)
+        self.assertEqual(service.misses, 2)
+
+    @patch(MODULE + '.Key.load', Mock())
+    @patch(MODULE + '.URL')
+    def test_sign_evicts(self, url):
+        service = SigningService(max_size=1)
+
+        # test
+        service.sign('http://pulp.org/a', '/tmp/key.pem')
+        service.sign('http://pulp.org/b', '/tmp/key.pem')
+        service.sign('http://pulp.org/a', '/tmp/key.pem')
+
+        # validation
+        self.assertEqual(service.misses, 3)
+
+    @patch(MODULE + '.Key.load')
+    def test_clear(self, load):
+        service = SigningService()
+        service.key('/tmp/key.pem')
+
+        # test
+        service.clear()
+        service.key('/tmp/key.pem')
+
+        # validation
+        self.assertEqual(load.call_count, 2)
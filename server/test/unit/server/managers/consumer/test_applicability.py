@@ -9,12 +9,14 @@ from pulp.server.db.model.consumer import (Bind, Consumer, RepoProfileApplicabil
                                            UnitProfile)
 from pulp.server.db.model.criteria import Criteria
 from pulp.server.db.model import Repository
+from pulp.server.exceptions import InvalidValue
 from pulp.server.managers import factory as factory
 from pulp.server.managers.consumer.applicability import (
     _add_consumers_to_applicability_map, _add_profiles_to_consumer_map_and_get_hashes,
     _add_repo_ids_to_consumer_map, _format_report, _get_applicability_map,
     _get_consumer_applicability_map, DoesNotExist, MultipleObjectsReturned,
-    retrieve_consumer_applicability, ApplicabilityRegenerationManager)
+    retrieve_consumer_applicability, retrieve_consumer_applicability_page,
+    ApplicabilityRegenerationManager)
 from pulp.server.managers.consumer.bind import BindManager
 from pulp.server.managers.consumer.cud import ConsumerManager
 from pulp.server.managers.consumer.profile import ProfileManager
@@ -53,6 +55,10 @@ class ApplicabilityRegenerationManagerTests(base.PulpServerTests):
         self.old_get_existing = ApplicabilityRegenerationManager._get_existing_repo_content_types
         ApplicabilityRegenerationManager._get_existing_repo_content_types = mock.Mock(
             return_value=['rpm', 'erratum'])
+        self.old_get_existing_map = \
+            ApplicabilityRegenerationManager._get_existing_repo_content_types_map
+        ApplicabilityRegenerationManager._get_existing_repo_content_types_map = mock.Mock(
+            side_effect=lambda repo_ids: dict((r, set(['rpm', 'erratum'])) for r in repo_ids))
 
     def tearDown(self):
         base.PulpServerTests.tearDown(self)
@@ -65,6 +71,8 @@ class ApplicabilityRegenerationManagerTests(base.PulpServerTests):
         mock_plugins.reset()
         ApplicabilityRegenerationManager._get_existing_repo_content_types = staticmethod(
             self.old_get_existing)
+        ApplicabilityRegenerationManager._get_existing_repo_content_types_map = staticmethod(
+            self.old_get_existing_map)
 
     def populate_consumers(self):
         # Register consumers with rpm profiles
@@ -441,10 +449,292 @@ class ApplicabilityRegenerationManagerTests(base.PulpServerTests):
                          'skip': None, 'fields': None}
         mock_objects.find_by_criteria.return_value = [Repository(repo_id='fake-repo')]
 
-        applicability_manager.regenerate_applicability_for_repos(repo_criteria)
+        with mock.patch.object(ApplicabilityRegenerationManager,
+                               'batch_regenerate_applicability') as mock_batch_regenerate:
+            mock_get_collection.return_value.find.return_value = [
+                {'profile_hash': 'hash-%d' % i} for i in range(120)]
+            applicability_manager.regenerate_applicability_for_repos(repo_criteria)
 
-        # validate that batch size of 5 is used
-        mock_get_collection.return_value.find.return_value.batch_size.assert_called_with(5)
+        # validate that the profile hashes are regenerated in batches
+        batch_sizes = [len(c[0][1]) for c in mock_batch_regenerate.call_args_list]
+        self.assertEqual(batch_sizes, [50, 50, 20])
+        for c in mock_batch_regenerate.call_args_list:
+            self.assertEqual(c[0][0], 'fake-repo')
+
+    @mock.patch('pulp.server.managers.consumer.applicability.UnitProfile.get_collection')
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_batch_regenerate_applicability_prefetches_profiles(self, mock_rpa_get_collection,
+                                                                mock_up_get_collection):
+        """
+        Test that the unit profiles for a whole batch are looked up with a single query and
+        the profiler is called once for the batch.
+        """
+        mock_rpa_get_collection.return_value.find.return_value = [
+            {'_id': 'id-1', 'profile_hash': 'hash-1', 'repo_id': 'repo-1',
+             'profile': self.PROFILE1, 'applicability': {}},
+            {'_id': 'id-2', 'profile_hash': 'hash-2', 'repo_id': 'repo-1',
+             'profile': self.PROFILE2, 'applicability': {}},
+            {'_id': 'id-3', 'profile_hash': 'hash-gone', 'repo_id': 'repo-1',
+             'profile': self.PROFILE2, 'applicability': {}}]
+        mock_up_get_collection.return_value.find.return_value = [
+            {'profile_hash': 'hash-1', 'content_type': 'rpm'},
+            {'profile_hash': 'hash-1', 'content_type': 'rpm'},
+            {'profile_hash': 'hash-2', 'content_type': 'rpm'}]
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+        profiler.calculate_applicable_units_batch = mock.Mock(
+            return_value={'hash-1': {'rpm': ['rpm-1']}, 'hash-2': {'rpm': []}})
+
+        ApplicabilityRegenerationManager.batch_regenerate_applicability(
+            'repo-1', ({'profile_hash': 'hash-1'}, {'profile_hash': 'hash-2'},
+                       {'profile_hash': 'hash-gone'}))
+
+        mock_up_get_collection.return_value.find.assert_called_once_with(
+            {'profile_hash': {'$in': ['hash-1', 'hash-2', 'hash-gone']}},
+            projection=['profile_hash', 'content_type'])
+        self.assertEqual(profiler.calculate_applicable_units_batch.call_count, 1)
+        unit_profiles = profiler.calculate_applicable_units_batch.call_args[0][0]
+        self.assertEqual(unit_profiles, {'hash-1': self.PROFILE1, 'hash-2': self.PROFILE2})
+        requests = mock_rpa_get_collection.return_value.bulk_write.call_args[0][0]
+        self.assertEqual(len(requests), 2)
+
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_regenerate_applicability_batch_skips_unrelated_repo(self, mock_get_collection):
+        """
+        Test that the profiler is not called when the repo has no types the profiler handles.
+        """
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+        profiler.calculate_applicable_units_batch = mock.Mock()
+
+        ApplicabilityRegenerationManager._regenerate_applicability_batch(
+            'repo-1', [('hash-1', 'rpm', self.PROFILE1)], set(['iso']))
+
+        self.assertFalse(profiler.calculate_applicable_units_batch.called)
+        self.assertFalse(mock_get_collection.return_value.bulk_write.called)
+
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_regenerate_applicability_batch_not_implemented(self, mock_get_collection):
+        """
+        Test that nothing is written when the profiler does not support applicability.
+        """
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+        profiler.calculate_applicable_units = mock.Mock(side_effect=NotImplementedError())
+
+        ApplicabilityRegenerationManager._regenerate_applicability_batch(
+            'repo-1', [('hash-1', 'rpm', self.PROFILE1)], set(['rpm']))
+
+        self.assertFalse(mock_get_collection.return_value.bulk_write.called)
+
+    @mock.patch('pulp.server.managers.consumer.applicability.repo_controller')
+    @mock.patch('pulp.server.managers.consumer.applicability.model.Repository.objects')
+    def test_regenerate_applicability_for_repos_incremental_no_changes(self, mock_repo_qs,
+                                                                       mock_repo_ctrl):
+        """
+        Test that nothing is recalculated when no content changed in an incremental regeneration.
+        """
+        mock_repo_qs.find_by_criteria.return_value = [Repository(repo_id='fake-repo')]
+        mock_repo_ctrl.get_content_changes.return_value = ({}, set())
+
+        with mock.patch.object(ApplicabilityRegenerationManager,
+                               'batch_patch_applicability') as mock_patch:
+            ApplicabilityRegenerationManager.regenerate_applicability_for_repos(
+                self.REPO_CRITERIA.as_dict(), incremental=True)
+
+        self.assertFalse(mock_patch.called)
+        changed_before = mock_repo_ctrl.get_content_changes.call_args[0][1]
+        mock_repo_ctrl.clear_content_changes.assert_called_once_with('fake-repo', changed_before)
+
+    @mock.patch('pulp.server.managers.consumer.applicability.repo_controller')
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    @mock.patch('pulp.server.managers.consumer.applicability.model.Repository.objects')
+    def test_regenerate_applicability_for_repos_incremental(self, mock_repo_qs,
+                                                            mock_get_collection, mock_repo_ctrl):
+        """
+        Test that the journaled changes are applied to every existing applicability.
+        """
+        mock_repo_qs.find_by_criteria.return_value = [Repository(repo_id='fake-repo')]
+        mock_repo_ctrl.get_content_changes.return_value = ({'rpm': ['rpm-3']}, set(['rpm-1']))
+        mock_get_collection.return_value.find.return_value = [{'profile_hash': 'hash-1'}]
+
+        with mock.patch.object(ApplicabilityRegenerationManager,
+                               'batch_patch_applicability') as mock_patch:
+            ApplicabilityRegenerationManager.regenerate_applicability_for_repos(
+                self.REPO_CRITERIA.as_dict(), incremental=True)
+
+        mock_patch.assert_called_once_with('fake-repo', ({'profile_hash': 'hash-1'},),
+                                           {'rpm': ['rpm-3']}, set(['rpm-1']), None)
+        self.assertEqual(mock_repo_ctrl.clear_content_changes.call_count, 1)
+
+    @mock.patch('pulp.server.managers.consumer.applicability.UnitProfile.get_collection')
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_batch_patch_applicability(self, mock_rpa_get_collection, mock_up_get_collection):
+        """
+        Test that removed units are dropped and applicable added units are appended.
+        """
+        mock_rpa_get_collection.return_value.find.return_value = [
+            {'_id': 'id-1', 'profile_hash': 'hash-1', 'repo_id': 'repo-1',
+             'profile': self.PROFILE1,
+             'applicability': {'rpm': ['rpm-1', 'rpm-2'], 'erratum': ['errata-1']}}]
+        mock_up_get_collection.return_value.find.return_value = [
+            {'profile_hash': 'hash-1', 'content_type': 'rpm'}]
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+
+        with mock.patch.object(profiler, 'calculate_applicable_units_delta',
+                               return_value={'hash-1': {'rpm': ['rpm-3']}}) as mock_delta:
+            ApplicabilityRegenerationManager.batch_patch_applicability(
+                'repo-1', ({'profile_hash': 'hash-1'},), {'rpm': ['rpm-3', 'rpm-4']},
+                set(['rpm-1', 'errata-1']))
+
+        unit_profiles, repo_id, added_units = mock_delta.call_args[0][:3]
+        self.assertEqual(unit_profiles, {'hash-1': self.PROFILE1})
+        self.assertEqual(added_units, {'rpm': ['rpm-3', 'rpm-4']})
+        requests = mock_rpa_get_collection.return_value.bulk_write.call_args[0][0]
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0]._doc,
+                         {'$set': {'applicability': {'rpm': ['rpm-2', 'rpm-3'], 'erratum': []}},
+                          '$unset': {'content_fingerprint': ''}})
+
+    @mock.patch('pulp.server.managers.consumer.applicability.UnitProfile.get_collection')
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_batch_patch_applicability_fingerprint(self, mock_rpa_get_collection,
+                                                   mock_up_get_collection):
+        """
+        Test that patched applicability is stored with the content fingerprint of the repo.
+        """
+        mock_rpa_get_collection.return_value.find.return_value = [
+            {'_id': 'id-1', 'profile_hash': 'hash-1', 'repo_id': 'repo-1',
+             'profile': self.PROFILE1, 'applicability': {'rpm': ['rpm-1']}}]
+        mock_up_get_collection.return_value.find.return_value = [
+            {'profile_hash': 'hash-1', 'content_type': 'rpm'}]
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+
+        with mock.patch.object(ApplicabilityRegenerationManager, '_get_content_fingerprint',
+                               return_value=42L), \
+                mock.patch.object(profiler, 'calculate_applicable_units_delta',
+                                  return_value={}):
+            ApplicabilityRegenerationManager.batch_patch_applicability(
+                'repo-1', ({'profile_hash': 'hash-1'},), {}, set(['rpm-1']), 42L)
+
+        requests = mock_rpa_get_collection.return_value.bulk_write.call_args[0][0]
+        self.assertEqual(requests[0]._doc,
+                         {'$set': {'applicability': {'rpm': []}, 'content_fingerprint': 42L}})
+
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_regenerate_applicability_batch_reuses_cached(self, mock_get_collection):
+        """
+        Test that applicability calculated for a repo with the same content is reused.
+        """
+        mock_get_collection.return_value.find.return_value = [
+            {'profile_hash': 'hash-1', 'applicability': {'rpm': ['rpm-1']}}]
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+        profiler.calculate_applicable_units_batch = mock.Mock(
+            return_value={'hash-2': {'rpm': ['rpm-2']}})
+
+        with mock.patch.object(ApplicabilityRegenerationManager, '_get_content_fingerprint',
+                               return_value=42L):
+            ApplicabilityRegenerationManager._regenerate_applicability_batch(
+                'repo-1', [('hash-1', 'rpm', self.PROFILE1), ('hash-2', 'rpm', self.PROFILE2)],
+                set(['rpm']))
+
+        mock_get_collection.return_value.find.assert_called_once_with(
+            {'profile_hash': {'$in': ['hash-1', 'hash-2']}, 'content_fingerprint': 42L,
+             'repo_id': {'$ne': 'repo-1'}},
+            projection=['profile_hash', 'applicability'])
+        # The profiler is only called for the profile that has no cached applicability
+        unit_profiles = profiler.calculate_applicable_units_batch.call_args[0][0]
+        self.assertEqual(unit_profiles, {'hash-2': self.PROFILE2})
+        requests = mock_get_collection.return_value.bulk_write.call_args[0][0]
+        docs = dict((r._filter['profile_hash'], r._doc) for r in requests)
+        self.assertEqual(docs['hash-1']['$set'],
+                         {'applicability': {'rpm': ['rpm-1']}, 'content_fingerprint': 42L})
+        self.assertEqual(docs['hash-2']['$set'],
+                         {'applicability': {'rpm': ['rpm-2']}, 'content_fingerprint': 42L})
+
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_regenerate_applicability_batch_content_changed(self, mock_get_collection):
+        """
+        Test that the fingerprint is not stored if the repo content changed in the meantime.
+        """
+        mock_get_collection.return_value.find.return_value = []
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+        profiler.calculate_applicable_units_batch = mock.Mock(
+            return_value={'hash-1': {'rpm': ['rpm-1']}})
+
+        with mock.patch.object(ApplicabilityRegenerationManager, '_get_content_fingerprint',
+                               side_effect=[42L, 43L]):
+            ApplicabilityRegenerationManager._regenerate_applicability_batch(
+                'repo-1', [('hash-1', 'rpm', self.PROFILE1)], set(['rpm']))
+
+        requests = mock_get_collection.return_value.bulk_write.call_args[0][0]
+        self.assertEqual(requests[0]._doc,
+                         {'$set': {'applicability': {'rpm': ['rpm-1']}},
+                          '$unset': {'content_fingerprint': ''},
+                          '$setOnInsert': {'profile': self.PROFILE1}})
+
+    @mock.patch('pulp.server.managers.consumer.applicability.UnitProfile.get_collection')
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_batch_patch_applicability_not_supported(self, mock_rpa_get_collection,
+                                                     mock_up_get_collection):
+        """
+        Test that applicability is regenerated in full if the profiler has no delta support.
+        """
+        mock_rpa_get_collection.return_value.find.return_value = [
+            {'_id': 'id-1', 'profile_hash': 'hash-1', 'repo_id': 'repo-1',
+             'profile': self.PROFILE1, 'applicability': {'rpm': ['rpm-1']}}]
+        mock_up_get_collection.return_value.find.return_value = [
+            {'profile_hash': 'hash-1', 'content_type': 'rpm'}]
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+
+        with mock.patch.object(ApplicabilityRegenerationManager,
+                               '_regenerate_applicability_batch') as mock_regenerate, \
+                mock.patch.object(profiler, 'calculate_applicable_units_delta',
+                                  side_effect=NotImplementedError):
+            ApplicabilityRegenerationManager.batch_patch_applicability(
+                'repo-1', ({'profile_hash': 'hash-1'},), {'rpm': ['rpm-3']}, set())
+
+        mock_regenerate.assert_called_once_with(
+            'repo-1', [('hash-1', 'rpm', self.PROFILE1)], set(['rpm', 'erratum']))
+        self.assertFalse(mock_rpa_get_collection.return_value.bulk_write.called)
+
+    @mock.patch('pulp.server.managers.consumer.applicability.UnitProfile.get_collection')
+    @mock.patch('pulp.server.db.model.consumer.RepoProfileApplicability.get_collection')
+    def test_batch_patch_applicability_removed_not_supported(self, mock_rpa_get_collection,
+                                                             mock_up_get_collection):
+        """
+        Test that applicability is regenerated in full if units were only removed and the
+        profiler has no delta support.
+        """
+        mock_rpa_get_collection.return_value.find.return_value = [
+            {'_id': 'id-1', 'profile_hash': 'hash-1', 'repo_id': 'repo-1',
+             'profile': self.PROFILE1, 'applicability': {'rpm': ['rpm-1']}}]
+        mock_up_get_collection.return_value.find.return_value = [
+            {'profile_hash': 'hash-1', 'content_type': 'rpm'}]
+        profiler, cfg = plugins.get_profiler_by_type('rpm')
+
+        with mock.patch.object(ApplicabilityRegenerationManager,
+                               '_regenerate_applicability_batch') as mock_regenerate, \
+                mock.patch.object(profiler, 'calculate_applicable_units_delta',
+                                  side_effect=NotImplementedError) as mock_delta:
+            ApplicabilityRegenerationManager.batch_patch_applicability(
+                'repo-1', ({'profile_hash': 'hash-1'},), {}, set(['rpm-1']))
+
+        self.assertEqual(mock_delta.call_args[0][2], {})
+        mock_regenerate.assert_called_once_with(
+            'repo-1', [('hash-1', 'rpm', self.PROFILE1)], set(['rpm', 'erratum']))
+        self.assertFalse(mock_rpa_get_collection.return_value.bulk_write.called)
+
+    @mock.patch('pulp.server.managers.consumer.applicability.model.Repository.objects')
+    def test_get_existing_repo_content_types_map(self, mock_repo_qs):
+        """
+        Test that the content types of many repositories are looked up with one query.
+        """
+        repo_1 = mock.Mock(repo_id='repo-1', content_unit_counts={'rpm': 3, 'erratum': 0})
+        repo_2 = mock.Mock(repo_id='repo-2', content_unit_counts={})
+        mock_repo_qs.return_value.only.return_value = [repo_1, repo_2]
+
+        content_types_map = self.old_get_existing_map(['repo-1', 'repo-2', 'repo-3'])
+
+        mock_repo_qs.assert_called_once_with(repo_id__in=['repo-1', 'repo-2', 'repo-3'])
+        self.assertEqual(content_types_map, {'repo-1': set(['rpm']), 'repo-2': set()})
 
 
 class TestRepoProfileApplicabilityManager(base.PulpServerTests):
@@ -1187,6 +1477,96 @@ class TestRetrieveConsumerApplicability(base.PulpServerTests,
         self.assert_equal_ignoring_list_order(applicability, expected_applicability)
 
 
+@mock.patch('pulp.server.managers.consumer.bind.factory.consumer_history_manager')
+@mock.patch('pulp.server.managers.consumer.bind.BindManager._validate_consumer_repo')
+class TestRetrieveConsumerApplicabilityPage(base.PulpServerTests,
+                                            base.RecursiveUnorderedListComparisonMixin):
+    """
+    Test the retrieve_consumer_applicability_page() function.
+    """
+    def setUp(self):
+        """
+        Set up three consumers with the same profile, bound to the same repository.
+        """
+        super(TestRetrieveConsumerApplicabilityPage, self).setUp()
+        self.consumer_ids = ['consumer_1', 'consumer_2', 'consumer_3']
+        manager = factory.consumer_manager()
+        for consumer_id in self.consumer_ids:
+            manager.register(consumer_id)
+        profile_manager = ProfileManager()
+        for consumer_id in self.consumer_ids:
+            consumer_profile = profile_manager.create(consumer_id, 'content_type', ['unit_1-0.9'])
+        RepoProfileApplicability.objects.create(
+            consumer_profile.profile_hash, 'repo_id', ['unit_1-0.9'],
+            {'content_type': ['unit_1-1.0'], 'other_type': ['unit_2-1.0']})
+
+    def tearDown(self):
+        """
+        Empty the collections that were written to during this test suite.
+        """
+        super(TestRetrieveConsumerApplicabilityPage, self).tearDown()
+        Consumer.get_collection().remove()
+        UnitProfile.get_collection().remove()
+        RepoProfileApplicability.get_collection().drop()
+        Bind.get_collection().drop()
+
+    def _bind(self):
+        """
+        Bind all the consumers to the repository.
+        """
+        bind_manager = BindManager()
+        for consumer_id in self.consumer_ids:
+            bind_manager.bind(consumer_id, 'repo_id', 'distributor_id', False, {})
+
+    def test_pages(self, m_validate_consumer_repo, *unused_mocks):
+        """
+        Test that consumers are paged by id with continuation tokens.
+        """
+        m_validate_consumer_repo.return_value = None
+        self._bind()
+        criteria = Criteria(filters={})
+
+        reports, continuation = retrieve_consumer_applicability_page(
+            criteria, ['content_type'], page_size=2)
+        self.assert_equal_ignoring_list_order(
+            list(reports), [{'consumers': ['consumer_1', 'consumer_2'],
+                             'applicability': {'content_type': ['unit_1-1.0']}}])
+        self.assertTrue(continuation is not None)
+
+        reports, continuation = retrieve_consumer_applicability_page(
+            criteria, ['content_type'], page_size=2, continuation=continuation)
+        self.assertEqual(list(reports), [{'consumers': ['consumer_3'],
+                                          'applicability': {'content_type': ['unit_1-1.0']}}])
+        self.assertTrue(continuation is None)
+
+    def test_chunks(self, m_validate_consumer_repo, *unused_mocks):
+        """
+        Test that consumers are only collated with consumers in the same chunk.
+        """
+        m_validate_consumer_repo.return_value = None
+        self._bind()
+
+        with mock.patch('pulp.server.managers.consumer.applicability.'
+                        'APPLICABILITY_REPORT_CHUNK_SIZE', 2):
+            reports, continuation = retrieve_consumer_applicability_page(
+                Criteria(filters={}))
+            reports = list(reports)
+
+        expected_applicability = {'content_type': ['unit_1-1.0'], 'other_type': ['unit_2-1.0']}
+        self.assert_equal_ignoring_list_order(
+            reports, [{'consumers': ['consumer_1', 'consumer_2'],
+                       'applicability': expected_applicability},
+                      {'consumers': ['consumer_3'], 'applicability': expected_applicability}])
+        self.assertTrue(continuation is None)
+
+    def test_invalid_continuation(self, *unused_mocks):
+        """
+        Test that an invalid continuation token is rejected.
+        """
+        self.assertRaises(InvalidValue, retrieve_consumer_applicability_page,
+                          Criteria(filters={}), continuation='not a token')
+
+
 class TestAddConsumersToApplicabilityMap(base.PulpServerTests,
                                          base.RecursiveUnorderedListComparisonMixin):
     """
@@ -1469,6 +1849,20 @@ class TestGetApplicabilityMap(base.PulpServerTests):
             ('hash_1', 'repo_2'): {'applicability': {'type_1': 'a_2'}, 'consumers': []}}
         self.assertEqual(a_map, expected_a_map)
 
+    def test__get_applicability_map_repo_ids(self):
+        """
+        Assert that _get_applicability_map() only returns data for the given repo_ids.
+        """
+        RepoProfileApplicability.objects.create('hash_1', 'repo_1', 'a_profile',
+                                                {'type_1': 'a_1'})
+        RepoProfileApplicability.objects.create('hash_1', 'repo_2', 'a_profile',
+                                                {'type_1': 'a_2'})
+
+        a_map = _get_applicability_map(['hash_1'], None, ['repo_2'])
+
+        self.assertEqual(a_map, {
+            ('hash_1', 'repo_2'): {'applicability': {'type_1': 'a_2'}, 'consumers': []}})
+
 
 class TestGetConsumerApplicabilityMap(base.PulpServerTests,
                                       base.RecursiveUnorderedListComparisonMixin):
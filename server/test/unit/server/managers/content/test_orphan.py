@@ -15,7 +15,7 @@ from pulp.plugins.types.model import TypeDefinition
 from pulp.server import exceptions as pulp_exceptions
 from pulp.server.db.model.repository import RepoContentUnit
 from pulp.server.managers import factory as manager_factory
-from pulp.server.managers.content.orphan import OrphanManager
+from pulp.server.managers.content.orphan import OrphanDeletionProgress, OrphanManager
 
 
 MODULE_PATH = 'pulp.server.managers.content.orphan.'
@@ -271,7 +271,7 @@ class OrphanManagerGeneratorTests(OrphanManagerTests):
         self.assertEqual(len(orphans), 0)
         self.assertEqual(self.number_of_files_in_content_root(), 0)
         mock_lazy_catalog_objects.assert_called_once_with(
-            unit_id=unit['_id'],
+            unit_id__in=[unit['_id']],
             unit_type_id=unit['_content_type_id']
         )
         mock_lazy_catalog_objects.return_value.delete.assert_called_once_with()
@@ -292,10 +292,12 @@ class OrphanManagerGeneratorTests(OrphanManagerTests):
 
         self.orphan_manager.delete_orphan_content_units_by_type('foo_type')
         mock_lazy_catalog_objects.assert_called_once_with(
-            unit_id='orphan',
+            unit_id__in=['orphan'],
             unit_type_id='foo_type'
         )
         mock_lazy_catalog_objects.return_value.delete.assert_called_once_with()
+        m_get_model.return_value.objects.assert_called_once_with(id__in=['orphan'])
+        m_get_model.return_value.objects.return_value.delete.assert_called_once_with()
         m_del_orphan.assert_called_once_with('test_foo_path')
 
     @patch(MODULE_PATH + 'plugin_api.get_unit_model_by_id')
@@ -307,6 +309,162 @@ class OrphanManagerGeneratorTests(OrphanManagerTests):
         mock_get_model.return_value.objects.assert_called_once_with(id__in=('orphan2',))
 
 
+@patch(MODULE_PATH + 'RepoContentUnit.get_collection')
+@patch(MODULE_PATH + 'content_types_db.type_units_collection')
+class TestOrphanLookups(TestCase):
+    """
+    Tests for the orphan lookups that do not need a database.
+    """
+
+    def test_generate_orphans_by_type_merges_sorted_ids(self, m_units_collection,
+                                                        m_associations_collection):
+        units = [{'_id': 'a'}, {'_id': 'b'}, {'_id': 'c'}, {'_id': 'd'}, {'_id': 'f'}]
+        m_units_collection.return_value.find.return_value.sort.return_value = units
+        associations = [{'unit_id': 'b'}, {'unit_id': 'b'}, {'unit_id': 'd'}, {'unit_id': 'e'}]
+        m_associations_collection.return_value.find.return_value.sort.return_value = \
+            associations
+
+        orphans = list(OrphanManager.generate_orphans_by_type('rpm', fields=['_id', 'name']))
+
+        self.assertEqual(orphans, [{'_id': 'a'}, {'_id': 'c'}, {'_id': 'f'}])
+        m_units_collection.return_value.find.assert_called_once_with(
+            {}, projection=['_id', 'name'])
+        m_units_collection.return_value.find.return_value.sort.assert_called_once_with('_id', 1)
+        m_associations_collection.return_value.find.assert_called_once_with(
+            {'unit_type_id': 'rpm'}, projection={'_id': False, 'unit_id': True})
+        m_associations_collection.return_value.find.return_value.sort.assert_called_once_with(
+            'unit_id', 1)
+
+    def test_generate_orphans_by_type_no_associations(self, m_units_collection,
+                                                      m_associations_collection):
+        units = [{'_id': 'a'}, {'_id': 'b'}]
+        m_units_collection.return_value.find.return_value.sort.return_value = units
+        m_associations_collection.return_value.find.return_value.sort.return_value = []
+
+        orphans = list(OrphanManager.generate_orphans_by_type('rpm'))
+
+        self.assertEqual(orphans, units)
+
+    def test_get_orphan(self, m_units_collection, m_associations_collection):
+        m_units_collection.return_value.find_one.return_value = {'_id': 'a'}
+        m_associations_collection.return_value.find_one.return_value = None
+
+        orphan = OrphanManager().get_orphan('rpm', 'a')
+
+        self.assertEqual(orphan, {'_id': 'a'})
+        m_units_collection.return_value.find_one.assert_called_once_with({'_id': 'a'},
+                                                                         projection=['_id'])
+        m_associations_collection.return_value.find_one.assert_called_once_with(
+            {'unit_id': 'a', 'unit_type_id': 'rpm'}, projection=['_id'])
+
+    def test_get_orphan_associated(self, m_units_collection, m_associations_collection):
+        m_units_collection.return_value.find_one.return_value = {'_id': 'a'}
+        m_associations_collection.return_value.find_one.return_value = {'_id': 'assoc'}
+
+        self.assertRaises(pulp_exceptions.MissingResource, OrphanManager().get_orphan, 'rpm', 'a')
+
+    def test_orphans_count_by_type_no_associations(self, m_units_collection,
+                                                   m_associations_collection):
+        m_associations_collection.return_value.find_one.return_value = None
+        m_units_collection.return_value.count.return_value = 12
+
+        self.assertEqual(OrphanManager().orphans_count_by_type('rpm'), 12)
+        self.assertEqual(m_units_collection.return_value.find.call_count, 0)
+
+
+class TestDeleteOrphansInBatches(TestCase):
+    """
+    Tests for deleting orphans in batches.
+    """
+
+    @patch(MODULE_PATH + 'ORPHAN_DELETE_BATCH_SIZE', 2)
+    @patch(MODULE_PATH + 'OrphanDeletionProgress')
+    @patch(MODULE_PATH + 'OrphanManager.delete_orphaned_file')
+    @patch(MODULE_PATH + 'OrphanManager.is_shared')
+    @patch(MODULE_PATH + 'model.VerifiedFile.objects')
+    @patch(MODULE_PATH + 'model.LazyCatalogEntry.objects')
+    def test_delete_orphans(self, m_catalog_objects, m_verified_objects, m_is_shared,
+                            m_delete_file, m_progress):
+        m_is_shared.side_effect = lambda storage_dir, path: path == '/shared'
+        m_catalog_objects.return_value.distinct.side_effect = [['/a/1', '/a/2'], []]
+        delete_units = Mock()
+        orphans = [('unit-1', '/a'), ('unit-2', None), ('unit-3', '/shared')]
+
+        OrphanManager._delete_orphans('rpm', iter(orphans), delete_units)
+
+        self.assertEqual(m_catalog_objects.call_args_list,
+                         [call(unit_id__in=['unit-1', 'unit-2'], unit_type_id='rpm'),
+                          call(unit_id__in=['unit-3'], unit_type_id='rpm')])
+        self.assertEqual(m_catalog_objects.return_value.delete.call_count, 2)
+        verified_paths = [sorted(c[1]['path__in']) for c in m_verified_objects.call_args_list]
+        self.assertEqual(verified_paths, [['/a', '/a/1', '/a/2'], ['/shared']])
+        self.assertEqual(m_verified_objects.return_value.delete.call_count, 2)
+        self.assertEqual(delete_units.call_args_list,
+                         [call(['unit-1', 'unit-2']), call(['unit-3'])])
+        self.assertEqual(sorted(c[0][0] for c in m_delete_file.call_args_list),
+                         ['/a', '/shared'])
+        m_progress.assert_called_once_with('rpm')
+        self.assertEqual(m_progress.return_value.units_deleted.call_args_list,
+                         [call(2), call(1)])
+        m_progress.return_value.report.assert_called_once_with()
+
+    @patch(MODULE_PATH + 'OrphanManager._delete_orphans')
+    @patch(MODULE_PATH + 'RepoContentUnit.get_collection')
+    @patch(MODULE_PATH + 'content_types_db.type_units_collection')
+    def test_delete_orphans_by_type_filtered(self, m_units_collection, m_associations_collection,
+                                             m_delete_orphans):
+        m_associations_collection.return_value.find.return_value.distinct.return_value = ['b']
+        m_units_collection.return_value.find.return_value = [
+            {'_id': 'a', '_storage_path': '/a'}, {'_id': 'c'}]
+
+        OrphanManager.delete_orphans_by_type('rpm', ['a', 'b', 'c'])
+
+        content_type_id, orphans, delete_units = m_delete_orphans.call_args[0]
+        self.assertEqual(content_type_id, 'rpm')
+        self.assertEqual(list(orphans), [('a', '/a'), ('c', None)])
+        m_associations_collection.return_value.find.assert_called_once_with(
+            {'unit_id': {'$in': ('a', 'b', 'c')}, 'unit_type_id': 'rpm'}, projection=['unit_id'])
+        m_units_collection.return_value.find.assert_called_once_with(
+            {'_id': {'$in': ['a', 'c']}}, projection=['_id', '_storage_path'])
+
+        delete_units(['a', 'c'])
+        m_units_collection.return_value.remove.assert_called_once_with(
+            {'_id': {'$in': ['a', 'c']}})
+
+
+class TestOrphanDeletionProgress(TestCase):
+    """
+    Tests for pulp.server.managers.content.orphan.OrphanDeletionProgress.
+    """
+
+    @patch(MODULE_PATH + 'time')
+    @patch(MODULE_PATH + 'model.TaskStatus._get_collection')
+    @patch(MODULE_PATH + 'get_current_task_id', return_value='task-1')
+    def test_units_deleted(self, m_task_id, m_get_collection, m_time):
+        m_time.time.return_value = 10.5
+        progress = OrphanDeletionProgress('rpm')
+
+        progress.units_deleted(2)
+        progress.units_deleted(3)
+
+        m_get_collection.return_value.update_one.assert_called_once_with(
+            {'task_id': 'task-1'}, {'$set': {'progress_report.delete_orphans.rpm': 2}})
+
+        progress.report()
+        m_get_collection.return_value.update_one.assert_called_with(
+            {'task_id': 'task-1'}, {'$set': {'progress_report.delete_orphans.rpm': 5}})
+
+    @patch(MODULE_PATH + 'model.TaskStatus._get_collection')
+    @patch(MODULE_PATH + 'get_current_task_id', return_value=None)
+    def test_no_task(self, m_task_id, m_get_collection):
+        progress = OrphanDeletionProgress('rpm')
+
+        progress.units_deleted(2)
+        progress.report()
+
+        self.assertEqual(m_get_collection.call_count, 0)
+
+
 class TestDelete(TestCase):
 
     @patch('shutil.rmtree')
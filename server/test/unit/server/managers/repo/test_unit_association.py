@@ -5,6 +5,7 @@ from pulp.common.compat import unittest
 from pulp.devel import mock_plugins, skip
 from pulp.plugins.types import database, model
 from pulp.server.controllers import importer as importer_controller
+from pulp.server.controllers import repository as repo_controller
 from pulp.server.db import model as me_model
 from pulp.server.db.model.criteria import UnitAssociationCriteria
 from pulp.server.db.model.repository import RepoContentUnit
@@ -66,6 +67,7 @@ class RepoUnitAssociationManagerTests(base.PulpServerTests):
         super(RepoUnitAssociationManagerTests, self).clean()
         database.clean()
         RepoContentUnit.get_collection().remove()
+        me_model.RepositoryContentChange.objects.delete()
         me_model.Repository.objects.delete()
         me_model.Importer.objects.delete()
 
@@ -165,6 +167,37 @@ class RepoUnitAssociationManagerTests(base.PulpServerTests):
         self.assertEqual(1, len(repo_units))
         self.assertEqual(self.unit_id_2, repo_units[0]['unit_id'])
 
+    def test_associate_and_unassociate_journal_changes(self, mock_repo):
+        """
+        Tests that added and removed units are recorded in the repo's content change journal.
+        """
+        self.manager.associate_unit_by_id(self.repo_id, self.unit_type_id, self.unit_id)
+        self.manager.associate_unit_by_id(self.repo_id, self.unit_type_id, self.unit_id_2)
+        self.manager.unassociate_unit_by_id(self.repo_id, self.unit_type_id, self.unit_id,
+                                            notify_plugins=False)
+
+        changes = dict((c.unit_id, c.action) for c in
+                       me_model.RepositoryContentChange.objects(repo_id=self.repo_id))
+        self.assertEqual(changes, {self.unit_id: me_model.RepositoryContentChange.ACTION_REMOVED,
+                                   self.unit_id_2: me_model.RepositoryContentChange.ACTION_ADDED})
+
+    def test_associate_and_unassociate_content_fingerprint(self, mock_repo):
+        """
+        Tests that the repo's content fingerprint is only updated for actual association changes.
+        """
+        self.manager.associate_unit_by_id(self.repo_id, self.unit_type_id, self.unit_id)
+        self.manager.associate_unit_by_id(self.repo_id, self.unit_type_id, self.unit_id)
+        self.manager.unassociate_unit_by_id(self.repo_id, self.unit_type_id, self.unit_id,
+                                            notify_plugins=False)
+        self.manager.unassociate_unit_by_id(self.repo_id, self.unit_type_id, self.unit_id,
+                                            notify_plugins=False)
+
+        delta = repo_controller.calculate_content_fingerprint(self.unit_type_id, [self.unit_id])
+        expected_call = mock.call({'repo_id': self.repo_id},
+                                  {'$bit': {'content_fingerprint': {'xor': delta}}})
+        self.assertEqual(mock_repo._get_collection.return_value.update_one.call_args_list,
+                         [expected_call, expected_call])
+
     def test_unassociate_by_id_no_association(self, mock_repo_qs):
         """
         Tests unassociating a unit where no association exists.
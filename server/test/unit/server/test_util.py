@@ -1,6 +1,8 @@
 from cStringIO import StringIO
 import hashlib
+import os
 import shutil
+import tempfile
 
 from mock import Mock, patch, call
 
@@ -170,6 +172,84 @@ class TestCopyTree(unittest.TestCase):
                                      call('src/file3')])
 
 
+class TestParallelCopyTree(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.working_dir, 'src')
+        self.dst = os.path.join(self.working_dir, 'master', 'dst')
+        os.makedirs(os.path.join(self.src, 'dir1'))
+        for name in ('dir1/file1', 'file2'):
+            with open(os.path.join(self.src, name), 'w') as f:
+                f.write(name)
+        os.symlink('../file2', os.path.join(self.src, 'dir1', 'link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def test_copy(self):
+        progress = Mock()
+
+        util.parallel_copytree(self.src, self.dst, symlinks=True, progress_callback=progress)
+
+        with open(os.path.join(self.dst, 'dir1', 'file1')) as f:
+            self.assertEqual(f.read(), 'dir1/file1')
+        with open(os.path.join(self.dst, 'file2')) as f:
+            self.assertEqual(f.read(), 'file2')
+        self.assertEqual(os.readlink(os.path.join(self.dst, 'dir1', 'link')), '../file2')
+        self.assertEqual(progress.call_args_list, [call(1, 2), call(2, 2)])
+
+    def test_copy_symlink_contents(self):
+        util.parallel_copytree(self.src, self.dst)
+
+        link = os.path.join(self.dst, 'dir1', 'link')
+        self.assertFalse(os.path.islink(link))
+        with open(link) as f:
+            self.assertEqual(f.read(), 'file2')
+
+    @patch('pulp.server.util.copy_file')
+    def test_errors(self, mock_copy_file):
+        mock_copy_file.side_effect = IOError('boom')
+
+        with self.assertRaises(shutil.Error) as cm:
+            util.parallel_copytree(self.src, self.dst, symlinks=True)
+
+        self.assertEqual(len(cm.exception.args[0]), 2)
+
+
+class TestCopyFile(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.working_dir, 'src')
+        self.dst = os.path.join(self.working_dir, 'dst')
+        with open(self.src, 'w') as f:
+            f.write('content')
+        os.chmod(self.src, 0640)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    @patch('pulp.server.util.SENDFILE_CHUNK_SIZE', 3)
+    @patch('pulp.server.util.sendfile')
+    def test_sendfile(self, mock_sendfile):
+        sizes = [3, 3, 1, 0]
+        mock_sendfile.side_effect = lambda out_fd, in_fd, offset, count: sizes.pop(0)
+
+        util.copy_file(self.src, self.dst)
+
+        self.assertEqual([c[0][2] for c in mock_sendfile.call_args_list], [0, 3, 6, 7])
+        self.assertEqual(os.stat(self.dst).st_mode & 0777, 0640)
+
+    @patch('pulp.server.util.sendfile', None)
+    def test_without_sendfile(self):
+        util.copy_file(self.src, self.dst)
+
+        with open(self.dst) as f:
+            self.assertEqual(f.read(), 'content')
+        self.assertEqual(os.stat(self.dst).st_mode & 0777, 0640)
+
+
 class TestPackageListenerDeleting(unittest.TestCase):
     @patch('os.remove')
     def test_removes_path(self, mock_remove):
@@ -10,6 +10,7 @@ from pulp.server.exceptions import (InvalidValue, MissingResource, MissingValue,
 from pulp.server.managers.consumer import bind
 from pulp.server.managers.consumer import profile
 from pulp.server.managers.consumer import query
+from pulp.server.managers.consumer.applicability import APPLICABILITY_REPORT_PAGE_SIZE
 from pulp.server.webservices.views import consumers
 from pulp.server.webservices.views import util
 from pulp.server.webservices.views.consumers import (ConsumersView, ConsumerBindingsView,
@@ -1194,6 +1195,54 @@ class TestConsumerQueryContentApplicabilityView(unittest.TestCase):
         mock_resp.assert_called_once_with(resp)
         self.assertTrue(response is mock_resp.return_value)
 
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
+                new=assert_auth_READ())
+    @mock.patch('pulp.server.webservices.views.consumers.generate_streaming_json_response')
+    @mock.patch('pulp.server.webservices.views.consumers.retrieve_consumer_applicability_page')
+    @mock.patch('pulp.server.webservices.views.consumers.Criteria.from_client_input')
+    def test_query_consumer_content_applic_paged(self, mock_criteria, mock_applic, mock_resp):
+        """
+        Test query consumer content applicability one page at a time
+        """
+        mock_applic.return_value = (mock.sentinel.reports, 'next-token')
+
+        request = mock.MagicMock()
+        request.body = json.dumps({'criteria': {'filters': {}}, 'content_types': ['type1'],
+                                   'page_size': 100, 'continuation': 'token'})
+        consumer_applic = ConsumerContentApplicabilityView()
+        response = consumer_applic.post(request)
+
+        mock_applic.assert_called_once_with(mock_criteria.return_value, ['type1'], 100, 'token')
+        mock_resp.assert_called_once_with(mock.sentinel.reports, 'applicability',
+                                          {'continuation': 'next-token'})
+        self.assertTrue(response is mock_resp.return_value)
+
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
+                new=assert_auth_READ())
+    @mock.patch('pulp.server.webservices.views.consumers.retrieve_consumer_applicability_page')
+    def test_query_consumer_content_applic_invalid_page_size(self, mock_applic):
+        """
+        Test query consumer content applicability with an invalid page size
+        """
+        request = mock.MagicMock()
+        request.body = json.dumps({'criteria': {'filters': {}}, 'page_size': 0})
+        consumer_applic = ConsumerContentApplicabilityView()
+        response = consumer_applic.post(request)
+
+        self.assertTrue(isinstance(response, HttpResponseBadRequest))
+        self.assertFalse(mock_applic.called)
+
+    def test_get_page_default_page_size(self):
+        """
+        Test that the default page size is used if only a continuation token is given.
+        """
+        request = mock.MagicMock()
+        request.body_as_json = {'continuation': 'token'}
+        consumer_applic = ConsumerContentApplicabilityView()
+        page_size, continuation = consumer_applic._get_page(request)
+        self.assertEqual(page_size, APPLICABILITY_REPORT_PAGE_SIZE)
+        self.assertEqual(continuation, 'token')
+
     def test_get_consumer_criteria_no_criteria(self):
         """
         Test get consumer criteria.
@@ -1469,6 +1469,51 @@ class TestContentApplicabilityRegenerationView(unittest.TestCase):
 
         self.assertEqual(response.http_status_code, 400)
 
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth', new=assert_auth_CREATE())
+    @mock.patch('pulp.server.webservices.views.repositories.regenerate_applicability_for_repos')
+    @mock.patch('pulp.server.webservices.views.repositories.tags')
+    @mock.patch('pulp.server.webservices.views.repositories.Criteria.from_client_input')
+    def test_post_incremental(self, mock_crit, mock_tags, mock_regen):
+        """
+        Test that incremental regeneration is passed on to the regeneration task.
+        """
+        mock_request = mock.MagicMock()
+        mock_request.body = json.dumps({'repo_criteria': {}, 'incremental': True})
+        mock_regen.apply_async_with_reservation.return_value = mock.MagicMock(task_id='1234')
+        content_app_regen = ContentApplicabilityRegenerationView()
+
+        self.assertRaises(exceptions.OperationPostponed, content_app_regen.post, mock_request)
+
+        mock_regen.apply_async_with_reservation.assert_called_once_with(
+            mock_tags.RESOURCE_REPOSITORY_PROFILE_APPLICABILITY_TYPE, mock_tags.RESOURCE_ANY_ID,
+            (mock_crit.return_value.as_dict(),), {'incremental': True},
+            tags=[mock_tags.action_tag.return_value])
+
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth', new=assert_auth_CREATE())
+    @mock.patch('pulp.server.webservices.views.repositories.Criteria.from_client_input')
+    def test_post_incremental_parallel(self, mock_crit):
+        """
+        Test that incremental regeneration cannot be done in parallel.
+        """
+        mock_request = mock.MagicMock()
+        mock_request.body = json.dumps({'repo_criteria': {}, 'parallel': True,
+                                        'incremental': True})
+        content_app_regen = ContentApplicabilityRegenerationView()
+
+        self.assertRaises(exceptions.InvalidValue, content_app_regen.post, mock_request)
+
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth', new=assert_auth_CREATE())
+    @mock.patch('pulp.server.webservices.views.repositories.Criteria.from_client_input')
+    def test_post_incremental_not_bool(self, mock_crit):
+        """
+        Test that incremental must be a boolean.
+        """
+        mock_request = mock.MagicMock()
+        mock_request.body = json.dumps({'repo_criteria': {}, 'incremental': 'yes'})
+        content_app_regen = ContentApplicabilityRegenerationView()
+
+        self.assertRaises(exceptions.InvalidValue, content_app_regen.post, mock_request)
+
 
 class TestHistoryView(unittest.TestCase):
     """
@@ -1,8 +1,9 @@
 """
 This module contains tests for the pulp.server.webservices.views.tasks module.
 """
+from bson import ObjectId
+from django import http
 import mock
-
 from mongoengine.queryset import DoesNotExist
 
 from .base import assert_auth_DELETE, assert_auth_READ
@@ -10,7 +11,7 @@ from pulp.common.compat import unittest
 from pulp.server import exceptions as pulp_exceptions
 from pulp.server.db import model
 from pulp.server.exceptions import MissingResource
-from pulp.server.webservices.views import util
+from pulp.server.webservices.views import tasks, util
 from pulp.server.webservices.views.tasks import (TaskCollectionView, TaskResourceView,
                                                  TaskSearchView, task_serializer)
 
@@ -59,14 +60,14 @@ class TestTaskCollection(unittest.TestCase):
                 new=assert_auth_READ())
     @mock.patch('pulp.server.webservices.views.tasks.task_serializer')
     @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
-    @mock.patch('pulp.server.webservices.views.tasks.generate_json_response_with_pulp_encoder')
+    @mock.patch('pulp.server.webservices.views.tasks.generate_streaming_json_response')
     def test_get_task_collection(self, mock_resp, mock_task_status, mock_task_serializer):
         """
         Test get task_collection with tags.
         """
 
         mock_request = mock.MagicMock()
-        mock_request.GET.getlist.return_value = ['mock_tag_1', 'mock_tag_2']
+        mock_request.GET = http.QueryDict('tag=mock_tag_1&tag=mock_tag_2')
         mock_task_status.objects.return_value = ['mock_1', 'mock_2']
         mock_task_serializer.side_effect = lambda x: x
 
@@ -75,7 +76,9 @@ class TestTaskCollection(unittest.TestCase):
 
         mock_task_status.objects.assert_called_once_with(group_id=None, tags__all=['mock_tag_1',
                                                                                    'mock_tag_2'])
-        mock_resp.assert_called_once_with(['mock_1', 'mock_2'])
+        streamed, items_key = mock_resp.call_args[0]
+        self.assertEqual(list(streamed), ['mock_1', 'mock_2'])
+        self.assertTrue(items_key is None)
         mock_task_serializer.assert_has_calls([mock.call('mock_1'), mock.call('mock_2')])
         self.assertTrue(response is mock_resp.return_value)
 
@@ -83,14 +86,14 @@ class TestTaskCollection(unittest.TestCase):
                 new=assert_auth_READ())
     @mock.patch('pulp.server.webservices.views.tasks.task_serializer')
     @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
-    @mock.patch('pulp.server.webservices.views.tasks.generate_json_response_with_pulp_encoder')
+    @mock.patch('pulp.server.webservices.views.tasks.generate_streaming_json_response')
     def test_get_task_collection_no_tags(self, mock_resp, mock_task_status, mock_task_serializer):
         """
         Test get task_collection with no tags.
         """
 
         mock_request = mock.MagicMock()
-        mock_request.GET.getlist.return_value = []
+        mock_request.GET = http.QueryDict('')
         mock_task_status.objects.return_value = ['mock_1', 'mock_2']
         mock_task_serializer.side_effect = lambda x: x
 
@@ -98,10 +101,144 @@ class TestTaskCollection(unittest.TestCase):
         response = task_collection.get(mock_request)
 
         mock_task_status.objects.assert_called_once_with(group_id=None)
-        mock_resp.assert_called_once_with(['mock_1', 'mock_2'])
-        mock_task_serializer.assert_has_calls([mock.call('mock_1'), mock.call('mock_2')])
+        streamed, items_key = mock_resp.call_args[0]
+        self.assertEqual(list(streamed), ['mock_1', 'mock_2'])
+        self.assertTrue(items_key is None)
         self.assertTrue(response is mock_resp.return_value)
 
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
+                new=assert_auth_READ())
+    @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
+    @mock.patch('pulp.server.webservices.views.tasks.generate_streaming_json_response')
+    def test_get_task_collection_filters(self, mock_resp, mock_task_status):
+        """
+        Test get task_collection filtered by state and time ranges.
+        """
+
+        mock_request = mock.MagicMock()
+        mock_request.GET = http.QueryDict('state=running&state=waiting'
+                                          '&started_after=2016-01-01T00:00:00%2B02:00'
+                                          '&finished_before=2016-01-02')
+
+        TaskCollectionView().get(mock_request)
+
+        mock_task_status.objects.assert_called_once_with(
+            group_id=None, state__in=['running', 'waiting'],
+            start_time__gte='2015-12-31T22:00:00Z', finish_time__lte='2016-01-02T00:00:00Z')
+
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
+                new=assert_auth_READ())
+    @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
+    def test_get_task_collection_invalid_filters(self, mock_task_status):
+        """
+        Test get task_collection with an invalid state, time, field, limit or continuation.
+        """
+
+        task_collection = TaskCollectionView()
+        for query in ('state=bogus', 'finished_after=yesterday', 'field=bogus', 'limit=0',
+                      'limit=ten', 'continuation=bogus'):
+            mock_request = mock.MagicMock()
+            mock_request.GET = http.QueryDict(query)
+            self.assertRaises(pulp_exceptions.InvalidValue, task_collection.get, mock_request)
+        self.assertFalse(mock_task_status.objects.called)
+
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
+                new=assert_auth_READ())
+    @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
+    @mock.patch('pulp.server.webservices.views.tasks.generate_streaming_json_response')
+    def test_get_task_collection_fields(self, mock_resp, mock_task_status):
+        """
+        Test get task_collection with a projection.
+        """
+
+        mock_request = mock.MagicMock()
+        mock_request.GET = http.QueryDict('field=state&field=tags')
+        task = model.TaskStatus(task_id='mock_task', state='running', tags=['mock_tag'])
+        mock_task_status.objects.return_value.only.return_value = [task]
+
+        TaskCollectionView().get(mock_request)
+
+        mock_task_status.objects.return_value.only.assert_called_once_with(
+            *set(['task_id', 'state', 'tags']))
+        streamed = list(mock_resp.call_args[0][0])
+        self.assertEqual(streamed, [{'task_id': 'mock_task', 'state': 'running',
+                                     'tags': ['mock_tag'],
+                                     '_href': '/pulp/api/v2/tasks/mock_task/'}])
+
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
+                new=assert_auth_READ())
+    @mock.patch('pulp.server.webservices.views.tasks.task_serializer')
+    @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
+    @mock.patch('pulp.server.webservices.views.tasks.generate_streaming_json_response')
+    def test_get_task_collection_page(self, mock_resp, mock_task_status, mock_task_serializer):
+        """
+        Test get task_collection with a limit, when there is a next page.
+        """
+
+        mock_request = mock.MagicMock()
+        mock_request.GET = http.QueryDict('limit=2')
+        raw_tasks = [mock.Mock(id=ObjectId()) for i in range(3)]
+        queryset = mock_task_status.objects.return_value
+        queryset.order_by.return_value.limit.return_value = raw_tasks
+        mock_task_serializer.side_effect = lambda x: x
+
+        TaskCollectionView().get(mock_request)
+
+        mock_task_status.objects.assert_called_once_with(group_id=None)
+        queryset.order_by.assert_called_once_with('id')
+        queryset.order_by.return_value.limit.assert_called_once_with(3)
+        streamed, items_key, extra = mock_resp.call_args[0]
+        self.assertEqual(list(streamed), raw_tasks[:2])
+        self.assertEqual(items_key, 'tasks')
+        self.assertEqual(extra, {'continuation': str(raw_tasks[1].id)})
+
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
+                new=assert_auth_READ())
+    @mock.patch('pulp.server.webservices.views.tasks.task_serializer')
+    @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
+    @mock.patch('pulp.server.webservices.views.tasks.generate_streaming_json_response')
+    def test_get_task_collection_last_page(self, mock_resp, mock_task_status,
+                                           mock_task_serializer):
+        """
+        Test get task_collection with a continuation, when this is the last page.
+        """
+
+        last_id = ObjectId()
+        mock_request = mock.MagicMock()
+        mock_request.GET = http.QueryDict('continuation=%s' % last_id)
+        raw_tasks = [mock.Mock(id=ObjectId())]
+        queryset = mock_task_status.objects.return_value
+        queryset.order_by.return_value.limit.return_value = raw_tasks
+        mock_task_serializer.side_effect = lambda x: x
+
+        TaskCollectionView().get(mock_request)
+
+        mock_task_status.objects.assert_called_once_with(group_id=None, id__gt=last_id)
+        queryset.order_by.return_value.limit.assert_called_once_with(
+            tasks.TASK_LIST_PAGE_SIZE + 1)
+        page, items_key, extra = mock_resp.call_args[0]
+        self.assertEqual(list(page), raw_tasks)
+        self.assertEqual(extra, {'continuation': None})
+
+    @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
+                new=assert_auth_READ())
+    @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
+    @mock.patch('pulp.server.webservices.views.tasks.generate_streaming_json_response')
+    def test_get_task_collection_limit_too_large(self, mock_resp, mock_task_status):
+        """
+        Test get task_collection with a limit larger than a page, which is reduced to a page.
+        """
+
+        mock_request = mock.MagicMock()
+        mock_request.GET = http.QueryDict('limit=%d' % (tasks.TASK_LIST_PAGE_SIZE * 10))
+        queryset = mock_task_status.objects.return_value
+        queryset.order_by.return_value.limit.return_value = []
+
+        TaskCollectionView().get(mock_request)
+
+        queryset.order_by.return_value.limit.assert_called_once_with(
+            tasks.TASK_LIST_PAGE_SIZE + 1)
+
     @mock.patch('pulp.server.webservices.views.decorators._verify_auth',
                 new=assert_auth_DELETE())
     @mock.patch('pulp.server.webservices.views.tasks.TaskStatus')
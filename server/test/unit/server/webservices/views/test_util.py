@@ -2,7 +2,7 @@ import httplib
 import json
 import mock
 
-from django.http import HttpResponse, HttpResponseNotFound
+from django.http import HttpResponse, HttpResponseNotFound, StreamingHttpResponse
 
 from pulp.common.compat import unittest
 from pulp.server.exceptions import InputEncodingError, PulpCodedValidationException
@@ -58,6 +58,35 @@ class TestResponseGenerators(unittest.TestCase):
         util.generate_json_response_with_pulp_encoder(test_content)
         mock_json.dumps.assert_called_once_with(test_content, default=pulp_json_encoder)
 
+    def test_generate_streaming_json_response(self):
+        """
+        Test that the items are streamed as an array inside a JSON object.
+        """
+        items = (i for i in [{'foo': 'bar'}, {'foo': 'baz'}])
+        response = util.generate_streaming_json_response(items, 'items', {'next': None})
+        self.assertTrue(isinstance(response, StreamingHttpResponse))
+        self.assertEqual(response._headers.get('content-type'),
+                         ('Content-Type', 'application/json; charset=utf-8'))
+        response_content = json.loads(''.join(response.streaming_content))
+        self.assertEqual(response_content,
+                         {'items': [{'foo': 'bar'}, {'foo': 'baz'}], 'next': None})
+
+    def test_generate_streaming_json_response_no_items(self):
+        """
+        Test that an empty iterable is streamed as an empty array.
+        """
+        response = util.generate_streaming_json_response([], 'items')
+        self.assertEqual(json.loads(''.join(response.streaming_content)), {'items': []})
+
+    def test_generate_streaming_json_response_array(self):
+        """
+        Test that the items are streamed as a bare array if there is no items key.
+        """
+        items = (i for i in [{'foo': 'bar'}, {'foo': 'baz'}])
+        response = util.generate_streaming_json_response(items, None)
+        self.assertEqual(json.loads(''.join(response.streaming_content)),
+                         [{'foo': 'bar'}, {'foo': 'baz'}])
+
     @mock.patch('pulp.server.webservices.views.util.iri_to_uri')
     def test_generate_redirect_response(self, mock_iri_to_uri):
         """
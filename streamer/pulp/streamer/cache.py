@@ -0,0 +1,243 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import copy
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    A thread-safe cache that holds at most a given number of entries, evicting the least recently
+    used entry when it is full. Entries expire after a given number of seconds, but are kept until
+    they are evicted, so that the caller can decide whether an expired entry is still valid.
+
+    :ivar hits:   The number of lookups that found an entry that had not expired.
+    :type hits:   int
+    :ivar misses: The number of lookups that found no entry or an expired one.
+    :type misses: int
+    """
+
+    def __init__(self, max_size, timeout):
+        """
+        :param max_size: The maximum number of entries to hold. A cache with a maximum size of
+                         0 holds nothing.
+        :type  max_size: int
+        :param timeout:  The number of seconds after which an entry expires.
+        :type  timeout:  float
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiration time, value)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up an entry and mark it as the most recently used.
+
+        :param key: The key of the entry.
+        :type  key: hashable
+
+        :return: A tuple of the value, or None if there is no entry for the key, and a boolean
+                 that is True if the entry has expired.
+        :rtype:  tuple
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None, True
+            self._entries[key] = (expires, value)
+            expired = time.time() >= expires
+            if expired:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value, expired
+
+    def put(self, key, value):
+        """
+        Add or replace an entry, which expires after the cache timeout.
+
+        :param key:   The key of the entry.
+        :type  key:   hashable
+        :param value: The value of the entry.
+        :type  value: object
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.timeout, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """
+        Remove an entry if it is present.
+
+        :param key: The key of the entry.
+        :type  key: hashable
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        """
+        :return: The number of entries in the cache, including expired ones.
+        :rtype:  int
+        """
+        return len(self._entries)
+
+
+class DownloaderCache(object):
+    """
+    A thread-safe cache of configured nectar downloaders, so that the downloader configuration,
+    including the SSL certificates it writes to disk, is built once for each importer rather
+    than for every download. Keeping the certificate paths stable also lets the HTTP session
+    reuse its connection pools, and so its TLS connections, across downloads.
+
+    Each importer has at most one entry, which is replaced when the importer is updated.
+    Replaced and evicted downloaders are finalized once no download is using them.
+
+    :ivar hits:   The number of downloads that used a cached downloader.
+    :type hits:   int
+    :ivar misses: The number of downloads that built a new downloader.
+    :type misses: int
+    """
+
+    def __init__(self, max_size):
+        """
+        :param max_size: The maximum number of downloaders to hold. A cache with a maximum size
+                         of 0 builds a downloader for every download.
+        :type  max_size: int
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # key -> CachedDownloader
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def downloader(self, key, revision, factory):
+        """
+        Provide a downloader for the duration of a download. The downloader is a copy of the
+        cached one that shares its configuration and session, so that its event listener can be
+        set without affecting concurrent downloads.
+
+        :param key:      The key of the entry, such as the importer ID and URL scheme.
+        :type  key:      hashable
+        :param revision: Identifies the configuration the downloader was built from, such as
+                         the importer's last update time. An entry with a different revision
+                         is replaced.
+        :type  revision: object
+        :param factory:  Called with no arguments to build a downloader.
+        :type  factory:  callable
+
+        :return: A context manager that provides the downloader.
+        :rtype:  contextlib.GeneratorContextManager
+        """
+        entry = self._checkout(key, revision, factory)
+        try:
+            yield copy.copy(entry.downloader)
+        finally:
+            self._checkin(entry)
+
+    def _checkout(self, key, revision, factory):
+        """
+        Find or build the entry for a key and mark it as in use.
+
+        :param key:      The key of the entry.
+        :type  key:      hashable
+        :param revision: Identifies the configuration the downloader was built from.
+        :type  revision: object
+        :param factory:  Called with no arguments to build a downloader.
+        :type  factory:  callable
+
+        :return: The entry, which must be passed to _checkin once the download is done.
+        :rtype:  CachedDownloader
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry.revision == revision:
+                self._entries[key] = entry
+                entry.users += 1
+                self.hits += 1
+                return entry
+            self.misses += 1
+            if entry is not None:
+                self._retire(entry)
+
+        # Building a downloader can be slow, so it is done without holding the lock
+        entry = CachedDownloader(factory(), revision)
+        entry.users += 1
+        if self.max_size <= 0:
+            entry.retired = True
+            return entry
+        with self._lock:
+            existing = self._entries.pop(key, None)
+            if existing is not None:
+                self._retire(existing)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._retire(self._entries.popitem(last=False)[1])
+        return entry
+
+    def _checkin(self, entry):
+        """
+        Mark an entry as no longer used by a download, finalizing its downloader if the entry
+        has been retired and was the last download using it.
+
+        :param entry: The entry returned by _checkout.
+        :type  entry: CachedDownloader
+        """
+        with self._lock:
+            entry.users -= 1
+            finalize = entry.retired and entry.users == 0
+        if finalize:
+            entry.downloader.config.finalize()
+
+    @staticmethod
+    def _retire(entry):
+        """
+        Mark an entry that has been removed from the cache so that its downloader is finalized
+        once it is no longer in use. Must be called with the lock held.
+
+        :param entry: The removed entry.
+        :type  entry: CachedDownloader
+        """
+        entry.retired = True
+        if entry.users == 0:
+            entry.downloader.config.finalize()
+
+    def __len__(self):
+        """
+        :return: The number of downloaders in the cache.
+        :rtype:  int
+        """
+        return len(self._entries)
+
+
+class CachedDownloader(object):
+    """
+    A downloader held by a DownloaderCache.
+
+    :ivar downloader: The configured downloader.
+    :type downloader: nectar.downloaders.base.Downloader
+    :ivar revision:   Identifies the configuration the downloader was built from.
+    :type revision:   object
+    :ivar users:      The number of downloads using the downloader.
+    :type users:      int
+    :ivar retired:    True once the entry has been removed from the cache.
+    :type retired:    bool
+    """
+
+    def __init__(self, downloader, revision):
+        self.downloader = downloader
+        self.revision = revision
+        self.users = 0
+        self.retired = False
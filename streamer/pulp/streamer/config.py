@@ -9,6 +9,11 @@ DEFAULT_VALUES = {
         'port': '8751',
         'interfaces': 'localhost',
         'cache_timeout': '86400',
+        'catalog_cache_size': '10000',
+        'catalog_cache_timeout': '60',
+        'downloader_cache_size': '100',
+        'async_downloads': 'false',
+        'async_connections_per_host': '10',
     },
 }
 
@@ -1,13 +1,23 @@
+from collections import namedtuple
 from gettext import gettext as _
-from httplib import NOT_FOUND, INTERNAL_SERVER_ERROR, SERVICE_UNAVAILABLE
+from httplib import NOT_FOUND, OK, INTERNAL_SERVER_ERROR, SERVICE_UNAVAILABLE
 from urlparse import urlparse
+import base64
 import logging
+import tempfile
+import threading
+import time
 
 from mongoengine import DoesNotExist, NotUniqueError
 from nectar import listener as nectar_listener
+from nectar.downloaders.threaded import HTTPThreadedDownloader
+from nectar.report import DownloadReport
 import requests
-from twisted.internet import reactor
+from twisted.internet import defer, protocol, reactor, threads
+from twisted.python import threadable
 from twisted.web import resource
+from twisted.web.client import Agent, HTTPConnectionPool, RedirectAgent, ResponseDone
+from twisted.web.http_headers import Headers
 from twisted.web.server import NOT_DONE_YET
 
 from pulp.plugins.loader import api as plugins_api
@@ -18,6 +28,7 @@ from pulp.server.db import model
 from pulp.server.controllers import repository as repo_controller
 from pulp.plugins.loader.exceptions import PluginNotFound
 from pulp.streamer import adapters as pulp_adapters
+from pulp.streamer.cache import DownloaderCache, LRUCache
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +51,28 @@ HOP_BY_HOP_HEADERS = [
 ]
 
 
+# Downloader settings that the asynchronous HTTP client does not support. Downloads that use
+# any of them are made by the threaded downloader.
+ASYNC_UNSUPPORTED_SETTINGS = (
+    'proxy_url',
+    'ssl_ca_cert',
+    'ssl_ca_cert_path',
+    'ssl_client_cert',
+    'ssl_client_cert_path',
+    'ssl_client_key',
+    'ssl_client_key_path',
+    'max_speed',
+)
+
+# The number of bytes a SpoolReader reads from the spool file at once
+SPOOL_READ_SIZE = 65536
+
+
+# Everything needed to download the file at a catalog path, as cached by the Streamer.
+CatalogLookup = namedtuple('CatalogLookup', ['catalog_entry', 'importer', 'db_importer',
+                                             'unit_key'])
+
+
 class StreamerListener(nectar_listener.DownloadEventListener):
     """
     This DownloadEventListener subclass's purpose is to set the
@@ -148,6 +181,26 @@ class Streamer(resource.Resource):
         # to avoid carrying the package.
         self.session = requests.Session()
         self.session.mount('https://', pulp_adapters.PulpHTTPAdapter())
+        # Catalog path -> CatalogLookup
+        self.catalog_cache = LRUCache(config.getint('streamer', 'catalog_cache_size'),
+                                      config.getfloat('streamer', 'catalog_cache_timeout'))
+        # (importer ID, URL scheme) -> configured primary downloader
+        self.downloader_cache = DownloaderCache(config.getint('streamer',
+                                                              'downloader_cache_size'))
+        # The content sources are loaded again once this many seconds have passed
+        self.content_sources_timeout = config.getfloat('streamer', 'catalog_cache_timeout')
+        self._content_container = None
+        self._content_container_loaded = 0
+        self._content_container_lock = threading.Lock()
+        # Catalog path -> DownloadSpool of the download in progress. Only used in the reactor
+        # thread.
+        self.spools = {}
+        self.async_downloads = config.getboolean('streamer', 'async_downloads')
+        if self.async_downloads:
+            self.connection_pool = HTTPConnectionPool(reactor)
+            self.connection_pool.maxPersistentPerHost = config.getint(
+                'streamer', 'async_connections_per_host')
+            self.agent = RedirectAgent(Agent(reactor, pool=self.connection_pool))
 
     def render_GET(self, request):
         """
@@ -163,10 +216,31 @@ class Streamer(resource.Resource):
             * The file is downloaded using the Nectar downloader and the content
               is streamed to the client as it is received.
 
+        Concurrent requests for the same file share a single download: the first request
+        starts it, and the requests that arrive while it is in progress are sent the content
+        spooled so far, followed by the rest of the content as it is received.
+
+        If async_downloads is enabled, the file is downloaded by Twisted's HTTP client in the
+        reactor thread, unless the download needs features that only the Nectar downloader
+        supports.
+
         :param request: the request to process.
         :type  request: twisted.web.server.Request
         """
-        reactor.callInThread(self._handle_get, request)
+        catalog_path = urlparse(request.uri).path
+        spool = self.spools.get(catalog_path)
+        if spool is None:
+            spool = DownloadSpool(request, lambda: self.spools.pop(catalog_path, None))
+            self.spools[catalog_path] = spool
+            spool.add_reader(request)
+            if self.async_downloads:
+                self._handle_get_async(spool)
+            else:
+                reactor.callInThread(self._handle_get, spool)
+        else:
+            logger.debug(_('Joining the download in progress for {path}.').format(
+                path=catalog_path))
+            spool.add_reader(request)
         return NOT_DONE_YET
 
     def _handle_get(self, request):
@@ -174,17 +248,18 @@ class Streamer(resource.Resource):
         Download the requested content using the content unit catalog and dispatch
         a celery task that causes Pulp to download the newly cached unit.
 
-        :param request: The content request.
-        :type  request: twisted.web.server.Request
+        :param request: The content request, or the spool that shares the download between
+                        several requests.
+        :type  request: twisted.web.server.Request or DownloadSpool
         """
         catalog_path = urlparse(request.uri).path
         with Responder(request) as responder:
             try:
-                catalog_entry = model.LazyCatalogEntry.objects(
-                    path=catalog_path).order_by('importer_id').first()
-                if not catalog_entry:
-                    raise DoesNotExist()
-                self._download(catalog_entry, request, responder)
+                lookup = self._lookup(catalog_path)
+                if lookup is None:
+                    request.setResponseCode(NOT_FOUND)
+                    return
+                self._download(lookup, request, responder)
             except DoesNotExist:
                 logger.error(_('Failed to find a catalog entry with path'
                                ' "{rel}".'.format(rel=catalog_path)))
@@ -198,20 +273,194 @@ class Streamer(resource.Resource):
                 logger.exception(_('An unexpected error occurred while handling the request.'))
                 request.setResponseCode(INTERNAL_SERVER_ERROR)
 
-    def _download(self, catalog_entry, request, responder):
+    def _handle_get_async(self, request):
         """
-        Build a nectar downloader and download the content from the catalog entry.
-        The download is performed by the alternate content container, so it is possible
-        to use the streamer in conjunction with alternate content sources.
+        Download the requested content with the asynchronous HTTP client. The catalog lookup is
+        made in a thread, and if the content cannot be downloaded asynchronously, or the lookup
+        fails, the request is handed to _handle_get, which also reports errors to the client.
 
-        :param catalog_entry:   The catalog entry to download.
-        :type  catalog_entry:   pulp.server.db.model.LazyCatalogEntry
-        :param request:         The client content request.
-        :type  request:         twisted.web.server.Request
-        :param responder:       The file-like object that nectar should write to.
-        :type  responder:       Responder
+        :param request: The spool that shares the download between requests.
+        :type  request: DownloadSpool
         """
-        # Configure the primary downloader for alternate content sources
+        catalog_path = urlparse(request.uri).path
+        d = threads.deferToThread(self._prepare_async_download, catalog_path)
+        d.addCallbacks(self._download_async, self._fall_back,
+                       callbackArgs=(request,), errbackArgs=(request,))
+
+    def _fall_back(self, failure, request):
+        """
+        Hand a request to the threaded download path.
+
+        :param failure: The reason the request is not downloaded asynchronously, if any.
+        :type  failure: twisted.python.failure.Failure
+        :param request: The spool that shares the download between requests.
+        :type  request: DownloadSpool
+        """
+        reactor.callInThread(self._handle_get, request)
+
+    def _prepare_async_download(self, catalog_path):
+        """
+        Look up the catalog entry for a path, and determine the request headers needed to
+        download it asynchronously. This is called in a thread.
+
+        :param catalog_path: The path of the requested file.
+        :type  catalog_path: str
+
+        :return: A tuple of the lookup and a dictionary of request headers, or None if the
+                 file must be downloaded by the Nectar downloader.
+        :rtype:  tuple
+        """
+        lookup = self._lookup(catalog_path)
+        if lookup is None:
+            return None
+        if self._get_content_container().sources:
+            # Alternate content sources are only supported by the Nectar downloader
+            return None
+
+        with self._primary_downloader(lookup) as downloader:
+            downloader_config = downloader.config
+            # Subclasses may customize the requests they make
+            if downloader.__class__ is not HTTPThreadedDownloader:
+                return None
+            if getattr(downloader_config, 'ssl_validation', True) is False:
+                return None
+            for setting in ASYNC_UNSUPPORTED_SETTINGS:
+                if getattr(downloader_config, setting, None):
+                    return None
+
+            headers = {}
+            for key, value in (getattr(downloader_config, 'headers', None) or {}).items():
+                headers[key] = [value]
+            username = getattr(downloader_config, 'basic_auth_username', None)
+            if username:
+                password = getattr(downloader_config, 'basic_auth_password', None) or ''
+                credentials = base64.b64encode('%s:%s' % (username, password))
+                headers['Authorization'] = ['Basic ' + credentials]
+            return lookup, headers
+
+    def _download_async(self, prepared, request):
+        """
+        Start downloading the content with the asynchronous HTTP client.
+
+        :param prepared: The result of _prepare_async_download.
+        :type  prepared: tuple
+        :param request:  The spool that shares the download between requests.
+        :type  request:  DownloadSpool
+        """
+        if prepared is None:
+            self._fall_back(None, request)
+            return
+        lookup, headers = prepared
+        catalog_entry = lookup.catalog_entry
+        pulp_request = request.getHeader(PULP_STREAM_REQUEST_HEADER)
+        listener = StreamerListener(request, self.config, catalog_entry, pulp_request)
+
+        d = self.agent.request('GET', str(catalog_entry.url), Headers(headers))
+        d.addCallback(self._receive_async_response, catalog_entry, listener, request)
+        d.addErrback(self._async_download_failed, catalog_entry, request)
+
+    def _receive_async_response(self, response, catalog_entry, listener, request):
+        """
+        Forward the upstream response to the request.
+
+        :param response:      The upstream response.
+        :type  response:      twisted.web.iweb.IResponse
+        :param catalog_entry: The catalog entry being downloaded.
+        :type  catalog_entry: pulp.server.db.model.LazyCatalogEntry
+        :param listener:      The listener that sets the response headers and records the
+                              download.
+        :type  listener:      StreamerListener
+        :param request:       The spool that shares the download between requests.
+        :type  request:       DownloadSpool
+
+        :return: A deferred that fires when the response body has been received.
+        :rtype:  twisted.internet.defer.Deferred
+        """
+        report = DownloadReport(catalog_entry.url, None)
+        if response.code != OK:
+            report.error_report['response_code'] = response.code
+            listener.download_failed(report)
+            finished = ResponseBodyWriter.discard(response)
+            finished.addBoth(lambda result: request.finish())
+            return finished
+
+        report.headers = dict((key, values[-1])
+                              for key, values in response.headers.getAllRawHeaders())
+        listener.download_headers(report)
+
+        finished = ResponseBodyWriter.forward(response, request)
+
+        def body_received(reason):
+            if not reason.check(ResponseDone):
+                logger.error(_('The download of {url} failed: {reason}').format(
+                    url=catalog_entry.url, reason=reason.getErrorMessage()))
+                request.finish()
+                return
+            # Recording the download uses the database, so it is done in a thread
+            d = threads.deferToThread(listener.download_succeeded, report)
+            d.addErrback(lambda failure: logger.error(failure.getTraceback()))
+            d.addBoth(lambda result: request.finish())
+
+        finished.addBoth(body_received)
+        return finished
+
+    @staticmethod
+    def _async_download_failed(failure, catalog_entry, request):
+        """
+        Report a download that failed before any content was received.
+
+        :param failure:       The reason the download failed.
+        :type  failure:       twisted.python.failure.Failure
+        :param catalog_entry: The catalog entry being downloaded.
+        :type  catalog_entry: pulp.server.db.model.LazyCatalogEntry
+        :param request:       The spool that shares the download between requests.
+        :type  request:       DownloadSpool
+        """
+        logger.error(_('The download of {url} failed: {reason}').format(
+            url=catalog_entry.url, reason=failure.getErrorMessage()))
+        request.setHeader('Content-Length', '0')
+        request.setResponseCode(SERVICE_UNAVAILABLE)
+        request.finish()
+
+    def _lookup(self, catalog_path):
+        """
+        Find the catalog entry for the given path, along with the importer that contributed it
+        and the unit key of its content unit.
+
+        Lookups are cached for the configured catalog_cache_timeout. Once a lookup expires, only
+        the catalog entry and the importer's last update time are loaded again, and the rest of
+        the lookup is reused if the entry has the same revision and the importer has not been
+        updated since.
+
+        :param catalog_path: The path of the requested file.
+        :type  catalog_path: str
+
+        :raises DoesNotExist:   if there is no catalog entry for the path.
+        :raises PluginNotFound: if the catalog entry references an importer that does not exist.
+
+        :return: The lookup, or None if the catalog entry references a content unit that does
+                 not exist.
+        :rtype:  CatalogLookup
+        """
+        cached, expired = self.catalog_cache.get(catalog_path)
+        if not expired:
+            return cached
+
+        catalog_entry = model.LazyCatalogEntry.objects(
+            path=catalog_path).order_by('importer_id').first()
+        if not catalog_entry:
+            self.catalog_cache.discard(catalog_path)
+            raise DoesNotExist()
+
+        if cached is not None and self._is_current(cached, catalog_entry):
+            lookup = cached._replace(catalog_entry=catalog_entry)
+            self.catalog_cache.put(catalog_path, lookup)
+            return lookup
+
+        logger.debug(_('Loading the catalog entry for {path}; the catalog cache has had {hits} '
+                       'hits and {misses} misses.').format(path=catalog_path,
+                                                           hits=self.catalog_cache.hits,
+                                                           misses=self.catalog_cache.misses))
         plugin_importer, config, db_importer = repo_controller.get_importer_by_id(
             catalog_entry.importer_id)
         # There is an unfortunate mess of configuration classes and attributes, and
@@ -222,36 +471,481 @@ class Streamer(resource.Resource):
         # have the whole config. In the future the importer object should seemlessly
         # load and apply the plugin-wide configuration.
         db_importer.config = config.flatten()
-        primary_downloader = plugin_importer.get_downloader_for_db_importer(
-            db_importer, catalog_entry.url, working_dir='/tmp')
-        pulp_request = request.getHeader(PULP_STREAM_REQUEST_HEADER)
-        listener = StreamerListener(request, self.config, catalog_entry, pulp_request)
-        primary_downloader.session = self.session
-        primary_downloader.event_listener = listener
 
-        # Build the alternate content source download request
         unit_model = plugins_api.get_unit_model_by_id(catalog_entry.unit_type_id)
         qs = unit_model.objects.filter(id=catalog_entry.unit_id).only(*unit_model.unit_key_fields)
         try:
             unit = qs.get()
+        except DoesNotExist:
+            # A catalog entry is referencing a unit that doesn't exist which is bad.
+            msg = _('The catalog entry for {path} references {unit_type}:{id}, but '
+                    'that unit is not in the database.')
+            logger.error(msg.format(path=catalog_entry.path, unit_type=catalog_entry.unit_type_id,
+                                    id=catalog_entry.unit_id))
+            self.catalog_cache.discard(catalog_path)
+            return None
+
+        lookup = CatalogLookup(catalog_entry, plugin_importer, db_importer, unit.unit_key)
+        self.catalog_cache.put(catalog_path, lookup)
+        return lookup
+
+    @staticmethod
+    def _is_current(lookup, catalog_entry):
+        """
+        Determine whether an expired lookup is still valid for the catalog entry now in the
+        database.
+
+        :param lookup:        The expired lookup.
+        :type  lookup:        CatalogLookup
+        :param catalog_entry: The catalog entry for the same path, freshly loaded.
+        :type  catalog_entry: pulp.server.db.model.LazyCatalogEntry
+
+        :return: True if the lookup can be reused.
+        :rtype:  bool
+        """
+        cached_entry = lookup.catalog_entry
+        if (cached_entry.importer_id, cached_entry.revision, cached_entry.unit_id) != \
+                (catalog_entry.importer_id, catalog_entry.revision, catalog_entry.unit_id):
+            return False
+        db_importer = model.Importer.objects(id=lookup.db_importer.id).only(
+            'last_updated').first()
+        return db_importer is not None and \
+            db_importer.last_updated == lookup.db_importer.last_updated
+
+    def _download(self, lookup, request, responder):
+        """
+        Build a nectar downloader and download the content from the catalog entry.
+        The download is performed by the alternate content container, so it is possible
+        to use the streamer in conjunction with alternate content sources.
+
+        :param lookup:          The catalog entry to download, with its importer and unit key.
+        :type  lookup:          CatalogLookup
+        :param request:         The client content request.
+        :type  request:         twisted.web.server.Request
+        :param responder:       The file-like object that nectar should write to.
+        :type  responder:       Responder
+        """
+        catalog_entry = lookup.catalog_entry
+        pulp_request = request.getHeader(PULP_STREAM_REQUEST_HEADER)
+        listener = StreamerListener(request, self.config, catalog_entry, pulp_request)
+
+        # Configure the primary downloader for alternate content sources
+        with self._primary_downloader(lookup) as primary_downloader:
+            primary_downloader.event_listener = listener
+
+            # Build the alternate content source download request
             download_request = content_models.Request(
                 catalog_entry.unit_type_id,
-                unit.unit_key,
+                lookup.unit_key,
                 catalog_entry.url,
                 responder,
             )
 
-            alt_content_container = content_container.ContentContainer(threaded=False)
+            alt_content_container = self._get_content_container()
             alt_content_container.download(primary_downloader, [download_request], listener)
-        except DoesNotExist:
-            # A catalog entry is referencing a unit that doesn't exist which is bad.
-            msg = _('The catalog entry for {path} references {unit_type}:{id}, but '
-                    'that unit is not in the database.')
-            logger.error(msg.format(path=catalog_entry.path, unit_type=catalog_entry.unit_type_id,
-                                    id=catalog_entry.unit_id))
-            request.setResponseCode(NOT_FOUND)
-        finally:
-            primary_downloader.config.finalize()
+
+    def _primary_downloader(self, lookup):
+        """
+        Provide a primary downloader for a catalog entry. Downloaders are cached for each
+        importer and URL scheme until the importer is updated, so that the downloader
+        configuration is not built for every request.
+
+        :param lookup: The catalog entry to download, with its importer.
+        :type  lookup: CatalogLookup
+
+        :return: A context manager that provides the downloader.
+        :rtype:  contextlib.GeneratorContextManager
+        """
+        catalog_entry = lookup.catalog_entry
+        db_importer = lookup.db_importer
+
+        def build():
+            downloader = lookup.importer.get_downloader_for_db_importer(
+                db_importer, catalog_entry.url, working_dir='/tmp')
+            downloader.session = self.session
+            return downloader
+
+        key = (catalog_entry.importer_id, urlparse(catalog_entry.url).scheme)
+        return self.downloader_cache.downloader(key, db_importer.last_updated, build)
+
+    def _get_content_container(self):
+        """
+        Get the alternate content container. The content source definitions are loaded again
+        once they are older than the catalog cache timeout.
+
+        :return: The alternate content container.
+        :rtype:  pulp.server.content.sources.container.ContentContainer
+        """
+        with self._content_container_lock:
+            now = time.time()
+            if self._content_container is None or \
+                    now - self._content_container_loaded >= self.content_sources_timeout:
+                self._content_container = content_container.ContentContainer(threaded=False)
+                self._content_container_loaded = now
+            return self._content_container
+
+
+class ResponseBodyWriter(protocol.Protocol):
+    """
+    Receives the body of an upstream response and writes it to a request. The upstream
+    connection is registered as the producer of the request, so that reading from upstream is
+    paused while the request cannot keep up.
+    """
+
+    def __init__(self, request, finished):
+        """
+        :param request:  The request to write the body to, or None to discard the body.
+        :type  request:  DownloadSpool
+        :param finished: Fired with the reason the body ended, which is a ResponseDone failure
+                         if the whole body was received.
+        :type  finished: twisted.internet.defer.Deferred
+        """
+        self.request = request
+        self.finished = finished
+
+    @classmethod
+    def forward(cls, response, request):
+        """
+        Write the body of a response to a request.
+
+        :param response: The upstream response.
+        :type  response: twisted.web.iweb.IResponse
+        :param request:  The request to write the body to.
+        :type  request:  DownloadSpool
+
+        :return: A deferred fired with the reason the body ended.
+        :rtype:  twisted.internet.defer.Deferred
+        """
+        finished = defer.Deferred()
+        response.deliverBody(cls(request, finished))
+        return finished
+
+    @classmethod
+    def discard(cls, response):
+        """
+        Read and discard the body of a response, so its connection can be reused.
+
+        :param response: The upstream response.
+        :type  response: twisted.web.iweb.IResponse
+
+        :return: A deferred fired with the reason the body ended.
+        :rtype:  twisted.internet.defer.Deferred
+        """
+        return cls.forward(response, None)
+
+    def connectionMade(self):
+        if self.request is not None:
+            self.request.registerProducer(self.transport, True)
+
+    def dataReceived(self, data):
+        if self.request is not None:
+            self.request.write(data)
+
+    def connectionLost(self, reason):
+        if self.request is not None:
+            self.request.unregisterProducer()
+        self.finished.callback(reason)
+
+
+class SpoolReader(object):
+    """
+    Sends the content of a DownloadSpool to one request, reading it from the spool file. The
+    reader is registered as the push producer of its request, so that it only reads from the
+    spool while the transport of the request can take more data.
+    """
+
+    def __init__(self, spool, request):
+        """
+        :param spool:   The spool to send.
+        :type  spool:   DownloadSpool
+        :param request: The request to send the spool to.
+        :type  request: twisted.web.server.Request
+        """
+        self.spool = spool
+        self.request = request
+        # The number of bytes of the spool sent to the request
+        self.offset = 0
+        self.paused = False
+        self.stopped = False
+        self.delayed_call = None
+
+    def start(self):
+        """
+        Register the reader as the producer of its request and start sending the spool.
+        """
+        self.request.registerProducer(self, True)
+        self.schedule()
+
+    def schedule(self):
+        """
+        Send the next part of the spool in a later reactor iteration, unless the transport of
+        the request is paused or a part is already scheduled, so that a large spool does not
+        block the reactor.
+        """
+        if not (self.paused or self.stopped or self.delayed_call):
+            self.delayed_call = reactor.callLater(0, self._send)
+
+    def _send(self):
+        """
+        Send the request the next part of the spool, or finish the request once it has been
+        sent the whole download.
+        """
+        self.delayed_call = None
+        if self.paused or self.stopped:
+            return
+        if self.offset < self.spool.size:
+            data = self.spool.read(self.offset, SPOOL_READ_SIZE)
+            self.offset += len(data)
+            self.request.write(data)
+            self.schedule()
+        elif self.spool.finished:
+            self._finish()
+
+    def _finish(self):
+        """
+        Finish a request that has been sent the whole download.
+        """
+        self.stop()
+        self.request.unregisterProducer()
+        try:
+            self.request.finish()
+        except RuntimeError as e:
+            logger.debug(str(e))
+        self.spool._remove_reader(self.request)
+
+    def stop(self):
+        """
+        Stop sending the spool to the request.
+        """
+        self.stopped = True
+        if self.delayed_call is not None:
+            self.delayed_call.cancel()
+            self.delayed_call = None
+        # The download goes on for the other requests, and to record it
+        self.spool._resume_upstream(self.request)
+
+    def pauseProducing(self):
+        self.paused = True
+        if self.delayed_call is not None:
+            self.delayed_call.cancel()
+            self.delayed_call = None
+        self.spool._pause_upstream(self.request)
+
+    def resumeProducing(self):
+        self.paused = False
+        self.spool._resume_upstream(self.request)
+        self.schedule()
+
+    def stopProducing(self):
+        self.stop()
+
+
+class DownloadSpool(object):
+    """
+    Shares one download between all the requests for the same file that arrive while it is in
+    progress. The download is written to a temporary spool file, and each request is sent the
+    content of the spool file by its own SpoolReader, at the pace its client reads it.
+
+    A spool stands in for the request that started the download. The download thread sets the
+    response headers and code with setHeader and setResponseCode, which are forwarded to the
+    reactor thread, and a Responder calls write and finish from the reactor thread. All the
+    state of the spool is used in the reactor thread only.
+    """
+
+    def __init__(self, request, finished_callback):
+        """
+        :param request:           The request that starts the download.
+        :type  request:           twisted.web.server.Request
+        :param finished_callback: Called, without arguments, when the download is finished.
+        :type  finished_callback: callable
+        """
+        self.request = request
+        self.uri = request.uri
+        self.finished_callback = finished_callback
+        self.spool_file = tempfile.TemporaryFile()
+        self.size = 0
+        self.code = None
+        self.headers = []
+        self.finished = False
+        # The upstream connection, when the download is made by the asynchronous HTTP client
+        self.upstream = None
+        # Request -> SpoolReader that sends the spool to it
+        self.readers = {}
+
+    def getHeader(self, key):
+        """
+        Get a header of the request that started the download.
+
+        :param key: The name of the header.
+        :type  key: str
+
+        :return: The value of the header, or None.
+        :rtype:  str
+        """
+        return self.request.getHeader(key)
+
+    def setHeader(self, name, value):
+        """
+        Set a response header for all the requests, from any thread.
+
+        :param name:  The name of the header.
+        :type  name:  str
+        :param value: The value of the header.
+        :type  value: str
+        """
+        if threadable.isInIOThread():
+            self._set_header(name, value)
+        else:
+            reactor.callFromThread(self._set_header, name, value)
+
+    def setResponseCode(self, code):
+        """
+        Set the response code for all the requests, from any thread.
+
+        :param code: The HTTP response code.
+        :type  code: int
+        """
+        if threadable.isInIOThread():
+            self._set_response_code(code)
+        else:
+            reactor.callFromThread(self._set_response_code, code)
+
+    def registerProducer(self, producer, streaming):
+        """
+        Register the upstream connection, so that the download proceeds at the pace the client
+        of the request that started it reads it.
+
+        :param producer:  The upstream connection.
+        :type  producer:  twisted.internet.interfaces.IPushProducer
+        :param streaming: True, since the upstream connection is a push producer.
+        :type  streaming: bool
+        """
+        self.upstream = producer
+        leader = self.readers.get(self.request)
+        if leader is not None and leader.paused:
+            producer.pauseProducing()
+
+    def unregisterProducer(self):
+        """
+        Unregister the upstream connection.
+        """
+        self.upstream = None
+
+    def _pause_upstream(self, request):
+        """
+        Pause the upstream connection if the transport of the request that started the
+        download is paused.
+
+        :param request: The request whose transport is paused.
+        :type  request: twisted.web.server.Request
+        """
+        if request is self.request and self.upstream is not None:
+            self.upstream.pauseProducing()
+
+    def _resume_upstream(self, request):
+        """
+        Resume the upstream connection if the request that started the download can take more
+        data, or is gone.
+
+        :param request: The request whose transport is resumed or stopped.
+        :type  request: twisted.web.server.Request
+        """
+        if request is self.request and self.upstream is not None:
+            self.upstream.resumeProducing()
+
+    def _set_header(self, name, value):
+        """
+        Set a response header for all the requests, in the reactor thread.
+
+        :param name:  The name of the header.
+        :type  name:  str
+        :param value: The value of the header.
+        :type  value: str
+        """
+        self.headers.append((name, value))
+        for request in self.readers:
+            request.setHeader(name, value)
+
+    def _set_response_code(self, code):
+        """
+        Set the response code for all the requests, in the reactor thread.
+
+        :param code: The HTTP response code.
+        :type  code: int
+        """
+        self.code = code
+        for request in self.readers:
+            request.setResponseCode(code)
+
+    def add_reader(self, request):
+        """
+        Start sending the download to a request.
+
+        :param request: The request.
+        :type  request: twisted.web.server.Request
+        """
+        if self.code is not None:
+            request.setResponseCode(self.code)
+        for name, value in self.headers:
+            request.setHeader(name, value)
+        reader = SpoolReader(self, request)
+        self.readers[request] = reader
+        request.notifyFinish().addBoth(lambda result: self._remove_reader(request))
+        reader.start()
+
+    def _remove_reader(self, request):
+        """
+        Stop sending the download to a request, and close the spool file once the download is
+        finished and sent to every request.
+
+        :param request: The request.
+        :type  request: twisted.web.server.Request
+        """
+        reader = self.readers.pop(request, None)
+        if reader is not None:
+            reader.stop()
+        if self.finished and not self.readers and not self.spool_file.closed:
+            self.spool_file.close()
+
+    def read(self, offset, size):
+        """
+        Read part of the spool.
+
+        :param offset: The position in the spool to read from.
+        :type  offset: int
+        :param size:   The maximum number of bytes to read.
+        :type  size:   int
+
+        :return: The content read.
+        :rtype:  str
+        """
+        self.spool_file.seek(offset)
+        return self.spool_file.read(size)
+
+    def write(self, data):
+        """
+        Add downloaded content to the spool. Each request is sent it by its reader, as soon as
+        the transport of the request can take it.
+
+        :param data: The downloaded content.
+        :type  data: str
+        """
+        self.spool_file.seek(self.size)
+        self.spool_file.write(data)
+        self.size += len(data)
+        for reader in self.readers.values():
+            reader.schedule()
+
+    def finish(self):
+        """
+        Finish the download. Each request is finished once it has been sent the whole spool.
+        """
+        self.finished = True
+        self.finished_callback()
+        for reader in self.readers.values():
+            reader.schedule()
+        if not self.readers:
+            self.spool_file.close()
 
 
 class Responder(object):
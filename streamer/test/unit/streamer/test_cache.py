@@ -0,0 +1,142 @@
+from mock import Mock, patch
+
+from pulp.common.compat import unittest
+from pulp.streamer.cache import DownloaderCache, LRUCache
+
+
+MODULE_PREFIX = 'pulp.streamer.cache.'
+
+
+@patch(MODULE_PREFIX + 'time')
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_missing(self, mock_time):
+        cache = LRUCache(2, 10)
+
+        self.assertEqual(cache.get('a'), (None, True))
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 0)
+
+    def test_get(self, mock_time):
+        mock_time.time.return_value = 100
+        cache = LRUCache(2, 10)
+        cache.put('a', 'value')
+
+        mock_time.time.return_value = 109
+        self.assertEqual(cache.get('a'), ('value', False))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 0)
+
+    def test_get_expired(self, mock_time):
+        mock_time.time.return_value = 100
+        cache = LRUCache(2, 10)
+        cache.put('a', 'value')
+
+        mock_time.time.return_value = 110
+        self.assertEqual(cache.get('a'), ('value', True))
+        self.assertEqual(cache.misses, 1)
+
+    def test_evicts_least_recently_used(self, mock_time):
+        mock_time.time.return_value = 100
+        cache = LRUCache(2, 10)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), (None, True))
+        self.assertEqual(cache.get('a'), (1, False))
+        self.assertEqual(cache.get('c'), (3, False))
+
+    def test_put_replaces(self, mock_time):
+        mock_time.time.return_value = 100
+        cache = LRUCache(2, 10)
+        cache.put('a', 1)
+        mock_time.time.return_value = 105
+        cache.put('a', 2)
+
+        mock_time.time.return_value = 112
+        self.assertEqual(cache.get('a'), (2, False))
+        self.assertEqual(len(cache), 1)
+
+    def test_disabled(self, mock_time):
+        cache = LRUCache(0, 10)
+        cache.put('a', 1)
+
+        self.assertEqual(len(cache), 0)
+
+    def test_discard(self, mock_time):
+        cache = LRUCache(2, 10)
+        cache.put('a', 1)
+        cache.discard('a')
+        cache.discard('b')
+
+        self.assertEqual(len(cache), 0)
+
+
+class TestDownloaderCache(unittest.TestCase):
+
+    def test_reuse(self):
+        cache = DownloaderCache(2)
+        factory = Mock()
+
+        with cache.downloader('a', 1, factory) as first:
+            pass
+        with cache.downloader('a', 1, factory) as second:
+            pass
+
+        self.assertEqual(factory.call_count, 1)
+        # Each download gets its own copy that shares the configuration
+        self.assertFalse(first is second)
+        self.assertEqual(first.config, second.config)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertFalse(factory.return_value.config.finalize.called)
+
+    def test_new_revision(self):
+        cache = DownloaderCache(2)
+        old, new = Mock(), Mock()
+
+        with cache.downloader('a', 1, Mock(return_value=old)):
+            pass
+        with cache.downloader('a', 2, Mock(return_value=new)) as downloader:
+            pass
+
+        self.assertEqual(downloader.config, new.config)
+        old.config.finalize.assert_called_once_with()
+        self.assertEqual(len(cache), 1)
+
+    def test_finalize_after_use(self):
+        """
+        A downloader that is replaced during a download is finalized once the download is done.
+        """
+        cache = DownloaderCache(2)
+        old = Mock()
+
+        with cache.downloader('a', 1, Mock(return_value=old)):
+            with cache.downloader('a', 2, Mock()):
+                self.assertFalse(old.config.finalize.called)
+            self.assertFalse(old.config.finalize.called)
+        old.config.finalize.assert_called_once_with()
+
+    def test_evict(self):
+        cache = DownloaderCache(1)
+        first = Mock()
+
+        with cache.downloader('a', 1, Mock(return_value=first)):
+            pass
+        with cache.downloader('b', 1, Mock()):
+            pass
+
+        first.config.finalize.assert_called_once_with()
+        self.assertEqual(len(cache), 1)
+
+    def test_disabled(self):
+        cache = DownloaderCache(0)
+        factory = Mock()
+
+        with cache.downloader('a', 1, factory):
+            self.assertFalse(factory.return_value.config.finalize.called)
+
+        factory.return_value.config.finalize.assert_called_once_with()
+        self.assertEqual(len(cache), 0)
@@ -1,12 +1,17 @@
-from httplib import INTERNAL_SERVER_ERROR, NOT_FOUND, SERVICE_UNAVAILABLE
+from httplib import INTERNAL_SERVER_ERROR, NOT_FOUND, OK, SERVICE_UNAVAILABLE
 
 from mock import Mock, patch
-from mongoengine import NotUniqueError
+from mongoengine import DoesNotExist, NotUniqueError
+from nectar.downloaders.threaded import HTTPThreadedDownloader
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
 from twisted.web.server import Request
 
 from pulp.common.compat import unittest
 from pulp.plugins.loader.exceptions import PluginNotFound
-from pulp.streamer import Responder, StreamerListener, Streamer
+from pulp.streamer import load_configuration, Responder, StreamerListener, Streamer
+from pulp.streamer.server import CatalogLookup, DownloadSpool, ResponseBodyWriter
 
 
 MODULE_PREFIX = 'pulp.streamer.server.'
@@ -116,50 +121,213 @@ class TestStreamerListener(unittest.TestCase):
 class TestStreamer(unittest.TestCase):
 
     def setUp(self):
-        self.config = Mock()
+        self.config = load_configuration([])
         self.streamer = Streamer(self.config)
         self.request = Mock(spec=Request)
 
+    @patch(MODULE_PREFIX + 'DownloadSpool')
     @patch(MODULE_PREFIX + 'reactor', autospec=True)
-    def test_render_GET(self, mock_reactor):
+    def test_render_GET(self, mock_reactor, mock_spool):
         """
         The handler for GET requests is invoked in a thread so that nectar is safe
-        to use.
+        to use. The download is spooled so other requests for the same path can share it.
         """
+        self.request.uri = '/a/resource?k=v'
+
         self.streamer.render_GET(self.request)
-        mock_reactor.callInThread.assert_called_once_with(self.streamer._handle_get,
-                                                          self.request)
 
-    @patch(MODULE_PREFIX + 'model')
+        spool = mock_spool.return_value
+        mock_reactor.callInThread.assert_called_once_with(self.streamer._handle_get, spool)
+        spool.add_reader.assert_called_once_with(self.request)
+        self.assertEqual(self.streamer.spools, {'/a/resource': spool})
+
+        # The spool removes itself once the download is finished
+        finished_callback = mock_spool.call_args[0][1]
+        finished_callback()
+        self.assertEqual(self.streamer.spools, {})
+
+    @patch(MODULE_PREFIX + 'DownloadSpool')
+    @patch(MODULE_PREFIX + 'reactor', autospec=True)
+    def test_render_GET_download_in_progress(self, mock_reactor, mock_spool):
+        """
+        A request for a path that is being downloaded joins the download.
+        """
+        spool = Mock()
+        self.streamer.spools['/a/resource'] = spool
+        self.request.uri = '/a/resource?k=v'
+
+        self.streamer.render_GET(self.request)
+
+        spool.add_reader.assert_called_once_with(self.request)
+        self.assertFalse(mock_reactor.callInThread.called)
+        self.assertFalse(mock_spool.called)
+
+    @patch(MODULE_PREFIX + 'Streamer._handle_get_async')
+    @patch(MODULE_PREFIX + 'DownloadSpool')
+    @patch(MODULE_PREFIX + 'reactor', autospec=True)
+    def test_render_GET_async(self, mock_reactor, mock_spool, mock_handle_get_async):
+        """
+        With async_downloads enabled, the download is started in the reactor thread.
+        """
+        self.config.set('streamer', 'async_downloads', 'true')
+        streamer = Streamer(self.config)
+        self.request.uri = '/a/resource'
+
+        streamer.render_GET(self.request)
+
+        mock_handle_get_async.assert_called_once_with(mock_spool.return_value)
+        self.assertFalse(mock_reactor.callInThread.called)
+
+    def _async_lookup(self, downloader_config):
+        downloader = Mock(spec=HTTPThreadedDownloader, config=downloader_config)
+        importer = Mock()
+        importer.get_downloader_for_db_importer.return_value = downloader
+        return CatalogLookup(Mock(url='http://dev.null/'), importer, Mock(), {'name': 'foo'})
+
+    @patch(MODULE_PREFIX + 'content_container.ContentContainer')
+    @patch(MODULE_PREFIX + 'Streamer._lookup')
+    def test_prepare_async_download(self, mock_lookup, mock_container):
+        mock_container.return_value.sources = {}
+        downloader_config = Mock(headers={'k': 'v'}, basic_auth_username='user',
+                                 basic_auth_password='pass', ssl_validation=True, proxy_url=None,
+                                 ssl_ca_cert=None, ssl_ca_cert_path=None, ssl_client_cert=None,
+                                 ssl_client_cert_path=None, ssl_client_key=None,
+                                 ssl_client_key_path=None, max_speed=None)
+        mock_lookup.return_value = self._async_lookup(downloader_config)
+
+        lookup, headers = self.streamer._prepare_async_download('/a/resource')
+
+        self.assertEqual(lookup, mock_lookup.return_value)
+        self.assertEqual(headers, {'k': ['v'], 'Authorization': ['Basic dXNlcjpwYXNz']})
+        # The downloader is kept for later requests
+        self.assertFalse(downloader_config.finalize.called)
+        self.assertEqual(len(self.streamer.downloader_cache), 1)
+
+    @patch(MODULE_PREFIX + 'content_container.ContentContainer')
+    @patch(MODULE_PREFIX + 'Streamer._lookup')
+    def test_prepare_async_download_unsupported(self, mock_lookup, mock_container):
+        """
+        Downloads that use a proxy are left to the threaded downloader.
+        """
+        mock_container.return_value.sources = {}
+        downloader_config = Mock(proxy_url='http://proxy/')
+        mock_lookup.return_value = self._async_lookup(downloader_config)
+
+        self.assertTrue(self.streamer._prepare_async_download('/a/resource') is None)
+
+    @patch(MODULE_PREFIX + 'content_container.ContentContainer')
+    @patch(MODULE_PREFIX + 'Streamer._lookup')
+    def test_prepare_async_download_content_sources(self, mock_lookup, mock_container):
+        mock_container.return_value.sources = {'source': Mock()}
+
+        self.assertTrue(self.streamer._prepare_async_download('/a/resource') is None)
+        importer = mock_lookup.return_value.importer
+        self.assertFalse(importer.get_downloader_for_db_importer.called)
+
+    @patch(MODULE_PREFIX + 'reactor', autospec=True)
+    def test_download_async_fall_back(self, mock_reactor):
+        spool = Mock()
+
+        self.streamer._download_async(None, spool)
+
+        mock_reactor.callInThread.assert_called_once_with(self.streamer._handle_get, spool)
+
+    def test_download_async(self):
+        self.streamer.agent = Mock()
+        lookup = CatalogLookup(Mock(url=u'http://dev.null/a'), Mock(), Mock(), {})
+
+        self.streamer._download_async((lookup, {'k': ['v']}), Mock())
+
+        self.streamer.agent.request.assert_called_once_with(
+            'GET', 'http://dev.null/a', Headers({'k': ['v']}))
+
+    @patch(MODULE_PREFIX + 'ResponseBodyWriter.discard')
+    def test_receive_async_response_error(self, mock_discard):
+        request = Mock()
+        listener = Mock()
+
+        self.streamer._receive_async_response(Mock(code=NOT_FOUND), Mock(), listener, request)
+
+        report = listener.download_failed.call_args[0][0]
+        self.assertEqual(report.error_report['response_code'], NOT_FOUND)
+        callback = mock_discard.return_value.addBoth.call_args[0][0]
+        callback(None)
+        request.finish.assert_called_once_with()
+
+    @patch(MODULE_PREFIX + 'threads')
+    @patch(MODULE_PREFIX + 'ResponseBodyWriter.forward')
+    def test_receive_async_response(self, mock_forward, mock_threads):
+        request = Mock()
+        listener = Mock()
+        response = Mock(code=OK, headers=Headers({'Content-Length': ['3']}))
+
+        self.streamer._receive_async_response(response, Mock(), listener, request)
+
+        report = listener.download_headers.call_args[0][0]
+        self.assertEqual(report.headers, {'Content-Length': '3'})
+        mock_forward.assert_called_once_with(response, request)
+        body_received = mock_forward.return_value.addBoth.call_args[0][0]
+        body_received(Failure(ResponseDone()))
+        mock_threads.deferToThread.assert_called_once_with(listener.download_succeeded, report)
+
+    @patch(MODULE_PREFIX + 'threads')
+    @patch(MODULE_PREFIX + 'ResponseBodyWriter.forward')
+    def test_receive_async_response_interrupted(self, mock_forward, mock_threads):
+        request = Mock()
+
+        self.streamer._receive_async_response(Mock(code=OK, headers=Headers()), Mock(), Mock(),
+                                              request)
+        body_received = mock_forward.return_value.addBoth.call_args[0][0]
+        body_received(Failure(Exception('Connection lost')))
+
+        request.finish.assert_called_once_with()
+        self.assertFalse(mock_threads.deferToThread.called)
+
+    def test_async_download_failed(self):
+        request = Mock()
+
+        self.streamer._async_download_failed(Failure(Exception('refused')), Mock(), request)
+
+        request.setResponseCode.assert_called_once_with(SERVICE_UNAVAILABLE)
+        request.finish.assert_called_once_with()
+
     @patch(MODULE_PREFIX + 'Responder.__exit__')
     @patch(MODULE_PREFIX + 'Responder.__enter__')
     @patch(MODULE_PREFIX + 'Streamer._download')
-    def test_handle_get(self, mock_download, mock_enter, mock_exit, mock_model):
+    @patch(MODULE_PREFIX + 'Streamer._lookup')
+    def test_handle_get(self, mock_lookup, mock_download, mock_enter, mock_exit):
         """
         When the streamer receives a request, the content is downloaded and a task
         is dispatched.
         """
         # Setup
-        self.streamer._add_deferred_download_entry = Mock()
         self.request.uri = '/a/resource?k=v'
         self.request.getHeader.return_value = None
-        mock_catalog = mock_model.LazyCatalogEntry.objects.return_value.order_by(
-            '-plugin_id').first.return_value
 
         # Test
         self.streamer._handle_get(self.request)
         mock_exit.assert_called_once_with(None, None, None)
-        mock_model.LazyCatalogEntry.objects.assert_called_once_with(path='/a/resource')
-        query_set = mock_model.LazyCatalogEntry.objects.return_value
-        self.assertEqual(1, query_set.order_by('importer_id').first.call_count)
-        mock_download.assert_called_once_with(mock_catalog, self.request,
+        mock_lookup.assert_called_once_with('/a/resource')
+        mock_download.assert_called_once_with(mock_lookup.return_value, self.request,
                                               mock_enter.return_value)
 
+    @patch(MODULE_PREFIX + 'Streamer._download')
+    @patch(MODULE_PREFIX + 'Streamer._lookup', Mock(return_value=None))
+    def test_handle_get_no_unit(self, mock_download):
+        """
+        When the catalog entry references a unit that does not exist, a 404 is returned.
+        """
+        self.request.uri = '/a/resource?k=v'
+
+        self.streamer._handle_get(self.request)
+        self.request.setResponseCode.assert_called_once_with(NOT_FOUND)
+        self.assertFalse(mock_download.called)
+
     @patch(MODULE_PREFIX + 'repo_controller', autospec=True)
     @patch(MODULE_PREFIX + 'model', Mock())
     def test_handle_get_no_plugin(self, mock_repo_controller):
         """
-        When the _download helper method fails to find the plugin, it raises an exception.
+        When the _lookup helper method fails to find the plugin, it raises an exception.
         """
         self.request.uri = '/a/resource?k=v'
         mock_repo_controller.get_importer_by_id.side_effect = PluginNotFound()
@@ -198,31 +366,389 @@ class TestStreamer(unittest.TestCase):
                                                       'handling the request.')
         self.request.setResponseCode.assert_called_once_with(INTERNAL_SERVER_ERROR)
 
-    @patch(MODULE_PREFIX + 'content_container.ContentContainer')
     @patch(MODULE_PREFIX + 'plugins_api.get_unit_model_by_id')
     @patch(MODULE_PREFIX + 'repo_controller', autospec=True)
-    def test_download(self, mock_repo_controller, mock_get_unit_model, mock_container):
+    @patch(MODULE_PREFIX + 'model')
+    def test_lookup(self, mock_model, mock_repo_controller, mock_get_unit_model):
+        """
+        The catalog entry, importer and unit key are looked up and cached.
+        """
+        catalog_entry = Mock(importer_id='mock_id', unit_id='unit', unit_type_id='rpm')
+        mock_model.LazyCatalogEntry.objects.return_value.order_by.return_value.first.\
+            return_value = catalog_entry
+        mock_importer = Mock()
+        mock_importer_config = Mock()
+        mock_db_importer = Mock()
+        mock_repo_controller.get_importer_by_id.return_value = (
+            mock_importer, mock_importer_config, mock_db_importer)
+        unit_model = mock_get_unit_model.return_value
+        unit_model.unit_key_fields = ('name',)
+        unit = unit_model.objects.filter.return_value.only.return_value.get.return_value
+
+        lookup = self.streamer._lookup('/a/resource')
+        cached_lookup = self.streamer._lookup('/a/resource')
+
+        self.assertEqual(lookup, (catalog_entry, mock_importer, mock_db_importer, unit.unit_key))
+        self.assertTrue(cached_lookup is lookup)
+        mock_model.LazyCatalogEntry.objects.assert_called_once_with(path='/a/resource')
+        mock_repo_controller.get_importer_by_id.assert_called_once_with('mock_id')
+        self.assertEqual(mock_db_importer.config, mock_importer_config.flatten.return_value)
+        unit_model.objects.filter.assert_called_once_with(id='unit')
+        unit_model.objects.filter.return_value.only.assert_called_once_with('name')
+        self.assertEqual(self.streamer.catalog_cache.hits, 1)
+        self.assertEqual(self.streamer.catalog_cache.misses, 1)
+
+    @patch(MODULE_PREFIX + 'logger')
+    @patch(MODULE_PREFIX + 'plugins_api.get_unit_model_by_id')
+    @patch(MODULE_PREFIX + 'repo_controller', autospec=True)
+    @patch(MODULE_PREFIX + 'model')
+    def test_lookup_no_unit(self, mock_model, mock_repo_controller, mock_get_unit_model,
+                            mock_logger):
+        """
+        When the catalog entry references a unit that does not exist, nothing is cached.
+        """
+        mock_repo_controller.get_importer_by_id.return_value = (Mock(), Mock(), Mock())
+        mock_get_unit_model.return_value.unit_key_fields = tuple()
+        mock_get_unit_model.return_value.objects.filter.return_value.only.return_value.get.\
+            side_effect = DoesNotExist()
+
+        self.assertEqual(self.streamer._lookup('/a/resource'), None)
+        self.assertEqual(len(self.streamer.catalog_cache), 0)
+        self.assertEqual(mock_logger.error.call_count, 1)
+
+    @patch(MODULE_PREFIX + 'repo_controller', autospec=True)
+    @patch(MODULE_PREFIX + 'model')
+    def test_lookup_expired_current(self, mock_model, mock_repo_controller):
+        """
+        An expired lookup is reused when the catalog entry revision and the importer are
+        unchanged.
+        """
+        cached_entry = Mock(importer_id='importer', revision=2, unit_id='unit')
+        catalog_entry = Mock(importer_id='importer', revision=2, unit_id='unit')
+        mock_model.LazyCatalogEntry.objects.return_value.order_by.return_value.first.\
+            return_value = catalog_entry
+        db_importer = Mock(last_updated=5)
+        mock_model.Importer.objects.return_value.only.return_value.first.return_value = \
+            Mock(last_updated=5)
+        lookup = CatalogLookup(cached_entry, Mock(), db_importer, {'name': 'foo'})
+        self.streamer.catalog_cache.put('/a/resource', lookup)
+        self.streamer.catalog_cache.timeout = -1
+
+        result = self.streamer._lookup('/a/resource')
+
+        self.assertEqual(result, lookup._replace(catalog_entry=catalog_entry))
+        mock_model.Importer.objects.assert_called_once_with(id=db_importer.id)
+        self.assertFalse(mock_repo_controller.get_importer_by_id.called)
+
+    @patch(MODULE_PREFIX + 'plugins_api.get_unit_model_by_id', Mock())
+    @patch(MODULE_PREFIX + 'repo_controller', autospec=True)
+    @patch(MODULE_PREFIX + 'model')
+    def test_lookup_expired_new_revision(self, mock_model, mock_repo_controller):
+        """
+        An expired lookup is loaded again when the catalog entry has a new revision.
+        """
+        cached_entry = Mock(importer_id='importer', revision=2, unit_id='unit')
+        catalog_entry = Mock(importer_id='importer', revision=3, unit_id='unit')
+        mock_model.LazyCatalogEntry.objects.return_value.order_by.return_value.first.\
+            return_value = catalog_entry
+        mock_repo_controller.get_importer_by_id.return_value = (Mock(), Mock(), Mock())
+        lookup = CatalogLookup(cached_entry, Mock(), Mock(), {'name': 'foo'})
+        self.streamer.catalog_cache.put('/a/resource', lookup)
+        self.streamer.catalog_cache.timeout = -1
+
+        result = self.streamer._lookup('/a/resource')
+
+        self.assertTrue(result.catalog_entry is catalog_entry)
+        mock_repo_controller.get_importer_by_id.assert_called_once_with('importer')
+
+    @patch(MODULE_PREFIX + 'model')
+    def test_lookup_expired_entry_removed(self, mock_model):
+        """
+        An expired lookup is removed from the cache when its catalog entry no longer exists.
+        """
+        mock_model.LazyCatalogEntry.objects.return_value.order_by.return_value.first.\
+            return_value = None
+        self.streamer.catalog_cache.put('/a/resource', Mock())
+        self.streamer.catalog_cache.timeout = -1
+
+        self.assertRaises(DoesNotExist, self.streamer._lookup, '/a/resource')
+        self.assertEqual(len(self.streamer.catalog_cache), 0)
+
+    @patch(MODULE_PREFIX + 'content_container.ContentContainer')
+    def test_download(self, mock_container):
         # Setup
         mock_catalog = Mock(importer_id='mock_id', url='http://dev.null/', working_dir='/tmp',
                             data={'k': 'v'})
         mock_request = Mock()
         mock_responder = Mock()
         mock_importer = Mock()
-        mock_importer_config = Mock()
         mock_db_importer = Mock()
-        mock_repo_controller.get_importer_by_id.return_value = (
-            mock_importer, mock_importer_config, mock_db_importer)
-        mock_get_unit_model.return_value.unit_key_fields = tuple()
+        lookup = CatalogLookup(mock_catalog, mock_importer, mock_db_importer, {'name': 'foo'})
 
         # Test
-        self.streamer._download(mock_catalog, mock_request, mock_responder)
-        mock_repo_controller.get_importer_by_id.assert_called_once_with(mock_catalog.importer_id)
+        self.streamer._download(lookup, mock_request, mock_responder)
         mock_importer.get_downloader_for_db_importer.assert_called_once_with(
             mock_db_importer,
             mock_catalog.url,
             working_dir=mock_catalog.working_dir)
+        downloader = mock_importer.get_downloader_for_db_importer.return_value
+        self.assertEqual(mock_container.return_value.download.call_count, 1)
+        primary_downloader, download_requests, listener = \
+            mock_container.return_value.download.call_args[0]
+        self.assertEqual(download_requests[0].unit_key, {'name': 'foo'})
+        self.assertEqual(primary_downloader.session, self.streamer.session)
+        self.assertEqual(primary_downloader.event_listener, listener)
+        # The cached downloader does not keep the listener of the request
+        self.assertFalse(downloader.event_listener is listener)
+        self.assertFalse(downloader.config.finalize.called)
+
+    @patch(MODULE_PREFIX + 'content_container.ContentContainer')
+    def test_download_reuses_downloader(self, mock_container):
+        """
+        The downloader for an importer is built once, and again when the importer is updated.
+        """
+        mock_catalog = Mock(importer_id='mock_id', url='http://dev.null/')
+        mock_importer = Mock()
+        mock_db_importer = Mock(last_updated=1)
+        lookup = CatalogLookup(mock_catalog, mock_importer, mock_db_importer, {'name': 'foo'})
+        build = mock_importer.get_downloader_for_db_importer
+        first = Mock()
+        build.return_value = first
+
+        self.streamer._download(lookup, Mock(), Mock())
+        self.streamer._download(lookup, Mock(), Mock())
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(mock_container.call_count, 1)
+
+        mock_db_importer.last_updated = 2
+        build.return_value = Mock()
+        self.streamer._download(lookup, Mock(), Mock())
+        self.assertEqual(build.call_count, 2)
+        first.config.finalize.assert_called_once_with()
+
+    @patch(MODULE_PREFIX + 'time')
+    @patch(MODULE_PREFIX + 'content_container.ContentContainer')
+    def test_get_content_container(self, mock_container, mock_time):
+        mock_time.time.return_value = 1000
+
+        container = self.streamer._get_content_container()
+        mock_time.time.return_value = 1059
+        self.assertEqual(self.streamer._get_content_container(), container)
+        self.assertEqual(mock_container.call_count, 1)
+
+        mock_time.time.return_value = 1060
+        self.streamer._get_content_container()
+        self.assertEqual(mock_container.call_count, 2)
+        mock_container.assert_called_with(threaded=False)
+
+
+@patch(MODULE_PREFIX + 'reactor')
+class TestDownloadSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.leader = Mock(spec=Request, uri='/a/resource')
+        self.finished_callback = Mock()
+
+    def _spool(self, mock_reactor):
+        # Run the calls scheduled in the reactor right away
+        mock_reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+        mock_reactor.callLater.side_effect = lambda delay, f, *args: f(*args)
+        return DownloadSpool(self.leader, self.finished_callback)
+
+    def test_get_header(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+
+        self.assertEqual(spool.getHeader('key'), self.leader.getHeader.return_value)
+        self.leader.getHeader.assert_called_once_with('key')
+
+    def test_headers_and_code(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+        spool.add_reader(self.leader)
+
+        spool.setResponseCode(NOT_FOUND)
+        spool.setHeader('Content-Length', '0')
+
+        late_request = Mock(spec=Request)
+        spool.add_reader(late_request)
+        for request in (self.leader, late_request):
+            request.setResponseCode.assert_called_once_with(NOT_FOUND)
+            request.setHeader.assert_called_once_with('Content-Length', '0')
+
+    def test_write_and_finish(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+        spool.add_reader(self.leader)
+
+        spool.write('abc')
+        late_request = Mock(spec=Request)
+        spool.add_reader(late_request)
+        spool.write('def')
+        spool.finish()
+
+        for request in (self.leader, late_request):
+            self.assertEqual(''.join(c[0][0] for c in request.write.call_args_list), 'abcdef')
+            request.finish.assert_called_once_with()
+        self.finished_callback.assert_called_once_with()
+        self.assertEqual(spool.readers, {})
+        self.assertTrue(spool.spool_file.closed)
+
+    @patch(MODULE_PREFIX + 'SPOOL_READ_SIZE', 2)
+    def test_send_in_parts(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+        mock_reactor.callLater.side_effect = None
+        spool.add_reader(self.leader)
+        reader = spool.readers[self.leader]
+        self.leader.registerProducer.assert_called_once_with(reader, True)
+        mock_reactor.callLater.assert_called_once_with(0, reader._send)
+
+        spool.write('abcde')
+        spool.finish()
+        self.assertFalse(self.leader.write.called)
+        # A part is scheduled once
+        self.assertEqual(mock_reactor.callLater.call_count, 1)
+
+        reader._send()
+        self.leader.write.assert_called_once_with('ab')
+        self.assertEqual(mock_reactor.callLater.call_count, 2)
+        # The spool file is kept until all the requests have been sent the download
+        self.assertFalse(spool.spool_file.closed)
+
+    def test_reader_paused(self, mock_reactor):
+        """
+        Nothing is sent to a request while its transport is paused.
+        """
+        spool = self._spool(mock_reactor)
+        spool.add_reader(self.leader)
+        reader = spool.readers[self.leader]
+
+        reader.pauseProducing()
+        spool.write('abc')
+        spool.finish()
+        self.assertFalse(self.leader.write.called)
+        self.assertFalse(self.leader.finish.called)
+
+        reader.resumeProducing()
+        self.leader.write.assert_called_once_with('abc')
+        self.leader.unregisterProducer.assert_called_once_with()
+        self.leader.finish.assert_called_once_with()
+
+    def test_reader_paused_cancels_send(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+        spool.write('abc')
+        mock_reactor.callLater.side_effect = None
+        spool.add_reader(self.leader)
+
+        spool.readers[self.leader].pauseProducing()
+
+        mock_reactor.callLater.return_value.cancel.assert_called_once_with()
+        self.assertFalse(self.leader.write.called)
+
+    def test_reader_disconnected(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+        spool.add_reader(self.leader)
+        notify_callback = self.leader.notifyFinish.return_value.addBoth.call_args[0][0]
+
+        notify_callback(Exception('Connection lost'))
+        spool.write('abc')
+        spool.finish()
+
+        self.assertFalse(self.leader.write.called)
+        self.assertFalse(self.leader.finish.called)
+        self.assertTrue(spool.spool_file.closed)
+
+    def test_register_producer(self, mock_reactor):
+        """
+        The upstream connection is paced by the leader, which cannot stop it, since the other
+        requests still need it.
+        """
+        spool = self._spool(mock_reactor)
+        spool.add_reader(self.leader)
+        producer = Mock()
+
+        spool.registerProducer(producer, True)
+        reader = self.leader.registerProducer.call_args[0][0]
+        reader.pauseProducing()
+        reader.stopProducing()
+        spool.unregisterProducer()
+
+        producer.pauseProducing.assert_called_once_with()
+        producer.resumeProducing.assert_called_once_with()
+        self.assertFalse(producer.stopProducing.called)
+
+    def test_register_producer_leader_paused(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+        spool.add_reader(self.leader)
+        spool.readers[self.leader].pauseProducing()
+        producer = Mock()
+
+        spool.registerProducer(producer, True)
+
+        producer.pauseProducing.assert_called_once_with()
+
+    def test_other_reader_paused(self, mock_reactor):
+        """
+        Only the leader paces the upstream connection.
+        """
+        spool = self._spool(mock_reactor)
+        spool.add_reader(self.leader)
+        late_request = Mock(spec=Request)
+        spool.add_reader(late_request)
+        producer = Mock()
+        spool.registerProducer(producer, True)
+
+        spool.readers[late_request].pauseProducing()
+        spool.write('abc')
+
+        self.assertFalse(producer.pauseProducing.called)
+        self.leader.write.assert_called_once_with('abc')
+        self.assertFalse(late_request.write.called)
+
+    def test_register_producer_disconnected(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+        producer = Mock()
+
+        spool.registerProducer(producer, True)
+        spool.unregisterProducer()
+
+        self.assertFalse(producer.pauseProducing.called)
+        self.assertFalse(self.leader.registerProducer.called)
+
+    def test_finish_disconnected(self, mock_reactor):
+        spool = self._spool(mock_reactor)
+        spool.add_reader(self.leader)
+        self.leader.finish.side_effect = RuntimeError()
+
+        spool.finish()
+
+        self.assertEqual(spool.readers, {})
+
+
+class TestResponseBodyWriter(unittest.TestCase):
+
+    def test_forward(self):
+        request = Mock()
+        response = Mock()
+
+        finished = ResponseBodyWriter.forward(response, request)
+        writer = response.deliverBody.call_args[0][0]
+        writer.makeConnection(Mock())
+        writer.dataReceived('abc')
+        writer.connectionLost(Failure(ResponseDone()))
+
+        request.registerProducer.assert_called_once_with(writer.transport, True)
+        request.write.assert_called_once_with('abc')
+        request.unregisterProducer.assert_called_once_with()
+        self.assertTrue(finished.called)
+
+    def test_discard(self):
+        response = Mock()
+
+        finished = ResponseBodyWriter.discard(response)
+        writer = response.deliverBody.call_args[0][0]
+        writer.makeConnection(Mock())
+        writer.dataReceived('abc')
+        writer.connectionLost(Failure(ResponseDone()))
 
-        mock_container.return_value.download.assert_called_once()
+        self.assertTrue(finished.called)
 
 
 class TestResponder(unittest.TestCase):